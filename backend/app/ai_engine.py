@@ -2,7 +2,6 @@
 import random, threading
 from typing import Dict, Any, List
 import numpy as np
-from sklearn.ensemble import IsolationForest
 
 """
 QFF AI Engine Decision Thresholds:
@@ -28,6 +27,7 @@ class AgenticAI:
 
     def _build_iso(self, amounts):
         try:
+            from sklearn.ensemble import IsolationForest  # ~1.5 s to import; only the scorer needs it
             X = np.array(amounts).reshape(-1,1)
             self.iso = IsolationForest(contamination=0.05, random_state=42).fit(X)
         except Exception:
@@ -0,0 +1,335 @@
+"""
+Alert Dispatch
+Delivery of alerts off the request path: notify() puts the alert on a
+bounded queue and returns, and a background thread delivers it.
+
+    dispatcher = AlertDispatcher([AlertChannel("webhook", post_batch)])
+    dispatcher.enqueue(alert)
+
+The dispatcher collects whatever arrives within QFF_ALERT_BATCH_WINDOW_MS
+(up to QFF_ALERT_BATCH_MAX alerts) and hands each channel one batch: one
+webhook post, one digest email. A failed batch is retried with exponential
+backoff and jitter, QFF_ALERT_BACKOFF_BASE_S doubling up to
+QFF_ALERT_BACKOFF_CAP_S, for QFF_ALERT_MAX_ATTEMPTS attempts. Retries are
+scheduled rather than slept, so other batches keep flowing.
+
+What still is not delivered goes to the spool directory (QFF_ALERT_SPOOL_DIR),
+one JSON file per batch and channel. This covers exhausted retries, alerts
+beyond a full queue and whatever is pending at shutdown. The spool is
+replayed when the dispatcher starts and every QFF_ALERT_SPOOL_RETRY_S
+after that, so alerts survive a restart. A replay pass merges each
+channel's spooled files into batches of up to QFF_ALERT_BATCH_MAX alerts
+and stops for a channel at its first failure, so a dead webhook costs the
+dispatcher one timeout per pass however much is spooled. Workers claim spool
+files by renaming them before sending, so two workers do not both deliver
+them; files claimed by a process that has since died are put back.
+"""
+import os
+import json
+import time
+import heapq
+import queue
+import random
+import itertools
+import threading
+from typing import Callable, Dict, List, Optional
+
+from .telemetry import ALERTS_DISPATCHED, ALERT_QUEUE_DEPTH
+
+ALERT_QUEUE_SIZE = int(os.environ.get("QFF_ALERT_QUEUE_SIZE", "10000"))
+ALERT_BATCH_WINDOW_MS = float(os.environ.get("QFF_ALERT_BATCH_WINDOW_MS", "200"))
+ALERT_BATCH_MAX = int(os.environ.get("QFF_ALERT_BATCH_MAX", "50"))
+ALERT_MAX_ATTEMPTS = int(os.environ.get("QFF_ALERT_MAX_ATTEMPTS", "5"))
+ALERT_BACKOFF_BASE_S = float(os.environ.get("QFF_ALERT_BACKOFF_BASE_S", "1"))
+ALERT_BACKOFF_CAP_S = float(os.environ.get("QFF_ALERT_BACKOFF_CAP_S", "60"))
+ALERT_SPOOL_DIR = os.environ.get("QFF_ALERT_SPOOL_DIR", "./data/alert_spool")
+ALERT_SPOOL_RETRY_S = float(os.environ.get("QFF_ALERT_SPOOL_RETRY_S", "60"))
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # exists, owned by someone else
+    return True
+
+
+class AlertChannel:
+    """A delivery channel: send(alerts) delivers a batch or raises; accepts(alert) filters what it gets"""
+
+    def __init__(self, name: str, send: Callable[[List[Dict]], None],
+                 accepts: Optional[Callable[[Dict], bool]] = None):
+        self.name = name
+        self.send = send
+        self.accepts = accepts or (lambda alert: True)
+
+
+class AlertDispatcher:
+    def __init__(self, channels: List[AlertChannel], spool_dir: str = ALERT_SPOOL_DIR,
+                 queue_size: int = ALERT_QUEUE_SIZE, batch_window_ms: float = ALERT_BATCH_WINDOW_MS,
+                 max_batch: int = ALERT_BATCH_MAX, max_attempts: int = ALERT_MAX_ATTEMPTS,
+                 backoff_base_s: float = ALERT_BACKOFF_BASE_S, backoff_cap_s: float = ALERT_BACKOFF_CAP_S,
+                 spool_retry_s: float = ALERT_SPOOL_RETRY_S):
+        self.channels = {channel.name: channel for channel in channels}
+        self.spool_dir = spool_dir
+        self.batch_window_s = batch_window_ms / 1000
+        self.max_batch = max_batch
+        self.max_attempts = max_attempts
+        self.backoff_base_s = backoff_base_s
+        self.backoff_cap_s = backoff_cap_s
+        self.spool_retry_s = spool_retry_s
+        self._queue: "queue.Queue[Dict]" = queue.Queue(maxsize=queue_size)
+        self._retries: list = []  # heap of (due, seq, channel, alerts, attempts)
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._next_spool_pass = 0.0
+        self.stats_counts = {"delivered": 0, "retried": 0, "spooled": 0, "replayed": 0}
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.channels)
+
+    def _count(self, channel: str, outcome: str, alerts: int = 1):
+        self.stats_counts[outcome] = self.stats_counts.get(outcome, 0) + alerts
+        ALERTS_DISPATCHED.labels(channel, outcome).inc(alerts)
+
+    # --- producer side ---
+
+    def enqueue(self, alert: Dict):
+        """Hand an alert to the dispatcher; never blocks on delivery"""
+        if not self.channels:
+            return
+        self.start()
+        try:
+            self._queue.put_nowait(alert)
+        except queue.Full:
+            self._spool_batch([alert], attempts=0)
+        ALERT_QUEUE_DEPTH.set(self._queue.qsize())
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None or not self.channels:
+                return
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="qff-alerts", daemon=True)
+            self._thread.start()
+
+    # --- dispatcher thread ---
+
+    def _run(self):
+        while not self._stop.is_set():
+            now = time.monotonic()
+            if now >= self._next_spool_pass:
+                self._next_spool_pass = now + self.spool_retry_s
+                self.replay_spool()
+            batch = self._collect()
+            if batch:
+                for channel in self.channels.values():
+                    accepted = [alert for alert in batch if channel.accepts(alert)]
+                    if accepted:
+                        self._deliver(channel.name, accepted, 0)
+                for _ in batch:
+                    self._queue.task_done()
+                ALERT_QUEUE_DEPTH.set(self._queue.qsize())
+            self._run_due_retries()
+
+    def _collect(self) -> List[Dict]:
+        """The next batch: the first alert to arrive, then whatever follows within the window"""
+        wait = self._next_spool_pass - time.monotonic()
+        with self._lock:
+            if self._retries:
+                wait = min(wait, self._retries[0][0] - time.monotonic())
+        try:
+            first = self._queue.get(timeout=max(0.01, min(wait, 0.5)))
+        except queue.Empty:
+            return []
+        batch = [first]
+        deadline = time.monotonic() + self.batch_window_s
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def backoff(self, attempts: int) -> float:
+        """Exponential backoff with jitter: half the capped exponential step, plus up to as much again"""
+        step = min(self.backoff_cap_s, self.backoff_base_s * 2 ** (attempts - 1))
+        return step / 2 + random.uniform(0, step / 2)
+
+    def _deliver(self, channel: str, alerts: List[Dict], attempts: int) -> bool:
+        try:
+            self.channels[channel].send(alerts)
+        except Exception as e:
+            attempts += 1
+            if attempts >= self.max_attempts:
+                print(f"Alert delivery via {channel} failed {attempts} times, spooling {len(alerts)} alerts: {e}")
+                self._spool_batch(alerts, attempts, channels=[channel])
+            else:
+                self._count(channel, "retried", len(alerts))
+                with self._lock:
+                    heapq.heappush(self._retries, (time.monotonic() + self.backoff(attempts), next(self._seq),
+                                                   channel, alerts, attempts))
+            return False
+        self._count(channel, "delivered", len(alerts))
+        return True
+
+    def _run_due_retries(self):
+        while True:
+            with self._lock:
+                if not self._retries or self._retries[0][0] > time.monotonic():
+                    return
+                _, _, channel, alerts, attempts = heapq.heappop(self._retries)
+            self._deliver(channel, alerts, attempts)
+
+    # --- spool ---
+
+    def _spool_batch(self, alerts: List[Dict], attempts: int, channels: List[str] = None):
+        """Write a batch to the spool, for the given channels as-is, or filtered for every channel"""
+        os.makedirs(self.spool_dir, exist_ok=True)
+        if channels is None:
+            batches = [(name, [a for a in alerts if channel.accepts(a)]) for name, channel in self.channels.items()]
+        else:
+            batches = [(name, alerts) for name in channels]
+        for channel, batch in batches:
+            if batch:
+                name = f"{time.time_ns()}-{next(self._seq)}-{channel}.json"
+                self._write_spool_file(name, {"channel": channel, "attempts": attempts, "alerts": batch})
+                self._count(channel, "spooled", len(batch))
+
+    def _write_spool_file(self, name: str, entry: Dict):
+        tmp = os.path.join(self.spool_dir, f".{name}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(entry, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, os.path.join(self.spool_dir, name))
+
+    def spooled(self) -> List[str]:
+        if not os.path.isdir(self.spool_dir):
+            return []
+        return sorted(n for n in os.listdir(self.spool_dir) if n.endswith(".json") and not n.startswith("."))
+
+    @staticmethod
+    def _spool_channel(name: str) -> str:
+        return name[:-len(".json")].split("-", 2)[2]
+
+    def _reclaim_orphans(self):
+        """Put back spool files claimed by a process that died before finishing with them"""
+        if not os.path.isdir(self.spool_dir):
+            return
+        for claimed in os.listdir(self.spool_dir):
+            if not (claimed.startswith(".") and claimed.endswith(".claimed")):
+                continue
+            name, pid, _ = claimed[1:].rsplit(".", 2)
+            if int(pid) == os.getpid() or _pid_alive(int(pid)):
+                continue
+            try:
+                os.rename(os.path.join(self.spool_dir, claimed), os.path.join(self.spool_dir, name))
+                print(f"Reclaimed alert spool file {name} from exited process {pid}")
+            except FileNotFoundError:
+                pass  # another worker put it back first
+
+    def _claim(self, name: str) -> Optional[tuple]:
+        """Rename a spool file to a claimed name and read it: (claimed path, entry), or None if gone"""
+        path = os.path.join(self.spool_dir, name)
+        claimed = os.path.join(self.spool_dir, f".{name}.{os.getpid()}.claimed")
+        try:
+            os.rename(path, claimed)
+        except FileNotFoundError:
+            return None  # another worker took it
+        try:
+            with open(claimed, encoding="utf-8") as f:
+                return claimed, json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Unreadable alert spool file {name} set aside: {e}")
+            os.replace(claimed, os.path.join(self.spool_dir, f".{name}.unreadable"))
+            return None
+
+    def replay_spool(self) -> int:
+        """One pass over the spool, in merged batches per channel; returns the number of alerts delivered"""
+        self._reclaim_orphans()
+        by_channel: Dict[str, List[str]] = {}
+        for name in self.spooled():
+            by_channel.setdefault(self._spool_channel(name), []).append(name)
+
+        delivered = 0
+        for channel_name, names in by_channel.items():
+            channel = self.channels.get(channel_name)
+            if channel is None:
+                continue  # left for a worker that has the channel configured
+            while names:
+                # files spooled one alert at a time (a full queue) go out together, up to max_batch
+                entries, alerts = [], []
+                while names and len(alerts) < self.max_batch:
+                    name = names.pop(0)
+                    claim = self._claim(name)
+                    if claim is None:
+                        continue
+                    claimed, entry = claim
+                    if alerts and len(alerts) + len(entry["alerts"]) > self.max_batch:
+                        os.rename(claimed, os.path.join(self.spool_dir, name))  # starts the next batch
+                        names.insert(0, name)
+                        break
+                    entries.append(claim)
+                    alerts.extend(entry["alerts"])
+                if not alerts:
+                    continue
+                try:
+                    channel.send(alerts)
+                except Exception as e:
+                    print(f"Spooled alerts via {channel_name} still undeliverable, retrying next pass: {e}")
+                    attempts = max(entry.get("attempts", 0) for _, entry in entries) + 1
+                    # merged under the oldest file's name, so it keeps its place in the spool
+                    oldest = os.path.basename(entries[0][0])[1:].rsplit(".", 2)[0]
+                    self._write_spool_file(oldest, {"channel": channel_name, "attempts": attempts, "alerts": alerts})
+                    for claimed, _ in entries:
+                        os.remove(claimed)
+                    break  # the channel is down: the rest waits for the next pass
+                for claimed, _ in entries:
+                    os.remove(claimed)
+                delivered += len(alerts)
+                self._count(channel_name, "replayed", len(alerts))
+        return delivered
+
+    # --- lifecycle ---
+
+    def flush(self, timeout: float = 5.0, include_retries: bool = False) -> bool:
+        """Wait until every queued alert has had a delivery attempt (and, optionally, all retries are done)"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self._queue.unfinished_tasks == 0 and (not include_retries or not self._retries):
+                return True
+            time.sleep(0.01)
+        return False
+
+    def close(self):
+        """Stop the dispatcher; alerts still queued or waiting for a retry go to the spool"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._stop.set()
+        thread.join(timeout=10)
+        pending = []
+        while True:
+            try:
+                pending.append(self._queue.get_nowait())
+                self._queue.task_done()
+            except queue.Empty:
+                break
+        if pending:
+            self._spool_batch(pending, attempts=0)
+        with self._lock:
+            retries, self._retries = self._retries, []
+        for _, _, channel, alerts, attempts in retries:
+            self._spool_batch(alerts, attempts, channels=[channel])
+
+    def stats(self) -> Dict:
+        return {"channels": list(self.channels), "queued": self._queue.qsize(), "retrying": len(self._retries),
+                "spooled_files": len(self.spooled()), **self.stats_counts}
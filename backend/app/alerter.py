@@ -1,7 +1,10 @@
 # backend/app/alerter.py
 """
 Incident Alert System - Email and Webhook Notifications
-Supports multiple notification channels for security events
+Supports multiple notification channels for security events. notify() only
+records and queues the alert; delivery (batched webhook posts over a
+keep-alive session, digest emails over one SMTP connection, retries and the
+disk spool) happens in the background, see alert_dispatch.py.
 """
 import os
 import json
@@ -12,6 +15,8 @@ from email.mime.multipart import MIMEMultipart
 from datetime import datetime
 from typing import Dict, Optional, List
 
+from .alert_dispatch import AlertChannel, AlertDispatcher
+
 # Configuration from environment
 ALERT_WEBHOOK = os.environ.get("QFF_ALERT_WEBHOOK", "")
 ALERT_EMAIL_ENABLED = os.environ.get("QFF_ALERT_EMAIL_ENABLED", "false").lower() == "true"
@@ -19,8 +24,9 @@ SMTP_HOST = os.environ.get("QFF_SMTP_HOST", "smtp.gmail.com")
 SMTP_PORT = int(os.environ.get("QFF_SMTP_PORT", "587"))
 SMTP_USER = os.environ.get("QFF_SMTP_USER", "")
 SMTP_PASS = os.environ.get("QFF_SMTP_PASS", "")
-ALERT_EMAIL_TO = os.environ.get("QFF_ALERT_EMAIL_TO", "").split(",")
+ALERT_EMAIL_TO = [a.strip() for a in os.environ.get("QFF_ALERT_EMAIL_TO", "").split(",") if a.strip()]
 ALERT_EMAIL_FROM = os.environ.get("QFF_ALERT_EMAIL_FROM", "qff-alerts@example.com")
+ALERT_WEBHOOK_TIMEOUT_S = float(os.environ.get("QFF_ALERT_WEBHOOK_TIMEOUT_S", "5"))
 
 # Alert history for dashboard
 alert_history: List[Dict] = []
@@ -62,120 +68,165 @@ def notify(level: str, title: str, message: str, metadata: Optional[Dict] = None
     # Console logging
     print(f"[ALERT][{level}] {title}: {message}")
     
-    # Webhook notification
-    if ALERT_WEBHOOK:
-        _send_webhook(payload)
-    
-    # Email notification for critical/security alerts
-    if ALERT_EMAIL_ENABLED and level in (AlertLevel.CRITICAL, AlertLevel.SECURITY):
-        _send_email(level, title, message, metadata)
+    # Webhook and email notification, off the request path
+    alert_dispatcher.enqueue(payload)
     
     return payload
 
 
-def _send_webhook(payload: Dict):
-    """Send alert to configured webhook (Slack, Discord, Teams, etc.)"""
-    try:
-        # Format for Slack-compatible webhook
-        webhook_payload = {
-            "text": f"🚨 *[{payload['level']}]* {payload['title']}",
-            "attachments": [{
-                "color": _get_color(payload['level']),
-                "fields": [
-                    {"title": "Message", "value": payload['message'], "short": False},
-                    {"title": "Time", "value": payload['time'], "short": True},
-                    {"title": "Level", "value": payload['level'], "short": True}
-                ]
-            }]
-        }
-        
-        if payload.get('metadata'):
-            webhook_payload["attachments"][0]["fields"].append({
-                "title": "Details",
-                "value": f"```{json.dumps(payload['metadata'], indent=2)[:500]}```",
-                "short": False
-            })
-        
-        response = requests.post(
-            ALERT_WEBHOOK,
-            json=webhook_payload,
-            timeout=5
-        )
-        
-        if response.status_code != 200:
-            print(f"Webhook failed: {response.status_code}")
-            
-    except Exception as e:
-        print(f"Webhook error: {e}")
-
-
-def _send_email(level: str, title: str, message: str, metadata: Optional[Dict] = None):
-    """Send email alert for critical incidents"""
-    if not SMTP_USER or not ALERT_EMAIL_TO:
-        print("Email not configured, skipping")
-        return
-    
-    try:
-        msg = MIMEMultipart("alternative")
-        msg["Subject"] = f"[QFF {level}] {title}"
-        msg["From"] = ALERT_EMAIL_FROM
-        msg["To"] = ", ".join(ALERT_EMAIL_TO)
-        
-        # Plain text version
-        text_content = f"""
+def _webhook_attachment(payload: Dict) -> Dict:
+    attachment = {
+        "color": _get_color(payload['level']),
+        "fields": [
+            {"title": "Message", "value": payload['message'], "short": False},
+            {"title": "Time", "value": payload['time'], "short": True},
+            {"title": "Level", "value": payload['level'], "short": True}
+        ]
+    }
+    if payload.get('metadata'):
+        attachment["fields"].append({
+            "title": "Details",
+            "value": f"```{json.dumps(payload['metadata'], indent=2)[:500]}```",
+            "short": False
+        })
+    return attachment
+
+
+def webhook_payload(alerts: List[Dict]) -> Dict:
+    """Slack-compatible message for a batch of alerts: one attachment per alert"""
+    if len(alerts) == 1:
+        text = f"🚨 *[{alerts[0]['level']}]* {alerts[0]['title']}"
+    else:
+        levels = sorted({a['level'] for a in alerts})
+        text = f"🚨 *{len(alerts)} alerts* ({', '.join(levels)}): " + "; ".join(a['title'] for a in alerts[:5])
+    # Slack renders at most 100 attachments per message
+    return {"text": text, "attachments": [_webhook_attachment(a) for a in alerts[:100]]}
+
+
+_webhook_session: Optional[requests.Session] = None
+
+
+def _send_webhook_batch(alerts: List[Dict]):
+    """Send a batch of alerts to the configured webhook (Slack, Discord, Teams, etc.); raises to retry"""
+    global _webhook_session
+    if _webhook_session is None:
+        # one keep-alive connection pool for every post
+        _webhook_session = requests.Session()
+        _webhook_session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=2))
+        _webhook_session.mount("http://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=2))
+    response = _webhook_session.post(ALERT_WEBHOOK, json=webhook_payload(alerts), timeout=ALERT_WEBHOOK_TIMEOUT_S)
+    if response.status_code >= 300:
+        raise RuntimeError(f"Webhook failed: {response.status_code}")
+
+
+def _render_email(alert: Dict):
+    """(plain text, html) sections for one alert"""
+    level, title, message = alert["level"], alert["title"], alert["message"]
+    metadata = alert.get("metadata") or {}
+    text_content = f"""
 QFF Security Alert
 ==================
 Level: {level}
 Title: {title}
-Time: {datetime.utcnow().isoformat()}Z
+Time: {alert['time']}
 
 Message:
 {message}
 
 Metadata:
-{json.dumps(metadata or {}, indent=2)}
-
----
-Quantum Financial Firewall
-        """
-        
-        # HTML version
-        html_content = f"""
-        <html>
-        <body style="font-family: Arial, sans-serif; padding: 20px;">
+{json.dumps(metadata, indent=2)}
+"""
+    html_content = f"""
             <div style="background: {_get_color(level)}; color: white; padding: 15px; border-radius: 5px;">
                 <h2 style="margin: 0;">🚨 QFF Security Alert</h2>
             </div>
             <div style="padding: 20px; border: 1px solid #ddd; margin-top: 10px; border-radius: 5px;">
                 <p><strong>Level:</strong> {level}</p>
                 <p><strong>Title:</strong> {title}</p>
-                <p><strong>Time:</strong> {datetime.utcnow().isoformat()}Z</p>
+                <p><strong>Time:</strong> {alert['time']}</p>
                 <hr>
                 <p><strong>Message:</strong></p>
                 <p>{message}</p>
                 <hr>
                 <p><strong>Details:</strong></p>
-                <pre style="background: #f5f5f5; padding: 10px; overflow-x: auto;">{json.dumps(metadata or {}, indent=2)}</pre>
+                <pre style="background: #f5f5f5; padding: 10px; overflow-x: auto;">{json.dumps(metadata, indent=2)}</pre>
             </div>
+"""
+    return text_content, html_content
+
+
+_smtp: Optional[smtplib.SMTP] = None
+
+
+def _smtp_connection() -> smtplib.SMTP:
+    """The dispatcher's SMTP connection, reopened only when the server has dropped it"""
+    global _smtp
+    if _smtp is not None:
+        try:
+            if _smtp.noop()[0] == 250:
+                return _smtp
+        except (smtplib.SMTPException, OSError):
+            pass
+        try:
+            _smtp.close()
+        except Exception:
+            pass
+        _smtp = None
+    server = smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=30)
+    server.starttls()
+    server.login(SMTP_USER, SMTP_PASS)
+    _smtp = server
+    return server
+
+
+def _send_email_digest(alerts: List[Dict]):
+    """One email for a batch of critical/security alerts; raises to retry"""
+    global _smtp
+    msg = MIMEMultipart("alternative")
+    if len(alerts) == 1:
+        msg["Subject"] = f"[QFF {alerts[0]['level']}] {alerts[0]['title']}"
+    else:
+        worst = AlertLevel.CRITICAL if any(a["level"] == AlertLevel.CRITICAL for a in alerts) else alerts[0]["level"]
+        msg["Subject"] = f"[QFF {worst}] {len(alerts)} alerts"
+    msg["From"] = ALERT_EMAIL_FROM
+    msg["To"] = ", ".join(ALERT_EMAIL_TO)
+    
+    sections = [_render_email(alert) for alert in alerts]
+    text_content = "\n".join(text for text, _ in sections) + "\n---\nQuantum Financial Firewall\n"
+    html_content = f"""
+        <html>
+        <body style="font-family: Arial, sans-serif; padding: 20px;">
+            {"".join(html for _, html in sections)}
             <p style="color: #888; font-size: 12px; margin-top: 20px;">
                 Quantum Financial Firewall - Automated Security Alert
             </p>
         </body>
         </html>
         """
-        
-        msg.attach(MIMEText(text_content, "plain"))
-        msg.attach(MIMEText(html_content, "html"))
-        
-        with smtplib.SMTP(SMTP_HOST, SMTP_PORT) as server:
-            server.starttls()
-            server.login(SMTP_USER, SMTP_PASS)
-            server.sendmail(ALERT_EMAIL_FROM, ALERT_EMAIL_TO, msg.as_string())
-            
-        print(f"Email alert sent to {ALERT_EMAIL_TO}")
-        
-    except Exception as e:
-        print(f"Email send failed: {e}")
+    msg.attach(MIMEText(text_content, "plain"))
+    msg.attach(MIMEText(html_content, "html"))
+    
+    try:
+        _smtp_connection().sendmail(ALERT_EMAIL_FROM, ALERT_EMAIL_TO, msg.as_string())
+    except (smtplib.SMTPServerDisconnected, OSError):
+        # a connection that went stale since the NOOP: reconnect once, then let the dispatcher retry
+        _smtp = None
+        _smtp_connection().sendmail(ALERT_EMAIL_FROM, ALERT_EMAIL_TO, msg.as_string())
+    print(f"Email alert ({len(alerts)} alerts) sent to {ALERT_EMAIL_TO}")
+
+
+def _configured_channels() -> List[AlertChannel]:
+    channels = []
+    if ALERT_WEBHOOK:
+        channels.append(AlertChannel("webhook", _send_webhook_batch))
+    if ALERT_EMAIL_ENABLED:
+        if SMTP_USER and ALERT_EMAIL_TO:
+            # Email notification for critical/security alerts
+            channels.append(AlertChannel("email", _send_email_digest,
+                                         lambda a: a["level"] in (AlertLevel.CRITICAL, AlertLevel.SECURITY)))
+        else:
+            print("Email not configured, skipping")
+    return channels
 
 
 def _get_color(level: str) -> str:
@@ -217,3 +268,5 @@ def get_alert_stats() -> Dict:
     
     return stats
 
+
+alert_dispatcher = AlertDispatcher(_configured_channels())
@@ -0,0 +1,131 @@
+"""
+Balance Engine
+Moves money between accounts inside the caller's transaction, so balance
+changes commit or roll back together with the ledger row that records them.
+
+Debits use optimistic concurrency: read (balance, version), check funds, then
+UPDATE ... WHERE version = :read_version. A concurrent writer makes the UPDATE
+match zero rows and the debit re-reads and retries, up to a bounded number of
+attempts. Credits cannot overdraw, so they skip the read and apply an atomic
+in-place increment; hot receivers (merchants) never see a conflict.
+"""
+import os
+import time
+import random
+from typing import Optional
+
+from sqlalchemy import select, update
+
+from .models import accounts
+from .money import format_minor
+from .telemetry import BALANCE_OCC_CONFLICTS, BALANCE_OCC_RETRIES_EXHAUSTED
+
+BALANCE_MAX_RETRIES = int(os.environ.get("QFF_BALANCE_MAX_RETRIES", "8"))
+BALANCE_BACKOFF_MS = float(os.environ.get("QFF_BALANCE_BACKOFF_MS", "1"))
+
+
+class BalanceError(ValueError):
+    """Base class for balance failures; status_code is the HTTP mapping"""
+    status_code = 400
+
+
+class AccountNotFound(BalanceError):
+    status_code = 404
+
+
+class InsufficientFunds(BalanceError):
+    status_code = 400
+
+
+class BalanceConflict(BalanceError):
+    """The account kept changing under us for every retry"""
+    status_code = 409
+
+
+def _backoff(attempt: int):
+    # full jitter, capped so a retrying debit never stalls a group-commit batch for long
+    time.sleep(random.random() * min(BALANCE_BACKOFF_MS * (2 ** attempt), 50) / 1000.0)
+
+
+def find_source_account(conn, user_id: str, currency: str, account_id: Optional[str] = None):
+    """
+    The account to debit: account_id if given (must be the user's and in
+    currency), else the user's best-funded account in that currency.
+    """
+    stmt = select(accounts.c.id, accounts.c.balance_minor, accounts.c.version).where(
+        accounts.c.user_id == user_id, accounts.c.currency == currency
+    )
+    if account_id:
+        stmt = stmt.where(accounts.c.id == account_id)
+    row = conn.execute(stmt.order_by(accounts.c.balance_minor.desc()).limit(1)).first()
+    if row is None or row.balance_minor is None:
+        raise AccountNotFound(f"No {currency} account to debit" if not account_id else f"Account {account_id} not found")
+    return row
+
+
+def find_credit_account(conn, receiver: str, currency: str):
+    """Receivers that name an internal account in the same currency get credited; others are external (None)"""
+    return conn.execute(select(accounts.c.id, accounts.c.user_id).where(
+        accounts.c.id == receiver, accounts.c.currency == currency, accounts.c.balance_minor.is_not(None)
+    )).first()
+
+
+def debit(conn, account_id: str, amount_minor: int, max_retries: int = BALANCE_MAX_RETRIES) -> int:
+    """Compare-and-swap debit on the version column; returns the new balance in minor units"""
+    for attempt in range(max_retries):
+        row = conn.execute(
+            select(accounts.c.balance_minor, accounts.c.version, accounts.c.currency)
+            .where(accounts.c.id == account_id)
+        ).first()
+        if row is None or row.balance_minor is None:
+            raise AccountNotFound(f"Account {account_id} not found")
+        if row.balance_minor < amount_minor:
+            raise InsufficientFunds("Insufficient funds")
+
+        new_balance = row.balance_minor - amount_minor
+        result = conn.execute(
+            update(accounts)
+            .where(accounts.c.id == account_id, accounts.c.version == row.version)
+            .values(balance_minor=new_balance, balance=format_minor(new_balance, row.currency),
+                    version=row.version + 1)
+        )
+        if result.rowcount == 1:
+            return new_balance
+        BALANCE_OCC_CONFLICTS.inc()
+        _backoff(attempt)
+
+    BALANCE_OCC_RETRIES_EXHAUSTED.inc()
+    raise BalanceConflict("Balance update conflict, please retry")
+
+
+def credit(conn, account_id: str, amount_minor: int) -> int:
+    """Atomic increment (no read-modify-write); returns the new balance in minor units"""
+    result = conn.execute(
+        update(accounts)
+        .where(accounts.c.id == account_id, accounts.c.balance_minor.is_not(None))
+        .values(balance_minor=accounts.c.balance_minor + amount_minor, version=accounts.c.version + 1)
+    )
+    if result.rowcount != 1:
+        raise AccountNotFound(f"Account {account_id} not found")
+    # the increment holds the row's write lock, so this read-back sees our value
+    row = conn.execute(select(accounts.c.balance_minor, accounts.c.currency).where(accounts.c.id == account_id)).one()
+    conn.execute(update(accounts).where(accounts.c.id == account_id)
+                 .values(balance=format_minor(row.balance_minor, row.currency)))
+    return row.balance_minor
+
+
+def transfer(conn, source_id: str, dest_id: Optional[str], amount_minor: int) -> dict:
+    """
+    Debit source and credit dest (None = external payee) in conn's transaction.
+    Rows are touched in account-id order so opposite transfers cannot deadlock.
+    """
+    if amount_minor <= 0:
+        raise BalanceError("Amount must be positive")
+    if dest_id == source_id:
+        return {"source_balance_minor": None, "dest_balance_minor": None}
+
+    balances = {}
+    steps = [(source_id, debit), (dest_id, credit)] if dest_id else [(source_id, debit)]
+    for account_id, op in sorted(steps, key=lambda s: s[0]):
+        balances[account_id] = op(conn, account_id, amount_minor)
+    return {"source_balance_minor": balances[source_id], "dest_balance_minor": balances.get(dest_id)}
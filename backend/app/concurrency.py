@@ -0,0 +1,200 @@
+"""
+Adaptive Concurrency Limits
+Load shedding for the transaction path (/execute, /analyze): each route gets
+a concurrency limit that follows observed latency, a bounded FIFO wait queue
+in front of it, and an immediate 503 for anything beyond that, instead of
+piling requests into the threadpool until they time out.
+
+The limit is a gradient limit (after Netflix's Gradient2): a long-term
+average of request latency is the baseline, a short-term average the
+current reading, and
+
+    gradient  = clamp(tolerance * long_rtt / short_rtt, 0.5, 1.0)
+    new_limit = limit * gradient + sqrt(limit)
+
+so the limit grows by about sqrt(limit) while latency is at its baseline
+and shrinks by up to half when latency rises (DB contention, PQC CPU). A 5xx
+is treated as a drop and backs the limit off multiplicatively (AIMD).
+Latency is measured from admission, so time spent queued does not feed back
+into the limit.
+
+Limits are per worker process. Current limits, in-flight requests, queue
+depths and shed counts are exported as qff_concurrency_* metrics.
+"""
+import os
+import math
+import json
+import time
+import asyncio
+from collections import deque
+from typing import Dict, Iterable
+
+from .telemetry import CONCURRENCY_LIMIT, CONCURRENCY_IN_FLIGHT, CONCURRENCY_QUEUE_DEPTH, CONCURRENCY_SHED
+
+CONCURRENCY_ENABLED = os.environ.get("QFF_CONCURRENCY_ENABLED", "true").lower() == "true"
+CONCURRENCY_ROUTES = [p.strip() for p in os.environ.get("QFF_CONCURRENCY_ROUTES", "/execute,/analyze").split(",")
+                      if p.strip()]
+CONCURRENCY_INITIAL = int(os.environ.get("QFF_CONCURRENCY_INITIAL", "20"))
+CONCURRENCY_MIN = int(os.environ.get("QFF_CONCURRENCY_MIN", "2"))
+CONCURRENCY_MAX = int(os.environ.get("QFF_CONCURRENCY_MAX", "200"))
+CONCURRENCY_QUEUE = int(os.environ.get("QFF_CONCURRENCY_QUEUE", "50"))
+CONCURRENCY_QUEUE_TIMEOUT_S = float(os.environ.get("QFF_CONCURRENCY_QUEUE_TIMEOUT_S", "1.0"))
+CONCURRENCY_TOLERANCE = float(os.environ.get("QFF_CONCURRENCY_TOLERANCE", "1.5"))
+
+
+class Overloaded(Exception):
+    def __init__(self, reason: str):
+        super().__init__(reason)
+        self.reason = reason
+
+
+class GradientLimit:
+    def __init__(self, initial: float = CONCURRENCY_INITIAL, min_limit: int = CONCURRENCY_MIN,
+                 max_limit: int = CONCURRENCY_MAX, tolerance: float = CONCURRENCY_TOLERANCE,
+                 smoothing: float = 0.2, short_window: int = 10, long_window: int = 600,
+                 backoff: float = 0.9):
+        self.limit = float(initial)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self.backoff = backoff
+        self._short_alpha = 2.0 / (short_window + 1)
+        self._long_alpha = 2.0 / (long_window + 1)
+        self.short_rtt = None
+        self.long_rtt = None
+
+    def update(self, rtt: float, in_flight: int, dropped: bool = False) -> float:
+        if dropped:
+            self.limit = max(self.min_limit, self.limit * self.backoff)
+            return self.limit
+        if self.long_rtt is None:
+            self.short_rtt = self.long_rtt = rtt
+        else:
+            self.short_rtt += self._short_alpha * (rtt - self.short_rtt)
+            self.long_rtt += self._long_alpha * (rtt - self.long_rtt)
+            if self.long_rtt / self.short_rtt > 2:
+                # latency fell well below the baseline: let the baseline catch up faster
+                self.long_rtt *= 0.95
+        if in_flight < self.limit / 2:
+            # nowhere near the limit, so latency says nothing about it
+            return self.limit
+        gradient = max(0.5, min(1.0, self.tolerance * self.long_rtt / self.short_rtt))
+        target = self.limit * gradient + math.sqrt(self.limit)
+        self.limit = self.limit * (1 - self.smoothing) + target * self.smoothing
+        self.limit = max(self.min_limit, min(self.max_limit, self.limit))
+        return self.limit
+
+
+class AdaptiveLimiter:
+    """Admission for one route: run up to the limit, queue up to queue_size, shed the rest"""
+
+    def __init__(self, name: str, limit: GradientLimit = None, queue_size: int = CONCURRENCY_QUEUE,
+                 queue_timeout_s: float = CONCURRENCY_QUEUE_TIMEOUT_S):
+        self.name = name
+        self.limit = limit or GradientLimit()
+        self.queue_size = queue_size
+        self.queue_timeout_s = queue_timeout_s
+        self.in_flight = 0
+        self._waiters = deque()
+        self.shed = 0
+        CONCURRENCY_LIMIT.labels(name).set(self.limit.limit)
+
+    def _gauges(self):
+        CONCURRENCY_IN_FLIGHT.labels(self.name).set(self.in_flight)
+        CONCURRENCY_QUEUE_DEPTH.labels(self.name).set(len(self._waiters))
+
+    def _shed(self, reason: str):
+        self.shed += 1
+        CONCURRENCY_SHED.labels(self.name, reason).inc()
+        raise Overloaded(reason)
+
+    async def acquire(self):
+        if self.in_flight < int(self.limit.limit) and not self._waiters:
+            self.in_flight += 1
+            self._gauges()
+            return
+        if len(self._waiters) >= self.queue_size:
+            self._shed("queue_full")
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self._gauges()
+        try:
+            # release() counts us in flight before resolving the future
+            await asyncio.wait_for(waiter, self.queue_timeout_s)
+        except asyncio.TimeoutError:
+            self._discard(waiter)
+            self._shed("queue_timeout")
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # admitted just as the caller went away: hand the slot on
+                self.in_flight -= 1
+                self._wake()
+            else:
+                self._discard(waiter)
+            raise
+        finally:
+            self._gauges()
+
+    def _discard(self, waiter):
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    def _wake(self):
+        while self._waiters and self.in_flight < int(self.limit.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def release(self, rtt: float, dropped: bool = False):
+        self.limit.update(rtt, self.in_flight, dropped)
+        self.in_flight -= 1
+        CONCURRENCY_LIMIT.labels(self.name).set(self.limit.limit)
+        self._wake()
+        self._gauges()
+
+    def stats(self) -> dict:
+        return {"limit": round(self.limit.limit, 2), "in_flight": self.in_flight,
+                "queued": len(self._waiters), "shed": self.shed}
+
+
+class ConcurrencyLimitMiddleware:
+    """ASGI middleware: adaptive concurrency limits on the listed routes, 503 when shed"""
+
+    def __init__(self, app, routes: Iterable[str] = None, limiters: Dict[str, AdaptiveLimiter] = None):
+        self.app = app
+        self.limiters = limiters if limiters is not None else {
+            path: AdaptiveLimiter(path) for path in (CONCURRENCY_ROUTES if routes is None else routes)}
+
+    async def __call__(self, scope, receive, send):
+        limiter = self.limiters.get(scope["path"]) if scope["type"] == "http" else None
+        if limiter is None:
+            return await self.app(scope, receive, send)
+        try:
+            await limiter.acquire()
+        except Overloaded as e:
+            body = json.dumps({"errorCode": "OVERLOADED", "userMessage": "Server is busy, please retry",
+                               "details": {"reason": e.reason}}).encode()
+            await send({"type": "http.response.start", "status": 503,
+                        "headers": [(b"content-type", b"application/json"),
+                                    (b"content-length", str(len(body)).encode()),
+                                    (b"retry-after", b"1")]})
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        status = 500
+
+        async def send_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_status)
+        finally:
+            limiter.release(time.perf_counter() - start, dropped=status >= 500)
@@ -1,9 +1,201 @@
 # backend/app/database.py
-from sqlalchemy import create_engine, MetaData
+from sqlalchemy import create_engine, event, MetaData
 from sqlalchemy.orm import sessionmaker
+from .telemetry import DB_POOL_CHECKOUT_SECONDS, DB_POOL_IN_USE, DB_POOL_SATURATION
 import os
+import time
+import threading
 
 DB_URL = os.environ.get("QFF_DB_URL", "sqlite:///./qff.db")
-engine = create_engine(DB_URL, connect_args={"check_same_thread": False} if DB_URL.startswith("sqlite") else {})
+
+# SQLite performance profile, applied to every new SQLite connection
+SQLITE_JOURNAL_MODE = os.environ.get("QFF_SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.environ.get("QFF_SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_MMAP_SIZE = int(os.environ.get("QFF_SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_CACHE_SIZE = int(os.environ.get("QFF_SQLITE_CACHE_SIZE", "-65536"))  # negative = KiB, i.e. 64 MiB
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("QFF_SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+# Connection pool tuning (ignored for in-memory SQLite, which uses a single connection)
+POOL_SIZE = int(os.environ.get("QFF_DB_POOL_SIZE", "10"))
+POOL_MAX_OVERFLOW = int(os.environ.get("QFF_DB_MAX_OVERFLOW", "20"))
+POOL_RECYCLE = int(os.environ.get("QFF_DB_POOL_RECYCLE", "1800"))
+POOL_TIMEOUT = float(os.environ.get("QFF_DB_POOL_TIMEOUT", "30"))
+
+
+def _is_memory_sqlite(url: str) -> bool:
+    return url.startswith("sqlite") and (":memory:" in url or url.rstrip("/").endswith("sqlite:"))
+
+
+def _engine_kwargs(url: str) -> dict:
+    kwargs = {"connect_args": {"check_same_thread": False}} if url.startswith("sqlite") and "aiosqlite" not in url else {}
+    if not _is_memory_sqlite(url):
+        kwargs.update(pool_size=POOL_SIZE, max_overflow=POOL_MAX_OVERFLOW,
+                      pool_recycle=POOL_RECYCLE, pool_timeout=POOL_TIMEOUT)
+    return kwargs
+
+
+def apply_sqlite_profile(db_engine, synchronous: str = None):
+    """Set WAL, synchronous, mmap and cache pragmas on each new connection"""
+    memory = _is_memory_sqlite(str(db_engine.url))
+
+    def _set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        if not memory:
+            cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+            cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        cursor.execute(f"PRAGMA synchronous={synchronous or SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA cache_size={SQLITE_CACHE_SIZE}")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
+
+    event.listen(db_engine, "connect", _set_pragmas)
+
+
+def instrument_pool(pool, name: str, capacity: int):
+    """Export in-use connections and saturation (in use / capacity) for a pool"""
+    lock = threading.Lock()
+    in_use = {"n": 0}
+
+    def _update(delta):
+        with lock:
+            in_use["n"] += delta
+            DB_POOL_IN_USE.labels(name).set(in_use["n"])
+            DB_POOL_SATURATION.labels(name).set(in_use["n"] / capacity)
+
+    event.listen(pool, "checkout", lambda *a: _update(1))
+    event.listen(pool, "checkin", lambda *a: _update(-1))
+
+
+def _pool_capacity(url: str) -> int:
+    return 1 if _is_memory_sqlite(url) else POOL_SIZE + POOL_MAX_OVERFLOW
+
+
+def make_engine(url: str, name: str = "primary"):
+    db_engine = create_engine(url, **_engine_kwargs(url))
+    if db_engine.dialect.name == "sqlite":
+        apply_sqlite_profile(db_engine)
+    instrument_pool(db_engine.pool, name, _pool_capacity(url))
+    return db_engine
+
+
+def make_writer_engine(url: str):
+    """
+    Engine for the group-commit writer (see group_commit.py).
+    On SQLite it is a single connection that takes the write lock up front
+    (BEGIN IMMEDIATE) and supports real SAVEPOINTs, with synchronous=FULL
+    so an acknowledged batch is on disk. Other dialects share the pool.
+    """
+    if not url.startswith("sqlite"):
+        return engine
+    from sqlalchemy.pool import StaticPool
+    db_engine = create_engine(url, poolclass=StaticPool,
+                              connect_args={"check_same_thread": False, "isolation_level": None})
+    apply_sqlite_profile(db_engine, synchronous=os.environ.get("QFF_GROUP_COMMIT_SYNCHRONOUS", "FULL"))
+
+    @event.listens_for(db_engine, "begin")
+    def _begin_immediate(conn):
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+    return db_engine
+
+
+engine = make_engine(DB_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 metadata = MetaData()
+
+# Optional read replica: a Postgres standby or a periodically refreshed copy of
+# the SQLite file. Unset means reads share the primary (see replica.py for routing).
+READ_DB_URL = os.environ.get("QFF_READ_DB_URL") or None
+read_engine = make_engine(READ_DB_URL, "replica") if READ_DB_URL else engine
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+
+
+def session_scope(replica: bool = False):
+    """One session, rolled back on error and always closed"""
+    replica = replica and read_engine is not engine
+    db = (ReadSessionLocal if replica else SessionLocal)()
+    start = time.perf_counter()
+    try:
+        db.connection()
+        DB_POOL_CHECKOUT_SECONDS.labels("replica" if replica else "primary").observe(time.perf_counter() - start)
+        yield db
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+def get_db():
+    """FastAPI dependency: one session per request on the primary"""
+    yield from session_scope()
+
+
+# ---- async engine (aiosqlite / asyncpg) ----
+
+def async_url(url: str) -> str:
+    """Map a sync database URL onto its async driver"""
+    if url.startswith("sqlite:"):
+        return url.replace("sqlite:", "sqlite+aiosqlite:", 1)
+    if url.startswith("postgresql:") or url.startswith("postgres:"):
+        return "postgresql+asyncpg:" + url.split(":", 1)[1]
+    return url
+
+
+ASYNC_DB_URL = os.environ.get("QFF_ASYNC_DB_URL", async_url(DB_URL))
+ASYNC_READ_DB_URL = os.environ.get("QFF_ASYNC_READ_DB_URL", async_url(READ_DB_URL) if READ_DB_URL else None)
+
+_async_engines = {}
+_async_sessionmakers = {}
+
+
+def _async_engine_for(name: str, url: str):
+    """Create an async engine on first use so the driver is only needed when used"""
+    if name not in _async_engines:
+        from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+        db_engine = create_async_engine(url, **_engine_kwargs(url))
+        if db_engine.dialect.name == "sqlite":
+            apply_sqlite_profile(db_engine.sync_engine)
+        instrument_pool(db_engine.sync_engine.pool, name, _pool_capacity(url))
+        _async_engines[name] = db_engine
+        _async_sessionmakers[name] = async_sessionmaker(db_engine, autoflush=False, expire_on_commit=False)
+    return _async_engines[name]
+
+
+def get_async_engine():
+    return _async_engine_for("async", ASYNC_DB_URL)
+
+
+def get_async_read_engine():
+    """Async engine for the replica, or the primary's when no replica is configured"""
+    return _async_engine_for("async_replica", ASYNC_READ_DB_URL) if ASYNC_READ_DB_URL else get_async_engine()
+
+
+def async_session_scope(replica: bool = False):
+    """One AsyncSession, rolled back on error and always closed"""
+    if replica and ASYNC_READ_DB_URL:
+        return async_session_for("async_replica", ASYNC_READ_DB_URL)
+    return async_session_for("async", ASYNC_DB_URL)
+
+
+async def async_session_for(name: str, url: str):
+    """One AsyncSession on the named async engine (created on first use)"""
+    _async_engine_for(name, url)
+    db = _async_sessionmakers[name]()
+    start = time.perf_counter()
+    try:
+        await db.connection()
+        DB_POOL_CHECKOUT_SECONDS.labels(name).observe(time.perf_counter() - start)
+        yield db
+    except Exception:
+        await db.rollback()
+        raise
+    finally:
+        await db.close()
+
+
+async def get_async_db():
+    """Async FastAPI dependency: one AsyncSession per request"""
+    async for db in async_session_scope():
+        yield db
@@ -0,0 +1,206 @@
+"""
+Envelope Encryption
+Field encryption without an HSM round trip per field: the HSM master key
+only wraps data keys, and the data keys do the bulk AES-256-GCM locally.
+
+    envelope = EnvelopeEncryptor(hsm_client)
+    token = envelope.encrypt_field("amount", "1250.00")
+    envelope.decrypt_field("amount", token)
+
+A data key is generated by the HSM (generate_data_key) and reused for
+encryption until it reaches QFF_DATA_KEY_MAX_AGE_S, QFF_DATA_KEY_MAX_MESSAGES
+or QFF_DATA_KEY_MAX_BYTES, whichever comes first; then the next encryption
+asks the HSM for a fresh one. Each ciphertext carries its wrapped data key,
+so it decrypts anywhere the HSM key is available. Decryption keeps the
+recently unwrapped keys (QFF_DATA_KEY_CACHE_SIZE, same max age), so reading
+a batch written under one data key costs one HSM unwrap.
+
+Ciphertext layout (base64url in the *_field helpers):
+
+    version (1) | key id length (1) | key id | wrapped key length (2) | wrapped key | nonce (12) | AES-GCM ciphertext + tag
+
+The field name is bound in as associated data, so a ciphertext cannot be
+moved from one field to another.
+"""
+import os
+import time
+import base64
+import struct
+import secrets
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from .telemetry import DATA_KEY_CACHE
+
+DATA_KEY_MAX_AGE_S = float(os.environ.get("QFF_DATA_KEY_MAX_AGE_S", "300"))
+DATA_KEY_MAX_MESSAGES = int(os.environ.get("QFF_DATA_KEY_MAX_MESSAGES", "100000"))
+DATA_KEY_MAX_BYTES = int(os.environ.get("QFF_DATA_KEY_MAX_BYTES", str(1 << 30)))
+DATA_KEY_CACHE_SIZE = int(os.environ.get("QFF_DATA_KEY_CACHE_SIZE", "1024"))
+ENVELOPE_KEY_ID = os.environ.get("QFF_ENVELOPE_KEY_ID", "qff_master_key")
+
+VERSION = 1
+NONCE_BYTES = 12
+
+
+class DataKey:
+    __slots__ = ("wrapped", "aead", "created", "messages", "bytes")
+
+    def __init__(self, plaintext: bytes, wrapped: bytes, created: float):
+        self.wrapped = wrapped
+        self.aead = AESGCM(plaintext)
+        self.created = created
+        self.messages = 0
+        self.bytes = 0
+
+
+class DataKeyCache:
+    """The current encryption data key per HSM key, plus an LRU of unwrapped keys for decryption"""
+
+    def __init__(self, max_age_s: float = DATA_KEY_MAX_AGE_S, max_messages: int = DATA_KEY_MAX_MESSAGES,
+                 max_bytes: int = DATA_KEY_MAX_BYTES, max_entries: int = DATA_KEY_CACHE_SIZE,
+                 clock: Callable[[], float] = time.monotonic):
+        self.max_age_s = max_age_s
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.clock = clock
+        self._current: Dict[str, DataKey] = {}
+        self._unwrapped: "OrderedDict[Tuple[str, bytes], DataKey]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.rotations = 0
+
+    def _fresh(self, key: DataKey) -> bool:
+        return self.clock() - key.created < self.max_age_s
+
+    def for_encrypt(self, key_id: str, size: int) -> Optional[DataKey]:
+        """The current data key charged with one message of `size` bytes, or None if it needs replacing"""
+        key = self._current.get(key_id)
+        if key is not None:
+            if (self._fresh(key) and key.messages < self.max_messages
+                    and key.bytes + size <= self.max_bytes):
+                key.messages += 1
+                key.bytes += size
+                self.hits += 1
+                DATA_KEY_CACHE.labels("encrypt", "hit").inc()
+                return key
+            del self._current[key_id]
+            self.rotations += 1
+        self.misses += 1
+        DATA_KEY_CACHE.labels("encrypt", "miss").inc()
+        return None
+
+    def set_current(self, key_id: str, key: DataKey, size: int):
+        key.messages, key.bytes = 1, size
+        self._current[key_id] = key
+        self.remember(key_id, key)
+
+    def for_decrypt(self, key_id: str, wrapped: bytes) -> Optional[DataKey]:
+        key = self._unwrapped.get((key_id, wrapped))
+        if key is not None and self._fresh(key):
+            self._unwrapped.move_to_end((key_id, wrapped))
+            self.hits += 1
+            DATA_KEY_CACHE.labels("decrypt", "hit").inc()
+            return key
+        self.misses += 1
+        DATA_KEY_CACHE.labels("decrypt", "miss").inc()
+        return None
+
+    def remember(self, key_id: str, key: DataKey):
+        self._unwrapped[(key_id, key.wrapped)] = key
+        self._unwrapped.move_to_end((key_id, key.wrapped))
+        while len(self._unwrapped) > self.max_entries:
+            self._unwrapped.popitem(last=False)
+
+    def clear(self):
+        self._current.clear()
+        self._unwrapped.clear()
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "rotations": self.rotations,
+                "unwrapped_keys": len(self._unwrapped)}
+
+
+class EnvelopeEncryptor:
+    def __init__(self, hsm, key_id: str = ENVELOPE_KEY_ID, cache: DataKeyCache = None):
+        self.hsm = hsm
+        self.key_id = key_id
+        self.cache = cache or DataKeyCache()
+        self._lock = threading.Lock()
+
+    def _encrypt_key(self, size: int) -> DataKey:
+        # held across the HSM call so a rotation costs one generate_data_key, not one per waiting thread
+        with self._lock:
+            key = self.cache.for_encrypt(self.key_id, size)
+            if key is None:
+                plaintext, wrapped = self.hsm.generate_data_key(self.key_id)
+                key = DataKey(plaintext, wrapped, self.cache.clock())
+                self.cache.set_current(self.key_id, key, size)
+            return key
+
+    def _decrypt_key(self, key_id: str, wrapped: bytes) -> DataKey:
+        with self._lock:
+            key = self.cache.for_decrypt(key_id, wrapped)
+            if key is None:
+                key = DataKey(self.hsm.unwrap_data_key(key_id, wrapped), wrapped, self.cache.clock())
+                self.cache.remember(key_id, key)
+            return key
+
+    def encrypt(self, plaintext: bytes, aad: bytes = b"") -> bytes:
+        key = self._encrypt_key(len(plaintext))
+        nonce = secrets.token_bytes(NONCE_BYTES)
+        key_id = self.key_id.encode()
+        header = (struct.pack("<BB", VERSION, len(key_id)) + key_id
+                  + struct.pack("<H", len(key.wrapped)) + key.wrapped)
+        return header + nonce + key.aead.encrypt(nonce, plaintext, aad)
+
+    def decrypt(self, blob: bytes, aad: bytes = b"") -> bytes:
+        version, id_len = struct.unpack_from("<BB", blob)
+        if version != VERSION:
+            raise ValueError(f"Unsupported envelope version {version}")
+        offset = 2 + id_len
+        key_id = blob[2:offset].decode()
+        (wrapped_len,) = struct.unpack_from("<H", blob, offset)
+        offset += 2
+        wrapped = blob[offset:offset + wrapped_len]
+        offset += wrapped_len
+        nonce = blob[offset:offset + NONCE_BYTES]
+        key = self._decrypt_key(key_id, wrapped)
+        return key.aead.decrypt(nonce, blob[offset + NONCE_BYTES:], aad)
+
+    def encrypt_field(self, field: str, value: str) -> str:
+        return base64.urlsafe_b64encode(self.encrypt(value.encode(), field.encode())).decode()
+
+    def decrypt_field(self, field: str, token: str) -> str:
+        return self.decrypt(base64.urlsafe_b64decode(token.encode()), field.encode()).decode()
+
+    def encrypt_fields(self, record: Dict, fields: Iterable[str]) -> Dict:
+        """Copy of record with the listed fields (those present and not None) encrypted"""
+        out = dict(record)
+        for field in fields:
+            if out.get(field) is not None:
+                out[field] = self.encrypt_field(field, str(out[field]))
+        return out
+
+    def decrypt_fields(self, record: Dict, fields: Iterable[str]) -> Dict:
+        out = dict(record)
+        for field in fields:
+            if out.get(field) is not None:
+                out[field] = self.decrypt_field(field, out[field])
+        return out
+
+    def encrypt_many(self, records: List[Dict], fields: Iterable[str]) -> List[Dict]:
+        fields = list(fields)
+        return [self.encrypt_fields(record, fields) for record in records]
+
+    def decrypt_many(self, records: List[Dict], fields: Iterable[str]) -> List[Dict]:
+        fields = list(fields)
+        return [self.decrypt_fields(record, fields) for record in records]
+
+    def stats(self) -> dict:
+        return {"key_id": self.key_id, "hsm_calls": dict(self.hsm.calls), **self.cache.stats(),
+                "max_age_s": self.cache.max_age_s, "max_messages": self.cache.max_messages,
+                "max_bytes": self.cache.max_bytes}
@@ -0,0 +1,158 @@
+"""
+Group-Commit Writer
+Batches write transactions submitted by many concurrent requests into one
+database transaction, committed once per window. Each unit of work runs in
+its own SAVEPOINT, so a failing unit is rolled back alone while the rest of
+the batch commits. Callers block on a Future that resolves only after the
+batch COMMIT returns, i.e. the acknowledgment is durable.
+
+A caller that gives up waiting (QFF_GROUP_COMMIT_TIMEOUT) only gets an error
+if its unit was withdrawn from the queue before the writer reached it; once a
+unit is in a batch the caller waits for that batch's outcome, so an error
+always means nothing was committed.
+"""
+import os
+import time
+import queue
+import atexit
+import threading
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from typing import Any, Callable, List, Tuple
+
+from .database import DB_URL, engine, make_writer_engine
+from .telemetry import GROUP_COMMIT_BATCH_SIZE, GROUP_COMMIT_WAIT_SECONDS
+
+GROUP_COMMIT_ENABLED = os.environ.get("QFF_GROUP_COMMIT_ENABLED", "true").lower() == "true"
+GROUP_COMMIT_WINDOW_MS = float(os.environ.get("QFF_GROUP_COMMIT_WINDOW_MS", "2"))
+GROUP_COMMIT_MAX_BATCH = int(os.environ.get("QFF_GROUP_COMMIT_MAX_BATCH", "256"))
+GROUP_COMMIT_TIMEOUT = float(os.environ.get("QFF_GROUP_COMMIT_TIMEOUT", "10"))
+
+_STOP = object()
+
+
+class GroupCommitWriter:
+    """
+    Single background thread that owns the write connection.
+    submit(work) queues a callable taking an open Connection; the callable's
+    return value becomes the Future's result once its batch has committed.
+    """
+
+    def __init__(self, db_engine=None, window_ms: float = GROUP_COMMIT_WINDOW_MS,
+                 max_batch: int = GROUP_COMMIT_MAX_BATCH, enabled: bool = GROUP_COMMIT_ENABLED):
+        self._engine = db_engine
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self.enabled = enabled
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.units = 0
+
+    @property
+    def engine(self):
+        if self._engine is None:
+            # without the writer thread, units run on the caller's thread and
+            # need the thread-safe pool rather than the single writer connection
+            self._engine = make_writer_engine(DB_URL) if self.enabled else engine
+        return self._engine
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="qff-group-commit", daemon=True)
+                self._thread.start()
+                atexit.register(self.stop)
+
+    def stop(self, timeout: float = 5.0):
+        """Drain queued work and stop the writer thread"""
+        if self._thread and self._thread.is_alive():
+            self._queue.put(_STOP)
+            self._thread.join(timeout)
+
+    def submit(self, work: Callable) -> Future:
+        future: Future = Future()
+        if not self.enabled:
+            self._commit_batch([(work, future, time.perf_counter())])
+            return future
+        self.start()
+        self._queue.put((work, future, time.perf_counter()))
+        return future
+
+    def execute(self, work: Callable, timeout: float = GROUP_COMMIT_TIMEOUT) -> Any:
+        """
+        Submit and wait for the durable result (re-raises the unit's exception).
+        Raises TimeoutError only for a unit still queued after timeout, which
+        is then withdrawn and never runs.
+        """
+        future = self.submit(work)
+        try:
+            return future.result(timeout)
+        except FutureTimeout:
+            if future.cancel():
+                raise
+            # already in a batch that may commit: its outcome is the answer
+            return future.result()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is _STOP:
+                return
+            batch = [item]
+            deadline = time.perf_counter() + self.window
+            stop = False
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                    break
+                batch.append(item)
+            self._commit_batch(batch)
+            if stop:
+                return
+
+    def _commit_batch(self, batch: List[Tuple[Callable, Future, float]]):
+        outcomes = []
+        try:
+            with self.engine.connect() as conn:
+                with conn.begin():
+                    for work, future, _ in batch:
+                        if not future.set_running_or_notify_cancel():
+                            outcomes.append((future, None, None))  # withdrawn by a caller that timed out
+                            continue
+                        savepoint = conn.begin_nested()
+                        try:
+                            result = work(conn)
+                            savepoint.commit()
+                            outcomes.append((future, result, None))
+                        except Exception as e:
+                            savepoint.rollback()
+                            outcomes.append((future, None, e))
+        except Exception as e:
+            # the COMMIT itself failed: nothing in this batch is durable
+            for _, future, _ in batch:
+                if not future.cancelled():
+                    future.set_exception(e)
+            return
+
+        self.batches += 1
+        self.units += len(batch)
+        GROUP_COMMIT_BATCH_SIZE.observe(len(batch))
+        now = time.perf_counter()
+        for (_, _, queued_at), (future, result, error) in zip(batch, outcomes):
+            GROUP_COMMIT_WAIT_SECONDS.observe(now - queued_at)
+            if future.cancelled():
+                continue
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+
+# Shared writer for the ledger write path
+ledger_writer = GroupCommitWriter()
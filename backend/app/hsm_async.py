@@ -0,0 +1,240 @@
+"""
+Async HSM Client
+HSM operations for async code, over a pluggable transport:
+
+    hsm = AsyncHSMClient(SocketTransport("127.0.0.1:9400"))
+    signature = await hsm.sign("qff_tx_signing_key", payload)
+
+SocketTransport keeps a pool of up to QFF_HSM_POOL_SIZE connections to a
+network HSM (or the stub, python -m app.hsm_stub). Each connection stands
+for one HSM session and carries one request at a time, so the pool size is
+also the concurrency limit for the slot; callers beyond it wait for a
+session. LocalTransport runs an in-process HSMClient on worker threads.
+
+Sign, verify, encrypt and decrypt requests are coalesced: the first request
+opens a QFF_HSM_BATCH_WINDOW_MS window, everything arriving within it (up to
+QFF_HSM_BATCH_MAX) goes out as one batch request, and each caller gets its
+own result or error back. A window of 0 sends every request on its own.
+Request latency and batch sizes are exported as qff_hsm_request_seconds and
+qff_hsm_batch_size.
+"""
+import os
+import json
+import time
+import base64
+import asyncio
+from typing import Dict, List, Optional, Tuple
+
+from .hsm_client import HSMClient, HSM_ADDRESS, HSM_TIMEOUT_S
+from .hsm_stub import DEFAULT_KEYS, handle
+from .telemetry import HSM_CALLS, HSM_REQUEST_SECONDS, HSM_BATCH_SIZE
+
+HSM_POOL_SIZE = int(os.environ.get("QFF_HSM_POOL_SIZE", "8"))
+HSM_BATCH_WINDOW_MS = float(os.environ.get("QFF_HSM_BATCH_WINDOW_MS", "2"))
+HSM_BATCH_MAX = int(os.environ.get("QFF_HSM_BATCH_MAX", "64"))
+
+BATCHED_OPS = frozenset({"sign", "verify", "encrypt", "decrypt"})
+
+
+def _encode(args: dict) -> dict:
+    return {k: base64.b64encode(v).decode() if isinstance(v, bytes) else v for k, v in args.items()}
+
+
+class HSMTransport:
+    """Sends one wire request ({"op", "args"}) and returns its response ({"ok", "result" | "error"})"""
+
+    async def send(self, request: dict) -> dict:
+        raise NotImplementedError
+
+    async def close(self):
+        pass
+
+
+class LocalTransport(HSMTransport):
+    """An in-process HSMClient, called on worker threads; latency_ms stands in for the round trip"""
+
+    def __init__(self, hsm: HSMClient = None, latency_ms: float = 0.0):
+        self.hsm = hsm or HSMClient(mode="simulation")
+        for key_id, key_type in DEFAULT_KEYS:
+            if key_id not in self.hsm.key_store:
+                self.hsm.generate_key(key_id, key_type, exportable=False)
+        self.latency_s = latency_ms / 1000
+        self._lock = asyncio.Lock()
+
+    def _one(self, request: dict) -> dict:
+        try:
+            return {"ok": True, "result": handle(self.hsm, request["op"], request.get("args", {}))}
+        except Exception as e:
+            return {"ok": False, "error": str(e)}
+
+    def _run(self, request: dict) -> dict:
+        if request["op"] == "batch":
+            return {"ok": True, "result": [self._one(r) for r in request["args"]["requests"]]}
+        return self._one(request)
+
+    async def send(self, request: dict) -> dict:
+        if self.latency_s:
+            await asyncio.sleep(self.latency_s)
+        # HSMClient is not thread-safe: one operation at a time, as on a single device
+        async with self._lock:
+            return await asyncio.to_thread(self._run, request)
+
+
+class _Connection:
+    __slots__ = ("reader", "writer")
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.reader = reader
+        self.writer = writer
+
+    def close(self):
+        self.writer.close()
+
+
+class SocketTransport(HSMTransport):
+    """A pool of connections to an HSM speaking the stub's line protocol, one request per connection at a time"""
+
+    def __init__(self, address: str = HSM_ADDRESS, pool_size: int = HSM_POOL_SIZE,
+                 timeout_s: float = HSM_TIMEOUT_S):
+        host, _, port = address.rpartition(":")
+        self.host = host or "127.0.0.1"
+        self.port = int(port)
+        self.pool_size = pool_size
+        self.timeout_s = timeout_s
+        self._sessions = asyncio.Semaphore(pool_size)
+        self._idle: List[_Connection] = []
+        self.opened = 0
+
+    async def _connect(self) -> _Connection:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.timeout_s)
+        self.opened += 1
+        return _Connection(reader, writer)
+
+    async def send(self, request: dict) -> dict:
+        async with self._sessions:
+            conn = self._idle.pop() if self._idle else await self._connect()
+            try:
+                conn.writer.write(json.dumps(request).encode() + b"\n")
+                await conn.writer.drain()
+                line = await asyncio.wait_for(conn.reader.readline(), self.timeout_s)
+                if not line:
+                    raise ConnectionError("HSM closed the connection")
+            except BaseException:
+                # a timed-out or broken session may still have a response in flight: never reuse it
+                conn.close()
+                raise
+            self._idle.append(conn)
+        return json.loads(line)
+
+    async def close(self):
+        while self._idle:
+            self._idle.pop().close()
+
+
+class _Batcher:
+    def __init__(self, transport: HSMTransport, window_s: float, max_batch: int):
+        self.transport = transport
+        self.window_s = window_s
+        self.max_batch = max_batch
+        self._pending: List[Tuple[dict, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._in_flight = set()
+        self.batches = 0
+        self.batched_requests = 0
+
+    def submit(self, request: dict) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((request, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window_s, self._flush)
+        return future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        pending, self._pending = self._pending, []
+        if pending:
+            task = asyncio.get_running_loop().create_task(self._send(pending))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _send(self, pending: List[Tuple[dict, asyncio.Future]]):
+        self.batches += 1
+        self.batched_requests += len(pending)
+        HSM_BATCH_SIZE.observe(len(pending))
+        try:
+            if len(pending) == 1:
+                responses = [await self.transport.send(pending[0][0])]
+            else:
+                batch = await self.transport.send({"op": "batch", "args": {"requests": [r for r, _ in pending]}})
+                responses = batch["result"] if batch.get("ok") else [batch] * len(pending)
+        except Exception as e:
+            for _, future in pending:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), response in zip(pending, responses):
+            if not future.done():
+                future.set_result(response)
+
+
+class AsyncHSMClient:
+    def __init__(self, transport: HSMTransport = None, batch_window_ms: float = HSM_BATCH_WINDOW_MS,
+                 max_batch: int = HSM_BATCH_MAX):
+        self.transport = transport or SocketTransport()
+        self.batch_window_ms = batch_window_ms
+        self._batcher = _Batcher(self.transport, batch_window_ms / 1000, max_batch) if batch_window_ms > 0 else None
+        self.requests = 0
+
+    async def _call(self, op: str, **args):
+        self.requests += 1
+        HSM_CALLS.labels(op).inc()
+        request = {"op": op, "args": _encode(args)}
+        start = time.perf_counter()
+        try:
+            if self._batcher is not None and op in BATCHED_OPS:
+                response = await self._batcher.submit(request)
+            else:
+                response = await self.transport.send(request)
+        finally:
+            HSM_REQUEST_SECONDS.labels(op).observe(time.perf_counter() - start)
+        if not response.get("ok"):
+            raise ValueError(response.get("error", "HSM request failed"))
+        return response.get("result")
+
+    async def generate_key(self, key_id: str, key_type: str = "AES256", exportable: bool = False) -> Dict:
+        return await self._call("generate_key", key_id=key_id, key_type=key_type, exportable=exportable)
+
+    async def encrypt(self, key_id: str, plaintext: bytes) -> Tuple[bytes, bytes]:
+        result = await self._call("encrypt", key_id=key_id, plaintext=plaintext)
+        return base64.b64decode(result["ciphertext"]), base64.b64decode(result["iv"])
+
+    async def decrypt(self, key_id: str, ciphertext: bytes, iv: bytes) -> bytes:
+        return base64.b64decode(await self._call("decrypt", key_id=key_id, ciphertext=ciphertext, iv=iv))
+
+    async def sign(self, key_id: str, data: bytes) -> bytes:
+        return base64.b64decode(await self._call("sign", key_id=key_id, data=data))
+
+    async def verify(self, key_id: str, data: bytes, signature: bytes) -> bool:
+        return bool(await self._call("verify", key_id=key_id, data=data, signature=signature))
+
+    async def generate_data_key(self, key_id: str, length: int = 32) -> Tuple[bytes, bytes]:
+        result = await self._call("generate_data_key", key_id=key_id, length=length)
+        return base64.b64decode(result["plaintext"]), base64.b64decode(result["wrapped"])
+
+    async def unwrap_data_key(self, key_id: str, wrapped: bytes) -> bytes:
+        return base64.b64decode(await self._call("unwrap_data_key", key_id=key_id, wrapped=wrapped))
+
+    def stats(self) -> dict:
+        batches = self._batcher.batches if self._batcher else 0
+        batched = self._batcher.batched_requests if self._batcher else 0
+        return {"requests": self.requests, "batches": batches,
+                "mean_batch_size": round(batched / batches, 2) if batches else None,
+                "batch_window_ms": self.batch_window_ms}
+
+    async def close(self):
+        await self.transport.close()
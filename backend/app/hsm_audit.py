@@ -0,0 +1,262 @@
+"""
+HSM Audit Log
+A fixed-size in-memory ring of the most recent HSM audit records, plus a
+background writer that persists every record to append-only, hash-chained
+segment files:
+
+    audit = AuditLog("./data/hsm_audit")
+    audit.append({"action": "SIGN", "details": "...", ...})
+    audit.tail(100)        # newest records: the ring, then the segments
+    audit.verify_chain()   # (ok, records checked, first bad seq or None)
+
+Each persisted line is a JSON record with a sequence number, the hash of
+the record before it and its own hash, sha256(prev + canonical JSON), so
+editing, dropping or reordering a line breaks the chain from that point on.
+The writer takes whatever has queued up every QFF_HSM_AUDIT_FLUSH_MS, writes
+it in one go and fsyncs once per batch, and starts a new segment file once
+the current one passes QFF_HSM_AUDIT_SEGMENT_BYTES. Batches are appended
+under an flock and continue the chain from the file's last line, so several
+worker processes can share one directory.
+
+The HSM call never waits for the disk. If the writer falls behind by more
+than QFF_HSM_AUDIT_PENDING records the caller waits for it, up to a second,
+and then the oldest pending record is dropped and counted. Dropped records
+never get a seq, so the writer puts a chained AUDIT_DROPPED record with the
+count at the head of its next batch: the loss shows in the file itself.
+"""
+import os
+import json
+import time
+import atexit
+import hashlib
+import threading
+from collections import deque
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: batches are not serialised across processes
+    fcntl = None
+
+HSM_AUDIT_DIR = os.environ.get("QFF_HSM_AUDIT_DIR", "./data/hsm_audit")
+HSM_AUDIT_BUFFER = int(os.environ.get("QFF_HSM_AUDIT_BUFFER", "10000"))
+HSM_AUDIT_PENDING = int(os.environ.get("QFF_HSM_AUDIT_PENDING", "50000"))
+HSM_AUDIT_FLUSH_MS = float(os.environ.get("QFF_HSM_AUDIT_FLUSH_MS", "200"))
+HSM_AUDIT_SEGMENT_BYTES = int(os.environ.get("QFF_HSM_AUDIT_SEGMENT_BYTES", str(16 << 20)))
+
+GENESIS = "0" * 64
+SEGMENT_PREFIX = "audit-"
+SEGMENT_SUFFIX = ".log"
+
+
+def _body(record: dict) -> str:
+    return json.dumps({k: v for k, v in record.items() if k not in ("prev", "hash")},
+                      sort_keys=True, separators=(",", ":"))
+
+
+def record_hash(prev: str, record: dict) -> str:
+    return hashlib.sha256((prev + _body(record)).encode()).hexdigest()
+
+
+class AuditLog:
+    def __init__(self, directory: Optional[str] = None, capacity: int = HSM_AUDIT_BUFFER,
+                 max_pending: int = HSM_AUDIT_PENDING, flush_ms: float = HSM_AUDIT_FLUSH_MS,
+                 segment_bytes: int = HSM_AUDIT_SEGMENT_BYTES):
+        """directory=None keeps the ring only, nothing is persisted"""
+        self.directory = directory
+        self.ring = deque(maxlen=capacity)
+        self.max_pending = max_pending
+        self.flush_s = flush_ms / 1000
+        self.segment_bytes = segment_bytes
+        self._pending = deque()
+        self._cond = threading.Condition()
+        self._writer: Optional[threading.Thread] = None
+        self._closed = False
+        self._flush_now = False
+        self._writing = False
+        self.persisted = 0
+        self.dropped = 0
+        self._dropped_unrecorded = 0  # dropped since the last AUDIT_DROPPED marker
+        self.batches = 0
+
+    def __len__(self):
+        return len(self.ring)
+
+    def append(self, record: dict):
+        self.ring.append(record)
+        if self.directory is None:
+            return
+        with self._cond:
+            if self._writer is None:
+                self._start()
+            if len(self._pending) >= self.max_pending:
+                self._cond.notify_all()
+                self._cond.wait_for(lambda: len(self._pending) < self.max_pending, timeout=1.0)
+                if len(self._pending) >= self.max_pending:
+                    self._pending.popleft()
+                    self.dropped += 1
+                    self._dropped_unrecorded += 1
+                    if self.dropped == 1 or self.dropped % 1000 == 0:
+                        print(f"HSM audit writer is behind: {self.dropped} records dropped")
+            self._pending.append(record)
+
+    # --- persistence ---
+
+    def _start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._writer = threading.Thread(target=self._run, name="qff-hsm-audit", daemon=True)
+        self._writer.start()
+        atexit.register(self.close)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._closed or self._flush_now
+                                    or len(self._pending) >= self.max_pending, timeout=self.flush_s)
+                self._flush_now = False
+                batch = list(self._pending)
+                self._pending.clear()
+                if self._dropped_unrecorded:
+                    batch.insert(0, {"timestamp": datetime.utcnow().isoformat(), "action": "AUDIT_DROPPED",
+                                     "details": f"{self._dropped_unrecorded} records dropped, writer was behind",
+                                     "dropped": self._dropped_unrecorded})
+                    self._dropped_unrecorded = 0
+                self._writing = bool(batch)
+                self._cond.notify_all()
+                closed = self._closed
+            if batch:
+                try:
+                    self._write(batch)
+                except Exception as e:
+                    print(f"HSM audit write failed, {len(batch)} records kept for retry: {e}")
+                    with self._cond:
+                        self._pending.extendleft(reversed(batch))
+                    if not closed:
+                        time.sleep(self.flush_s)
+                with self._cond:
+                    self._writing = False
+                    self._cond.notify_all()
+            if closed:
+                return
+
+    def segments(self) -> List[str]:
+        if not self.directory or not os.path.isdir(self.directory):
+            return []
+        names = sorted(n for n in os.listdir(self.directory)
+                       if n.startswith(SEGMENT_PREFIX) and n.endswith(SEGMENT_SUFFIX))
+        return [os.path.join(self.directory, n) for n in names]
+
+    @staticmethod
+    def _last_record(path: str) -> Optional[dict]:
+        with open(path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            chunk = min(size, 4096)
+            while chunk:
+                f.seek(size - chunk)
+                lines = f.read(chunk).splitlines()
+                # the first line of a partial read may be cut off, unless we read from the start
+                if len(lines) > 1 or chunk == size:
+                    return json.loads(lines[-1]) if lines else None
+                chunk = min(size, chunk * 4)
+        return None
+
+    def _head(self, segments: List[str]) -> Tuple[int, str]:
+        """(last seq, last hash) of the chain on disk"""
+        for path in reversed(segments):
+            last = self._last_record(path)
+            if last is not None:
+                return last["seq"], last["hash"]
+        return 0, GENESIS
+
+    def _write(self, batch: List[dict]):
+        lock_file = open(os.path.join(self.directory, ".lock"), "a+") if fcntl else None
+        try:
+            if lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            segments = self.segments()
+            seq, prev = self._head(segments)
+            path = segments[-1] if segments else None
+            if path is None or os.path.getsize(path) >= self.segment_bytes:
+                number = int(os.path.basename(path)[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]) + 1 if path else 1
+                path = os.path.join(self.directory, f"{SEGMENT_PREFIX}{number:06d}{SEGMENT_SUFFIX}")
+            lines = []
+            for record in batch:
+                seq += 1
+                record["seq"] = seq
+                body = _body(record)
+                digest = hashlib.sha256((prev + body).encode()).hexdigest()
+                # the body's JSON with the chain fields appended: one serialisation per record
+                lines.append(f'{body[:-1]},"prev":"{prev}","hash":"{digest}"}}')
+                record["prev"], record["hash"] = prev, digest
+                prev = digest
+            with open(path, "a", encoding="utf-8") as f:
+                f.write("\n".join(lines) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+            self.persisted += len(batch)
+            self.batches += 1
+        finally:
+            if lock_file:
+                lock_file.close()
+
+    def flush(self, timeout: float = 5.0) -> bool:
+        """Wait until everything appended so far is on disk"""
+        if self._writer is None:
+            return True
+        with self._cond:
+            self._flush_now = True
+            self._cond.notify_all()
+            return self._cond.wait_for(lambda: not self._pending and not self._writing, timeout=timeout)
+
+    def close(self):
+        if self._writer is None or self._closed:
+            return
+        self.flush()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._writer.join(timeout=5.0)
+
+    # --- reading ---
+
+    def _read_segment(self, path: str) -> List[dict]:
+        with open(path, encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def tail(self, limit: int = 100) -> List[dict]:
+        """The newest `limit` records, oldest first: the ring, preceded by older persisted records if needed"""
+        recent = list(self.ring)[-limit:] if limit > 0 else []
+        missing = limit - len(recent)
+        if missing <= 0 or self.directory is None:
+            return recent
+        # everything in the ring from seq `first` on is already in hand
+        first = next((r["seq"] for r in recent if "seq" in r), None)
+        older: List[dict] = []
+        for path in reversed(self.segments()):
+            records = self._read_segment(path)
+            if first is not None:
+                records = [r for r in records if r["seq"] < first]
+            older = records + older
+            if len(older) >= missing:
+                break
+        return older[-missing:] + recent
+
+    def verify_chain(self) -> Tuple[bool, int, Optional[int]]:
+        """Walk every persisted record: (chain intact, records checked, seq of the first bad record)"""
+        prev, checked = None, 0
+        for path in self.segments():
+            for record in self._read_segment(path):
+                if prev is None:
+                    prev = record["prev"]  # the oldest segment may have been archived away
+                if record["prev"] != prev or record_hash(prev, record) != record["hash"]:
+                    return False, checked, record.get("seq")
+                prev = record["hash"]
+                checked += 1
+        return True, checked, None
+
+    def stats(self) -> dict:
+        return {"buffered": len(self.ring), "capacity": self.ring.maxlen, "pending": len(self._pending),
+                "persisted": self.persisted, "batches": self.batches, "dropped": self.dropped,
+                "segments": len(self.segments())}
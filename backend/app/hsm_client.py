@@ -4,12 +4,24 @@ HSM (Hardware Security Module) Client for secure key management
 Simulates HSM operations with optional integration points for real HSM devices
 """
 import os
+import base64
+import socket
 import secrets
 import hashlib
+import threading
+from collections import Counter
 from typing import Optional, Dict, Tuple
 from datetime import datetime
 import json
 
+from .telemetry import HSM_CALLS
+from .hsm_audit import AuditLog, HSM_AUDIT_DIR
+from .hsm_keystore import KeyStore, HSM_KEYSTORE
+
+# host:port of the HSM stub server (python -m app.hsm_stub) for mode="stub"
+HSM_ADDRESS = os.environ.get("QFF_HSM_ADDRESS", "127.0.0.1:9400")
+HSM_TIMEOUT_S = float(os.environ.get("QFF_HSM_TIMEOUT_S", "5"))
+
 class HSMClient:
     """
     HSM Client for secure cryptographic operations
@@ -17,14 +29,20 @@ class HSMClient:
     or cloud HSM services (AWS CloudHSM, Azure Key Vault HSM, Google Cloud HSM)
     """
     
-    def __init__(self, mode: str = "simulation"):
+    def __init__(self, mode: str = "simulation", address: Optional[str] = None, audit: Optional[AuditLog] = None,
+                 key_store: Optional[KeyStore] = None):
         """
         Initialize HSM client
-        mode: 'simulation' | 'aws_cloudhsm' | 'azure_keyvault' | 'physical'
+        mode: 'simulation' | 'stub' | 'aws_cloudhsm' | 'azure_keyvault' | 'physical'
+        address: host:port of the HSM stub server (mode='stub', default QFF_HSM_ADDRESS)
+        audit: where audit records go (default: a bounded in-memory ring, not persisted)
+        key_store: where keys live (default: an in-memory KeyStore)
         """
         self.mode = mode
-        self.key_store: Dict[str, Dict] = {}
-        self.audit_log: list = []
+        self.address_spec = address or HSM_ADDRESS
+        self.key_store = key_store if key_store is not None else KeyStore()
+        self.audit = audit if audit is not None else AuditLog()
+        self.calls: Counter = Counter()  # operations sent to the HSM, by op
         self.initialized = True
         
         if mode == "simulation":
@@ -43,8 +61,32 @@ class HSMClient:
         """Initialize connection to real HSM device"""
         # Placeholder for real HSM SDK initialization
         # Example: boto3 for AWS CloudHSM, Azure SDK for Key Vault
+        if self.mode == "stub":
+            host, _, port = self.address_spec.rpartition(":")
+            self.address = (host or "127.0.0.1", int(port))
+            self._conn = None
+            self._conn_lock = threading.Lock()
         self._log_audit("HSM_INIT", f"Real HSM mode: {self.mode} (stub)")
     
+    def _count(self, op: str):
+        self.calls[op] += 1
+        HSM_CALLS.labels(op).inc()
+    
+    @staticmethod
+    def _new_key(key_id: str, key_type: str, exportable: bool) -> Dict:
+        key_material = secrets.token_bytes(32 if "AES" in key_type else 64)
+        return {
+            "key_id": key_id,
+            "key_type": key_type,
+            "created_at": datetime.utcnow().isoformat(),
+            "exportable": exportable,
+            "algorithm": key_type,
+            "length_bits": 256 if "AES" in key_type else 2048,
+            "usage": ["ENCRYPT", "DECRYPT", "SIGN", "VERIFY"],
+            # kept inside the HSM (sealed in the keystore); only exportable keys ever leave it
+            "material": key_material.hex()
+        }
+
     def generate_key(self, key_id: str, key_type: str = "AES256", exportable: bool = False) -> Dict:
         """
         Generate cryptographic key in HSM
@@ -57,18 +99,9 @@ class HSMClient:
         Returns:
             Dictionary with key metadata
         """
+        self._count("generate_key")
         if self.mode == "simulation":
-            key_material = secrets.token_bytes(32 if "AES" in key_type else 64)
-            key_metadata = {
-                "key_id": key_id,
-                "key_type": key_type,
-                "created_at": datetime.utcnow().isoformat(),
-                "exportable": exportable,
-                "algorithm": key_type,
-                "length_bits": 256 if "AES" in key_type else 2048,
-                "usage": ["ENCRYPT", "DECRYPT", "SIGN", "VERIFY"],
-                "material": key_material.hex() if exportable else None
-            }
+            key_metadata = self._new_key(key_id, key_type, exportable)
             self.key_store[key_id] = key_metadata
             self._log_audit("KEY_GENERATE", f"Generated {key_type} key: {key_id}")
             return {k: v for k, v in key_metadata.items() if k != "material"}
@@ -76,6 +109,56 @@ class HSMClient:
             # Call real HSM API
             return self._real_hsm_generate_key(key_id, key_type, exportable)
     
+    def ensure_key(self, key_id: str, key_type: str = "AES256", exportable: bool = False) -> Dict:
+        """
+        The key with this id, generated only if none exists yet. Workers that
+        race on it all end up with the one that reached the keystore first.
+        """
+        key = self.key_store.get(key_id)
+        if key is None and self.mode == "simulation":
+            self._count("generate_key")
+            key = self.key_store.add(key_id, self._new_key(key_id, key_type, exportable))
+            self._log_audit("KEY_GENERATE", f"Generated {key_type} key: {key_id}")
+        elif key is None:
+            return self.generate_key(key_id, key_type, exportable)
+        return {k: v for k, v in key.items() if k != "material"}
+
+    def _key_material(self, key_id: str) -> bytes:
+        key = self.key_store.get(key_id)
+        if key is None:
+            raise ValueError(f"Key {key_id} not found in HSM")
+        if key.get("status") == "DELETED":
+            raise ValueError(f"Key {key_id} has been deleted")
+        return bytes.fromhex(key.get("material") or self.master_key.hex())
+    
+    def _cipher_key(self, key_id: str) -> bytes:
+        return self._key_material(key_id)[:32]
+    
+    def _sim_encrypt(self, key_id: str, plaintext: bytes) -> Tuple[bytes, bytes]:
+        from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+        from cryptography.hazmat.backends import default_backend
+        
+        # Simulate AES-GCM encryption
+        key = self._cipher_key(key_id)
+        iv = secrets.token_bytes(12)  # 96-bit IV for GCM
+        cipher = Cipher(algorithms.AES(key), modes.GCM(iv), backend=default_backend())
+        encryptor = cipher.encryptor()
+        ciphertext = encryptor.update(plaintext) + encryptor.finalize()
+        return ciphertext + encryptor.tag, iv
+    
+    def _sim_decrypt(self, key_id: str, ciphertext: bytes, iv: bytes) -> bytes:
+        from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+        from cryptography.hazmat.backends import default_backend
+        
+        key = self._cipher_key(key_id)
+        # Extract tag (last 16 bytes)
+        tag = ciphertext[-16:]
+        actual_ciphertext = ciphertext[:-16]
+        
+        cipher = Cipher(algorithms.AES(key), modes.GCM(iv, tag), backend=default_backend())
+        decryptor = cipher.decryptor()
+        return decryptor.update(actual_ciphertext) + decryptor.finalize()
+    
     def encrypt(self, key_id: str, plaintext: bytes, algorithm: str = "AES-GCM") -> Tuple[bytes, bytes]:
         """
         Encrypt data using HSM key
@@ -83,22 +166,11 @@ class HSMClient:
         Returns:
             (ciphertext, iv/nonce)
         """
-        if key_id not in self.key_store:
-            raise ValueError(f"Key {key_id} not found in HSM")
-        
+        self._count("encrypt")
         if self.mode == "simulation":
-            from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
-            from cryptography.hazmat.backends import default_backend
-            
-            # Simulate AES-GCM encryption
-            key = bytes.fromhex(self.key_store[key_id].get("material", self.master_key.hex()))
-            iv = secrets.token_bytes(12)  # 96-bit IV for GCM
-            cipher = Cipher(algorithms.AES(key[:32]), modes.GCM(iv), backend=default_backend())
-            encryptor = cipher.encryptor()
-            ciphertext = encryptor.update(plaintext) + encryptor.finalize()
-            
+            result = self._sim_encrypt(key_id, plaintext)
             self._log_audit("ENCRYPT", f"Encrypted data with key {key_id}")
-            return ciphertext + encryptor.tag, iv
+            return result
         else:
             return self._real_hsm_encrypt(key_id, plaintext, algorithm)
     
@@ -106,35 +178,55 @@ class HSMClient:
         """
         Decrypt data using HSM key
         """
-        if key_id not in self.key_store:
-            raise ValueError(f"Key {key_id} not found in HSM")
-        
+        self._count("decrypt")
         if self.mode == "simulation":
-            from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
-            from cryptography.hazmat.backends import default_backend
-            
-            key = bytes.fromhex(self.key_store[key_id].get("material", self.master_key.hex()))
-            # Extract tag (last 16 bytes)
-            tag = ciphertext[-16:]
-            actual_ciphertext = ciphertext[:-16]
-            
-            cipher = Cipher(algorithms.AES(key[:32]), modes.GCM(iv, tag), backend=default_backend())
-            decryptor = cipher.decryptor()
-            plaintext = decryptor.update(actual_ciphertext) + decryptor.finalize()
-            
+            plaintext = self._sim_decrypt(key_id, ciphertext, iv)
             self._log_audit("DECRYPT", f"Decrypted data with key {key_id}")
             return plaintext
         else:
             return self._real_hsm_decrypt(key_id, ciphertext, iv, algorithm)
     
+    def generate_data_key(self, key_id: str, length: int = 32) -> Tuple[bytes, bytes]:
+        """
+        Generate a data key for envelope encryption, wrapped by an HSM key
+        
+        Returns:
+            (plaintext data key, wrapped data key = iv + ciphertext + tag);
+            only the wrapped key may be stored
+        """
+        self._count("generate_data_key")
+        if self.mode == "simulation":
+            data_key = secrets.token_bytes(length)
+            ciphertext, iv = self._sim_encrypt(key_id, data_key)
+            self._log_audit("DATA_KEY_GENERATE", f"Generated data key under {key_id}")
+            return data_key, iv + ciphertext
+        else:
+            return self._real_hsm_generate_data_key(key_id, length)
+    
+    def unwrap_data_key(self, key_id: str, wrapped: bytes) -> bytes:
+        """
+        Unwrap a data key returned by generate_data_key
+        """
+        self._count("unwrap_data_key")
+        if self.mode == "simulation":
+            data_key = self._sim_decrypt(key_id, wrapped[12:], wrapped[:12])
+            self._log_audit("DATA_KEY_UNWRAP", f"Unwrapped data key under {key_id}")
+            return data_key
+        else:
+            return self._real_hsm_unwrap_data_key(key_id, wrapped)
+    
+    def _sim_sign(self, key_id: str, data: bytes) -> bytes:
+        # Simulate signing with HMAC for simplicity
+        key = self._key_material(key_id)
+        return hashlib.sha256(key + data).digest()
+    
     def sign(self, key_id: str, data: bytes, algorithm: str = "SHA256-RSA") -> bytes:
         """
         Sign data using HSM key
         """
+        self._count("sign")
         if self.mode == "simulation":
-            # Simulate signing with HMAC for simplicity
-            key = bytes.fromhex(self.key_store[key_id].get("material", self.master_key.hex()))
-            signature = hashlib.sha256(key + data).digest()
+            signature = self._sim_sign(key_id, data)
             self._log_audit("SIGN", f"Signed data with key {key_id}")
             return signature
         else:
@@ -144,8 +236,9 @@ class HSMClient:
         """
         Verify signature using HSM key
         """
+        self._count("verify")
         if self.mode == "simulation":
-            expected_signature = self.sign(key_id, data, algorithm)
+            expected_signature = self._sim_sign(key_id, data)
             result = secrets.compare_digest(expected_signature, signature)
             self._log_audit("VERIFY", f"Verified signature with key {key_id}: {result}")
             return result
@@ -161,9 +254,8 @@ class HSMClient:
             raise ValueError(f"Key {old_key_id} not found")
         
         new_key = self.generate_key(new_key_id, old_key["key_type"], old_key["exportable"])
-        old_key["status"] = "DEPRECATED"
-        old_key["rotated_at"] = datetime.utcnow().isoformat()
-        old_key["successor"] = new_key_id
+        self.key_store.update(old_key_id, status="DEPRECATED", rotated_at=datetime.utcnow().isoformat(),
+                              successor=new_key_id)
         
         self._log_audit("KEY_ROTATE", f"Rotated {old_key_id} -> {new_key_id}")
         return new_key
@@ -172,10 +264,9 @@ class HSMClient:
         """
         Securely delete key from HSM
         """
-        if key_id in self.key_store:
-            # In real HSM, this would securely wipe the key
-            self.key_store[key_id]["status"] = "DELETED"
-            self.key_store[key_id]["deleted_at"] = datetime.utcnow().isoformat()
+        # the sealed material is discarded with the status change (crypto-shredding)
+        if self.key_store.update(key_id, discard_material=True, status="DELETED",
+                                 deleted_at=datetime.utcnow().isoformat()):
             self._log_audit("KEY_DELETE", f"Deleted key {key_id}")
             return True
         return False
@@ -205,42 +296,83 @@ class HSMClient:
     
     def _log_audit(self, action: str, details: str):
         """Log audit event"""
-        self.audit_log.append({
+        self.audit.append({
             "timestamp": datetime.utcnow().isoformat(),
             "action": action,
             "details": details,
             "mode": self.mode
         })
     
+    @property
+    def audit_log(self) -> list:
+        """The audit records still in the in-memory ring"""
+        return list(self.audit.ring)
+    
     def get_audit_log(self, limit: int = 100) -> list:
-        """Retrieve audit log"""
-        return self.audit_log[-limit:]
+        """Retrieve audit log: the newest records, from the ring and then the persisted segments"""
+        return self.audit.tail(limit)
+    
+    # Placeholder methods for real HSM integration; mode="stub" speaks to app/hsm_stub.py
+    def _rpc(self, op: str, **args):
+        """One request/response over the stub's line protocol: bytes travel base64-encoded"""
+        if self.mode != "stub":
+            # TODO: Implement AWS CloudHSM, Azure Key Vault, or physical HSM integration
+            raise NotImplementedError("Real HSM integration not implemented")
+        request = {"op": op, "args": {k: base64.b64encode(v).decode() if isinstance(v, bytes) else v
+                                      for k, v in args.items()}}
+        with self._conn_lock:
+            try:
+                if self._conn is None:
+                    sock = socket.create_connection(self.address, timeout=HSM_TIMEOUT_S)
+                    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                    self._conn = sock.makefile("rwb")
+                self._conn.write(json.dumps(request).encode() + b"\n")
+                self._conn.flush()
+                line = self._conn.readline()
+                if not line:
+                    raise ConnectionError("HSM closed the connection")
+            except OSError:
+                self._conn = None
+                raise
+        response = json.loads(line)
+        if not response.get("ok"):
+            raise ValueError(response.get("error", "HSM request failed"))
+        return response.get("result")
     
-    # Placeholder methods for real HSM integration
     def _real_hsm_generate_key(self, key_id: str, key_type: str, exportable: bool) -> Dict:
         """Integrate with real HSM key generation"""
-        # TODO: Implement AWS CloudHSM, Azure Key Vault, or physical HSM integration
-        raise NotImplementedError("Real HSM integration not implemented")
+        metadata = self._rpc("generate_key", key_id=key_id, key_type=key_type, exportable=exportable)
+        self.key_store[key_id] = dict(metadata)
+        return metadata
     
     def _real_hsm_encrypt(self, key_id: str, plaintext: bytes, algorithm: str) -> Tuple[bytes, bytes]:
-        raise NotImplementedError("Real HSM integration not implemented")
+        result = self._rpc("encrypt", key_id=key_id, plaintext=plaintext)
+        return base64.b64decode(result["ciphertext"]), base64.b64decode(result["iv"])
     
     def _real_hsm_decrypt(self, key_id: str, ciphertext: bytes, iv: bytes, algorithm: str) -> bytes:
-        raise NotImplementedError("Real HSM integration not implemented")
+        return base64.b64decode(self._rpc("decrypt", key_id=key_id, ciphertext=ciphertext, iv=iv))
     
     def _real_hsm_sign(self, key_id: str, data: bytes, algorithm: str) -> bytes:
-        raise NotImplementedError("Real HSM integration not implemented")
+        return base64.b64decode(self._rpc("sign", key_id=key_id, data=data))
     
     def _real_hsm_verify(self, key_id: str, data: bytes, signature: bytes, algorithm: str) -> bool:
-        raise NotImplementedError("Real HSM integration not implemented")
+        return bool(self._rpc("verify", key_id=key_id, data=data, signature=signature))
+    
+    def _real_hsm_generate_data_key(self, key_id: str, length: int) -> Tuple[bytes, bytes]:
+        result = self._rpc("generate_data_key", key_id=key_id, length=length)
+        return base64.b64decode(result["plaintext"]), base64.b64decode(result["wrapped"])
+    
+    def _real_hsm_unwrap_data_key(self, key_id: str, wrapped: bytes) -> bytes:
+        return base64.b64decode(self._rpc("unwrap_data_key", key_id=key_id, wrapped=wrapped))
 
 
-# Global HSM client instance
-hsm_client = HSMClient(mode=os.environ.get("QFF_HSM_MODE", "simulation"))
+# Global HSM client instance; its keys and audit trail are persisted (the audit writer starts with the first record)
+hsm_client = HSMClient(mode=os.environ.get("QFF_HSM_MODE", "simulation"), audit=AuditLog(HSM_AUDIT_DIR),
+                       key_store=KeyStore(HSM_KEYSTORE))
 
-# Initialize default keys
+# Initialize default keys (kept across restarts, so data wrapped under them stays readable)
 try:
-    hsm_client.generate_key("qff_master_key", "AES256", exportable=False)
-    hsm_client.generate_key("qff_tx_signing_key", "RSA2048", exportable=False)
+    for default_key_id, default_key_type in (("qff_master_key", "AES256"), ("qff_tx_signing_key", "RSA2048")):
+        hsm_client.ensure_key(default_key_id, default_key_type, exportable=False)
 except Exception as e:
     print(f"HSM initialization warning: {e}")
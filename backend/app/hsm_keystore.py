@@ -0,0 +1,272 @@
+"""
+HSM Keystore
+Where HSMClient keeps its keys: a bounded LRU of hot keys in memory in front
+of an indexed SQLite table on disk, so per-user and per-session keys can run
+into the millions without living in RAM, and survive a restart.
+
+    store = KeyStore("./data/keystore/keys.db")
+    store["user-42"] = {"key_id": "user-42", "key_type": "AES256", "material": "<hex>", ...}
+    store["user-42"]["material"]                 # hot: a dict lookup; cold: one indexed read + unseal
+    store.update("user-42", status="DEPRECATED")  # one row update, no key material touched
+
+Key material never reaches the disk in the clear: it is sealed with
+AES-256-GCM under the keystore's key-encryption key, with the key id as
+associated data, so a sealed blob cannot be swapped between rows. The KEK
+comes from QFF_HSM_MASTER_KEY (64 hex chars) or, for the simulation, from a
+key file created next to the database. Metadata (type, status, rotation and
+deletion stamps) is stored unencrypted as JSON beside it. Deleting a key
+discards its sealed material along with marking it DELETED.
+
+QFF_HSM_KEYSTORE_HOT_KEYS bounds the in-memory set; path=None keeps the
+table in memory (tests, the stub server).
+
+Several worker processes share one keystore file. Every change to an
+existing key (rotation, deletion, replacement) is logged to hsm_key_changes
+by a trigger; before serving from its hot set a store checks SQLite's
+data_version, and when another connection has committed it evicts the keys
+changed since it last looked. A key deleted in one worker is therefore
+refused by all of them on their next use. add() creates a key only if the
+id is free and returns whichever material won, so workers starting together
+agree on their default keys.
+"""
+import os
+import json
+import secrets
+import sqlite3
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, Iterator, Optional
+
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+HSM_KEYSTORE = os.environ.get("QFF_HSM_KEYSTORE", "./data/keystore/keys.db")
+HSM_KEYSTORE_HOT_KEYS = int(os.environ.get("QFF_HSM_KEYSTORE_HOT_KEYS", "10000"))
+HSM_MASTER_KEY = os.environ.get("QFF_HSM_MASTER_KEY", "")
+
+_SCHEMA = (
+    """CREATE TABLE IF NOT EXISTS hsm_keys (
+        key_id TEXT PRIMARY KEY,
+        metadata TEXT NOT NULL,
+        material BLOB
+    ) WITHOUT ROWID""",
+    """CREATE TABLE IF NOT EXISTS hsm_key_changes (
+        gen INTEGER PRIMARY KEY AUTOINCREMENT,
+        key_id TEXT NOT NULL
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS trg_hsm_keys_changed AFTER UPDATE ON hsm_keys
+    BEGIN
+        INSERT INTO hsm_key_changes (key_id) VALUES (NEW.key_id);
+    END""",
+)
+
+# change-log entries kept; a store that falls further behind drops its whole hot set
+CHANGE_LOG_KEEP = 10000
+
+
+def load_kek(path: Optional[str]) -> bytes:
+    """The key-encryption key: QFF_HSM_MASTER_KEY, else a key file beside the store (created once)"""
+    if HSM_MASTER_KEY:
+        return bytes.fromhex(HSM_MASTER_KEY)
+    if path is None:
+        return secrets.token_bytes(32)
+    kek_path = path + ".kek"
+    if not os.path.exists(kek_path):
+        # written in full under a private name, then linked into place: readers never see a partial file
+        fd, tmp = tempfile.mkstemp(prefix=".kek.", dir=os.path.dirname(os.path.abspath(kek_path)))
+        try:
+            with os.fdopen(fd, "w") as f:
+                f.write(secrets.token_bytes(32).hex())
+                f.flush()
+                os.fsync(f.fileno())
+            try:
+                os.link(tmp, kek_path)
+            except FileExistsError:
+                pass  # another worker got there first; use theirs
+        finally:
+            os.remove(tmp)
+    with open(kek_path, "rb") as f:
+        return bytes.fromhex(f.read().decode().strip())
+
+
+class KeyStore:
+    """A dict-like key_id -> metadata (with "material" as hex) store; see the module docstring"""
+
+    def __init__(self, path: Optional[str] = None, hot_keys: int = HSM_KEYSTORE_HOT_KEYS, kek: bytes = None):
+        self.path = path
+        self.hot_keys = hot_keys
+        if path is not None:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._kek = AESGCM(kek or load_kek(path))
+        self._db = sqlite3.connect(path or ":memory:", check_same_thread=False, isolation_level=None)
+        if path is not None:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+        for statement in _SCHEMA:
+            self._db.execute(statement)
+        self._hot: "OrderedDict[str, Dict]" = OrderedDict()
+        self._lock = threading.RLock()
+        self._data_version = self._db.execute("PRAGMA data_version").fetchone()[0]
+        self._seen_gen = self._db.execute("SELECT COALESCE(MAX(gen), 0) FROM hsm_key_changes").fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    # --- sealing ---
+
+    def _seal(self, key_id: str, material_hex: Optional[str]) -> Optional[bytes]:
+        if material_hex is None:
+            return None
+        nonce = secrets.token_bytes(12)
+        return nonce + self._kek.encrypt(nonce, bytes.fromhex(material_hex), key_id.encode())
+
+    def _unseal(self, key_id: str, sealed: Optional[bytes]) -> Optional[str]:
+        if sealed is None:
+            return None
+        return self._kek.decrypt(sealed[:12], sealed[12:], key_id.encode()).hex()
+
+    # --- hot set ---
+
+    def _remember(self, key_id: str, key: Dict):
+        self._hot[key_id] = key
+        self._hot.move_to_end(key_id)
+        while len(self._hot) > self.hot_keys:
+            self._hot.popitem(last=False)
+
+    def _sync(self):
+        """Evict hot keys another connection (another worker) has changed since we last looked"""
+        version = self._db.execute("PRAGMA data_version").fetchone()[0]
+        if version == self._data_version:
+            return
+        self._data_version = version
+        oldest, newest = self._db.execute("SELECT MIN(gen), MAX(gen) FROM hsm_key_changes").fetchone()
+        if newest is None or newest <= self._seen_gen:
+            return
+        if oldest > self._seen_gen + 1:
+            self._hot.clear()  # the log was trimmed past what we saw
+            self.invalidations += 1
+        else:
+            for (key_id,) in self._db.execute("SELECT key_id FROM hsm_key_changes WHERE gen > ?", (self._seen_gen,)):
+                if self._hot.pop(key_id, None) is not None:
+                    self.invalidations += 1
+        self._seen_gen = newest
+
+    def _load(self, key_id: str) -> Optional[Dict]:
+        self._sync()
+        key = self._hot.get(key_id)
+        if key is not None:
+            self._hot.move_to_end(key_id)
+            self.hits += 1
+            return key
+        self.misses += 1
+        row = self._db.execute("SELECT metadata, material FROM hsm_keys WHERE key_id = ?", (key_id,)).fetchone()
+        if row is None:
+            return None
+        key = json.loads(row[0])
+        key["material"] = self._unseal(key_id, row[1])
+        self._remember(key_id, key)
+        return key
+
+    # --- mapping interface ---
+
+    def __contains__(self, key_id: str) -> bool:
+        with self._lock:
+            self._sync()
+            if key_id in self._hot:
+                return True
+            return self._db.execute("SELECT 1 FROM hsm_keys WHERE key_id = ?", (key_id,)).fetchone() is not None
+
+    def __getitem__(self, key_id: str) -> Dict:
+        key = self.get(key_id)
+        if key is None:
+            raise KeyError(key_id)
+        return key
+
+    def get(self, key_id: str, default=None) -> Optional[Dict]:
+        with self._lock:
+            key = self._load(key_id)
+        return default if key is None else key
+
+    def __setitem__(self, key_id: str, key: Dict):
+        self.put_many([(key_id, key)])
+
+    def _row(self, key_id: str, key: Dict) -> tuple:
+        metadata = {k: v for k, v in key.items() if k != "material"}
+        return key_id, json.dumps(metadata), self._seal(key_id, key.get("material"))
+
+    def _write_many(self, sql: str, rows: list):
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            self._db.executemany(sql, rows)
+            self._db.execute("COMMIT")
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+
+    def put_many(self, items: Iterable):
+        """Insert or replace (key_id, metadata) pairs in one transaction"""
+        with self._lock:
+            stored = [(key_id, dict(key)) for key_id, key in items]
+            # an upsert rather than INSERT OR REPLACE, so replacing a key fires the change trigger
+            self._write_many("INSERT INTO hsm_keys (key_id, metadata, material) VALUES (?, ?, ?) "
+                             "ON CONFLICT (key_id) DO UPDATE SET metadata = excluded.metadata, "
+                             "material = excluded.material", [self._row(k, key) for k, key in stored])
+            for key_id, key in stored:
+                self._remember(key_id, key)
+
+    def add(self, key_id: str, key: Dict) -> Dict:
+        """Store a key unless the id is taken; returns the stored key, ours or the one already there"""
+        with self._lock:
+            self._write_many("INSERT OR IGNORE INTO hsm_keys (key_id, metadata, material) VALUES (?, ?, ?)",
+                             [self._row(key_id, key)])
+            self._hot.pop(key_id, None)
+            return self._load(key_id)
+
+    def update(self, key_id: str, discard_material: bool = False, **fields) -> bool:
+        """Merge fields into a key's metadata with a single row update; False if there is no such key"""
+        with self._lock:
+            # read-modify-write under the database write lock, so workers updating one key do not lose fields
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._db.execute("SELECT metadata FROM hsm_keys WHERE key_id = ?", (key_id,)).fetchone()
+                if row is None:
+                    self._db.execute("ROLLBACK")
+                    return False
+                metadata = {**json.loads(row[0]), **fields}
+                if discard_material:
+                    self._db.execute("UPDATE hsm_keys SET metadata = ?, material = NULL WHERE key_id = ?",
+                                     (json.dumps(metadata), key_id))
+                else:
+                    self._db.execute("UPDATE hsm_keys SET metadata = ? WHERE key_id = ?",
+                                     (json.dumps(metadata), key_id))
+                self._db.execute("DELETE FROM hsm_key_changes WHERE gen <= "
+                                 "(SELECT MAX(gen) FROM hsm_key_changes) - ?", (CHANGE_LOG_KEEP,))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            hot = self._hot.get(key_id)
+            if hot is not None:
+                hot.update(fields)
+                if discard_material:
+                    hot["material"] = None
+            return True
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM hsm_keys").fetchone()[0]
+
+    def values(self) -> Iterator[Dict]:
+        """Every key's metadata, without material (nothing is unsealed); for listing, not for crypto"""
+        with self._lock:
+            rows = self._db.execute("SELECT metadata FROM hsm_keys ORDER BY key_id").fetchall()
+        for (metadata,) in rows:
+            yield json.loads(metadata)
+
+    def stats(self) -> dict:
+        return {"keys": len(self), "hot": len(self._hot), "hot_capacity": self.hot_keys,
+                "hits": self.hits, "misses": self.misses, "invalidations": self.invalidations, "path": self.path}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
@@ -0,0 +1,135 @@
+"""
+HSM Stub Server
+A stand-in for a network HSM, for tests and benchmarks: a TCP server holding
+a simulation-mode HSMClient, speaking the line protocol that HSMClient uses
+in mode="stub" (QFF_HSM_MODE=stub, QFF_HSM_ADDRESS=host:port).
+
+    {"op": "encrypt", "args": {"key_id": "qff_master_key", "plaintext": "<base64>"}}
+    {"ok": true, "result": {"ciphertext": "<base64>", "iv": "<base64>"}}
+
+A "batch" request carries a list of requests and gets a list of responses,
+so many operations share one round trip:
+
+    {"op": "batch", "args": {"requests": [{"op": "sign", "args": {...}}, ...]}}
+    {"ok": true, "result": [{"ok": true, "result": "<base64>"}, {"ok": false, "error": "..."}]}
+
+Every request waits --latency-ms first, to stand in for the network round
+trip of a real HSM, and every operation (each one in a batch) --op-ms, for
+its device time. Run with `python -m app.hsm_stub --port 9400`.
+"""
+import time
+import json
+import base64
+import threading
+import socketserver
+from typing import Tuple
+
+from .hsm_client import HSMClient
+
+DEFAULT_KEYS = (("qff_master_key", "AES256"), ("qff_tx_signing_key", "RSA2048"))
+
+_BYTES_ARGS = {"plaintext", "ciphertext", "iv", "data", "signature", "wrapped"}
+
+
+def _b64(data: bytes) -> str:
+    return base64.b64encode(data).decode()
+
+
+def handle_one(server: "HSMStubServer", request: dict) -> dict:
+    if server.op_s:
+        time.sleep(server.op_s)
+    try:
+        with server.lock:
+            result = handle(server.hsm, request["op"], request.get("args", {}))
+        return {"ok": True, "result": result}
+    except Exception as e:
+        return {"ok": False, "error": str(e)}
+
+
+def handle(hsm: HSMClient, op: str, args: dict):
+    args = {k: base64.b64decode(v) if k in _BYTES_ARGS else v for k, v in args.items()}
+    if op == "generate_key":
+        return hsm.generate_key(args["key_id"], args.get("key_type", "AES256"), args.get("exportable", False))
+    if op == "encrypt":
+        ciphertext, iv = hsm.encrypt(args["key_id"], args["plaintext"])
+        return {"ciphertext": _b64(ciphertext), "iv": _b64(iv)}
+    if op == "decrypt":
+        return _b64(hsm.decrypt(args["key_id"], args["ciphertext"], args["iv"]))
+    if op == "sign":
+        return _b64(hsm.sign(args["key_id"], args["data"]))
+    if op == "verify":
+        return hsm.verify(args["key_id"], args["data"], args["signature"])
+    if op == "generate_data_key":
+        plaintext, wrapped = hsm.generate_data_key(args["key_id"], args.get("length", 32))
+        return {"plaintext": _b64(plaintext), "wrapped": _b64(wrapped)}
+    if op == "unwrap_data_key":
+        return _b64(hsm.unwrap_data_key(args["key_id"], args["wrapped"]))
+    raise ValueError(f"Unknown HSM operation: {op}")
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        server = self.server
+        server.connections += 1
+        for line in self.rfile:
+            server.requests += 1
+            if server.latency_s:
+                time.sleep(server.latency_s)
+            try:
+                request = json.loads(line)
+            except ValueError as e:
+                response = {"ok": False, "error": f"Malformed request: {e}"}
+            else:
+                if request.get("op") == "batch":
+                    response = {"ok": True, "result": [handle_one(server, r) for r in request["args"]["requests"]]}
+                else:
+                    response = handle_one(server, request)
+            self.wfile.write(json.dumps(response).encode() + b"\n")
+            self.wfile.flush()
+
+
+class HSMStubServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address: Tuple[str, int] = ("127.0.0.1", 9400), latency_ms: float = 0.0,
+                 op_ms: float = 0.0, hsm: HSMClient = None):
+        super().__init__(address, _Handler)
+        self.latency_s = latency_ms / 1000
+        self.op_s = op_ms / 1000
+        self.connections = 0
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.hsm = hsm or HSMClient(mode="simulation")
+        for key_id, key_type in DEFAULT_KEYS:
+            if key_id not in self.hsm.key_store:
+                self.hsm.generate_key(key_id, key_type, exportable=False)
+
+    @property
+    def address(self) -> str:
+        host, port = self.server_address[:2]
+        return f"{host}:{port}"
+
+    def start(self) -> threading.Thread:
+        """Serve on a daemon thread (tests, benchmarks); stop with shutdown()"""
+        thread = threading.Thread(target=self.serve_forever, name="qff-hsm-stub", daemon=True)
+        thread.start()
+        return thread
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Run a local stand-in for a network HSM")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9400)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Simulated network round trip per request")
+    parser.add_argument("--op-ms", type=float, default=0.0, help="Simulated device time per operation")
+    args = parser.parse_args()
+
+    server = HSMStubServer((args.host, args.port), latency_ms=args.latency_ms, op_ms=args.op_ms)
+    print(f"HSM stub listening on {server.address} ({args.latency_ms:g} ms per request, {args.op_ms:g} ms per op)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
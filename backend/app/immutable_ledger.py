@@ -7,7 +7,7 @@ import hashlib
 import json
 from datetime import datetime
 from typing import Dict, List, Optional
-from .database import SessionLocal
+from .database import SessionLocal, ReadSessionLocal, engine, read_engine
 from .models import ledger
 from sqlalchemy import select, insert, update
 
@@ -68,6 +68,24 @@ class ImmutableLedger:
         
         return entry
     
+    def link_hash(self, row, previous_hash: str) -> str:
+        """
+        Chained fingerprint for an already stored ledger row, hashed like a
+        create_entry() entry; bulk imports link their rows with it in one pass.
+        """
+        return self._compute_hash({
+            "tx_id": row.id,
+            "user_id": row.user_id,
+            "tx_type": row.tx_type,
+            "amount": str(row.amount),
+            "currency": row.currency,
+            "receiver": row.receiver,
+            "timestamp": row.timestamp.isoformat() if isinstance(row.timestamp, datetime) else str(row.timestamp),
+            "previous_hash": previous_hash,
+            "risk_score": row.risk_score,
+            "status": row.status,
+        })
+    
     def verify_chain(self, limit: int = 100) -> Dict:
         """
         Verify the integrity of the ledger hash chain.
@@ -120,33 +138,51 @@ class ImmutableLedger:
         finally:
             db.close()
     
-    def get_audit_trail(self, tx_id: str) -> Optional[Dict]:
-        """Get complete audit trail for a transaction"""
-        db = SessionLocal()
+    def _find_entry(self, session_factory, tx_id: str):
+        db = session_factory()
         try:
-            row = db.execute(
-                select(ledger).where(ledger.c.id == tx_id)
-            ).fetchone()
-            
-            if not row:
-                return None
-            
-            return {
-                "tx_id": row.id,
-                "timestamp": str(row.timestamp),
-                "tx_type": row.tx_type,
-                "amount": row.amount,
-                "currency": row.currency,
-                "receiver": row.receiver,
-                "risk_score": row.risk_score,
-                "status": row.status,
-                "fingerprint": row.fingerprint,
-                "tamper_proof": True,
-                "chain_verified": True  # Would verify in production
-            }
+            return db.execute(select(ledger).where(ledger.c.id == tx_id)).fetchone()
         finally:
             db.close()
 
+    def get_audit_trail(self, tx_id: str) -> Optional[Dict]:
+        """
+        Get complete audit trail for a transaction: replica first, then the
+        primary if not replicated yet, then the other hash shards, then the
+        archived partitions.
+        """
+        row = self._find_entry(ReadSessionLocal, tx_id)
+        if not row and read_engine is not engine:
+            row = self._find_entry(SessionLocal, tx_id)
+        if not row:
+            from .sharding import shards
+            if shards.enabled:
+                _, row = shards.find_first(lambda conn: conn.execute(select(ledger).where(ledger.c.id == tx_id)).fetchone())
+        archived = False
+        if not row:
+            # months past the retention horizon live in compressed partition files
+            from .ledger_archive import ledger_archive
+            row = ledger_archive.find(tx_id)
+            archived = row is not None
+        if not row:
+            return None
+
+        return {
+            "tx_id": row.id,
+            "timestamp": str(row.timestamp),
+            "tx_type": row.tx_type,
+            "amount": row.amount,
+            "currency": row.currency,
+            "receiver": row.receiver,
+            "risk_score": row.risk_score,
+            "status": row.status,
+            "fingerprint": row.fingerprint,
+            "meta": row.meta.to_dict() if row.meta is not None else None,  # the only reader that decodes meta
+            "archived": archived,
+            "tamper_proof": True,
+            "chain_verified": True  # Would verify in production
+        }
+
 
 # Singleton instance
 immutable_ledger = ImmutableLedger()
@@ -0,0 +1,512 @@
+"""
+Ledger Archive Partitions
+Keeps the hot `ledger` table to a retention window by moving whole months past
+the horizon into monthly partition files:
+
+    <root>/ledger-YYYY-MM.db.gz   gzip'd, read-only SQLite file, same schema/indexes
+    <root>/manifest.json          partitions with row counts and timestamp ranges
+
+ledger_archive_index maps each archived tx id to its month, so /security/audit
+can open the right partition on demand; timestamp-range readers (the ledger
+export) prune partitions by the manifest's ranges. Opened partitions are
+decompressed into a small cache directory and queried read-only.
+
+A month is archived by: streaming its rows in (timestamp, id) keyset batches
+into a private work copy of the partition (merged with any earlier file for
+that month), publishing the file, then, batch by batch, indexing and deleting
+the rows from the hot table by the batch's key range, then updating the
+manifest. A range delete that would touch a different number of rows than the
+batch wrote (a row landed in the month meanwhile) is rolled back and redone
+for just the ids the partition holds. Each step is safe to repeat, so an
+interrupted pass is completed by the next one.
+
+Every worker process runs the archiver; a pass holds an flock on
+<root>/.archive.lock, so one worker archives at a time and the others find
+nothing left to do. Work files are per process.
+
+With hash shards (sharding.py) each shard's ledger is archived into its own
+LedgerArchive: the primary's under <root>, shard i's under <root>/shard<i>.
+ShardedLedgerArchive runs, lists and searches them together, and merges
+their partitions on (timestamp, id) for readers.
+"""
+import os
+import json
+import heapq
+import itertools
+import gzip
+import shutil
+import atexit
+import tempfile
+import threading
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from sqlalchemy import MetaData, create_engine, select, insert, delete, func, literal, tuple_
+from sqlalchemy.pool import NullPool
+
+try:
+    import fcntl
+except ImportError:  # Windows: archive passes are not serialised across processes
+    fcntl = None
+
+from .database import engine
+from .models import ledger, ledger_archive_index
+from .pagination import timestamp_key, timestamp_bound
+
+ARCHIVE_DIR = os.environ.get("QFF_ARCHIVE_DIR", "./data/archive")
+ARCHIVE_ENABLED = os.environ.get("QFF_ARCHIVE_ENABLED", "false").lower() == "true"
+ARCHIVE_RETENTION_MONTHS = int(os.environ.get("QFF_ARCHIVE_RETENTION_MONTHS", "12"))
+ARCHIVE_INTERVAL_S = float(os.environ.get("QFF_ARCHIVE_INTERVAL_S", "3600"))
+ARCHIVE_BATCH_ROWS = int(os.environ.get("QFF_ARCHIVE_BATCH_ROWS", "5000"))
+ARCHIVE_CACHE_FILES = int(os.environ.get("QFF_ARCHIVE_CACHE_FILES", "4"))
+
+# partition files carry their own copy of the ledger table (and its indexes)
+archive_metadata = MetaData()
+archive_ledger = ledger.to_metadata(archive_metadata)
+
+
+def month_start(ts: datetime) -> datetime:
+    if ts.tzinfo is not None:
+        ts = ts.astimezone(timezone.utc).replace(tzinfo=None)
+    return datetime(ts.year, ts.month, 1)
+
+
+def add_months(month: datetime, n: int) -> datetime:
+    index = month.year * 12 + month.month - 1 + n
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def month_key(month: datetime) -> str:
+    return month.strftime("%Y-%m")
+
+
+class LedgerArchive:
+    """Monthly partition files plus the bookkeeping to find rows in them"""
+
+    def __init__(self, root: str = ARCHIVE_DIR, db_engine=None,
+                 retention_months: int = ARCHIVE_RETENTION_MONTHS, batch_rows: int = ARCHIVE_BATCH_ROWS,
+                 cache_files: int = ARCHIVE_CACHE_FILES):
+        self.root = root
+        self.engine = db_engine or engine
+        self.retention_months = retention_months
+        self.batch_rows = batch_rows
+        self.cache_files = cache_files
+        self._open: "OrderedDict[str, Tuple[object, float]]" = OrderedDict()  # key -> (engine, file mtime)
+        self._lock = threading.RLock()
+        self._manifest_mtime = None
+        self.manifest = self._load_manifest()
+
+    # ---- manifest ----
+
+    def _manifest_path(self) -> str:
+        return os.path.join(self.root, "manifest.json")
+
+    def _load_manifest(self) -> Dict:
+        if os.path.exists(self._manifest_path()):
+            self._manifest_mtime = os.path.getmtime(self._manifest_path())
+            with open(self._manifest_path()) as f:
+                return json.load(f)
+        return {"version": 1, "partitions": {}}
+
+    def _refresh_manifest(self):
+        """Pick up partitions another worker archived since we last looked"""
+        path = self._manifest_path()
+        if os.path.exists(path) and os.path.getmtime(path) != self._manifest_mtime:
+            self.manifest = self._load_manifest()
+
+    def _save_manifest(self):
+        os.makedirs(self.root, exist_ok=True)
+        tmp = self._manifest_path() + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(self.manifest, f, indent=2, sort_keys=True)
+        os.replace(tmp, self._manifest_path())
+        self._manifest_mtime = os.path.getmtime(self._manifest_path())
+
+    def partition_path(self, key: str) -> str:
+        return os.path.join(self.root, f"ledger-{key}.db.gz")
+
+    def partitions(self) -> List[Dict]:
+        self._refresh_manifest()
+        return [{"partition": k, **v} for k, v in sorted(self.manifest["partitions"].items())]
+
+    def archived_rows(self) -> int:
+        self._refresh_manifest()
+        return sum(p["rows"] for p in self.manifest["partitions"].values())
+
+    # ---- archiving ----
+
+    def cutoff(self, now: Optional[datetime] = None) -> datetime:
+        """Rows before the first day of this month minus the retention window are cold"""
+        return add_months(month_start(now or datetime.utcnow()), -self.retention_months)
+
+    def _month_filter(self, stmt, start: datetime, end: datetime):
+        ts_key = timestamp_key(ledger.c.timestamp, self.engine.dialect.name)
+        return stmt.where(ts_key >= timestamp_bound(start, self.engine.dialect.name),
+                          ts_key < timestamp_bound(end, self.engine.dialect.name))
+
+    def _key_range(self, stmt, month: datetime, low: Optional[tuple], high: tuple):
+        """Restrict stmt to the month's rows with low < (timestamp key, id) <= high"""
+        ts_key = timestamp_key(ledger.c.timestamp, self.engine.dialect.name)
+        stmt = self._month_filter(stmt, month, add_months(month, 1)).where(tuple_(ts_key, ledger.c.id) <= tuple_(*high))
+        return stmt if low is None else stmt.where(tuple_(ts_key, ledger.c.id) > tuple_(*low))
+
+    def _month_batches(self, month: datetime) -> Iterator[list]:
+        """The month's hot rows in (timestamp key, id) keyset batches of batch_rows"""
+        ts_key = timestamp_key(ledger.c.timestamp, self.engine.dialect.name)
+        page = self._month_filter(select(ledger, ts_key.label("ts_key")), month, add_months(month, 1)) \
+            .order_by(ts_key, ledger.c.id).limit(self.batch_rows)
+        last = None
+        while True:
+            stmt = page if last is None else page.where(tuple_(ts_key, ledger.c.id) > tuple_(*last))
+            with self.engine.connect() as conn:
+                batch = conn.execute(stmt).fetchall()
+            if not batch:
+                return
+            yield batch
+            if len(batch) < self.batch_rows:
+                return
+            last = (batch[-1].ts_key, batch[-1].id)
+
+    def pending_months(self, cutoff: datetime) -> List[datetime]:
+        ts_key = timestamp_key(ledger.c.timestamp, self.engine.dialect.name)
+        with self.engine.connect() as conn:
+            oldest = conn.execute(select(func.min(ledger.c.timestamp))
+                                  .where(ts_key < timestamp_bound(cutoff, self.engine.dialect.name))).scalar()
+        if oldest is None:
+            return []
+        if isinstance(oldest, str):
+            oldest = datetime.fromisoformat(oldest)
+        months, month = [], month_start(oldest)
+        while month < cutoff:
+            months.append(month)
+            month = add_months(month, 1)
+        return months
+
+    def _fill_partition(self, key: str, month: datetime, work: str) -> List[Tuple[Optional[tuple], tuple, int]]:
+        """
+        Stream the month's rows into the work file, on top of the existing
+        partition's contents. Returns each batch's (low, high, rows) key range;
+        empty if the month has no hot rows.
+        """
+        ranges, part_engine, low = [], None, None
+        columns = [c.name for c in ledger.columns]
+        try:
+            for batch in self._month_batches(month):
+                if part_engine is None:
+                    if os.path.exists(self.partition_path(key)):
+                        with gzip.open(self.partition_path(key), "rb") as src, open(work, "wb") as dst:
+                            shutil.copyfileobj(src, dst)
+                    part_engine = create_engine(f"sqlite:///{work}", poolclass=NullPool)
+                    archive_metadata.create_all(part_engine)
+                with part_engine.begin() as conn:
+                    conn.execute(insert(archive_ledger).prefix_with("OR REPLACE"),
+                                 [{c: r._mapping[c] for c in columns} for r in batch])
+                high = (batch[-1].ts_key, batch[-1].id)
+                ranges.append((low, high, len(batch)))
+                low = high
+            if part_engine is not None:
+                with part_engine.connect() as conn:
+                    conn.exec_driver_sql("VACUUM")
+        finally:
+            if part_engine is not None:
+                part_engine.dispose()
+        return ranges
+
+    def _publish_partition(self, key: str, work: str) -> Dict:
+        """Compress the work file over the month's partition file"""
+        part_engine = create_engine(f"sqlite:///{work}", poolclass=NullPool)
+        try:
+            with part_engine.connect() as conn:
+                stats = conn.execute(select(func.count(), func.min(archive_ledger.c.timestamp),
+                                            func.max(archive_ledger.c.timestamp))).one()
+        finally:
+            part_engine.dispose()
+
+        path = self.partition_path(key)
+        fd, tmp = tempfile.mkstemp(prefix=f"ledger-{key}.", suffix=".gz.tmp", dir=self.root)
+        with open(work, "rb") as src, os.fdopen(fd, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb",
+                                                                               compresslevel=9) as dst:
+            shutil.copyfileobj(src, dst)
+        with open(tmp, "rb") as f:
+            os.fsync(f.fileno())
+        os.chmod(tmp, 0o444)
+        os.replace(tmp, path)
+        self._evict(key)
+        return {"rows": stats[0], "min_ts": str(stats[1]), "max_ts": str(stats[2]),
+                "bytes": os.path.getsize(path), "archived_at": datetime.utcnow().isoformat()}
+
+    def _move_batch(self, key: str, month: datetime, low: Optional[tuple], high: tuple, rows: int, work: str):
+        """Index and delete one archived batch from the hot table"""
+        in_batch = lambda stmt: self._key_range(stmt, month, low, high)  # noqa: E731
+        with self.engine.connect() as conn:
+            with conn.begin() as trans:
+                conn.execute(delete(ledger_archive_index)
+                             .where(ledger_archive_index.c.id.in_(in_batch(select(ledger.c.id)))))
+                conn.execute(insert(ledger_archive_index).from_select(
+                    ["id", "partition"], in_batch(select(ledger.c.id, literal(key)))))
+                if conn.execute(in_batch(delete(ledger))).rowcount == rows:
+                    return
+                trans.rollback()
+
+        # the range now holds rows this pass did not write: move only the archived ones
+        with self.engine.connect() as conn:
+            ids = conn.execute(in_batch(select(ledger.c.id))).scalars().all()
+        part_engine = create_engine(f"sqlite:///{work}", poolclass=NullPool)
+        try:
+            with part_engine.connect() as conn:
+                archived = set(conn.execute(select(archive_ledger.c.id)
+                                            .where(archive_ledger.c.id.in_(ids))).scalars())
+        finally:
+            part_engine.dispose()
+        chunk = [i for i in ids if i in archived]
+        with self.engine.begin() as conn:
+            conn.execute(delete(ledger_archive_index).where(ledger_archive_index.c.id.in_(chunk)))
+            conn.execute(insert(ledger_archive_index), [{"id": i, "partition": key} for i in chunk])
+            conn.execute(delete(ledger).where(ledger.c.id.in_(chunk)))
+
+    def archive_month(self, month: datetime) -> Optional[Dict]:
+        key = month_key(month)
+        os.makedirs(self.root, exist_ok=True)
+        fd, work = tempfile.mkstemp(prefix=f".ledger-{key}.", suffix=".db.tmp", dir=self.root)
+        os.close(fd)
+        try:
+            ranges = self._fill_partition(key, month, work)
+            if not ranges:
+                return None
+            entry = self._publish_partition(key, work)
+            for low, high, rows in ranges:
+                self._move_batch(key, month, low, high, rows, work)
+        finally:
+            os.remove(work)
+
+        moved = sum(rows for _, _, rows in ranges)
+        self.manifest["partitions"][key] = entry
+        self._save_manifest()
+        print(f"Archived {moved} ledger rows into {self.partition_path(key)}")
+        return {"partition": key, "moved": moved, **entry}
+
+    def _discard_stale_work(self):
+        """Work files left by a crashed pass; only called under the archive lock"""
+        for name in os.listdir(self.root):
+            if name.endswith(".tmp") and (name.startswith(".ledger-") or name.startswith("ledger-")):
+                os.remove(os.path.join(self.root, name))
+
+    def _reconcile(self):
+        """Register partition files whose manifest update was interrupted"""
+        if not os.path.isdir(self.root):
+            return
+        for name in sorted(os.listdir(self.root)):
+            if name.startswith("ledger-") and name.endswith(".db.gz"):
+                key = name[len("ledger-"):-len(".db.gz")]
+                if key not in self.manifest["partitions"]:
+                    with self._partition_engine(key).connect() as conn:
+                        stats = conn.execute(select(func.count(), func.min(archive_ledger.c.timestamp),
+                                                    func.max(archive_ledger.c.timestamp))).one()
+                    self.manifest["partitions"][key] = {
+                        "rows": stats[0], "min_ts": str(stats[1]), "max_ts": str(stats[2]),
+                        "bytes": os.path.getsize(os.path.join(self.root, name)),
+                        "archived_at": datetime.utcnow().isoformat()}
+                    self._save_manifest()
+
+    def run(self, now: Optional[datetime] = None) -> List[Dict]:
+        """Archive every month older than the retention horizon"""
+        with self._lock:
+            os.makedirs(self.root, exist_ok=True)
+            lock_file = open(os.path.join(self.root, ".archive.lock"), "a+") if fcntl else None
+            try:
+                if lock_file:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                self.manifest = self._load_manifest()  # another worker may have just run a pass
+                self._discard_stale_work()
+                self._reconcile()
+                return [r for r in (self.archive_month(m) for m in self.pending_months(self.cutoff(now))) if r]
+            finally:
+                if lock_file:
+                    lock_file.close()
+
+    # ---- reading ----
+
+    def _cache_dir(self) -> str:
+        return os.path.join(self.root, ".cache")
+
+    def _cached_path(self, key: str) -> str:
+        # per process: workers decompress and drop their copies independently
+        return os.path.join(self._cache_dir(), f"ledger-{key}.{os.getpid()}.db")
+
+    def _evict(self, key: str):
+        with self._lock:
+            opened = self._open.pop(key, None)
+            if opened is not None:
+                opened[0].dispose()
+            cached = self._cached_path(key)
+            if os.path.exists(cached):
+                os.remove(cached)
+
+    def _partition_engine(self, key: str):
+        """Read-only engine over the decompressed partition, opened on demand and reopened once rewritten"""
+        with self._lock:
+            mtime = os.path.getmtime(self.partition_path(key))
+            if key in self._open:
+                if self._open[key][1] == mtime:
+                    self._open.move_to_end(key)
+                    return self._open[key][0]
+                self._evict(key)  # another worker merged late rows into it
+            os.makedirs(self._cache_dir(), exist_ok=True)
+            cached = self._cached_path(key)
+            tmp = cached + ".tmp"
+            with gzip.open(self.partition_path(key), "rb") as src, open(tmp, "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            os.chmod(tmp, 0o444)
+            os.replace(tmp, cached)
+            part_engine = create_engine(f"sqlite:///file:{cached}?mode=ro&uri=true", poolclass=NullPool)
+            self._open[key] = (part_engine, mtime)
+            while len(self._open) > self.cache_files:
+                self._evict(next(iter(self._open)))
+            return part_engine
+
+    def find(self, tx_id: str):
+        """Fetch one archived ledger row by id, or None"""
+        with self.engine.connect() as conn:
+            key = conn.execute(select(ledger_archive_index.c.partition)
+                               .where(ledger_archive_index.c.id == tx_id)).scalar()
+        if key is None or not os.path.exists(self.partition_path(key)):
+            return None
+        with self._partition_engine(key).connect() as conn:
+            return conn.execute(select(archive_ledger).where(archive_ledger.c.id == tx_id)).fetchone()
+
+    def overlapping(self, start: Optional[datetime] = None, end: Optional[datetime] = None) -> List[str]:
+        """Partitions whose timestamp range intersects [start, end), oldest first"""
+        self._refresh_manifest()
+        keys = []
+        for key, p in sorted(self.manifest["partitions"].items()):
+            if end is not None and p["min_ts"] >= timestamp_bound(end, "sqlite"):
+                continue
+            if start is not None and p["max_ts"] < timestamp_bound(start, "sqlite"):
+                continue
+            keys.append(key)
+        return keys
+
+    def iter_partition_batches(self, stmt, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                               batch_rows: int = ARCHIVE_BATCH_ROWS) -> Iterator[list]:
+        """Run a SQLite-compiled ledger query against each overlapping partition"""
+        for key in self.overlapping(start, end):
+            with self._partition_engine(key).connect() as conn:
+                result = conn.execution_options(stream_results=True, yield_per=batch_rows).execute(stmt)
+                for batch in result.partitions(batch_rows):
+                    yield batch
+
+
+class ShardedLedgerArchive:
+    """One LedgerArchive per hash shard, built on first use, behind the LedgerArchive reading API"""
+
+    def __init__(self, root: str = ARCHIVE_DIR, retention_months: int = ARCHIVE_RETENTION_MONTHS):
+        self.root = root
+        self._retention_months = retention_months
+        self._archives: Optional[List[LedgerArchive]] = None
+        self._lock = threading.Lock()
+
+    @property
+    def archives(self) -> List[LedgerArchive]:
+        with self._lock:
+            if self._archives is None:
+                from .sharding import shards
+                self._archives = [
+                    LedgerArchive(self.root if i == 0 else os.path.join(self.root, f"shard{i}"), db_engine,
+                                  retention_months=self._retention_months)
+                    for i, db_engine in enumerate(shards.engines)]
+            return self._archives
+
+    @property
+    def retention_months(self) -> int:
+        return self._retention_months
+
+    @retention_months.setter
+    def retention_months(self, months: int):
+        self._retention_months = months
+        for archive in self._archives or []:
+            archive.retention_months = months
+
+    def _tagged(self, per_shard: List[List[Dict]]) -> List[Dict]:
+        if len(per_shard) == 1:
+            return per_shard[0]
+        return [{"shard": i, **item} for i, items in enumerate(per_shard) for item in items]
+
+    def cutoff(self, now: Optional[datetime] = None) -> datetime:
+        return self.archives[0].cutoff(now)
+
+    def run(self, now: Optional[datetime] = None) -> List[Dict]:
+        """An archive pass over every shard in turn"""
+        return self._tagged([archive.run(now) for archive in self.archives])
+
+    def partitions(self) -> List[Dict]:
+        return self._tagged([archive.partitions() for archive in self.archives])
+
+    def archived_rows(self) -> int:
+        return sum(archive.archived_rows() for archive in self.archives)
+
+    def find(self, tx_id: str):
+        for archive in self.archives:
+            row = archive.find(tx_id)
+            if row is not None:
+                return row
+        return None
+
+    def iter_partition_batches(self, stmt, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                               batch_rows: int = ARCHIVE_BATCH_ROWS) -> Iterator[list]:
+        """Like LedgerArchive.iter_partition_batches, with every shard's rows merged on (timestamp, id)"""
+        if len(self.archives) == 1:
+            yield from self.archives[0].iter_partition_batches(stmt, start, end, batch_rows)
+            return
+        streams = [itertools.chain.from_iterable(a.iter_partition_batches(stmt, start, end, batch_rows))
+                   for a in self.archives]
+        merged = heapq.merge(*streams, key=lambda r: (r.timestamp, r.id))
+        while True:
+            batch = list(itertools.islice(merged, batch_rows))
+            if not batch:
+                return
+            yield batch
+
+
+class LedgerArchiver:
+    """Background thread that runs an archive pass every interval"""
+
+    def __init__(self, archive, interval_s: float = ARCHIVE_INTERVAL_S):
+        self.archive = archive
+        self.interval_s = interval_s
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.archive.run()
+            except Exception as e:
+                print(f"Ledger archive pass failed: {e}")
+            self._stop.wait(self.interval_s)
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="qff-ledger-archiver", daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def stop(self):
+        self._stop.set()
+
+
+ledger_archive = ShardedLedgerArchive()
+ledger_archiver = LedgerArchiver(ledger_archive)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Archive ledger months past the retention horizon")
+    parser.add_argument("--retention-months", type=int, default=ARCHIVE_RETENTION_MONTHS)
+    args = parser.parse_args()
+    ledger_archive.retention_months = args.retention_months
+    for r in ledger_archive.run():
+        shard = f"shard {r['shard']} " if "shard" in r else ""
+        print(f"{shard}{r['partition']}: moved {r['moved']} rows, partition now {r['rows']} rows / {r['bytes']} bytes")
@@ -1,31 +1,55 @@
 # backend/app/main.py
-from fastapi import FastAPI, HTTPException, Query, Depends
+from .startup import startup, LazySubsystem, warm_in_background, WARM_SUBSYSTEMS  # first: starts the startup clock
+from fastapi import FastAPI, HTTPException, Query, Depends, Request, Security
+from fastapi.security import HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
-from .database import SessionLocal, engine
+from .database import SessionLocal, engine, get_db, async_session_scope
 from .models import (
     init_db, ledger, accounts, users,
     TransactionRequest, ExecuteRequest, ErrorResponse,
     UserRegister, UserLogin, UserResponse, TokenResponse, UserUpdate
 )
 from fastapi.exceptions import RequestValidationError
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from .ai_engine import AgenticAI
 from .pqc_sim import establish_key, simulate_qkd_interception, encapsulate_payload, export_pqc_demo
 from .gateway import quote, exec_on_rail, decide_rail
 from .telemetry import ANALYZE_COUNT, QKD_ATTEMPT, metrics_endpoint
 from .utils import gen_id, fingerprint
-from .alerter import notify
+from .alerter import notify, alert_dispatcher
+from .pagination import keyset_page, page_rows
+from .ledger_export import export_stream, MEDIA_TYPES
+from .ledger_import import import_stream
+from .meta_codec import encode_meta
+from .stats import read_stats, rebuild_stats, refresh_stats
+from .ledger_archive import ledger_archive, ledger_archiver, ARCHIVE_ENABLED
+from .replica import replica_router, get_read_db, get_async_analytics_db
+from .sharding import shards, get_async_user_db, get_async_target_db
+from .money import to_minor, from_minor_array, format_minor, ledger_totals_stmt
+from .balance_engine import BalanceError, InsufficientFunds, find_source_account, debit, credit
 from .quantum_layer import establish_quantum_key, get_quantum_info
 from .security import (
-    verify_admin, get_current_user, require_admin,
-    hash_password, verify_password, create_access_token, generate_user_id
+    verify_admin, get_current_user, require_admin, token_cache, revoke_token, revoke_user_tokens,
+    hash_password, create_access_token, generate_user_id, security as bearer
 )
+from .revocation import revocation_list
+from .rate_limit import RateLimitMiddleware, RATE_LIMIT_ENABLED
+from .concurrency import ConcurrencyLimitMiddleware, CONCURRENCY_ENABLED
+from .passwords import password_hasher
+from .security_layer import security_layer
 from sqlalchemy import select, insert, update, delete
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+from contextlib import asynccontextmanager
+from concurrent.futures import TimeoutError as FutureTimeout
 from datetime import datetime
-import os, uuid
+import os, uuid, tempfile, time
 
-# Initialize database
-init_db()
+DEMO_SEED = int(os.environ.get("QFF_DEMO_SEED", "0")) or None
+INTERCEPT_PROB = float(os.environ.get("QFF_INTERCEPT_PROB","0.0"))
+# Demo users and data are only created when asked for (docker-compose and the start scripts do)
+SEED_DEMO = os.environ.get("QFF_SEED_DEMO", "false").lower() == "true"
 
 # Seed demo users with passwords on startup
 def seed_users():
@@ -79,24 +103,72 @@ def seed_users():
     finally:
         db.close()
 
-seed_users()
-
-# Seed demo data on startup (optional - won't crash if it fails)
-try:
-    from .seed import seed_demo_data
-    print("Seeding demo data...")
-    seed_demo_data()
-    print("Demo data seeded successfully!")
-except Exception as e:
-    print(f"Note: Could not seed demo data: {e}")
-    print("This is OK - the system will work without seed data")
-
-DEMO_SEED = int(os.environ.get("QFF_DEMO_SEED", "0")) or None
-INTERCEPT_PROB = float(os.environ.get("QFF_INTERCEPT_PROB","0.0"))
-ai = AgenticAI(DEMO_SEED)
-app = FastAPI(title="QFF Backend - Quantum Financial Firewall", version="1.0.0")
+def seed_demo():
+    """Demo users plus demo accounts and ledger, skipped when already present"""
+    seed_users()
+    try:
+        from .seed import seed_demo_data
+        if any(rows for rows in shards.fetch_all(select(accounts.c.id).limit(1))[1:]):
+            print("Found accounts on other shards, skipping seed")
+        else:
+            print("Seeding demo data...")
+            with engine.connect() as conn:
+                fresh = conn.execute(select(accounts.c.id).limit(1)).first() is None
+            seed_demo_data()
+            if fresh and shards.enabled:
+                # the seed writes to the primary: keep its users there rather than moving them
+                print(f"Pinned {shards.pin_in_place(0)} seeded users to the primary shard")
+            print("Demo data seeded successfully!")
+    except Exception as e:
+        print(f"Note: Could not seed demo data: {e}")
+        print("This is OK - the system will work without seed data")
+
+# Heavy subsystems are built on first use (and warmed in the background after startup):
+# the anomaly model pulls in sklearn and fits an IsolationForest
+ai = startup.register(LazySubsystem("ai_engine", lambda: AgenticAI(DEMO_SEED)))
+startup.register(LazySubsystem("security_layer_key", lambda: security_layer.fernet))
+startup.register(LazySubsystem("bcrypt_cost", lambda: password_hasher.rounds))
+
+@asynccontextmanager
+async def lifespan(app):
+    """Per-worker startup: only what the first request needs, each phase timed"""
+    startup.record("import", time.perf_counter() - startup.started)
+    with startup.phase("init_db"):
+        # Initialize database (and any additional hash shards)
+        init_db()
+        shards.init()
+    if SEED_DEMO:
+        with startup.phase("seed_demo"):
+            seed_demo()
+    if shards.enabled:
+        with startup.phase("shards"):
+            # Finish any cross-shard credits a previous run left queued. Rebalancing moves rows
+            # and must not race other workers' writes: it is left to `python -m app.sharding`
+            shards.drain_outbox()
+    with startup.phase("revocation_filters"):
+        # Load (or build) the shared token revocation filters before the first request
+        revocation_list.refresh(force=True)
+    # Move ledger months past the retention horizon into archive partitions
+    if ARCHIVE_ENABLED:
+        ledger_archiver.start()
+    # Alert delivery thread; it first replays alerts a previous run spooled
+    alert_dispatcher.start()
+    startup.ready()
+    if WARM_SUBSYSTEMS:
+        warm_in_background()
+    yield
+    password_hasher.shutdown()
+    alert_dispatcher.close()
+
+app = FastAPI(title="QFF Backend - Quantum Financial Firewall", version="1.0.0", lifespan=lifespan)
 
 origins = os.environ.get("QFF_CORS_ORIGINS", "http://localhost:3000,http://localhost:3001,http://localhost:5173,http://localhost:8000").split(",")
+# Innermost first: concurrency limits see only requests the rate limiter let through,
+# and both sit inside CORS so a 429/503 still carries the CORS headers
+if CONCURRENCY_ENABLED:
+    app.add_middleware(ConcurrencyLimitMiddleware)
+if RATE_LIMIT_ENABLED:
+    app.add_middleware(RateLimitMiddleware)
 app.add_middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"], allow_credentials=True)
 
 @app.exception_handler(RequestValidationError)
@@ -108,9 +180,8 @@ async def validation_exception_handler(request, exc):
 
 # ============ AUTH ENDPOINTS ============
 
-@app.post("/auth/register", response_model=TokenResponse)
-def register(user_data: UserRegister):
-    """Register a new user"""
+def _create_user(user_data: UserRegister, password_hash: str):
+    """Insert the user row and their default accounts"""
     db = SessionLocal()
     try:
         # Check if username exists
@@ -133,232 +204,322 @@ def register(user_data: UserRegister):
             id=user_id,
             username=user_data.username,
             email=user_data.email,
-            password_hash=hash_password(user_data.password),
+            password_hash=password_hash,
             role="user",
             is_active=True
         ))
         
-        # Create default accounts for the new user
-        db.execute(insert(accounts).values(
-            id=f"acc-{user_id}-bank",
-            user_id=user_id,
-            account_type="BANK",
-            currency="USD",
-            balance="1000.00"
-        ))
-        db.execute(insert(accounts).values(
-            id=f"acc-{user_id}-crypto",
-            user_id=user_id,
-            account_type="CRYPTO",
-            currency="BTC",
-            balance="0.05"
-        ))
+        # Create default accounts for the new user, on the user's shard
+        default_accounts = [
+            dict(id=f"acc-{user_id}-bank", user_id=user_id, account_type="BANK", currency="USD", balance="1000.00"),
+            dict(id=f"acc-{user_id}-crypto", user_id=user_id, account_type="CRYPTO", currency="BTC", balance="0.05"),
+        ]
+        shard_engine = shards.engine_for(user_id)
+        if shard_engine is engine:
+            for account in default_accounts:
+                db.execute(insert(accounts).values(**account))
         
         db.commit()
-        
-        # Generate token
-        token = create_access_token({
-            "sub": user_id,
-            "username": user_data.username,
-            "role": "user"
-        })
-        
-        return TokenResponse(
-            access_token=token,
-            user=UserResponse(
-                id=user_id,
-                username=user_data.username,
-                email=user_data.email,
-                role="user",
-                is_active=True
-            )
-        )
+        if shard_engine is not engine:
+            with shard_engine.begin() as conn:
+                conn.execute(insert(accounts), default_accounts)
+        return user_id
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+@app.post("/auth/register", response_model=TokenResponse)
+async def register(user_data: UserRegister):
+    """Register a new user"""
+    # bcrypt runs in the hashing pool (503 when it is saturated), the inserts in the threadpool
+    password_hash = await password_hasher.hash_async(user_data.password)
+    try:
+        user_id = await run_in_threadpool(_create_user, user_data, password_hash)
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
         raise HTTPException(status_code=500, detail=str(e))
-    finally:
-        db.close()
+    
+    # Generate token
+    token = create_access_token({
+        "sub": user_id,
+        "username": user_data.username,
+        "role": "user"
+    })
+    
+    return TokenResponse(
+        access_token=token,
+        user=UserResponse(
+            id=user_id,
+            username=user_data.username,
+            email=user_data.email,
+            role="user",
+            is_active=True
+        )
+    )
 
 @app.post("/auth/login", response_model=TokenResponse)
-def login(credentials: UserLogin):
+async def login(credentials: UserLogin):
     """Login and get access token"""
-    db = SessionLocal()
-    try:
-        user = db.execute(
+    # short sessions on either side of the hash: no connection is held while bcrypt runs
+    async for db in async_session_scope():
+        user = (await db.execute(
             select(users).where(users.c.username == credentials.username)
-        ).fetchone()
-        
-        if not user:
-            raise HTTPException(status_code=401, detail="Invalid username or password")
-        
-        if not verify_password(credentials.password, user.password_hash):
-            raise HTTPException(status_code=401, detail="Invalid username or password")
-        
-        if not user.is_active:
-            raise HTTPException(status_code=403, detail="Account is disabled")
-        
-        # Update last login
-        db.execute(
-            update(users).where(users.c.id == user.id).values(last_login=datetime.utcnow())
-        )
-        db.commit()
-        
-        # Generate token
-        token = create_access_token({
-            "sub": user.id,
-            "username": user.username,
-            "role": user.role
-        })
-        
-        return TokenResponse(
-            access_token=token,
-            user=UserResponse(
-                id=user.id,
-                username=user.username,
-                email=user.email,
-                role=user.role,
-                is_active=user.is_active
-            )
+        )).fetchone()
+    
+    if not user:
+        await password_hasher.verify_unknown_async(credentials.password)
+        raise HTTPException(status_code=401, detail="Invalid username or password")
+    
+    # legacy SHA-256 hashes (and bcrypt below the current cost) come back upgraded
+    valid, upgraded_hash = await password_hasher.verify_async(credentials.password, user.password_hash)
+    if not valid:
+        raise HTTPException(status_code=401, detail="Invalid username or password")
+    
+    if not user.is_active:
+        raise HTTPException(status_code=403, detail="Account is disabled")
+    
+    # Update last login, and store the upgraded hash
+    values = {"last_login": datetime.utcnow()}
+    if upgraded_hash:
+        values["password_hash"] = upgraded_hash
+    async for db in async_session_scope():
+        await db.execute(
+            update(users).where(users.c.id == user.id).values(**values)
         )
-    finally:
-        db.close()
-
-@app.get("/auth/me", response_model=UserResponse)
-def get_me(current_user: dict = Depends(get_current_user)):
-    """Get current user profile"""
-    db = SessionLocal()
-    try:
-        user = db.execute(
-            select(users).where(users.c.id == current_user["user_id"])
-        ).fetchone()
-        
-        if not user:
-            raise HTTPException(status_code=404, detail="User not found")
-        
-        return UserResponse(
+        await db.commit()
+    
+    # Generate token
+    token = create_access_token({
+        "sub": user.id,
+        "username": user.username,
+        "role": user.role
+    })
+    
+    return TokenResponse(
+        access_token=token,
+        user=UserResponse(
             id=user.id,
             username=user.username,
             email=user.email,
             role=user.role,
             is_active=user.is_active
         )
-    finally:
-        db.close()
+    )
+
+@app.post("/auth/logout")
+def logout(current_user: dict = Depends(get_current_user),
+           credentials: HTTPAuthorizationCredentials = Security(bearer)):
+    """Revoke the presented token"""
+    revoke_token(credentials.credentials)
+    return {"message": "Logged out"}
+
+@app.get("/auth/me", response_model=UserResponse)
+def get_me(current_user: dict = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Get current user profile"""
+    user = db.execute(
+        select(users).where(users.c.id == current_user["user_id"])
+    ).fetchone()
+    
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    return UserResponse(
+        id=user.id,
+        username=user.username,
+        email=user.email,
+        role=user.role,
+        is_active=user.is_active
+    )
 
 # ============ ADMIN ENDPOINTS ============
 
 @app.get("/admin/users")
-def list_users(current_user: dict = Depends(require_admin)):
-    """List all users (admin only)"""
-    db = SessionLocal()
-    try:
-        rows = db.execute(select(users).order_by(users.c.created_at.desc())).fetchall()
-        return {
-            "users": [
-                {
-                    "id": r.id,
-                    "username": r.username,
-                    "email": r.email,
-                    "role": r.role,
-                    "is_active": r.is_active,
-                    "created_at": str(r.created_at) if r.created_at else None,
-                    "last_login": str(r.last_login) if r.last_login else None
-                }
-                for r in rows
-            ]
-        }
-    finally:
-        db.close()
+def list_users(
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: str = None,
+    current_user: dict = Depends(require_admin),
+    db: Session = Depends(get_db)
+):
+    """List users, newest first, one keyset page at a time (admin only)"""
+    stmt = keyset_page(select(users), users.c.created_at, users.c.id, cursor, limit)
+    rows, next_cursor = page_rows(db.execute(stmt).fetchall(), limit)
+    return {
+        "users": [
+            {
+                "id": r.id,
+                "username": r.username,
+                "email": r.email,
+                "role": r.role,
+                "is_active": r.is_active,
+                "created_at": str(r.created_at) if r.created_at else None,
+                "last_login": str(r.last_login) if r.last_login else None
+            }
+            for r in rows
+        ],
+        "next_cursor": next_cursor
+    }
 
 @app.put("/admin/users/{user_id}")
-def update_user(user_id: str, user_update: UserUpdate, current_user: dict = Depends(require_admin)):
+def update_user(user_id: str, user_update: UserUpdate, current_user: dict = Depends(require_admin),
+                db: Session = Depends(get_db)):
     """Update user (admin only)"""
-    db = SessionLocal()
-    try:
-        # Check user exists
-        user = db.execute(select(users).where(users.c.id == user_id)).fetchone()
-        if not user:
-            raise HTTPException(status_code=404, detail="User not found")
-        
-        # Build update dict
-        update_data = {}
-        if user_update.email is not None:
-            update_data["email"] = user_update.email
-        if user_update.role is not None:
-            update_data["role"] = user_update.role
-        if user_update.is_active is not None:
-            update_data["is_active"] = user_update.is_active
-        
-        if update_data:
-            db.execute(update(users).where(users.c.id == user_id).values(**update_data))
-            db.commit()
-        
-        return {"message": "User updated successfully"}
-    finally:
-        db.close()
+    # Check user exists
+    user = db.execute(select(users).where(users.c.id == user_id)).fetchone()
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    # Build update dict
+    update_data = {}
+    if user_update.email is not None:
+        update_data["email"] = user_update.email
+    if user_update.role is not None:
+        update_data["role"] = user_update.role
+    if user_update.is_active is not None:
+        update_data["is_active"] = user_update.is_active
+    
+    if update_data:
+        db.execute(update(users).where(users.c.id == user_id).values(**update_data))
+        db.commit()
+        if "role" in update_data or "is_active" in update_data:
+            # cached and outstanding tokens still carry the old role / active user
+            revoke_user_tokens(user_id)
+    
+    return {"message": "User updated successfully"}
 
 @app.delete("/admin/users/{user_id}")
-def delete_user(user_id: str, current_user: dict = Depends(require_admin)):
+def delete_user(user_id: str, current_user: dict = Depends(require_admin), db: Session = Depends(get_db)):
     """Delete user (admin only)"""
-    db = SessionLocal()
-    try:
-        # Prevent deleting self
-        if user_id == current_user["user_id"]:
-            raise HTTPException(status_code=400, detail="Cannot delete yourself")
-        
-        db.execute(delete(users).where(users.c.id == user_id))
-        db.commit()
-        return {"message": "User deleted successfully"}
-    finally:
-        db.close()
+    # Prevent deleting self
+    if user_id == current_user["user_id"]:
+        raise HTTPException(status_code=400, detail="Cannot delete yourself")
+    
+    db.execute(delete(users).where(users.c.id == user_id))
+    db.commit()
+    revoke_user_tokens(user_id)
+    return {"message": "User deleted successfully"}
 
 @app.get("/admin/stats")
-def admin_stats(current_user: dict = Depends(require_admin)):
-    """Get system statistics (admin only)"""
-    db = SessionLocal()
-    try:
-        user_count = len(db.execute(select(users)).fetchall())
-        tx_count = len(db.execute(select(ledger)).fetchall())
-        account_count = len(db.execute(select(accounts)).fetchall())
-        
-        # Get recent transactions
+def admin_stats(current_user: dict = Depends(require_admin), db: Session = Depends(get_read_db)):
+    """Get system statistics from the maintained counters (admin only)"""
+    if shards.enabled:
+        # every shard counts its own rows; recent transactions are merged newest first
+        stats = shards.sum_stats()
+        recent_txs, _ = shards.merged_page(keyset_page(select(ledger), ledger.c.timestamp, ledger.c.id, None, 10), 10)
+    else:
+        refresh_stats(engine)  # counters are rebuilt on the primary; the replica only reads them
+        stats = read_stats(db.connection())
         recent_txs = db.execute(
             select(ledger).order_by(ledger.c.timestamp.desc()).limit(10)
         ).fetchall()
-        
-        return {
-            "total_users": user_count,
-            "total_transactions": tx_count,
-            "total_accounts": account_count,
-            "recent_transactions": [
-                {"id": r.id, "type": r.tx_type, "amount": r.amount, "status": r.status}
-                for r in recent_txs
-            ]
-        }
+    
+    return {
+        "total_users": stats["users"],
+        "total_transactions": stats["ledger"],
+        "total_accounts": stats["accounts"],
+        "transactions_by_type": stats["ledger.tx_type"],
+        "transactions_by_status": stats["ledger.status"],
+        "transactions_by_currency": stats["ledger.currency"],
+        "archived_transactions": ledger_archive.archived_rows(),
+        "replica": replica_router.status(),
+        "shards": shards.count,
+        "recent_transactions": [
+            {"id": r.id, "type": r.tx_type, "amount": r.amount, "status": r.status}
+            for r in recent_txs
+        ]
+    }
+
+@app.get("/admin/ledger/totals")
+def admin_ledger_totals(
+    user_id: str = None,
+    currency: str = None,
+    min_amount: str = None,
+    status: str = None,
+    current_user: dict = Depends(require_admin),
+    db: Session = Depends(get_db)
+):
+    """Per-currency transaction count and volume, aggregated in SQL (admin only)"""
+    if min_amount is not None and not currency:
+        raise HTTPException(status_code=400, detail="min_amount requires currency")
+    try:
+        stmt = ledger_totals_stmt(ledger, user_id=user_id, currency=currency, min_amount=min_amount, status=status)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if shards.enabled:
+        totals = shards.sum_totals(stmt)
+    else:
+        totals = [(r.currency, r.count, r.total_minor or 0) for r in db.execute(stmt).fetchall()]
+    return {
+        "totals": [
+            {"currency": currency, "count": count, "total": format_minor(total_minor, currency)}
+            for currency, count, total_minor in totals
+        ]
+    }
+
+@app.get("/admin/ledger/partitions")
+def admin_ledger_partitions(current_user: dict = Depends(require_admin)):
+    """Archived monthly ledger partitions (admin only)"""
+    return {
+        "retention_months": ledger_archive.retention_months,
+        "cutoff": ledger_archive.cutoff().isoformat(),
+        "partitions": ledger_archive.partitions()
+    }
+
+@app.post("/admin/ledger/archive")
+def admin_ledger_archive(current_user: dict = Depends(require_admin)):
+    """Run an archive pass now instead of waiting for the background archiver (admin only)"""
+    return {"archived": ledger_archive.run()}
+
+@app.post("/admin/ledger/import")
+async def admin_ledger_import(
+    request: Request,
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    current_user: dict = Depends(require_admin)
+):
+    """Bulk-import historical transactions from an NDJSON or CSV body, optionally gzipped (admin only)"""
+    # spool the upload (to disk past 16 MiB) so validation and inserts never hold the whole file
+    spool = tempfile.SpooledTemporaryFile(max_size=16 * 1024 * 1024)
+    try:
+        async for chunk in request.stream():
+            spool.write(chunk)
+        spool.seek(0)
+        return await run_in_threadpool(import_stream, spool, format)
     finally:
-        db.close()
+        spool.close()
+
+@app.post("/admin/stats/rebuild")
+def admin_stats_rebuild(current_user: dict = Depends(require_admin)):
+    """Recompute the counters from COUNT(*) aggregates (admin only)"""
+    with engine.begin() as conn:
+        rebuild_stats(conn)
+        return read_stats(conn)
 
 # ============ EXISTING ENDPOINTS ============
 
 @app.get("/health")
 def health(): return {"status":"ok","phase":"6-ready","version":"1.0.0"}
 
+@app.get("/health/startup")
+def health_startup():
+    """Per-phase startup timings of this worker and build times of its lazy subsystems"""
+    return {**startup.as_dict(), "loaded": {s.name: s.loaded for s in startup.registered}}
+
 @app.get("/metrics", dependencies=[Depends(verify_admin)])
 def metrics():
     return metrics_endpoint()
 
 @app.get("/balance")
-def balance(userId: str = None, current_user: dict = Depends(get_current_user)):
+async def balance(userId: str = None, current_user: dict = Depends(get_current_user),
+                  db: AsyncSession = Depends(get_async_target_db)):
     """Get balance for current user or specified user (admin)"""
     target_user = userId if userId and current_user.get("role") == "admin" else current_user["user_id"]
     
-    db = SessionLocal()
     stmt = select(accounts).where(accounts.c.user_id == target_user)
-    rows = db.execute(stmt).fetchall()
-    db.close()
-    res = [{"accountId":r.id,"accountType":r.account_type,"currency":r.currency,"balance":r.balance} for r in rows]
+    rows = (await db.execute(stmt)).fetchall()
+    res = [{"accountId":r.id,"accountType":r.account_type,"currency":r.currency,
+            "balance":format_minor(r.balance_minor, r.currency) if r.balance_minor is not None else r.balance} for r in rows]
     return {"userId": target_user, "balances": res}
 
 @app.post("/quote")
@@ -369,19 +530,26 @@ def get_quote(tx: TransactionRequest):
 def get_route(tx: TransactionRequest):
     return {"rail": decide_rail(tx.dict())}
 
-@app.post("/analyze")
-def analyze(tx: TransactionRequest):
-    # fetch some history amounts
-    db = SessionLocal()
-    rows = db.execute(select(ledger.c.amount).order_by(ledger.c.timestamp.desc()).limit(500)).fetchall()
-    history = [{"amount": r.amount} for r in rows]
-    db.close()
-    res = ai.analyze(tx.dict(), history)
+def _score_transaction(tx: dict, history: list):
+    res = ai.get().analyze(tx, history)
     ANALYZE_COUNT.inc()
     if res.get("riskLevel") == "CRITICAL" or res.get("recommendation") == "BLOCK":
-        notify("CRITICAL","Transaction flagged", f"score={res.get('score')}", {"tx": tx.dict(), "ai": res})
+        notify("CRITICAL","Transaction flagged", f"score={res.get('score')}", {"tx": tx, "ai": res})
     return res
 
+@app.post("/analyze")
+async def analyze(tx: TransactionRequest, db: AsyncSession = Depends(get_async_analytics_db)):
+    # fetch some history amounts
+    rows = (await db.execute(
+        select(ledger.c.amount_minor, ledger.c.currency).where(ledger.c.amount_minor.is_not(None))
+        .order_by(ledger.c.timestamp.desc()).limit(500)
+    )).fetchall()
+    amounts = from_minor_array([r.amount_minor for r in rows], [r.currency for r in rows])
+    history = [{"amount": a} for a in amounts.tolist()]
+    await db.close()
+    # scoring and alerting are CPU/blocking work, keep them off the event loop
+    return await run_in_threadpool(_score_transaction, tx.dict(), history)
+
 @app.post("/establish-key")
 def establish_key_endpoint(demo_seed: int = Query(None), intercept_prob: float = Query(None)):
     prob = INTERCEPT_PROB if intercept_prob is None else float(intercept_prob)
@@ -395,42 +563,145 @@ def establish_key_endpoint(demo_seed: int = Query(None), intercept_prob: float =
 
 @app.post("/execute")
 def execute(req: ExecuteRequest, current_user: dict = Depends(get_current_user)):
-    tx = req.dict(exclude={"key", "risk_score"})
+    tx = req.dict(exclude={"key", "risk_score", "source_account"})
     key = req.key
     risk_score = req.risk_score or 100
-    # route & execute
-    exec_res = exec_on_rail(tx)
+    payer = current_user["user_id"]
+    try:
+        amount_minor = to_minor(tx.get("amount"), tx.get("currency"))
+        if amount_minor <= 0:
+            raise ValueError("Amount must be positive")
+        # fail fast before routing; the authoritative check is the versioned debit below
+        with shards.engine_for(payer).connect() as conn:
+            source = find_source_account(conn, payer, tx.get("currency"), req.source_account)
+        if source.balance_minor < amount_minor:
+            raise InsufficientFunds("Insufficient funds")
+        dest = shards.find_credit_account(tx.get("receiver"), tx.get("currency"))
+    except BalanceError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
     enc = encapsulate_payload(tx, key or "nokey")
     fp = fingerprint(tx, key or "nokey")
     tx_id = gen_id()
-    db = SessionLocal()
-    db.execute(insert(ledger).values(
+    row = dict(
         id=tx_id, user_id=current_user["user_id"], tx_type=tx.get("type"), amount=tx.get("amount"), currency=tx.get("currency"),
-        receiver=tx.get("receiver"), risk_score=int(risk_score), status="COMPLETED" if exec_res.get("success") else "FAILED",
-        fingerprint=fp, meta=str({"enc":enc,"exec":exec_res})
-    ))
-    db.commit(); db.close()
-    return {"tx_id": tx_id, "fingerprint": fp, "routed_rail": exec_res.get("rail"), "fees": exec_res.get("fees"), "backend_reference": exec_res.get("backend_ref")}
+        receiver=tx.get("receiver"), risk_score=int(risk_score), status="PENDING",
+        # encoded here, in parallel across requests, so the group-commit writer only binds bytes
+        fingerprint=fp, meta=encode_meta({"enc":enc})
+    )
+    # paying an account into itself moves nothing
+    self_payment = dest is not None and dest.id == source.id
+
+    def reserve(conn):
+        # the payer's funds are held, with a PENDING row, before anything reaches the rail
+        balance = None if self_payment else debit(conn, source.id, amount_minor)
+        conn.execute(insert(ledger).values(**row))
+        return balance
+
+    # batched with concurrent /execute calls on the payer's shard; returns once the batch is durable
+    try:
+        with shards.user_locks(payer):
+            balance = shards.writers[shards.shard_of(payer)].execute(reserve)
+    except BalanceError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except FutureTimeout:
+        # withdrawn before the writer reached it, so nothing was recorded
+        raise HTTPException(status_code=503, detail="Ledger is busy, the transaction was not recorded; please retry")
+
+    # route & execute
+    try:
+        exec_res = exec_on_rail(tx)
+    except Exception as e:
+        exec_res = {"success": False, "error": str(e)}
+    completed = bool(exec_res.get("success"))
+    status = "COMPLETED" if completed else "FAILED"
+    meta = encode_meta({"enc":enc,"exec":exec_res})
+    # a payee on another shard is credited through the payer shard's outbox
+    remote_credit = False
+
+    def settle(conn):
+        # completed: pay the held funds to an internal payee; failed: release them to the payer
+        moved = None
+        if completed and dest is not None and not self_payment:
+            if remote_credit:
+                shards.queue_credit(conn, tx_id, dest.user_id, dest.id, amount_minor)
+            else:
+                credit(conn, dest.id, amount_minor)
+        elif not completed and not self_payment:
+            moved = credit(conn, source.id, amount_minor)
+        conn.execute(update(ledger).where(ledger.c.id == tx_id).values(status=status, meta=meta))
+        return moved
+
+    try:
+        with shards.user_locks(payer, dest and dest.user_id):
+            payer_shard = shards.shard_of(payer)
+            remote_credit = dest is not None and shards.shard_of(dest.user_id) != payer_shard
+            released = shards.writers[payer_shard].execute(settle)
+        if released is not None:
+            balance = released
+    except Exception as e:
+        # the rail has the payment and the hold is recorded: leave the row PENDING for reconciliation
+        print(f"Settlement of {tx_id} after the rail call failed, left PENDING: {e}")
+        status, remote_credit = "PENDING", False
+    if remote_credit and completed:
+        try:
+            shards.deliver_credit(payer_shard, tx_id, dest.user_id, dest.id, amount_minor)
+        except Exception as e:
+            # still queued in the outbox; drain_outbox() retries it
+            print(f"Cross-shard credit {tx_id} deferred: {e}")
+    # balance/history reads for both parties stay on the primary until the replica has this commit
+    replica_router.record_write(payer)
+    if dest is not None:
+        replica_router.record_write(dest.user_id)
+    return {"tx_id": tx_id, "status": status, "fingerprint": fp, "routed_rail": exec_res.get("rail"), "fees": exec_res.get("fees"), "backend_reference": exec_res.get("backend_ref"),
+            "source_account": source.id, "balance": format_minor(balance, tx.get("currency")) if balance is not None else None}
 
 @app.get("/history")
-def history(limit: int = 50, current_user: dict = Depends(get_current_user)):
-    """Get transaction history for current user"""
-    db = SessionLocal()
+async def history(
+    limit: int = Query(50, ge=1, le=1000),
+    cursor: str = None,
+    current_user: dict = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_user_db)
+):
+    """Get transaction history for current user, one keyset page at a time"""
     
     # Admin sees all, users see only their own
-    if current_user.get("role") == "admin":
-        stmt = select(ledger).order_by(ledger.c.timestamp.desc()).limit(limit)
-    else:
-        stmt = select(ledger).where(
-            ledger.c.user_id == current_user["user_id"]
-        ).order_by(ledger.c.timestamp.desc()).limit(limit)
+    stmt = select(ledger)
+    admin = current_user.get("role") == "admin"
+    if not admin:
+        stmt = stmt.where(ledger.c.user_id == current_user["user_id"])
+    stmt = keyset_page(stmt, ledger.c.timestamp, ledger.c.id, cursor, limit)
     
-    rows = db.execute(stmt).fetchall()
-    db.close()
+    if admin and shards.enabled:
+        # all users: page every shard concurrently and merge
+        rows, next_cursor = await run_in_threadpool(shards.merged_page, stmt, limit)
+    else:
+        rows, next_cursor = page_rows((await db.execute(stmt)).fetchall(), limit)
     items = []
     for r in rows:
         items.append({"id":r.id,"timestamp":str(r.timestamp),"type":r.tx_type,"amount":r.amount,"currency":r.currency,"receiver":r.receiver,"riskScore":r.risk_score,"status":r.status,"quantumKeySnippet": (r.fingerprint or "")[:12]})
-    return {"history": items}
+    return {"history": items, "next_cursor": next_cursor}
+
+@app.get("/ledger/export")
+def ledger_export(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    compress: bool = False,
+    start: datetime = None,
+    end: datetime = None,
+    user_id: str = None,
+    status: str = None,
+    current_user: dict = Depends(require_admin)
+):
+    """Stream the ledger as NDJSON or CSV, optionally gzipped (admin only)"""
+    stream = export_stream(format, compress, start=start, end=end, user_id=user_id, status=status)
+    filename = f"ledger-{datetime.utcnow().strftime('%Y%m%dT%H%M%SZ')}.{format}" + (".gz" if compress else "")
+    return StreamingResponse(
+        stream,
+        media_type="application/gzip" if compress else MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
 
 @app.get("/pqc-info")
 def pqc_info(): 
@@ -457,7 +728,6 @@ def quantum_establish(intercept_prob: float = Query(0.0)):
 @app.get("/security/status")
 def security_status(current_user: dict = Depends(require_admin)):
     """Get comprehensive security status (admin only)"""
-    from .security_layer import security_layer
     from .immutable_ledger import immutable_ledger
     from .alerter import get_alert_stats
     
@@ -466,6 +736,9 @@ def security_status(current_user: dict = Depends(require_admin)):
         "ledger_integrity": immutable_ledger.verify_chain(100),
         "quantum": get_quantum_info(),
         "alerts": get_alert_stats(),
+        "alert_dispatch": alert_dispatcher.stats(),
+        "token_cache": token_cache.stats(),
+        "token_revocation": revocation_list.stats(),
         "status": "OPERATIONAL"
     }
 
@@ -493,7 +766,6 @@ def verify_chain(current_user: dict = Depends(require_admin)):
 @app.get("/security/encryption-status")
 def encryption_status(current_user: dict = Depends(require_admin)):
     """Get encryption layer status (admin only)"""
-    from .security_layer import security_layer
     return security_layer.get_security_status()
 
 # ============ TRANSACTION TYPES INFO ============
@@ -0,0 +1,180 @@
+"""
+Ledger Meta Encoding
+Compact, versioned binary encoding for ledger.meta:
+
+    b"QM" | version (1 byte) | flags (1 byte) | payload
+
+Version 1 payloads are compact JSON (orjson when installed, else the stdlib
+encoder; both produce the same bytes for our data). FLAG_ZLIB marks payloads
+that were raw-deflated against the version's preset dictionary because they
+were large enough for it to pay off.
+
+Rows come back from the database as LazyMeta, which holds the raw bytes and
+only decodes them when an endpoint actually looks inside. Already-encoded
+bytes are bound as-is, so hot write paths call encode_meta() on the request
+thread and the single group-commit writer never serializes or deflates.
+"""
+import os
+import ast
+import json
+import zlib
+from collections.abc import Mapping
+from typing import Any, Dict, Optional, Union
+
+from sqlalchemy.types import TypeDecorator, LargeBinary
+
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+
+MAGIC = b"QM"
+META_VERSION = 1
+FLAG_ZLIB = 0x01
+HEADER_SIZE = 4
+
+META_COMPRESS = os.environ.get("QFF_META_COMPRESS", "true").lower() == "true"
+META_COMPRESS_MIN_BYTES = int(os.environ.get("QFF_META_COMPRESS_MIN_BYTES", "128"))
+META_COMPRESS_LEVEL = int(os.environ.get("QFF_META_COMPRESS_LEVEL", "6"))
+
+# raw deflate, 4 KiB window, small memLevel: cheap to set up per row
+_WBITS, _MEMLEVEL = -12, 4
+
+
+def _build_dictionary() -> bytes:
+    """
+    Preset deflate dictionary for version 1, built from frozen sample /execute
+    payloads. Short rows share almost all of their bytes with it, which is what
+    makes deflate worthwhile at ~200 bytes. Changing this breaks decoding of
+    existing rows: add a new META_VERSION instead.
+    """
+    import base64
+    rails = [("BANK_TRANSFER", "BANK_RAIL", "BANK_R", '{"flat":"0.00"}'),
+             ("CARD_PAYMENT", "CARD", "CARD", '{"flat":"0.00"}'),
+             ("UPI_PAYMENT", "UPI", "UPI", '{"flat":"0.00"}'),
+             ("FOREX_PAYMENT", "FOREX", "FOREX", '{"flat":"0.00"}'),
+             ("CRYPTO_TRANSFER", "BLOCKCHAIN", "BLOCKC", '{"network_fee":"0.0005"}')]
+    samples = []
+    for tx_type, rail, ref, fees in rails:
+        for amount, currency in (("1250.5", "USD"), ("99.99", "INR"), ("10.0", "BTC")):
+            tx = json.dumps({"amount": float(amount), "currency": currency, "type": tx_type, "receiver": "r"})
+            enc = "PQC::REDACTED::" + base64.b64encode(tx.encode()).decode()[:80]
+            samples.append('{"enc":"%s","exec":{"success":true,"backend_ref":"%s-0123456789","fees":%s,"rail":"%s"}}'
+                           % (enc, ref, fees, rail))
+    return "".join(samples).encode()[-4096:]
+
+
+META_DICTIONARY = _build_dictionary()
+
+
+def _dumps(value: Any) -> bytes:
+    if HAS_ORJSON:
+        return orjson.dumps(value, default=str)
+    return json.dumps(value, separators=(",", ":"), default=str, ensure_ascii=False).encode()
+
+
+def _loads(payload: bytes) -> Any:
+    return orjson.loads(payload) if HAS_ORJSON else json.loads(payload)
+
+
+def is_encoded(raw: Any) -> bool:
+    return isinstance(raw, (bytes, bytearray, memoryview)) and bytes(raw[:2]) == MAGIC
+
+
+def encode_meta(value: Any) -> bytes:
+    payload = _dumps(value)
+    flags = 0
+    if META_COMPRESS and len(payload) >= META_COMPRESS_MIN_BYTES:
+        deflate = zlib.compressobj(META_COMPRESS_LEVEL, zlib.DEFLATED, _WBITS, _MEMLEVEL,
+                                   zlib.Z_DEFAULT_STRATEGY, META_DICTIONARY)
+        packed = deflate.compress(payload) + deflate.flush()
+        if len(packed) < len(payload):
+            payload, flags = packed, flags | FLAG_ZLIB
+    return MAGIC + bytes((META_VERSION, flags)) + payload
+
+
+def decode_meta(raw: Union[bytes, str, None]) -> Any:
+    """Decode stored meta, including legacy text rows (JSON or a Python repr)"""
+    if raw is None:
+        return None
+    if is_encoded(raw):
+        raw = bytes(raw)
+        version, flags = raw[2], raw[3]
+        if version != META_VERSION:
+            raise ValueError(f"Unsupported meta version {version}")
+        payload = raw[HEADER_SIZE:]
+        if flags & FLAG_ZLIB:
+            payload = zlib.decompressobj(_WBITS, META_DICTIONARY).decompress(payload)
+        return _loads(payload)
+    return _decode_legacy(raw)
+
+
+def _decode_legacy(raw: Union[bytes, str]) -> Any:
+    text = raw.decode("utf-8", "replace") if isinstance(raw, (bytes, bytearray, memoryview)) else raw
+    try:
+        return json.loads(text)
+    except ValueError:
+        pass
+    try:
+        # older /execute rows stored str(dict); literal_eval never executes code
+        return ast.literal_eval(text)
+    except (ValueError, SyntaxError):
+        return {"raw": text}
+
+
+class LazyMeta(Mapping):
+    """Read-only view over stored meta that decodes on first access"""
+
+    __slots__ = ("raw", "_value", "_decoded")
+
+    def __init__(self, raw: Union[bytes, str]):
+        self.raw = raw
+        self._value = None
+        self._decoded = False
+
+    @property
+    def value(self) -> Any:
+        if not self._decoded:
+            self._value = decode_meta(self.raw)
+            self._decoded = True
+        return self._value
+
+    def to_dict(self) -> Dict:
+        value = self.value
+        return value if isinstance(value, dict) else {"value": value}
+
+    def __getitem__(self, key):
+        return self.to_dict()[key]
+
+    def __iter__(self):
+        return iter(self.to_dict())
+
+    def __len__(self):
+        return len(self.to_dict())
+
+    def __repr__(self):
+        return f"LazyMeta({len(self.raw)} bytes{', decoded' if self._decoded else ''})"
+
+
+class MetaType(TypeDecorator):
+    """Column type for ledger.meta: encodes on write (pre-encoded bytes pass through), returns LazyMeta on read"""
+
+    impl = LargeBinary
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect) -> Optional[bytes]:
+        if value is None:
+            return None
+        if type(value) is bytes and value[:2] == MAGIC:
+            return value  # encoded on the request thread
+        if isinstance(value, LazyMeta):
+            value = value.raw
+        if is_encoded(value):
+            return bytes(value)
+        if isinstance(value, (str, bytes, bytearray)):
+            value = _decode_legacy(value)
+        return encode_meta(value)
+
+    def process_result_value(self, value, dialect) -> Optional[LazyMeta]:
+        return None if value is None else LazyMeta(value)
@@ -0,0 +1,169 @@
+"""
+Schema Migrations
+Ordered, idempotent upgrades for databases created by earlier releases.
+metadata.create_all() only creates missing tables, so anything added to an
+existing table (indexes, columns, backfills) is registered here and applied
+once per database by init_db().
+"""
+from typing import Callable, Dict, List, Tuple
+from sqlalchemy import select, insert, update, inspect, text, bindparam, LargeBinary
+from sqlalchemy.schema import CreateColumn
+from .models import schema_migrations, ledger, users, accounts, currency_scales
+
+MIGRATIONS: List[Tuple[int, str, Callable]] = []
+
+
+def migration(version: int, name: str):
+    """Register a migration function taking an open connection"""
+    def decorator(fn: Callable) -> Callable:
+        MIGRATIONS.append((version, name, fn))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return fn
+    return decorator
+
+
+def _create_indexes(conn, table, *names):
+    for index in table.indexes:
+        if index.name in names:
+            index.create(conn, checkfirst=True)
+
+
+def _add_column(conn, table, column_name: str):
+    """ALTER TABLE ... ADD COLUMN for a column declared in models.py, if missing"""
+    existing = {c["name"] for c in inspect(conn).get_columns(table.name)}
+    if column_name in existing:
+        return
+    ddl = CreateColumn(table.c[column_name]).compile(dialect=conn.dialect)
+    conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {ddl}"))
+
+
+@migration(1, "ledger_and_users_keyset_indexes")
+def _m001_keyset_indexes(conn):
+    _create_indexes(conn, ledger, "ix_ledger_user_ts", "ix_ledger_ts")
+    _create_indexes(conn, users, "ix_users_created_at")
+
+
+@migration(2, "stats_counter_triggers")
+def _m002_stats_counters(conn):
+    from .stats import install_stats_triggers
+    install_stats_triggers(conn)
+
+
+def _backfill_minor_units(conn, table, key_col, amount_col, minor_col, batch_rows: int = 5000):
+    """Convert string amounts to minor units in keyset batches with the vectorized helper"""
+    from .money import to_minor_array, parse_amount_array
+    key = table.c[key_col]
+    page = (select(key, table.c[amount_col], table.c.currency)
+            .where(table.c[minor_col].is_(None)).order_by(key).limit(batch_rows))
+    upd = update(table).where(key == bindparam("_key")).values({minor_col: bindparam("_minor")})
+    last = None
+    while True:
+        # unparseable amounts stay NULL, so page past them by key rather than re-selecting NULLs
+        chunk = conn.execute(page if last is None else page.where(key > last)).fetchall()
+        if not chunk:
+            break
+        _, valid = parse_amount_array([r[1] for r in chunk])
+        minor = to_minor_array([r[1] for r in chunk], [r[2] for r in chunk])
+        params = [{"_key": r[0], "_minor": int(m)} for r, m, ok in zip(chunk, minor, valid) if ok]
+        if params:
+            conn.execute(upd, params)
+        last = chunk[-1][0]
+
+
+@migration(3, "integer_minor_unit_amounts")
+def _m003_minor_units(conn):
+    from .money import CURRENCY_SCALES
+    _add_column(conn, ledger, "amount_minor")
+    _add_column(conn, accounts, "balance_minor")
+    _backfill_minor_units(conn, ledger, "id", "amount", "amount_minor")
+    _backfill_minor_units(conn, accounts, "id", "balance", "balance_minor")
+    existing = {r.code for r in conn.execute(select(currency_scales.c.code))}
+    rows = [{"code": c, "scale": s} for c, s in CURRENCY_SCALES.items() if c not in existing]
+    if rows:
+        conn.execute(insert(currency_scales), rows)
+    _create_indexes(conn, ledger, "ix_ledger_user_currency_amount", "ix_ledger_currency_amount")
+
+
+
+@migration(4, "account_balance_versions")
+def _m004_account_versions(conn):
+    _add_column(conn, accounts, "version")
+
+
+
+@migration(5, "binary_ledger_meta")
+def _m005_binary_meta(conn, batch_rows: int = 5000):
+    """Re-encode legacy text meta (JSON or Python repr) with meta_codec"""
+    from .meta_codec import encode_meta, decode_meta, is_encoded
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("ALTER TABLE ledger ALTER COLUMN meta TYPE bytea USING convert_to(meta, 'UTF8')"))
+    # raw SQL so values come back as stored, not through MetaType
+    page = text("SELECT id, meta FROM ledger WHERE id > :last AND meta IS NOT NULL ORDER BY id LIMIT :n")
+    upd = text("UPDATE ledger SET meta = :meta WHERE id = :_key").bindparams(bindparam("meta", type_=LargeBinary))
+    last = ""
+    while True:
+        rows = conn.execute(page, {"last": last, "n": batch_rows}).fetchall()
+        if not rows:
+            break
+        params = [{"_key": r[0], "meta": encode_meta(decode_meta(r[1]))} for r in rows if not is_encoded(r[1])]
+        if params:
+            conn.execute(upd, params)
+        last = rows[-1][0]
+
+
+@migration(6, "ledger_insert_sequence")
+def _m006_insert_sequence(conn):
+    """Insert-order sequence for incremental exports (snapshots.py); SQLite gets it in migration 7"""
+    if conn.dialect.name == "sqlite":
+        return
+    conn.execute(text("ALTER TABLE ledger ADD COLUMN IF NOT EXISTS seq BIGSERIAL"))
+    conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS ix_ledger_seq ON ledger (seq)"))
+
+
+# ledger's TEXT primary key leaves the rowid unstable (VACUUM renumbers it, deleting the
+# highest row lets the next insert reuse it), so SQLite numbers rows from an AUTOINCREMENT
+# counter, which never hands out a value twice; the counter table is emptied on every insert
+SQLITE_LEDGER_SEQ_DDL = (
+    "CREATE TABLE IF NOT EXISTS ledger_seq (seq INTEGER PRIMARY KEY AUTOINCREMENT)",
+    """CREATE TRIGGER IF NOT EXISTS trg_ledger_seq AFTER INSERT ON ledger
+    BEGIN
+        INSERT INTO ledger_seq (seq) VALUES (NULL);
+        UPDATE ledger SET seq = last_insert_rowid() WHERE rowid = NEW.rowid;
+        DELETE FROM ledger_seq;
+    END""",
+)
+
+
+@migration(7, "sqlite_ledger_insert_sequence")
+def _m007_sqlite_insert_sequence(conn):
+    """The seq column of migration 6 on SQLite, numbered by trigger; existing rows keep their rowid"""
+    if conn.dialect.name != "sqlite":
+        return
+    if "seq" not in {c["name"] for c in inspect(conn).get_columns("ledger")}:
+        conn.execute(text("ALTER TABLE ledger ADD COLUMN seq INTEGER"))
+    conn.execute(text("UPDATE ledger SET seq = rowid WHERE seq IS NULL"))
+    conn.execute(text("CREATE UNIQUE INDEX IF NOT EXISTS ix_ledger_seq ON ledger (seq)"))
+    for stmt in SQLITE_LEDGER_SEQ_DDL:
+        conn.execute(text(stmt))
+    # continue past the rowids handed out so far, so existing watermarks stay valid
+    top = conn.execute(text("SELECT MAX(seq) FROM ledger")).scalar()
+    if top:
+        conn.execute(text("INSERT INTO ledger_seq (seq) VALUES (:top)"), {"top": top})
+        conn.execute(text("DELETE FROM ledger_seq"))
+
+
+def run_migrations(db_engine) -> List[Dict]:
+    """Apply pending migrations in version order, each in its own transaction"""
+    applied = []
+    with db_engine.connect() as conn:
+        done = {r.version for r in conn.execute(select(schema_migrations.c.version))}
+
+    for version, name, fn in MIGRATIONS:
+        if version in done:
+            continue
+        with db_engine.begin() as conn:
+            fn(conn)
+            conn.execute(insert(schema_migrations).values(version=version, name=name))
+        applied.append({"version": version, "name": name})
+        print(f"Applied migration {version:03d} {name}")
+    return applied
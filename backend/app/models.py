@@ -1,7 +1,21 @@
 # backend/app/models.py
-from sqlalchemy import Table, Column, Integer, String, Text, DateTime, Boolean, MetaData
+from sqlalchemy import Table, Column, Integer, BigInteger, Float, String, Text, DateTime, Boolean, MetaData, Index
 from sqlalchemy.sql import func
 from .database import metadata, engine
+from .money import to_minor
+from .meta_codec import MetaType
+
+def _minor_units_default(amount_column: str):
+    """Column default deriving integer minor units from the string amount and currency"""
+    def default(context):
+        params = context.get_current_parameters()
+        if params.get(amount_column) is None:
+            return None
+        try:
+            return to_minor(params[amount_column], params.get("currency"))
+        except ValueError:
+            return None
+    return default
 
 # Users table with roles
 users = Table(
@@ -22,26 +36,117 @@ ledger = Table(
     Column("user_id", String, nullable=True),  # Link to user
     Column("tx_type", String, nullable=False),
     Column("amount", String, nullable=False),
+    Column("amount_minor", BigInteger, nullable=True, default=_minor_units_default("amount")),
     Column("currency", String, nullable=False),
     Column("receiver", String, nullable=False),
     Column("risk_score", Integer, default=100),
     Column("status", String, default="PENDING"),
     Column("fingerprint", String, nullable=True),
-    Column("meta", Text, nullable=True),
+    Column("meta", MetaType, nullable=True),  # encoded by meta_codec.py, read back as LazyMeta
     Column("timestamp", DateTime(timezone=True), server_default=func.now())
 )
 
+# Keyset pagination walks (timestamp, id) in descending order; id is the tie-breaker
+Index("ix_ledger_user_ts", ledger.c.user_id, ledger.c.timestamp, ledger.c.id)
+Index("ix_ledger_ts", ledger.c.timestamp, ledger.c.id)
+Index("ix_users_created_at", users.c.created_at, users.c.id)
+# SQL-side money aggregation: per-user totals and per-currency threshold filters
+Index("ix_ledger_user_currency_amount", ledger.c.user_id, ledger.c.currency, ledger.c.amount_minor)
+Index("ix_ledger_currency_amount", ledger.c.currency, ledger.c.amount_minor)
+
 accounts = Table(
     "accounts", metadata,
     Column("id", String, primary_key=True),
     Column("user_id", String, nullable=False),
     Column("account_type", String, nullable=False),
     Column("currency", String, nullable=False),
-    Column("balance", String, nullable=False)
+    Column("balance", String, nullable=False),
+    Column("balance_minor", BigInteger, nullable=True, default=_minor_units_default("balance")),
+    # bumped on every balance change; debits compare-and-swap on it (balance_engine.py)
+    Column("version", Integer, nullable=False, default=0, server_default="0")
+)
+
+# Decimal places per currency (see money.py); amount_minor / 10^scale = major units
+currency_scales = Table(
+    "currency_scales", metadata,
+    Column("code", String, primary_key=True),
+    Column("scale", Integer, nullable=False)
+)
+
+# Row counters maintained by triggers (see stats.py); scope is a table name or
+# "<table>.<column>" for per-value breakdowns, key is the column value ("*" for totals)
+stats_counters = Table(
+    "stats_counters", metadata,
+    Column("scope", String, primary_key=True),
+    Column("key", String, primary_key=True),
+    Column("count", Integer, nullable=False, default=0)
+)
+
+# Applied schema migrations (see migrations.py)
+schema_migrations = Table(
+    "schema_migrations", metadata,
+    Column("version", Integer, primary_key=True),
+    Column("name", String, nullable=False),
+    Column("applied_at", DateTime(timezone=True), server_default=func.now())
+)
+
+# Where archived ledger rows went: tx id -> monthly partition file (ledger_archive.py)
+ledger_archive_index = Table(
+    "ledger_archive_index", metadata,
+    Column("id", String, primary_key=True),
+    Column("partition", String, nullable=False)  # YYYY-MM
+)
+
+# Hash-sharding (sharding.py): per-user shard overrides, kept on the primary
+shard_directory = Table(
+    "shard_directory", metadata,
+    Column("user_id", String, primary_key=True),
+    Column("shard", Integer, nullable=False)
+)
+
+# Bumped with every shard_directory change, so other processes know to reload the directory
+shard_directory_version = Table(
+    "shard_directory_version", metadata,
+    Column("id", Integer, primary_key=True),  # single row, id 1
+    Column("version", BigInteger, nullable=False)
+)
+
+# Cross-shard credits: queued in the payer's shard with the debit, applied once in the payee's
+shard_outbox = Table(
+    "shard_outbox", metadata,
+    Column("tx_id", String, primary_key=True),
+    Column("user_id", String, nullable=False),  # payee, whose shard receives the credit
+    Column("account_id", String, nullable=False),
+    Column("amount_minor", BigInteger, nullable=False)
+)
+
+shard_inbox = Table(
+    "shard_inbox", metadata,
+    Column("tx_id", String, primary_key=True),
+    Column("user_id", String, nullable=False)  # moves with the payee's rows
+)
+
+# Single-row heartbeat written on the primary; its replicated value measures replica lag (replica.py)
+replica_heartbeat = Table(
+    "replica_heartbeat", metadata,
+    Column("id", Integer, primary_key=True),
+    Column("beat_at", Float, nullable=False)  # epoch seconds
+)
+
+# Authoritative token revocations behind the Bloom filters in revocation.py
+revoked_tokens = Table(
+    "revoked_tokens", metadata,
+    Column("jti", String, primary_key=True),  # token id, or user:<id> for all of a user's earlier tokens
+    Column("user_id", String, nullable=False),
+    Column("expires_at", Float, nullable=False),  # epoch seconds; the row is useless after this
+    Column("revoked_at", Float, nullable=False)
 )
 
-def init_db():
-    metadata.create_all(engine)
+def init_db(db_engine=None):
+    from .migrations import run_migrations
+    db_engine = db_engine or engine
+    metadata.create_all(db_engine)
+    run_migrations(db_engine)
 
 from pydantic import BaseModel, Field, EmailStr
 from typing import Optional, Any, List
@@ -55,6 +160,7 @@ class TransactionRequest(BaseModel):
 class ExecuteRequest(TransactionRequest):
     key: Optional[str] = None
     risk_score: Optional[int] = 100
+    source_account: Optional[str] = None  # defaults to the user's best-funded account in `currency`
 
 class ErrorResponse(BaseModel):
     errorCode: str
@@ -0,0 +1,80 @@
+"""
+Keyset (cursor) pagination helpers
+Pages are ordered by (timestamp DESC, id DESC) and continue strictly after the
+last row returned, so a deep page costs the same index range scan as the first.
+"""
+import json
+import base64
+from datetime import datetime, timezone
+from typing import Any, List, Optional, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import String, type_coerce, tuple_
+
+from .database import engine
+
+
+def timestamp_key(column, dialect_name: str = None):
+    """
+    Sort/compare expression for a timestamp column.
+    SQLite stores timestamps as text in mixed precisions ('...:45' from
+    CURRENT_TIMESTAMP, '...:45.123456' from bound datetimes), so the stored
+    text itself is used as the key there; other dialects compare natively.
+    """
+    if (dialect_name or engine.dialect.name) == "sqlite":
+        return type_coerce(column, String)
+    return column
+
+
+def timestamp_bound(value: datetime, dialect_name: str = None):
+    """
+    Bind value for comparing against timestamp_key(). On SQLite the bound is
+    rendered like the stored text (no fractional part when it is zero) so
+    range filters line up with CURRENT_TIMESTAMP rows.
+    """
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    if (dialect_name or engine.dialect.name) == "sqlite":
+        return value.isoformat(sep=" ")
+    return value
+
+
+def encode_cursor(ts_key: Any, row_id: str) -> str:
+    """Build an opaque cursor pointing just past (ts_key, row_id)"""
+    raw = json.dumps({"t": ts_key.isoformat() if isinstance(ts_key, datetime) else str(ts_key), "i": row_id})
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, dialect_name: str = None) -> Tuple[Any, str]:
+    """Parse a cursor produced by encode_cursor; raises 400 on anything else"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        ts_key, row_id = data["t"], data["i"]
+        if (dialect_name or engine.dialect.name) != "sqlite":
+            ts_key = datetime.fromisoformat(ts_key)
+        return ts_key, row_id
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def keyset_page(stmt, ts_column, id_column, cursor: Optional[str], limit: int, dialect_name: str = None):
+    """
+    Apply keyset ordering, the cursor predicate and limit+1 to a select.
+    The extra row tells page_rows() whether another page exists.
+    """
+    ts_key = timestamp_key(ts_column, dialect_name)
+    stmt = stmt.add_columns(ts_key.label("cursor_ts"))
+    if cursor:
+        c_ts, c_id = decode_cursor(cursor, dialect_name)
+        stmt = stmt.where(tuple_(ts_key, id_column) < tuple_(c_ts, c_id))
+    return stmt.order_by(ts_key.desc(), id_column.desc()).limit(limit + 1)
+
+
+def page_rows(rows: List, limit: int, id_attr: str = "id") -> Tuple[List, Optional[str]]:
+    """Trim the look-ahead row and compute next_cursor from the last row kept"""
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(last.cursor_ts, getattr(last, id_attr))
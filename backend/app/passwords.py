@@ -0,0 +1,222 @@
+"""
+Password Hashing Service
+bcrypt password hashes computed in a bounded process pool, so a burst of
+logins or registrations uses the pool's cores instead of tying up the
+request threadpool or the event loop:
+
+    hash/verify -> admission (workers + QFF_HASH_QUEUE_LIMIT in flight, else
+    503 with Retry-After) -> ProcessPoolExecutor -> awaited future
+
+The bcrypt cost is QFF_BCRYPT_ROUNDS or, when that is "auto", the highest
+cost whose hash fits QFF_HASH_TARGET_MS on this host (measured once, on first
+use; the async API measures on a thread, so a login that arrives before the
+startup warm-up never runs the calibration on the event loop). Stored hashes are upgraded transparently on a successful login: the old
+salted SHA-256 hex digests, and bcrypt hashes below the current cost.
+
+Worker processes start from a fork server (spawn where that is missing), so
+a script that imports the app must keep its own work under
+`if __name__ == "__main__":`; QFF_HASH_WORKERS=0 hashes on a thread instead.
+
+Passwords are pre-hashed (SHA-256, base64) before bcrypt so inputs longer
+than bcrypt's 72-byte limit are neither truncated nor rejected.
+"""
+import os
+import hmac
+import math
+import time
+import base64
+import asyncio
+import hashlib
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, Future
+from typing import Optional, Tuple
+
+import bcrypt
+from fastapi import HTTPException
+
+from .telemetry import PASSWORD_HASH_SECONDS, PASSWORD_HASH_REJECTED
+
+HASH_WORKERS = int(os.environ.get("QFF_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+HASH_QUEUE_LIMIT = int(os.environ.get("QFF_HASH_QUEUE_LIMIT", "32"))
+BCRYPT_ROUNDS = os.environ.get("QFF_BCRYPT_ROUNDS", "auto")
+HASH_TARGET_MS = float(os.environ.get("QFF_HASH_TARGET_MS", "250"))
+
+# Autotuning never goes below the commonly recommended minimum cost
+MIN_AUTO_ROUNDS = 10
+MAX_ROUNDS = 16
+
+# The pre-bcrypt scheme: SHA-256 over a static salt (hex digest)
+LEGACY_SALT = "qff-secure-salt-2024"
+
+
+def legacy_hash(password: str) -> str:
+    salted = f"{LEGACY_SALT}{password}{LEGACY_SALT}"
+    return hashlib.sha256(salted.encode()).hexdigest()
+
+
+def is_legacy(stored: str) -> bool:
+    return not stored.startswith("$2")
+
+
+def _prehash(password: str) -> bytes:
+    return base64.b64encode(hashlib.sha256(password.encode()).digest())
+
+
+def _bcrypt_hash(password: str, rounds: int) -> str:
+    return bcrypt.hashpw(_prehash(password), bcrypt.gensalt(rounds)).decode()
+
+
+def _bcrypt_check(password: str, stored: str) -> bool:
+    try:
+        return bcrypt.checkpw(_prehash(password), stored.encode())
+    except ValueError:
+        return False
+
+
+def cost_of(stored: str) -> int:
+    """Cost factor of a bcrypt hash ($2b$12$...)"""
+    return int(stored.split("$")[2])
+
+
+def tune_rounds(target_ms: float = HASH_TARGET_MS, samples: int = 3) -> int:
+    """Highest bcrypt cost whose hash takes at most target_ms here (each +1 doubles the work)"""
+    probe = 8
+    password, salt = _prehash("calibration"), bcrypt.gensalt(probe)
+    best = math.inf
+    for _ in range(samples):
+        start = time.perf_counter()
+        bcrypt.hashpw(password, salt)
+        best = min(best, (time.perf_counter() - start) * 1000)
+    rounds = probe + int(math.floor(math.log2(max(target_ms, 1e-3) / max(best, 1e-3))))
+    return max(MIN_AUTO_ROUNDS, min(MAX_ROUNDS, rounds))
+
+
+class PasswordHasher:
+    """
+    Admission-controlled front for the hashing pool. At most `workers` hashes
+    run at once and `queue_limit` more wait; past that callers get a 503
+    rather than an unbounded queue whose latency grows with the backlog.
+    workers=0 hashes on a private thread pool of one (bcrypt releases the
+    GIL), for hosts where worker processes are not available.
+    """
+
+    def __init__(self, workers: int = HASH_WORKERS, queue_limit: int = HASH_QUEUE_LIMIT,
+                 rounds: str = BCRYPT_ROUNDS, target_ms: float = HASH_TARGET_MS):
+        self.workers = workers
+        self.queue_limit = queue_limit
+        self.capacity = max(workers, 1) + queue_limit
+        self.target_ms = target_ms
+        self._rounds = None if str(rounds) == "auto" else int(rounds)
+        self._pool = None
+        self._dummy = None
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self.rejected = 0
+        self.rehashed = 0
+
+    @property
+    def rounds(self) -> int:
+        if self._rounds is None:
+            with self._lock:
+                if self._rounds is None:
+                    self._rounds = tune_rounds(self.target_ms)
+                    print(f"bcrypt cost tuned to {self._rounds} for a {self.target_ms:.0f} ms target")
+        return self._rounds
+
+    def _executor(self):
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    if self.workers > 0:
+                        methods = multiprocessing.get_all_start_methods()
+                        # fork is unsafe once the server has threads running
+                        context = multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+                        self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+                    else:
+                        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="qff-hash")
+        return self._pool
+
+    def _submit(self, op: str, fn, *args) -> Future:
+        with self._lock:
+            if self._in_flight >= self.capacity:
+                self.rejected += 1
+                PASSWORD_HASH_REJECTED.inc()
+                raise HTTPException(status_code=503, detail="Authentication is busy, please retry",
+                                    headers={"Retry-After": "1"})
+            self._in_flight += 1
+        start = time.perf_counter()
+        try:
+            future = self._executor().submit(fn, *args)
+        except Exception:
+            self._release(op, start)
+            raise
+        future.add_done_callback(lambda _: self._release(op, start))
+        return future
+
+    def _release(self, op: str, start: float):
+        with self._lock:
+            self._in_flight -= 1
+        PASSWORD_HASH_SECONDS.labels(op).observe(time.perf_counter() - start)
+
+    async def rounds_async(self) -> int:
+        """rounds without blocking the event loop: tuning, if still due, runs on a thread"""
+        if self._rounds is not None:
+            return self._rounds
+        return await asyncio.get_running_loop().run_in_executor(None, lambda: self.rounds)
+
+    def needs_rehash(self, stored: str, rounds: Optional[int] = None) -> bool:
+        return is_legacy(stored) or cost_of(stored) < (rounds or self.rounds)
+
+    # ---- blocking API (startup seeding, CLI, sync callers) ----
+
+    def hash(self, password: str) -> str:
+        return self._submit("hash", _bcrypt_hash, password, self.rounds).result()
+
+    def verify(self, password: str, stored: str) -> Tuple[bool, Optional[str]]:
+        """(matches, upgraded hash to store or None)"""
+        if is_legacy(stored):
+            ok = hmac.compare_digest(legacy_hash(password), stored)
+        else:
+            ok = self._submit("verify", _bcrypt_check, password, stored).result()
+        if ok and self.needs_rehash(stored):
+            self.rehashed += 1
+            return True, self.hash(password)
+        return ok, None
+
+    # ---- async API (request handlers) ----
+
+    async def hash_async(self, password: str) -> str:
+        rounds = await self.rounds_async()
+        return await asyncio.wrap_future(self._submit("hash", _bcrypt_hash, password, rounds))
+
+    async def verify_async(self, password: str, stored: str) -> Tuple[bool, Optional[str]]:
+        """(matches, upgraded hash to store or None)"""
+        if is_legacy(stored):
+            ok = hmac.compare_digest(legacy_hash(password), stored)
+        else:
+            ok = await asyncio.wrap_future(self._submit("verify", _bcrypt_check, password, stored))
+        if ok and self.needs_rehash(stored, await self.rounds_async()):
+            self.rehashed += 1
+            return True, await self.hash_async(password)
+        return ok, None
+
+    async def verify_unknown_async(self, password: str):
+        """Spend a verify's worth of time for a username that does not exist, so
+        response time does not reveal which usernames are registered"""
+        if self._dummy is None:
+            self._dummy = await self.hash_async("qff-unknown-user")
+        await self.verify_async(password, self._dummy)
+
+    def stats(self) -> dict:
+        return {"workers": self.workers, "capacity": self.capacity, "in_flight": self._in_flight,
+                "rounds": self._rounds, "rejected": self.rejected, "rehashed": self.rehashed}
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+
+password_hasher = PasswordHasher()
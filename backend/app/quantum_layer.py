@@ -11,14 +11,25 @@ from typing import Tuple, Optional, Dict
 from datetime import datetime, timedelta
 import base64
 
-# Try to import liboqs for real PQC, fallback to simulation
-try:
-    import oqs
-    HAS_LIBOQS = True
-except (ImportError, RuntimeError) as e:
-    HAS_LIBOQS = False
-    print(f"Note: liboqs not available ({type(e).__name__}), using PQC simulation mode")
-    print("This is expected and the system will work perfectly in simulation mode")
+from .startup import startup, LazySubsystem
+
+# liboqs (real PQC) is imported on first use, falling back to simulation;
+# None until then
+oqs = None
+HAS_LIBOQS = None
+
+
+def load_liboqs() -> bool:
+    global oqs, HAS_LIBOQS
+    if HAS_LIBOQS is None:
+        try:
+            import oqs as _oqs
+            oqs, HAS_LIBOQS = _oqs, True
+        except (ImportError, RuntimeError) as e:
+            HAS_LIBOQS = False
+            print(f"Note: liboqs not available ({type(e).__name__}), using PQC simulation mode")
+            print("This is expected and the system will work perfectly in simulation mode")
+    return HAS_LIBOQS
 
 
 class QuantumLayer:
@@ -30,8 +41,8 @@ class QuantumLayer:
     4. Quantum-safe channel establishment
     """
     
-    def __init__(self, use_real_pqc: bool = HAS_LIBOQS):
-        self.use_real_pqc = use_real_pqc and HAS_LIBOQS
+    def __init__(self, use_real_pqc: bool = True):
+        self.use_real_pqc = use_real_pqc and load_liboqs()
         self.kyber_algorithm = "Kyber1024" if self.use_real_pqc else "Kyber1024-Simulated"
         self.dilithium_algorithm = "Dilithium5" if self.use_real_pqc else "Dilithium5-Simulated"
         self.active_sessions: Dict[str, Dict] = {}
@@ -269,8 +280,8 @@ class QuantumLayer:
         }
 
 
-# Global quantum layer instance
-quantum_layer = QuantumLayer()
+# Global quantum layer instance, built on first use
+quantum_layer = startup.register(LazySubsystem("quantum_layer", QuantumLayer))
 
 
 # Utility functions for easy access
@@ -278,15 +289,15 @@ def establish_quantum_key(intercept_prob: float = 0.0, session_id: str = None) -
     """Establish quantum-safe key - wrapper for main.py"""
     if session_id is None:
         session_id = f"qss_{secrets.token_hex(8)}"
-    return quantum_layer.establish_quantum_session(session_id, intercept_prob)
+    return quantum_layer.get().establish_quantum_session(session_id, intercept_prob)
 
 
 def encrypt_with_quantum_key(data: dict, session_id: str) -> Dict:
     """Encrypt data with quantum-safe key"""
     plaintext = json.dumps(data).encode()
-    return quantum_layer.encrypt_quantum_safe(plaintext, session_id)
+    return quantum_layer.get().encrypt_quantum_safe(plaintext, session_id)
 
 
 def get_quantum_info() -> Dict:
     """Get quantum layer information"""
-    return quantum_layer.get_quantum_metrics()
+    return quantum_layer.get().get_quantum_metrics()
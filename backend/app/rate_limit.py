@@ -0,0 +1,217 @@
+"""
+Rate Limiting
+Admission limits for the expensive routes (/analyze, /execute, the PQC key
+establishment routes and the bcrypt-backed auth routes), enforced as ASGI
+middleware before any of the request is parsed.
+
+Every limited request draws its route's cost (QFF_RATE_LIMIT_COSTS, e.g.
+PQC operations cost more) from three token buckets: the caller's user, the
+caller's IP and the route as a whole. It is admitted only if all three
+have the tokens, otherwise it gets a 429 with Retry-After. The user is the
+bearer token's signature-checked subject; revocation is left to the handler,
+so the middleware never blocks the event loop on the database.
+
+Buckets use GCRA: a bucket is a single "theoretical arrival time", so a
+check is O(1) arithmetic plus one 16-byte slot read and write, with no lock.
+The slots live in a memory-mapped file (QFF_RATE_LIMIT_FILE) that every
+uvicorn worker maps, so the limits hold across workers. Slot reads and
+writes are not atomic across processes: N workers checking the same bucket
+in the same instant can each admit against the same arrival time, letting up
+to N-1 extra requests through, and two keys claiming one free slot at once
+can leave one of them without it, which resets that bucket to full. Under
+that kind of contention the limits are approximate, not exact.
+"""
+import os
+import json
+import math
+import mmap
+import time
+import struct
+import hashlib
+from typing import Dict, List, Optional, Tuple
+
+from fastapi import HTTPException
+
+from .telemetry import RATE_LIMITED
+
+RATE_LIMIT_ENABLED = os.environ.get("QFF_RATE_LIMIT_ENABLED", "true").lower() == "true"
+RATE_LIMIT_FILE = os.environ.get("QFF_RATE_LIMIT_FILE", "./data/ratelimit/buckets.bin")
+RATE_LIMIT_SLOTS = int(os.environ.get("QFF_RATE_LIMIT_SLOTS", "65536"))
+# rate (tokens per second) : burst (bucket size), per user, per client IP and per route
+RATE_LIMIT_USER = os.environ.get("QFF_RATE_LIMIT_USER", "10:20")
+RATE_LIMIT_IP = os.environ.get("QFF_RATE_LIMIT_IP", "20:40")
+RATE_LIMIT_ROUTE = os.environ.get("QFF_RATE_LIMIT_ROUTE", "200:400")
+# path=cost; unlisted paths are not limited
+RATE_LIMIT_COSTS = os.environ.get(
+    "QFF_RATE_LIMIT_COSTS",
+    "/analyze=1,/execute=2,/quantum-establish=5,/establish-key=5,/auth/login=4,/auth/register=4")
+# Take the client IP from X-Forwarded-For (only behind a proxy that sets it)
+RATE_LIMIT_TRUST_FORWARDED = os.environ.get("QFF_RATE_LIMIT_TRUST_FORWARDED", "false").lower() == "true"
+
+# Slots tried after the home slot before evicting the least-constrained bucket
+PROBES = 4
+
+_SLOT = struct.Struct("<Qd")  # key fingerprint (0 = empty), theoretical arrival time (epoch seconds)
+
+
+def parse_limit(spec: str) -> Tuple[float, float]:
+    """'rate:burst' -> (tokens per second, bucket size)"""
+    rate, _, burst = spec.partition(":")
+    rate = float(rate)
+    return rate, float(burst) if burst else rate
+
+
+def parse_costs(spec: str) -> Dict[str, float]:
+    costs = {}
+    for item in spec.split(","):
+        if item.strip():
+            path, _, cost = item.partition("=")
+            costs[path.strip()] = float(cost or 1)
+    return costs
+
+
+def _fingerprint(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little") or 1
+
+
+class SharedBuckets:
+    """GCRA buckets in a fixed table of slots in a shared memory-mapped file"""
+
+    def __init__(self, path: str = RATE_LIMIT_FILE, slots: int = RATE_LIMIT_SLOTS):
+        self.path = path
+        self.slots = slots
+        size = slots * _SLOT.size
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            self._map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+    def _find(self, fp: int, now: float) -> Tuple[int, float]:
+        """(slot offset, stored TAT) for a key, claiming a slot if it has none"""
+        home = fp % self.slots
+        free, victim, victim_tat = None, None, math.inf
+        for i in range(PROBES + 1):
+            offset = ((home + i) % self.slots) * _SLOT.size
+            slot_fp, tat = _SLOT.unpack_from(self._map, offset)
+            if slot_fp == fp:
+                return offset, tat
+            if free is None and (slot_fp == 0 or tat <= now):
+                # empty, or a bucket that has refilled completely: nothing to lose by taking it
+                free = offset
+            elif tat < victim_tat:
+                victim, victim_tat = offset, tat
+        return (free if free is not None else victim), 0.0
+
+    def check(self, requests: List[Tuple[str, float, float, float]], now: float = None) -> Optional[float]:
+        """
+        Draw from several buckets at once: requests are (key, rate, burst, cost).
+        Returns None if every bucket had the tokens (all are charged), else the
+        seconds until the tightest one would (none are charged).
+        """
+        now = time.time() if now is None else now
+        updates, wait = [], 0.0
+        for key, rate, burst, cost in requests:
+            fp = _fingerprint(key)
+            offset, tat = self._find(fp, now)
+            interval = 1.0 / rate
+            new_tat = max(tat, now) + cost * interval
+            over = new_tat - now - burst * interval
+            if over > 1e-9:
+                wait = max(wait, over)
+            else:
+                updates.append((offset, fp, new_tat))
+        if wait:
+            return wait
+        for offset, fp, new_tat in updates:
+            _SLOT.pack_into(self._map, offset, fp, new_tat)
+        return None
+
+    def reset(self):
+        self._map[:] = bytes(len(self._map))
+
+    def close(self):
+        self._map.close()
+
+
+class RateLimiter:
+    def __init__(self, buckets: SharedBuckets = None, costs: Dict[str, float] = None,
+                 user_limit: Tuple[float, float] = None, ip_limit: Tuple[float, float] = None,
+                 route_limit: Tuple[float, float] = None, trust_forwarded: bool = RATE_LIMIT_TRUST_FORWARDED):
+        self._buckets = buckets
+        self.costs = parse_costs(RATE_LIMIT_COSTS) if costs is None else costs
+        self.user_limit = user_limit or parse_limit(RATE_LIMIT_USER)
+        self.ip_limit = ip_limit or parse_limit(RATE_LIMIT_IP)
+        self.route_limit = route_limit or parse_limit(RATE_LIMIT_ROUTE)
+        self.trust_forwarded = trust_forwarded
+
+    @property
+    def buckets(self) -> SharedBuckets:
+        # mapped on first use, i.e. in the worker process rather than the one that imported us
+        if self._buckets is None:
+            self._buckets = SharedBuckets()
+        return self._buckets
+
+    def client_ip(self, scope) -> str:
+        if self.trust_forwarded:
+            for name, value in scope.get("headers", ()):
+                if name == b"x-forwarded-for":
+                    return value.decode("latin-1").split(",")[0].strip()
+        client = scope.get("client")
+        return client[0] if client else "unknown"
+
+    @staticmethod
+    def user_of(scope) -> Optional[str]:
+        for name, value in scope.get("headers", ()):
+            if name == b"authorization":
+                scheme, _, token = value.decode("latin-1").partition(" ")
+                if scheme.lower() != "bearer" or not token:
+                    return None
+                from .security import token_cache
+                try:
+                    return token_cache.subject(token)
+                except HTTPException:
+                    # the handler rejects it; until then it is just another caller from this IP
+                    return None
+        return None
+
+    def check(self, scope) -> Optional[float]:
+        """Seconds to wait before retrying, or None if the request is admitted"""
+        path = scope["path"]
+        cost = self.costs.get(path)
+        if cost is None:
+            return None
+        requests = [(f"ip:{self.client_ip(scope)}", *self.ip_limit, cost),
+                    (f"route:{path}", *self.route_limit, cost)]
+        user = self.user_of(scope)
+        if user:
+            requests.append((f"user:{user}", *self.user_limit, cost))
+        return self.buckets.check(requests)
+
+
+class RateLimitMiddleware:
+    """ASGI middleware: 429 + Retry-After for requests over their limits"""
+
+    def __init__(self, app, limiter: RateLimiter = None):
+        self.app = app
+        self.limiter = limiter or RateLimiter()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        wait = self.limiter.check(scope)
+        if wait is None:
+            return await self.app(scope, receive, send)
+
+        RATE_LIMITED.labels(scope["path"]).inc()
+        retry_after = max(1, math.ceil(wait))
+        body = json.dumps({"errorCode": "RATE_LIMITED", "userMessage": "Too many requests, please retry later",
+                           "details": {"retryAfter": retry_after}}).encode()
+        await send({"type": "http.response.start", "status": 429,
+                    "headers": [(b"content-type", b"application/json"),
+                                (b"content-length", str(len(body)).encode()),
+                                (b"retry-after", str(retry_after).encode())]})
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,153 @@
+"""
+Read Replica Routing
+Sends read-only requests to the replica engine (QFF_READ_DB_URL) unless it is
+lagging or the caller needs to see its own recent writes.
+
+Lag is measured with a heartbeat: a background thread stamps the current time
+into replica_heartbeat on the primary every QFF_REPLICA_HEARTBEAT_S seconds and
+reads the stamp back from the replica. Lag = now - replicated stamp, which works
+the same for a Postgres standby and for a copied SQLite file.
+
+Read-your-writes: after a user's write commits, record_write(user_id) notes the
+time; that user's reads stay on the primary until the replica's heartbeat is
+newer than the write, i.e. the replica has applied it.
+"""
+import os
+import time
+import atexit
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from fastapi import Depends
+from sqlalchemy import select, update, insert
+
+from .database import engine, read_engine, session_scope, async_session_scope
+from .models import replica_heartbeat
+from .security import get_current_user
+from .telemetry import DB_REPLICA_LAG_SECONDS, DB_READS_ROUTED
+
+REPLICA_MAX_LAG_S = float(os.environ.get("QFF_REPLICA_MAX_LAG_S", "5"))
+REPLICA_HEARTBEAT_S = float(os.environ.get("QFF_REPLICA_HEARTBEAT_S", "1"))
+READ_YOUR_WRITES_MAX_USERS = int(os.environ.get("QFF_READ_YOUR_WRITES_MAX_USERS", "100000"))
+
+
+class ReplicaRouter:
+    """Decides per request whether a read may go to the replica"""
+
+    def __init__(self, primary=None, replica=None, max_lag_s: float = REPLICA_MAX_LAG_S,
+                 heartbeat_s: float = REPLICA_HEARTBEAT_S):
+        self.primary = primary or engine
+        self.replica = replica or read_engine
+        self.max_lag_s = max_lag_s
+        self.heartbeat_s = heartbeat_s
+        self.replica_beat = 0.0       # newest primary heartbeat seen on the replica
+        self.lag = float("inf")       # unknown until the first heartbeat round trip
+        self._writes: "OrderedDict[str, float]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+        self._warned = False
+
+    @property
+    def enabled(self) -> bool:
+        return self.replica is not self.primary
+
+    # ---- heartbeat ----
+
+    def beat(self):
+        """Stamp the primary, then measure how far behind the replica is"""
+        now = time.time()
+        with self.primary.begin() as conn:
+            if conn.execute(update(replica_heartbeat).where(replica_heartbeat.c.id == 1)
+                            .values(beat_at=now)).rowcount == 0:
+                conn.execute(insert(replica_heartbeat).values(id=1, beat_at=now))
+        try:
+            with self.replica.connect() as conn:
+                seen = conn.execute(select(replica_heartbeat.c.beat_at)
+                                    .where(replica_heartbeat.c.id == 1)).scalar()
+        except Exception as e:
+            if self.lag != float("inf") or not self._warned:
+                print(f"Replica heartbeat read failed, routing reads to primary: {str(e).splitlines()[0]}")
+                self._warned = True
+            seen = None
+        if seen is not None:
+            self.replica_beat = max(self.replica_beat, seen)
+            self.lag = max(0.0, time.time() - self.replica_beat)
+        else:
+            self.lag = float("inf")
+        DB_REPLICA_LAG_SECONDS.set(self.lag if self.lag != float("inf") else -1)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.beat()
+            except Exception as e:
+                print(f"Replica heartbeat failed: {e}")
+            self._stop.wait(self.heartbeat_s)
+
+    def start(self):
+        with self._lock:
+            if self.enabled and (self._thread is None or not self._thread.is_alive()):
+                self._stop.clear()
+                self._thread = threading.Thread(target=self._run, name="qff-replica-heartbeat", daemon=True)
+                self._thread.start()
+                atexit.register(self.stop)
+
+    def stop(self):
+        self._stop.set()
+
+    # ---- routing ----
+
+    def record_write(self, user_id: Optional[str]):
+        """Call after a user's write has committed on the primary"""
+        if not self.enabled or not user_id:
+            return
+        with self._lock:
+            self._writes[user_id] = time.time()
+            self._writes.move_to_end(user_id)
+            while len(self._writes) > READ_YOUR_WRITES_MAX_USERS:
+                self._writes.popitem(last=False)
+
+    def use_replica(self, user_id: Optional[str] = None) -> bool:
+        if not self.enabled:
+            return False
+        self.start()
+        if self.lag > self.max_lag_s:
+            DB_READS_ROUTED.labels("primary", "lag").inc()
+            return False
+        if user_id:
+            with self._lock:
+                written = self._writes.get(user_id)
+                if written is not None and written > self.replica_beat:
+                    DB_READS_ROUTED.labels("primary", "read_your_writes").inc()
+                    return False
+                if written is not None:
+                    del self._writes[user_id]  # the replica has caught up past it
+        DB_READS_ROUTED.labels("replica", "ok").inc()
+        return True
+
+    def status(self) -> dict:
+        return {"enabled": self.enabled, "lag_seconds": None if self.lag == float("inf") else round(self.lag, 3),
+                "max_lag_seconds": self.max_lag_s, "pinned_users": len(self._writes)}
+
+
+replica_router = ReplicaRouter()
+
+
+# ---- FastAPI dependencies ----
+
+def get_read_db(current_user: dict = Depends(get_current_user)):
+    """Session on the replica when it is fresh enough for this user, else the primary"""
+    yield from session_scope(replica=replica_router.use_replica(current_user.get("user_id")))
+
+
+async def get_async_read_db(current_user: dict = Depends(get_current_user)):
+    async for db in async_session_scope(replica=replica_router.use_replica(current_user.get("user_id"))):
+        yield db
+
+
+async def get_async_analytics_db():
+    """Unauthenticated aggregate reads (e.g. scoring history); lag-checked only"""
+    async for db in async_session_scope(replica=replica_router.use_replica()):
+        yield db
@@ -0,0 +1,268 @@
+"""
+Token Revocation List
+Revoked tokens (by jti) and revoked users (every token issued before a given
+moment) are recorded in the revoked_tokens table, which is the authority.
+Requests consult a set of Bloom filters instead, one per QFF_REVOCATION_WINDOW_S
+expiry window, so the common case costs a digest and a few bit lookups:
+
+    token exp -> window filter -> jti or user:<id> present?
+        no  -> valid (no false negatives)
+        yes -> revoked_tokens lookup (real revocation or a false positive)
+
+A filter only has to hold revocations whose tokens can still be alive, so a
+window's filter is dropped once its window has passed: rotation replaces
+ever-growing state.
+
+Workers share the filters through a snapshot file (QFF_REVOCATION_SNAPSHOT).
+Revoking rebuilds it from the table under a file lock and swaps it in
+atomically; every worker stats it at most every QFF_REVOCATION_REFRESH_S and
+reloads when it changed, so another worker sees a revocation within that
+interval (the revoking worker sees it immediately).
+"""
+import os
+import time
+import struct
+import hashlib
+import tempfile
+import threading
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy import select, insert, delete
+
+from .database import engine
+from .models import revoked_tokens
+from .telemetry import TOKEN_REVOCATION_CHECKS
+
+try:
+    import fcntl
+except ImportError:  # Windows: snapshot rebuilds are not serialised across processes
+    fcntl = None
+
+REVOCATION_WINDOW_S = int(os.environ.get("QFF_REVOCATION_WINDOW_S", "900"))
+REVOCATION_BLOOM_BITS = int(os.environ.get("QFF_REVOCATION_BLOOM_BITS", str(1 << 20)))  # 128 KiB per window
+REVOCATION_BLOOM_HASHES = int(os.environ.get("QFF_REVOCATION_BLOOM_HASHES", "7"))
+REVOCATION_SNAPSHOT = os.environ.get("QFF_REVOCATION_SNAPSHOT", "./data/revocations/filters.bloom")
+REVOCATION_REFRESH_S = float(os.environ.get("QFF_REVOCATION_REFRESH_S", "1.0"))
+
+# Bound on the memo of bloom hits already confirmed valid
+MAX_CLEARED = 100000
+
+SNAPSHOT_MAGIC = b"QFFR"
+SNAPSHOT_VERSION = 1
+_HEADER = struct.Struct("<4sHIIII")  # magic, version, window_s, bits, hashes, filter count
+_WINDOW = struct.Struct("<q")
+
+
+def user_key(user_id: str) -> str:
+    return f"user:{user_id}"
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter; positions by double hashing one blake2b digest"""
+
+    def __init__(self, bits: int = REVOCATION_BLOOM_BITS, hashes: int = REVOCATION_BLOOM_HASHES,
+                 data: bytes = None):
+        self.bits = bits
+        self.hashes = hashes
+        self.data = bytearray(data) if data is not None else bytearray((bits + 7) // 8)
+
+    def _positions(self, key: str) -> Iterable[int]:
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.bits for i in range(self.hashes))
+
+    def add(self, key: str):
+        for p in self._positions(key):
+            self.data[p >> 3] |= 1 << (p & 7)
+
+    def __contains__(self, key: str) -> bool:
+        data = self.data
+        return all(data[p >> 3] & (1 << (p & 7)) for p in self._positions(key))
+
+
+class RevocationList:
+    def __init__(self, db_engine=None, snapshot_path: str = REVOCATION_SNAPSHOT,
+                 window_s: int = REVOCATION_WINDOW_S, bits: int = REVOCATION_BLOOM_BITS,
+                 hashes: int = REVOCATION_BLOOM_HASHES, refresh_s: float = REVOCATION_REFRESH_S):
+        self.engine = db_engine or engine
+        self.snapshot_path = snapshot_path
+        self.window_s = window_s
+        self.bits = bits
+        self.hashes = hashes
+        self.refresh_s = refresh_s
+        self._filters: Dict[int, BloomFilter] = {}
+        self._loaded = None          # (inode, mtime_ns, size) of the snapshot the filters came from
+        self._next_refresh = 0.0
+        self._cleared = set()        # (jti, user_id, iat) confirmed valid since the filters last changed
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.false_positives = 0
+
+    def _window(self, epoch: float) -> int:
+        return int(epoch // self.window_s)
+
+    # ---- snapshot ----
+
+    def _build(self, rows) -> Dict[int, BloomFilter]:
+        filters: Dict[int, BloomFilter] = {}
+
+        def add(window: int, key: str):
+            if window not in filters:
+                filters[window] = BloomFilter(self.bits, self.hashes)
+            filters[window].add(key)
+
+        for r in rows:
+            if r.jti == user_key(r.user_id):
+                # the user's tokens issued before revoked_at expire before expires_at
+                for window in range(self._window(r.revoked_at), self._window(r.expires_at) + 1):
+                    add(window, r.jti)
+            else:
+                add(self._window(r.expires_at), r.jti)
+        return filters
+
+    def _encode(self, filters: Dict[int, BloomFilter]) -> bytes:
+        parts = [_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, self.window_s, self.bits, self.hashes, len(filters))]
+        for window in sorted(filters):
+            parts.append(_WINDOW.pack(window))
+            parts.append(bytes(filters[window].data))
+        return b"".join(parts)
+
+    def _decode(self, blob: bytes) -> Optional[Dict[int, BloomFilter]]:
+        """Filters from a snapshot, or None when it was written with other settings"""
+        if len(blob) < _HEADER.size:
+            return None
+        magic, version, window_s, bits, hashes, count = _HEADER.unpack_from(blob)
+        if (magic, version, window_s, bits, hashes) != (SNAPSHOT_MAGIC, SNAPSHOT_VERSION,
+                                                        self.window_s, self.bits, self.hashes):
+            return None
+        size = (bits + 7) // 8
+        filters, offset = {}, _HEADER.size
+        for _ in range(count):
+            (window,) = _WINDOW.unpack_from(blob, offset)
+            offset += _WINDOW.size
+            filters[window] = BloomFilter(bits, hashes, blob[offset:offset + size])
+            offset += size
+        return filters
+
+    def _set_filters(self, filters: Dict[int, BloomFilter], stamp):
+        current = self._window(time.time())
+        self._filters = {w: f for w, f in filters.items() if w >= current}
+        self._loaded = stamp
+        self._cleared.clear()
+
+    def _stamp(self):
+        try:
+            st = os.stat(self.snapshot_path)
+            return st.st_ino, st.st_mtime_ns, st.st_size
+        except FileNotFoundError:
+            return None
+
+    def publish(self):
+        """Rebuild the filters from the table and swap in a new snapshot for every worker"""
+        directory = os.path.dirname(os.path.abspath(self.snapshot_path))
+        os.makedirs(directory, exist_ok=True)
+        lock_file = open(self.snapshot_path + ".lock", "a+") if fcntl else None
+        try:
+            if lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            now = time.time()
+            with self.engine.begin() as conn:
+                conn.execute(delete(revoked_tokens).where(revoked_tokens.c.expires_at < now))
+                rows = conn.execute(select(revoked_tokens)).fetchall()
+            filters = self._build(rows)
+            fd, tmp = tempfile.mkstemp(dir=directory, prefix=".revocations-")
+            with os.fdopen(fd, "wb") as f:
+                f.write(self._encode(filters))
+            os.replace(tmp, self.snapshot_path)
+            with self._lock:
+                self._set_filters(filters, self._stamp())
+        finally:
+            if lock_file:
+                lock_file.close()
+
+    def refresh(self, force: bool = False):
+        """Reload the snapshot if another worker replaced it (checked every refresh_s)"""
+        now = time.monotonic()
+        if not force and now < self._next_refresh:
+            return
+        self._next_refresh = now + self.refresh_s
+        stamp = self._stamp()
+        if stamp == self._loaded and not force:
+            return
+        try:
+            filters = None
+            if stamp is not None:
+                with open(self.snapshot_path, "rb") as f:
+                    filters = self._decode(f.read())
+            if filters is None:
+                # no snapshot yet, or one from different settings
+                self.publish()
+                return
+        except Exception as e:
+            # keep checking against the filters already loaded; retried next interval
+            print(f"Revocation snapshot refresh failed: {e}")
+            return
+        with self._lock:
+            self._set_filters(filters, stamp)
+
+    # ---- checks ----
+
+    def might_be_revoked(self, jti: Optional[str], user_id: str, exp: float) -> bool:
+        self.refresh()
+        bloom = self._filters.get(self._window(exp))
+        if bloom is None:
+            return False
+        return (jti is not None and jti in bloom) or user_key(user_id) in bloom
+
+    def is_revoked(self, payload: dict) -> bool:
+        """Whether a verified token payload (sub, jti, iat, exp) has been revoked"""
+        jti, user_id, iat = payload.get("jti"), payload.get("sub"), payload.get("iat")
+        if not self.might_be_revoked(jti, user_id, payload.get("exp", 0)):
+            TOKEN_REVOCATION_CHECKS.labels("clear").inc()
+            return False
+        key = (jti, user_id, iat)
+        if key in self._cleared:
+            return False
+
+        self.lookups += 1
+        keys = [user_key(user_id)] + ([jti] if jti else [])
+        with self.engine.connect() as conn:
+            rows = conn.execute(select(revoked_tokens).where(revoked_tokens.c.jti.in_(keys))).fetchall()
+        revoked = any(r.jti == jti or (r.jti == user_key(user_id) and (iat is None or iat < r.revoked_at))
+                      for r in rows)
+        if revoked:
+            TOKEN_REVOCATION_CHECKS.labels("revoked").inc()
+        else:
+            self.false_positives += 1
+            TOKEN_REVOCATION_CHECKS.labels("false_positive").inc()
+            with self._lock:
+                if len(self._cleared) >= MAX_CLEARED:
+                    self._cleared.clear()
+                self._cleared.add(key)
+        return revoked
+
+    # ---- revoking ----
+
+    def _record(self, jti: str, user_id: str, expires_at: float, revoked_at: float):
+        with self.engine.begin() as conn:
+            conn.execute(delete(revoked_tokens).where(revoked_tokens.c.jti == jti))
+            conn.execute(insert(revoked_tokens).values(jti=jti, user_id=user_id, expires_at=expires_at,
+                                                       revoked_at=revoked_at))
+        self.publish()
+
+    def revoke_token(self, jti: str, user_id: str, exp: float):
+        """Revoke one token (e.g. on logout) until it expires"""
+        self._record(jti, user_id, exp, time.time())
+
+    def revoke_user(self, user_id: str, token_lifetime_s: float):
+        """Revoke every token issued to the user before now (all expire within token_lifetime_s)"""
+        now = time.time()
+        self._record(user_key(user_id), user_id, now + token_lifetime_s, now)
+
+    def stats(self) -> dict:
+        return {"windows": len(self._filters), "window_s": self.window_s, "bits_per_window": self.bits,
+                "lookups": self.lookups, "false_positives": self.false_positives}
+
+
+revocation_list = RevocationList()
@@ -2,7 +2,13 @@
 from fastapi import HTTPException, Security, Depends, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from datetime import datetime, timedelta
+from collections import OrderedDict
+from .telemetry import AUTH_TOKEN_CACHE, AUTH_TOKEN_CACHE_SIZE
+from .passwords import password_hasher
+from .revocation import revocation_list
 import hashlib
+import threading
+import time
 import jwt
 import os
 import uuid
@@ -17,23 +23,26 @@ ACCESS_TOKEN_EXPIRE_MINUTES = int(os.environ.get("QFF_TOKEN_EXPIRE", "60"))
 
 ADMIN_TOKEN = os.environ.get("QFF_ADMIN_TOKEN", "admin-demo-token")
 
-# Simple password hashing using SHA256 + salt (for demo purposes)
-SALT = "qff-secure-salt-2024"
+# Decoded-claims cache (0 disables it)
+TOKEN_CACHE_SIZE = int(os.environ.get("QFF_TOKEN_CACHE_SIZE", "10000"))
 
+# Password hashing: bcrypt in a bounded worker pool (see passwords.py).
+# These blocking forms are for seeding and scripts; handlers await the async ones.
 def hash_password(password: str) -> str:
-    """Hash a password using SHA256 with salt"""
-    salted = f"{SALT}{password}{SALT}"
-    return hashlib.sha256(salted.encode()).hexdigest()
+    """Hash a password with bcrypt"""
+    return password_hasher.hash(password)
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """Verify a password against its hash"""
-    return hash_password(plain_password) == hashed_password
+    """Verify a password against its hash (bcrypt or legacy SHA-256)"""
+    return password_hasher.verify(plain_password, hashed_password)[0]
 
 def create_access_token(data: dict, expires_delta: timedelta = None) -> str:
     """Create a JWT access token"""
     to_encode = data.copy()
     expire = datetime.utcnow() + (expires_delta or timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES))
-    to_encode.update({"exp": expire})
+    # fractional iat so a revocation (TokenCache.revoke_user) splits tokens within the same second;
+    # jti names this token for revoke_token()
+    to_encode.update({"exp": expire, "iat": time.time(), "jti": uuid.uuid4().hex})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
@@ -47,19 +56,155 @@ def decode_token(token: str) -> dict:
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
+class TokenCache:
+    """
+    Bounded LRU of verified token claims, keyed by a digest of the token and
+    kept until the token's exp. A hit skips the HMAC check and JSON parsing.
+
+    revoke_user() drops a user's entries and rejects their tokens issued
+    before that moment (cached or not), so a role change or disable takes
+    effect on the next request instead of when the token expires. That is
+    per process; with a revocation list, hits and misses alike are also
+    checked against it, which is what other workers and restarts see.
+    """
+
+    def __init__(self, max_entries: int = TOKEN_CACHE_SIZE, revocations=None):
+        self.max_entries = max_entries
+        self.revocations = revocations
+        self._entries: "OrderedDict[bytes, tuple]" = OrderedDict()  # digest -> (claims, token payload)
+        self._by_user = {}        # user_id -> set of digests
+        self._revoked_at = {}     # user_id -> tokens issued before this (epoch seconds) are rejected
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _digest(token: str) -> bytes:
+        return hashlib.blake2b(token.encode(), digest_size=16).digest()
+
+    def _issued_at(self, payload: dict) -> float:
+        # tokens minted before iat was added: assume they were issued a full lifetime before exp
+        return payload.get("iat", payload.get("exp", 0) - ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+
+    def _drop(self, digest: bytes):
+        claims, _ = self._entries.pop(digest)
+        owned = self._by_user.get(claims["user_id"])
+        if owned is not None:
+            owned.discard(digest)
+            if not owned:
+                del self._by_user[claims["user_id"]]
+
+    def claims(self, token: str) -> dict:
+        """Verified claims for a token, from the cache when possible"""
+        digest = self._digest(token)
+        if self.max_entries > 0:
+            with self._lock:
+                entry = self._entries.get(digest)
+                if entry is not None and entry[1]["exp"] > time.time():
+                    self._entries.move_to_end(digest)
+                    self.hits += 1
+                    AUTH_TOKEN_CACHE.labels("hit").inc()
+                elif entry is not None:
+                    self._drop(digest)
+                    entry = None
+            if entry is not None:
+                self._check_revocations(entry[1])
+                return dict(entry[0])
+
+        payload = decode_token(token)
+        claims = {
+            "user_id": payload.get("sub"),
+            "username": payload.get("username"),
+            "role": payload.get("role", "user")
+        }
+        with self._lock:
+            self.misses += 1
+            AUTH_TOKEN_CACHE.labels("miss").inc()
+            revoked_at = self._revoked_at.get(claims["user_id"])
+            if revoked_at is not None and self._issued_at(payload) < revoked_at:
+                raise HTTPException(status_code=401, detail="Token has been revoked, please log in again")
+        self._check_revocations(payload)
+        with self._lock:
+            if self.max_entries > 0:
+                token = {k: payload.get(k) for k in ("sub", "jti", "iat")}
+                token["exp"] = payload.get("exp", 0)
+                self._entries[digest] = (claims, token)
+                self._by_user.setdefault(claims["user_id"], set()).add(digest)
+                while len(self._entries) > self.max_entries:
+                    self._drop(next(iter(self._entries)))
+                AUTH_TOKEN_CACHE_SIZE.set(len(self._entries))
+        return dict(claims)
+
+    def subject(self, token: str) -> str:
+        """
+        The user id of a token whose signature and expiry check out, without
+        the revocation check (no database or file access): for keying per-user
+        limits, not for authorization. Raises 401 like claims().
+        """
+        if self.max_entries > 0:
+            with self._lock:
+                entry = self._entries.get(self._digest(token))
+            if entry is not None and entry[1]["exp"] > time.time():
+                return entry[0]["user_id"]
+        return decode_token(token).get("sub")
+
+    def _check_revocations(self, payload: dict):
+        if self.revocations is not None and self.revocations.is_revoked(payload):
+            raise HTTPException(status_code=401, detail="Token has been revoked, please log in again")
+
+    def forget(self, token: str):
+        """Drop one token's cached claims"""
+        with self._lock:
+            digest = self._digest(token)
+            if digest in self._entries:
+                self._drop(digest)
+
+    def revoke_user(self, user_id: str):
+        """Forget cached claims for a user and reject their existing tokens"""
+        with self._lock:
+            now = time.time()
+            self._revoked_at[user_id] = now
+            # a revocation older than the token lifetime can no longer match any live token
+            horizon = now - ACCESS_TOKEN_EXPIRE_MINUTES * 60
+            for uid in [u for u, at in self._revoked_at.items() if at < horizon]:
+                del self._revoked_at[uid]
+            for digest in list(self._by_user.get(user_id, ())):
+                self._drop(digest)
+            AUTH_TOKEN_CACHE_SIZE.set(len(self._entries))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_user.clear()
+            AUTH_TOKEN_CACHE_SIZE.set(0)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"entries": len(self._entries), "max_entries": self.max_entries, "hits": self.hits,
+                "misses": self.misses, "hit_rate": round(self.hits / total, 4) if total else None}
+
+
+token_cache = TokenCache(revocations=revocation_list)
+
+def revoke_token(token: str):
+    """Revoke one token (logout) in every worker until it expires"""
+    payload = decode_token(token)
+    if payload.get("jti") is None:
+        raise HTTPException(status_code=400, detail="Token has no jti and cannot be revoked individually")
+    revocation_list.revoke_token(payload["jti"], payload.get("sub"), payload["exp"])
+    token_cache.forget(token)
+
+def revoke_user_tokens(user_id: str):
+    """Revoke every token issued to a user so far, in every worker (role change, disable, delete)"""
+    token_cache.revoke_user(user_id)
+    revocation_list.revoke_user(user_id, ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+
 def get_current_user(credentials: HTTPAuthorizationCredentials = Security(security)):
     """Get current user from JWT token"""
     if not credentials:
         raise HTTPException(status_code=401, detail="Not authenticated")
     
-    token = credentials.credentials
-    payload = decode_token(token)
-    
-    return {
-        "user_id": payload.get("sub"),
-        "username": payload.get("username"),
-        "role": payload.get("role", "user")
-    }
+    return token_cache.claims(credentials.credentials)
 
 def require_admin(credentials: HTTPAuthorizationCredentials = Security(security)):
     """Require admin role"""
@@ -81,10 +226,10 @@ def verify_admin(credentials: HTTPAuthorizationCredentials = Security(security))
     
     # Otherwise, decode JWT and check role
     try:
-        payload = decode_token(token)
-        if payload.get("role") != "admin":
+        claims = token_cache.claims(token)
+        if claims.get("role") != "admin":
             raise HTTPException(status_code=403, detail="Admin access required")
-        return payload
+        return claims
     except:
         raise HTTPException(status_code=401, detail="Invalid authentication")
 
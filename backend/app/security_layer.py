@@ -10,7 +10,7 @@ import secrets
 from cryptography.fernet import Fernet
 from cryptography.hazmat.primitives import hashes
 from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
-from typing import Dict, Optional, Any
+from typing import Dict, List, Optional, Any
 import json
 
 class SecurityLayer:
@@ -23,17 +23,33 @@ class SecurityLayer:
     """
     
     def __init__(self):
-        # Master key from environment or generate
-        master_key_env = os.environ.get("QFF_MASTER_KEY", "")
-        if master_key_env:
-            self.master_key = base64.urlsafe_b64decode(master_key_env)
-        else:
-            # Generate deterministic key for demo (use env var in production)
-            self.master_key = self._derive_key("qff-demo-master-key-2024", b"qff-salt")
-        
-        self.fernet = Fernet(base64.urlsafe_b64encode(self.master_key[:32]))
+        self._fernet = None
+        self._envelope = None
         self.initialized = True
     
+    @property
+    def fernet(self) -> Fernet:
+        # the PBKDF2 derivation (100k iterations) is paid on first use, not on import
+        if self._fernet is None:
+            # Master key from environment or generate
+            master_key_env = os.environ.get("QFF_MASTER_KEY", "")
+            if master_key_env:
+                self.master_key = base64.urlsafe_b64decode(master_key_env)
+            else:
+                # Generate deterministic key for demo (use env var in production)
+                self.master_key = self._derive_key("qff-demo-master-key-2024", b"qff-salt")
+            self._fernet = Fernet(base64.urlsafe_b64encode(self.master_key[:32]))
+        return self._fernet
+    
+    @property
+    def envelope(self):
+        """Envelope encryption under the HSM master key, for bulk field encryption"""
+        if self._envelope is None:
+            from .hsm_client import hsm_client
+            from .envelope import EnvelopeEncryptor
+            self._envelope = EnvelopeEncryptor(hsm_client)
+        return self._envelope
+    
     def _derive_key(self, password: str, salt: bytes) -> bytes:
         """Derive encryption key from password using PBKDF2"""
         kdf = PBKDF2HMAC(
@@ -117,12 +133,19 @@ class SecurityLayer:
             encrypted_tx["receiver_hash"] = self.hash_pii(encrypted_tx["receiver"])
             encrypted_tx["receiver_masked"] = self.mask_account(encrypted_tx["receiver"])
         
-        # Encrypt amount for at-rest storage
+        # Encrypt amount for at-rest storage (cached HSM data key, no HSM round trip per field)
         if "amount" in encrypted_tx:
-            encrypted_tx["amount_encrypted"] = self.encrypt(str(encrypted_tx["amount"]))
+            encrypted_tx["amount_encrypted"] = self.envelope.encrypt_field("amount", str(encrypted_tx["amount"]))
         
         return encrypted_tx
     
+    def encrypt_fields(self, records: List[Dict], fields: List[str]) -> List[Dict]:
+        """Bulk field-level encryption under cached HSM data keys"""
+        return self.envelope.encrypt_many(records, fields)
+    
+    def decrypt_fields(self, records: List[Dict], fields: List[str]) -> List[Dict]:
+        return self.envelope.decrypt_many(records, fields)
+    
     def get_security_status(self) -> Dict:
         """Get current security layer status"""
         return {
@@ -132,6 +155,8 @@ class SecurityLayer:
             "iterations": 100000,
             "masking_enabled": True,
             "pii_hashing": "SHA-256",
+            "field_encryption": "AES-256-GCM envelope (HSM-wrapped data keys)",
+            "envelope": self._envelope.stats() if self._envelope is not None else None,
             "status": "ACTIVE"
         }
 
@@ -155,7 +155,7 @@ def seed_demo_data():
                 "risk_score": 95,
                 "status": "COMPLETED",
                 "fingerprint": "fp_abc123",
-                "meta": '{"note": "Payment for services"}'
+                "meta": {"note": "Payment for services"}
             },
             {
                 "id": f"TX-{uuid.uuid4().hex[:10]}",
@@ -166,7 +166,7 @@ def seed_demo_data():
                 "risk_score": 90,
                 "status": "COMPLETED",
                 "fingerprint": "fp_def456",
-                "meta": '{"note": "Coffee payment"}'
+                "meta": {"note": "Coffee payment"}
             },
             {
                 "id": f"TX-{uuid.uuid4().hex[:10]}",
@@ -177,7 +177,7 @@ def seed_demo_data():
                 "risk_score": 75,
                 "status": "COMPLETED",
                 "fingerprint": "fp_ghi789",
-                "meta": '{"note": "Crypto transfer"}'
+                "meta": {"note": "Crypto transfer"}
             },
             {
                 "id": f"TX-{uuid.uuid4().hex[:10]}",
@@ -188,7 +188,7 @@ def seed_demo_data():
                 "risk_score": 88,
                 "status": "COMPLETED",
                 "fingerprint": "fp_jkl012",
-                "meta": '{"note": "Online purchase"}'
+                "meta": {"note": "Online purchase"}
             },
             {
                 "id": f"TX-{uuid.uuid4().hex[:10]}",
@@ -199,7 +199,7 @@ def seed_demo_data():
                 "risk_score": 70,
                 "status": "COMPLETED",
                 "fingerprint": "fp_mno345",
-                "meta": '{"note": "Cross-border payment"}'
+                "meta": {"note": "Cross-border payment"}
             }
         ]
         
@@ -14,13 +14,12 @@ def seed():
     db.execute(insert(accounts).prefix_with("OR IGNORE").values({
         "id":"acct-2","user_id":"user-1","account_type":"CRYPTO","currency":"BTC","balance":"2.5"
     }))
-    # seed ledger
-    for i in range(6):
-        tx_id = f"TX-{uuid.uuid4().hex[:8]}"
-        db.execute(insert(ledger).values(
-            id=tx_id, tx_type="BANK_TRANSFER", amount=str(1000*(i+1)), currency="INR",
-            receiver=f"receiver-{i}", risk_score=95, status="COMPLETED", fingerprint=None, meta="{}"
-        ))
+    # seed ledger (one executemany instead of a statement per row)
+    db.execute(insert(ledger), [
+        dict(id=f"TX-{uuid.uuid4().hex[:8]}", tx_type="BANK_TRANSFER", amount=str(1000*(i+1)), currency="INR",
+             receiver=f"receiver-{i}", risk_score=95, status="COMPLETED", fingerprint=None, meta={})
+        for i in range(6)
+    ])
     db.commit(); db.close()
 
 if __name__=="__main__":
@@ -0,0 +1,297 @@
+"""
+Synthetic Ledger Generator
+Reproducible ledgers of any size (10^3 .. 10^8 rows) for tests and scale
+benchmarks. Rows are generated column-wise with NumPy, one batch at a time,
+so memory stays flat and the database insert is the bottleneck.
+
+What makes the data look like a payment ledger rather than uniform noise:
+
+- tx_type mix with per-type currency mix and amount distribution
+  (log-normal body in USD terms, converted per currency, plus a Pareto tail)
+- skewed activity: per-user weights are log-normal, receivers follow a
+  Zipf popularity curve (a few merchants take most payments)
+- a diurnal time-of-day profile, rows in timestamp order
+- injected fraud patterns, labelled in meta {"synthetic": "<pattern>"}:
+  structuring (just under a reporting threshold), burst (one user, many
+  payments within minutes), mule (many users paying a few receivers) and
+  large_new_receiver (an outsized payment to a never-seen payee)
+
+The same (seed, rows, batch_rows, profile) always yields the same ledger.
+
+    python -m app.seed.synthetic --rows 1000000 --seed 42
+"""
+import os
+import copy
+import json
+import time
+import argparse
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+
+import numpy as np
+
+from ..money import CURRENCY_SCALES, format_minor_array
+
+SYNTHETIC_BATCH_ROWS = int(os.environ.get("QFF_SYNTHETIC_BATCH_ROWS", "50000"))
+
+# rough units of each currency per USD; only the shape of the data depends on them
+USD_RATES = {"USD": 1.0, "EUR": 0.92, "GBP": 0.79, "INR": 83.0, "JPY": 150.0, "SAR": 3.75, "AED": 3.67,
+             "BTC": 1 / 60000, "ETH": 1 / 3000, "USDT": 1.0, "USDC": 1.0}
+
+# share of a day's transactions per hour (UTC), quiet at night, peaks at lunch and evening
+DIURNAL = np.array([1, 0.6, 0.4, 0.3, 0.3, 0.5, 1.2, 2.5, 4, 5, 5.5, 6,
+                    6.5, 6, 5.5, 5.5, 5.5, 6, 6.5, 6.5, 5.5, 4, 3, 2], dtype=np.float64)
+
+DEFAULT_PROFILE = {
+    "users": 10000,
+    "receivers": 50000,
+    "receiver_zipf": 1.1,         # popularity exponent of receiver rank
+    "user_activity_sigma": 1.2,   # log-normal spread of per-user activity
+    "start": "2024-01-01T00:00:00",
+    "days": 365,
+    "status": {"COMPLETED": 0.97, "FAILED": 0.025, "PENDING": 0.005},
+    "tx_types": {
+        "BANK_TRANSFER": {"weight": 0.25, "currencies": {"USD": 0.4, "INR": 0.3, "EUR": 0.2, "GBP": 0.1},
+                          "median_usd": 400, "sigma": 1.2},
+        "UPI_PAYMENT": {"weight": 0.25, "currencies": {"INR": 1.0}, "median_usd": 6, "sigma": 1.0},
+        "CARD_PAYMENT": {"weight": 0.30, "currencies": {"USD": 0.6, "EUR": 0.25, "GBP": 0.15},
+                         "median_usd": 40, "sigma": 1.0},
+        "FOREX_PAYMENT": {"weight": 0.08, "currencies": {"EUR": 0.4, "GBP": 0.2, "AED": 0.2, "SAR": 0.1, "JPY": 0.1},
+                          "median_usd": 1500, "sigma": 1.1},
+        "CRYPTO_TRANSFER": {"weight": 0.07, "currencies": {"BTC": 0.4, "ETH": 0.3, "USDT": 0.2, "USDC": 0.1},
+                            "median_usd": 250, "sigma": 1.6},
+        "WIRE_TRANSFER": {"weight": 0.05, "currencies": {"USD": 0.7, "EUR": 0.3}, "median_usd": 5000, "sigma": 1.3},
+    },
+    "tail": {"prob": 0.01, "alpha": 1.3},  # Pareto tail starting at the body's 99th percentile
+    "fraud": {
+        "rate": 0.005,
+        "patterns": {"structuring": 0.35, "burst": 0.35, "mule": 0.2, "large_new_receiver": 0.1},
+        "structuring_threshold_usd": 10000,
+        "burst_size": 8,
+        "burst_window_s": 300,
+        "mule_receivers": 20,
+        "large_multiplier": 25,
+    },
+}
+
+
+def load_profile(overrides: Optional[Dict] = None) -> Dict:
+    """DEFAULT_PROFILE with overrides deep-merged in (e.g. {"fraud": {"rate": 0.02}})"""
+    def merge(base, extra):
+        for key, value in extra.items():
+            if isinstance(value, dict) and isinstance(base.get(key), dict) and key not in ("currencies", "patterns", "status"):
+                merge(base[key], value)
+            else:
+                base[key] = value
+        return base
+    return merge(copy.deepcopy(DEFAULT_PROFILE), overrides or {})
+
+
+def _normalized(weights: Dict[str, float]):
+    keys = list(weights)
+    p = np.array([weights[k] for k in keys], dtype=np.float64)
+    return keys, p / p.sum()
+
+
+def _pick(rng, cumulative: np.ndarray, size: int) -> np.ndarray:
+    """Inverse-CDF sampling from a precomputed cumulative distribution"""
+    return np.minimum(np.searchsorted(cumulative, rng.random(size), side="right"), len(cumulative) - 1)
+
+
+class SyntheticLedger:
+    """Batch generator; iterate batches() for columnar data or rows() for ledger insert dicts"""
+
+    def __init__(self, rows: int, seed: int = 0, profile: Optional[Dict] = None,
+                 batch_rows: int = SYNTHETIC_BATCH_ROWS):
+        self.total = rows
+        self.seed = seed
+        self.profile = load_profile(profile)
+        self.batch_rows = batch_rows
+        p = self.profile
+
+        self.types, self.type_p = _normalized({t: c["weight"] for t, c in p["tx_types"].items()})
+        self.type_currencies = [_normalized(p["tx_types"][t]["currencies"]) for t in self.types]
+        for codes, _ in self.type_currencies:
+            unknown = [c for c in codes if c not in CURRENCY_SCALES]
+            if unknown:
+                raise ValueError(f"Unknown currencies in profile: {unknown}")
+        self.statuses, status_p = _normalized(p["status"])
+        self.status_cdf = np.cumsum(status_p)
+        self.patterns, pattern_p = _normalized(p["fraud"]["patterns"])
+        self.pattern_cdf = np.cumsum(pattern_p)
+
+        # population-level draws come from their own stream so they do not depend on batching
+        rng = np.random.default_rng([seed, 0])
+        activity = rng.lognormal(0.0, p["user_activity_sigma"], p["users"])
+        self.user_cdf = np.cumsum(activity) / activity.sum()
+        self.user_ids = np.array([f"syn-user-{i:07d}" for i in range(p["users"])], dtype=object)
+        ranks = np.arange(1, p["receivers"] + 1, dtype=np.float64)
+        popularity = ranks ** -p["receiver_zipf"]
+        self.receiver_cdf = np.cumsum(popularity) / popularity.sum()
+        self.receiver_ids = np.array([f"rcv-{i:07d}" for i in range(p["receivers"])], dtype=object)
+        self.mule_ids = np.array([f"mule-{i:03d}" for i in range(p["fraud"]["mule_receivers"])], dtype=object)
+        self.diurnal_cdf = np.concatenate([[0.0], np.cumsum(DIURNAL / DIURNAL.sum())])
+
+        self.start = np.datetime64(datetime.fromisoformat(p["start"]), "us")
+        self.span_us = int(p["days"] * 86400 * 1e6)
+
+    # ---- generation ----
+
+    def _timestamps(self, rng, size: int, lo_us: int, hi_us: int) -> np.ndarray:
+        """Uniform over [lo, hi) by day, reshaped within each day by the diurnal profile"""
+        t = rng.integers(lo_us, max(hi_us, lo_us + 1), size)
+        day, frac = np.divmod(t, 86400 * 10 ** 6)
+        u = frac / (86400 * 10 ** 6)
+        hour = np.minimum(np.searchsorted(self.diurnal_cdf, u, side="right") - 1, 23)
+        within = (u - self.diurnal_cdf[hour]) / (self.diurnal_cdf[hour + 1] - self.diurnal_cdf[hour])
+        warped = day * 86400 * 10 ** 6 + ((hour + within) * 3600 * 10 ** 6).astype(np.int64)
+        return np.clip(warped, lo_us, max(hi_us - 1, lo_us))
+
+    def _amounts_usd(self, rng, type_idx: np.ndarray) -> np.ndarray:
+        p = self.profile
+        median = np.array([p["tx_types"][t]["median_usd"] for t in self.types])[type_idx]
+        sigma = np.array([p["tx_types"][t]["sigma"] for t in self.types])[type_idx]
+        usd = rng.lognormal(np.log(median), sigma)
+        tail = rng.random(len(usd)) < p["tail"]["prob"]
+        p99 = median[tail] * np.exp(2.326 * sigma[tail])
+        usd[tail] = p99 * (1.0 + rng.pareto(p["tail"]["alpha"], int(tail.sum())))
+        return np.minimum(usd, 1e9)
+
+    def batch(self, index: int) -> Dict[str, np.ndarray]:
+        """Batch number index, covering its share of the row count and of the time span"""
+        start_row = index * self.batch_rows
+        size = min(self.batch_rows, self.total - start_row)
+        if size <= 0:
+            raise IndexError(index)
+        rng = np.random.default_rng([self.seed, 1, index])
+        fraud_cfg = self.profile["fraud"]
+
+        type_idx = rng.choice(len(self.types), size, p=self.type_p)
+        currencies = np.empty(size, dtype=object)
+        for t, (codes, cur_p) in enumerate(self.type_currencies):
+            at = np.nonzero(type_idx == t)[0]
+            currencies[at] = np.array(codes, dtype=object)[rng.choice(len(codes), len(at), p=cur_p)]
+        usd = self._amounts_usd(rng, type_idx)
+        users = _pick(rng, self.user_cdf, size)
+        receivers = self.receiver_ids[_pick(rng, self.receiver_cdf, size)]
+        lo = self.span_us * start_row // self.total
+        hi = self.span_us * (start_row + size) // self.total
+        ts_us = self._timestamps(rng, size, lo, hi)
+        status = np.array(self.statuses, dtype=object)[_pick(rng, self.status_cdf, size)]
+        risk = np.clip(rng.normal(88, 6, size), 50, 100)
+
+        # fraud injection
+        fraud = np.full(size, "", dtype=object)
+        hit = np.nonzero(rng.random(size) < fraud_cfg["rate"])[0]
+        kinds = np.array(self.patterns, dtype=object)[_pick(rng, self.pattern_cdf, len(hit))]
+        for kind in self.patterns:
+            idx = hit[kinds == kind]
+            if not len(idx):
+                continue
+            fraud[idx] = kind
+            risk[idx] = np.clip(rng.normal(45, 12, len(idx)), 0, 100)
+            if kind == "structuring":
+                usd[idx] = fraud_cfg["structuring_threshold_usd"] * rng.uniform(0.90, 0.999, len(idx))
+            elif kind == "burst":
+                # groups of burst_size rows: same user, within burst_window_s of the group's first row
+                first = idx[(np.arange(len(idx)) // fraud_cfg["burst_size"]) * fraud_cfg["burst_size"]]
+                users[idx] = users[first]
+                offset = rng.integers(0, int(fraud_cfg["burst_window_s"] * 1e6), len(idx))
+                ts_us[idx] = np.clip(ts_us[first] + offset, lo, max(hi - 1, lo))
+            elif kind == "mule":
+                receivers[idx] = self.mule_ids[rng.integers(0, len(self.mule_ids), len(idx))]
+            elif kind == "large_new_receiver":
+                usd[idx] *= fraud_cfg["large_multiplier"]
+                receivers[idx] = [f"new-{self.seed}-{start_row + i}" for i in idx]
+
+        order = np.argsort(ts_us, kind="stable")
+        rates = np.array([USD_RATES.get(c, 1.0) for c in self.currency_codes()])
+        cur_idx = np.searchsorted(self.currency_codes(), currencies.astype(str))
+        scale = np.array([CURRENCY_SCALES[c] for c in self.currency_codes()])[cur_idx]
+        minor = np.maximum(np.rint(usd * rates[cur_idx] * np.power(10.0, scale)), 1).astype(np.int64)
+
+        currencies, minor = currencies[order], minor[order]
+        return {
+            "id": np.array([f"SYN{self.seed}-{start_row + i:010d}" for i in range(size)], dtype=object),
+            "user_id": self.user_ids[users[order]],
+            "tx_type": np.array(self.types, dtype=object)[type_idx[order]],
+            "amount": format_minor_array(minor, currencies),
+            "amount_minor": minor,
+            "currency": currencies,
+            "receiver": receivers[order],
+            "risk_score": np.rint(risk[order]).astype(np.int64),
+            "status": status[order],
+            "timestamp": self.start + ts_us[order].astype("timedelta64[us]"),
+            "fraud": fraud[order],
+        }
+
+    def currency_codes(self) -> np.ndarray:
+        return np.array(sorted(CURRENCY_SCALES))
+
+    def batches(self) -> Iterator[Dict[str, np.ndarray]]:
+        for index in range((self.total + self.batch_rows - 1) // self.batch_rows):
+            yield self.batch(index)
+
+    @staticmethod
+    def to_rows(batch: Dict[str, np.ndarray], label_meta: bool = True) -> List[Dict]:
+        """Ledger insert dicts; only fraud rows carry meta (their label)"""
+        columns = ("id", "user_id", "tx_type", "amount", "amount_minor", "currency", "receiver", "risk_score", "status")
+        lists = {c: batch[c].tolist() for c in columns}
+        lists["timestamp"] = batch["timestamp"].astype("datetime64[us]").tolist()
+        fraud = batch["fraud"].tolist()
+        rows = []
+        for i in range(len(fraud)):
+            row = {c: lists[c][i] for c in lists}
+            row["fingerprint"] = None
+            row["meta"] = {"synthetic": fraud[i]} if label_meta and fraud[i] else None
+            rows.append(row)
+        return rows
+
+    def rows(self, label_meta: bool = True) -> Iterator[List[Dict]]:
+        for batch in self.batches():
+            yield self.to_rows(batch, label_meta)
+
+
+def populate(rows: int, seed: int = 0, profile: Optional[Dict] = None, batch_rows: int = SYNTHETIC_BATCH_ROWS,
+             shard_set=None, label_meta: bool = True) -> Dict:
+    """Generate and bulk-insert a synthetic ledger (one executemany/COPY per batch and shard)"""
+    from ..ledger_import import insert_rows
+    if shard_set is None:
+        from ..sharding import shards as shard_set
+    generator = SyntheticLedger(rows, seed, profile, batch_rows)
+    start = time.perf_counter()
+    gen_seconds, inserted, fraud = 0.0, 0, {}
+    for batch in generator.batches():
+        t = time.perf_counter()
+        batch_dicts = generator.to_rows(batch, label_meta)
+        gen_seconds += time.perf_counter() - t
+        by_shard: Dict[int, List[Dict]] = {}
+        for row in batch_dicts:
+            by_shard.setdefault(shard_set.shard_of(row["user_id"]), []).append(row)
+        for shard, shard_rows in by_shard.items():
+            with shard_set.engines[shard].begin() as conn:
+                insert_rows(conn, shard_rows)
+        inserted += len(batch_dicts)
+        kinds, counts = np.unique(batch["fraud"][batch["fraud"] != ""].astype(str), return_counts=True)
+        for kind, n in zip(kinds.tolist(), counts.tolist()):
+            fraud[kind] = fraud.get(kind, 0) + n
+    seconds = time.perf_counter() - start
+    return {"rows": inserted, "seconds": round(seconds, 3), "generate_seconds": round(gen_seconds, 3),
+            "rows_per_second": round(inserted / seconds, 1) if seconds > 0 else None, "fraud": fraud}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Insert a reproducible synthetic ledger")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--batch-rows", type=int, default=SYNTHETIC_BATCH_ROWS)
+    parser.add_argument("--profile", help="JSON file with overrides of DEFAULT_PROFILE")
+    parser.add_argument("--no-labels", action="store_true", help="do not write fraud labels into meta")
+    args = parser.parse_args()
+
+    from ..models import init_db
+    from ..sharding import shards
+    init_db()
+    shards.init()
+    overrides = json.load(open(args.profile)) if args.profile else None
+    print(json.dumps(populate(args.rows, args.seed, overrides, args.batch_rows, label_meta=not args.no_labels), indent=2))
@@ -0,0 +1,427 @@
+"""
+Hash Sharding
+Spreads per-user data (ledger, accounts) over N databases. Shard 0 is the
+primary (QFF_DB_URL), which also keeps the global tables (users, directory);
+QFF_SHARD_URLS lists the additional shards. Unset, there is one shard and
+every helper here degrades to the primary engine and the shared writer.
+
+A user lives on hash(user_id) % N unless shard_directory overrides it, which
+is how the rebalancer moves users without rehashing everyone. Each process
+caches the directory and, at most every QFF_SHARD_DIRECTORY_TTL_S, compares
+shard_directory_version with the version it loaded, so a move made by the
+CLI in another process reaches every worker within that interval; a move
+keeps the user's old rows until then.
+
+Single-user work routes to one shard. Cross-user reads fan out to all shards
+on a thread pool and merge: counters are summed, ordered pages are k-way
+merged on their sort key. A transfer whose payee lives on another shard
+debits and queues the credit in the payer's shard (shard_outbox), then applies
+it exactly once in the payee's shard (shard_inbox dedupes replays).
+"""
+import os
+import time
+import heapq
+import hashlib
+import itertools
+import threading
+from collections import OrderedDict
+from contextlib import ExitStack, nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from fastapi import Depends
+from sqlalchemy import select, insert, update, delete, union
+
+from .database import (engine, make_engine, make_writer_engine, async_url, async_session_for,
+                       async_session_scope, ASYNC_DB_URL)
+from .group_commit import GroupCommitWriter, ledger_writer, GROUP_COMMIT_ENABLED
+from .models import init_db, ledger, accounts, shard_directory, shard_directory_version, shard_outbox, shard_inbox
+from .pagination import page_rows
+from .replica import replica_router
+from .security import get_current_user
+from .stats import read_stats, refresh_stats
+
+SHARD_URLS = [u.strip() for u in os.environ.get("QFF_SHARD_URLS", "").split(",") if u.strip()]
+SHARD_FANOUT_WORKERS = int(os.environ.get("QFF_SHARD_FANOUT_WORKERS", "8"))
+SHARD_MOVE_BATCH_ROWS = int(os.environ.get("QFF_SHARD_MOVE_BATCH_ROWS", "5000"))
+SHARD_DIRECTORY_TTL_S = float(os.environ.get("QFF_SHARD_DIRECTORY_TTL_S", "1"))
+SHARD_OWNER_CACHE_SIZE = int(os.environ.get("QFF_SHARD_OWNER_CACHE_SIZE", "100000"))
+SHARD_EXTERNAL_TTL_S = float(os.environ.get("QFF_SHARD_EXTERNAL_TTL_S", "5"))
+SHARD_LOCK_STRIPES = 1024
+
+# tables whose rows belong to a user and move with them
+USER_TABLES = (accounts, ledger, shard_inbox)
+
+
+def shard_hash(user_id: Optional[str], n: int) -> int:
+    """Stable shard for a user id (rows without a user live on shard 0)"""
+    if n <= 1 or not user_id:
+        return 0
+    return int.from_bytes(hashlib.blake2b(user_id.encode(), digest_size=8).digest(), "big") % n
+
+
+class ShardSet:
+    """Engines and writers for every shard, plus routing, fan-out and moves"""
+
+    def __init__(self, engines: Optional[List] = None, writers: Optional[List] = None,
+                 fanout_workers: int = SHARD_FANOUT_WORKERS, directory_ttl: float = SHARD_DIRECTORY_TTL_S):
+        self.engines = engines or [engine]
+        # default writers run units inline on each shard's pool
+        self.writers = writers or [GroupCommitWriter(db_engine=e, enabled=False) for e in self.engines]
+        self.fanout_workers = fanout_workers
+        self.directory_ttl = directory_ttl
+        self._directory: Optional[Dict[str, int]] = None
+        self._directory_version = None
+        self._directory_checked = 0.0
+        self._owners: "OrderedDict[str, str]" = OrderedDict()  # account id -> user id, LRU
+        self._external: Dict[str, float] = {}  # receiver -> when no shard had such an account
+        self._pool = None
+        self._locks = [threading.Lock() for _ in range(SHARD_LOCK_STRIPES)]
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_urls(cls, urls: List[str]) -> "ShardSet":
+        engines, writers = [engine], [ledger_writer]
+        for i, url in enumerate(urls, start=1):
+            engines.append(make_engine(url, f"shard{i}"))
+            writers.append(GroupCommitWriter(db_engine=make_writer_engine(url) if GROUP_COMMIT_ENABLED else engines[-1]))
+        return cls(engines, writers)
+
+    @property
+    def count(self) -> int:
+        return len(self.engines)
+
+    @property
+    def enabled(self) -> bool:
+        return self.count > 1
+
+    @property
+    def primary(self):
+        return self.engines[0]
+
+    def init(self):
+        """Create/migrate the schema on every shard but the primary (init_db covers it)"""
+        for db_engine in self.engines[1:]:
+            init_db(db_engine)
+
+    # ---- routing ----
+
+    def _load_directory(self) -> Dict[str, int]:
+        now = time.monotonic()
+        if self._directory is None or now - self._directory_checked >= self.directory_ttl:
+            with self.primary.connect() as conn:
+                version = conn.execute(select(shard_directory_version.c.version)).scalar() or 0
+                if self._directory is None or version != self._directory_version:
+                    self._directory = {r.user_id: r.shard for r in conn.execute(select(shard_directory))}
+                    self._directory_version = version
+            self._directory_checked = now
+        return self._directory
+
+    def shard_of(self, user_id: Optional[str]) -> int:
+        if not self.enabled:
+            return 0
+        override = self._load_directory().get(user_id)
+        return override if override is not None else shard_hash(user_id, self.count)
+
+    def engine_for(self, user_id: Optional[str]):
+        return self.engines[self.shard_of(user_id)]
+
+    def user_locks(self, *user_ids: Optional[str]):
+        """
+        Hold off moves of these users while their rows are written. Only needed
+        with several shards; stripes are taken in index order to avoid deadlock.
+        """
+        if not self.enabled:
+            return nullcontext()
+        stripes = sorted({shard_hash(u or "", SHARD_LOCK_STRIPES) for u in user_ids})
+        stack = ExitStack()
+        for i in stripes:
+            stack.enter_context(self._locks[i])
+        return stack
+
+    # ---- fan-out ----
+
+    def fan_out(self, fn: Callable) -> List:
+        """fn(engine) on every shard concurrently; results in shard order"""
+        if not self.enabled:
+            return [fn(self.primary)]
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=min(self.fanout_workers, self.count),
+                                                thread_name_prefix="qff-shard")
+        return list(self._pool.map(fn, self.engines))
+
+    def fetch_all(self, stmt) -> List[list]:
+        def run(db_engine):
+            with db_engine.connect() as conn:
+                return conn.execute(stmt).fetchall()
+        return self.fan_out(run)
+
+    @staticmethod
+    def merge(sorted_lists: Iterable[Iterable], key: Callable, reverse: bool = False) -> Iterator:
+        """k-way merge of per-shard results that are each already sorted by key"""
+        return heapq.merge(*sorted_lists, key=key, reverse=reverse)
+
+    def merged_page(self, stmt, limit: int) -> Tuple[List, Optional[str]]:
+        """
+        One keyset page across shards. stmt comes from keyset_page(), so each
+        shard returns its first limit+1 rows newest first; the global page is
+        the first limit+1 of their merge.
+        """
+        merged = self.merge(self.fetch_all(stmt), key=lambda r: (r.cursor_ts, r.id), reverse=True)
+        return page_rows(list(itertools.islice(merged, limit + 1)), limit)
+
+    def iter_merged_batches(self, stmt, key: Callable, batch_rows: int = 2000) -> Iterator[list]:
+        """Stream an ordered query from every shard as one ordered sequence of row batches"""
+        def stream(db_engine):
+            with db_engine.connect() as conn:
+                result = conn.execution_options(stream_results=True, yield_per=batch_rows).execute(stmt)
+                for row in result:
+                    yield row
+        merged = self.merge([stream(e) for e in self.engines], key=key)
+        while True:
+            batch = list(itertools.islice(merged, batch_rows))
+            if not batch:
+                return
+            yield batch
+
+    def sum_stats(self) -> Dict:
+        """read_stats() of every shard added together (users only exist on the primary)"""
+        def run(db_engine):
+            refresh_stats(db_engine)
+            with db_engine.connect() as conn:
+                return read_stats(conn)
+        total: Dict = {}
+        for stats in self.fan_out(run):
+            for scope, value in stats.items():
+                if isinstance(value, dict):
+                    counts = total.setdefault(scope, {})
+                    for key, n in value.items():
+                        counts[key] = counts.get(key, 0) + n
+                else:
+                    total[scope] = total.get(scope, 0) + value
+        return total
+
+    def sum_totals(self, stmt) -> List[Tuple[str, int, int]]:
+        """Per-currency (currency, count, total_minor) from ledger_totals_stmt() on every shard"""
+        totals: Dict[str, List[int]] = {}
+        for rows in self.fetch_all(stmt):
+            for r in rows:
+                t = totals.setdefault(r.currency, [0, 0])
+                t[0] += r.count
+                t[1] += r.total_minor or 0
+        return [(currency, n, minor) for currency, (n, minor) in sorted(totals.items(), key=lambda kv: str(kv[0]))]
+
+    # ---- cross-shard credits ----
+
+    def find_first(self, lookup: Callable) -> Tuple[Optional[int], Optional[object]]:
+        """Run lookup(conn) on every shard; return (shard, row) of the first hit"""
+        def run(db_engine):
+            with db_engine.connect() as conn:
+                return lookup(conn)
+        for shard, row in enumerate(self.fan_out(run)):
+            if row is not None:
+                return shard, row
+        return None, None
+
+    def find_credit_account(self, receiver: str, currency: str):
+        """
+        balance_engine.find_credit_account on the payee's shard. An account's
+        owner never changes, so it is cached and the lookup goes to the owner's
+        shard; only unknown receivers fan out, and receivers no shard has
+        (external payees) are remembered for QFF_SHARD_EXTERNAL_TTL_S.
+        """
+        from .balance_engine import find_credit_account
+        if not self.enabled:
+            with self.primary.connect() as conn:
+                return find_credit_account(conn, receiver, currency)
+        with self._lock:
+            owner = self._owners.get(receiver)
+            if owner is not None:
+                self._owners.move_to_end(receiver)
+            elif time.monotonic() - self._external.get(receiver, float("-inf")) < SHARD_EXTERNAL_TTL_S:
+                return None
+        if owner is None:
+            _, row = self.find_first(lambda conn: conn.execute(
+                select(accounts.c.user_id).where(accounts.c.id == receiver)).first())
+            with self._lock:
+                if row is None:
+                    if len(self._external) >= SHARD_OWNER_CACHE_SIZE:
+                        self._external.clear()
+                    self._external[receiver] = time.monotonic()
+                    return None
+                owner = self._owners[receiver] = row.user_id
+                while len(self._owners) > SHARD_OWNER_CACHE_SIZE:
+                    self._owners.popitem(last=False)
+        with self.engine_for(owner).connect() as conn:
+            return find_credit_account(conn, receiver, currency)
+
+    @staticmethod
+    def queue_credit(conn, tx_id: str, user_id: str, account_id: str, amount_minor: int):
+        """Inside the payer's unit: remember the credit owed to another shard"""
+        conn.execute(insert(shard_outbox).values(tx_id=tx_id, user_id=user_id,
+                                                 account_id=account_id, amount_minor=amount_minor))
+
+    def deliver_credit(self, source_shard: int, tx_id: str, user_id: str, account_id: str, amount_minor: int):
+        """Apply a queued credit once on the payee's current shard, then clear the outbox entry"""
+        from .balance_engine import credit
+
+        def apply(conn):
+            if conn.execute(select(shard_inbox.c.tx_id).where(shard_inbox.c.tx_id == tx_id)).first() is None:
+                credit(conn, account_id, amount_minor)
+                conn.execute(insert(shard_inbox).values(tx_id=tx_id, user_id=user_id))
+
+        with self.user_locks(user_id):
+            self.writers[self.shard_of(user_id)].execute(apply)
+        self.writers[source_shard].execute(
+            lambda conn: conn.execute(delete(shard_outbox).where(shard_outbox.c.tx_id == tx_id)))
+
+    def drain_outbox(self) -> int:
+        """Deliver credits left queued by a crash or failed delivery"""
+        delivered = 0
+        for shard, rows in enumerate(self.fetch_all(select(shard_outbox))):
+            for r in rows:
+                try:
+                    self.deliver_credit(shard, r.tx_id, r.user_id, r.account_id, r.amount_minor)
+                    delivered += 1
+                except Exception as e:
+                    print(f"Cross-shard credit {r.tx_id} still pending: {e}")
+        return delivered
+
+    # ---- moves ----
+
+    def _set_directory(self, user_id: str, shard: int):
+        with self.primary.begin() as conn:
+            conn.execute(delete(shard_directory).where(shard_directory.c.user_id == user_id))
+            if shard != shard_hash(user_id, self.count):
+                conn.execute(insert(shard_directory).values(user_id=user_id, shard=shard))
+            bumped = conn.execute(update(shard_directory_version).where(shard_directory_version.c.id == 1)
+                                  .values(version=shard_directory_version.c.version + 1))
+            if bumped.rowcount == 0:
+                conn.execute(insert(shard_directory_version).values(id=1, version=1))
+        self._directory = None
+
+    def move_user(self, user_id: str, src: int, dst: int, batch_rows: int = SHARD_MOVE_BATCH_ROWS) -> Dict:
+        """
+        Copy a user's rows to dst, point the directory at dst, then delete them
+        from src once every process has reloaded the directory. Holds the
+        user's lock, so this process's writes wait; run the CLI only while no
+        other process writes for the user.
+        """
+        moved = {}
+        with self.user_locks(user_id):
+            src_engine, dst_engine = self.engines[src], self.engines[dst]
+            for table in USER_TABLES:
+                key = table.primary_key.columns.values()[0]
+                last, count = None, 0
+                while True:
+                    stmt = select(table).where(table.c.user_id == user_id).order_by(key).limit(batch_rows)
+                    if last is not None:
+                        stmt = stmt.where(key > last)
+                    with src_engine.connect() as conn:
+                        rows = [dict(r._mapping) for r in conn.execute(stmt)]
+                    if not rows:
+                        break
+                    with dst_engine.begin() as conn:
+                        conn.execute(delete(table).where(key.in_([r[key.name] for r in rows])))
+                        conn.execute(insert(table), rows)
+                    last, count = rows[-1][key.name], count + len(rows)
+                moved[table.name] = count
+            self._set_directory(user_id, dst)
+            # other workers route to src until they next check the directory version
+            time.sleep(self.directory_ttl)
+            with src_engine.begin() as conn:
+                for table in USER_TABLES:
+                    conn.execute(delete(table).where(table.c.user_id == user_id))
+        print(f"Moved user {user_id} from shard {src} to shard {dst}: {moved}")
+        return {"user_id": user_id, "from": src, "to": dst, "rows": moved}
+
+    def pin_in_place(self, shard: int = 0) -> int:
+        """
+        Point the directory at shard for every user stored there but hashed
+        elsewhere, without moving rows: for data written straight to one
+        shard (the demo seed lands on the primary) before anyone else writes
+        for those users.
+        """
+        users = {u for u, _, _ in self.misplaced_users([shard])}
+        for user_id in users:
+            self._set_directory(user_id, shard)
+        return len(users)
+
+    def misplaced_users(self, shards: Optional[List[int]] = None) -> List[Tuple[str, int, int]]:
+        """(user_id, current shard, target shard) for users stored away from their shard"""
+        stmt = union(select(accounts.c.user_id), select(ledger.c.user_id))
+        found = []
+        for i in (shards if shards is not None else range(self.count)):
+            with self.engines[i].connect() as conn:
+                for (user_id,) in conn.execute(stmt):
+                    if user_id and self.shard_of(user_id) != i:
+                        found.append((user_id, i, self.shard_of(user_id)))
+        return found
+
+    def rebalance(self, shards: Optional[List[int]] = None, dry_run: bool = False) -> List[Dict]:
+        """Move every misplaced user to its target shard (e.g. after adding shards)"""
+        plan = self.misplaced_users(shards)
+        if dry_run:
+            return [{"user_id": u, "from": s, "to": t} for u, s, t in plan]
+        return [self.move_user(u, s, t) for u, s, t in plan]
+
+    def relocate(self, user_id: str, dst: int) -> Dict:
+        """Pin a user to shard dst and move their rows there"""
+        if not 0 <= dst < self.count:
+            raise ValueError(f"Unknown shard {dst}")
+        src = self.shard_of(user_id)
+        if src == dst:
+            return {"user_id": user_id, "from": src, "to": dst, "rows": {}}
+        return self.move_user(user_id, src, dst)
+
+
+shards = ShardSet.from_urls(SHARD_URLS)
+
+
+# ---- FastAPI dependencies ----
+
+def _user_session(user_id: Optional[str]):
+    if not shards.enabled:
+        return async_session_scope(replica=replica_router.use_replica(user_id))
+    i = shards.shard_of(user_id)
+    if i == 0:
+        return async_session_for("async", ASYNC_DB_URL)
+    url = shards.engines[i].url.render_as_string(hide_password=False)
+    return async_session_for(f"async_shard{i}", async_url(url))
+
+
+async def get_async_user_db(current_user: dict = Depends(get_current_user)):
+    """AsyncSession holding the current user's rows (their shard, or the replica router when unsharded)"""
+    async for db in _user_session(current_user.get("user_id")):
+        yield db
+
+
+async def get_async_target_db(userId: str = None, current_user: dict = Depends(get_current_user)):
+    """Like get_async_user_db, but follows ?userId= for admins"""
+    target = userId if userId and current_user.get("role") == "admin" else current_user.get("user_id")
+    async for db in _user_session(target):
+        yield db
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Inspect and rebalance ledger shards")
+    sub = parser.add_subparsers(dest="command", required=True)
+    plan = sub.add_parser("rebalance", help="Move users stored away from their target shard")
+    plan.add_argument("--dry-run", action="store_true")
+    move = sub.add_parser("move", help="Pin a user to a shard and move their rows")
+    move.add_argument("user_id")
+    move.add_argument("shard", type=int)
+    sub.add_parser("drain", help="Deliver pending cross-shard credits")
+    args = parser.parse_args()
+
+    shards.init()
+    if args.command == "rebalance":
+        for m in shards.rebalance(dry_run=args.dry_run):
+            print(f"{m['user_id']}: shard {m['from']} -> {m['to']}")
+    elif args.command == "move":
+        shards.relocate(args.user_id, args.shard)
+    else:
+        print(f"Delivered {shards.drain_outbox()} credits")
@@ -0,0 +1,114 @@
+"""
+Startup Phases and Lazy Subsystems
+Cold start is what an autoscaled worker pays before it can take traffic, so
+startup keeps to what the first request cannot do without (schema, shard
+map, revocation filters) and times each phase. Everything heavy is a
+LazySubsystem: built on first use. Subsystems registered with
+startup.register() are, with QFF_WARM_SUBSYSTEMS, warmed in a background
+thread after the app reports ready, so usually nobody waits for them.
+
+    with startup.phase("init_db"):
+        init_db()
+    ai = startup.register(LazySubsystem("ai_engine", lambda: AgenticAI(seed)))
+    ai.get().analyze(tx)
+
+The report (per phase and per subsystem, in ms) is printed once the app is
+ready, served at /health/startup and exported as qff_startup_phase_seconds.
+"""
+import os
+import time
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Generic, List, Optional, TypeVar
+
+from .telemetry import STARTUP_PHASE_SECONDS
+
+WARM_SUBSYSTEMS = os.environ.get("QFF_WARM_SUBSYSTEMS", "true").lower() == "true"
+
+T = TypeVar("T")
+
+
+class StartupReport:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases: Dict[str, float] = {}       # phase -> ms
+        self.subsystems: Dict[str, float] = {}   # lazy subsystem -> ms to build
+        self.failed: Dict[str, str] = {}
+        self.ready_ms: Optional[float] = None
+        self.registered: List["LazySubsystem"] = []  # warmed by warm_in_background()
+
+    def record(self, name: str, seconds: float):
+        self.phases[name] = round(seconds * 1000, 1)
+        STARTUP_PHASE_SECONDS.labels(name).set(seconds)
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def register(self, subsystem: "LazySubsystem") -> "LazySubsystem":
+        self.registered.append(subsystem)
+        return subsystem
+
+    def record_subsystem(self, name: str, seconds: float):
+        self.subsystems[name] = round(seconds * 1000, 1)
+        STARTUP_PHASE_SECONDS.labels(f"lazy:{name}").set(seconds)
+
+    def ready(self):
+        self.ready_ms = round((time.perf_counter() - self.started) * 1000, 1)
+        STARTUP_PHASE_SECONDS.labels("ready").set(self.ready_ms / 1000)
+        breakdown = ", ".join(f"{name} {ms:.0f} ms" for name, ms in self.phases.items())
+        print(f"Startup ready in {self.ready_ms:.0f} ms ({breakdown})")
+
+    def as_dict(self) -> dict:
+        return {"ready_ms": self.ready_ms, "phases_ms": dict(self.phases),
+                "subsystems_ms": dict(self.subsystems), "failed": dict(self.failed)}
+
+
+startup = StartupReport()
+
+
+class LazySubsystem(Generic[T]):
+    """A subsystem built by `factory` on first get(), once, even under concurrent first use"""
+
+    def __init__(self, name: str, factory: Callable[[], T], report: StartupReport = startup):
+        self.name = name
+        self._factory = factory
+        self._report = report
+        self._value = None
+        self._loaded = False
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    def get(self) -> T:
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    start = time.perf_counter()
+                    self._value = self._factory()
+                    self._loaded = True
+                    self._report.record_subsystem(self.name, time.perf_counter() - start)
+        return self._value
+
+
+def warm_in_background(subsystems: List[LazySubsystem] = None) -> threading.Thread:
+    """Build the given (default: registered) subsystems off the request path; failures are recorded, and retried on first use"""
+    subsystems = startup.registered if subsystems is None else subsystems
+
+    def warm():
+        for subsystem in subsystems:
+            try:
+                subsystem.get()
+            except Exception as e:
+                subsystem._report.failed[subsystem.name] = str(e)
+                print(f"Warming {subsystem.name} failed (it will be retried on first use): {e}")
+
+    thread = threading.Thread(target=warm, name="qff-warm", daemon=True)
+    thread.start()
+    return thread
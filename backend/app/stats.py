@@ -0,0 +1,142 @@
+"""
+Aggregate Statistics
+Row counts per table plus per-value breakdowns of the ledger, kept in the
+small stats_counters table so /admin/stats never scans the big tables.
+
+On SQLite the counters are maintained by triggers inside the same
+transaction as every insert, update and delete. Other dialects rebuild them
+from GROUP BY aggregates (a full scan) on a background thread against the
+primary, at most every QFF_STATS_REFRESH_SECONDS, so counters there are as
+fresh as the last rebuild. read_stats() itself only ever reads, which keeps
+it safe on a read replica.
+"""
+import os
+import time
+import threading
+from typing import Dict, List
+
+from sqlalchemy import select, delete, text
+
+from .models import stats_counters
+
+STATS_REFRESH_SECONDS = float(os.environ.get("QFF_STATS_REFRESH_SECONDS", "30"))
+
+# table -> columns broken down by value
+STAT_TABLES: Dict[str, tuple] = {
+    "users": (),
+    "accounts": (),
+    "ledger": ("tx_type", "status", "currency"),
+}
+
+_last_rebuild: Dict[str, float] = {}
+_rebuilding: Dict[str, threading.Thread] = {}
+_rebuild_lock = threading.Lock()
+
+
+def _bump(scope: str, key_expr: str, delta: int) -> str:
+    return (
+        f"INSERT INTO stats_counters (scope, key, count) VALUES ('{scope}', {key_expr}, {delta}) "
+        f"ON CONFLICT (scope, key) DO UPDATE SET count = count + ({delta});"
+    )
+
+
+def _trigger_statements(table: str, columns: tuple) -> List[str]:
+    def body(row: str, delta: int) -> str:
+        parts = [_bump(table, "'*'", delta)]
+        parts += [_bump(f"{table}.{col}", f"COALESCE({row}.{col}, '')", delta) for col in columns]
+        return "\n  ".join(parts)
+
+    stmts = [
+        f"CREATE TRIGGER IF NOT EXISTS trg_stats_{table}_insert AFTER INSERT ON {table}\n"
+        f"BEGIN\n  {body('NEW', 1)}\nEND",
+        f"CREATE TRIGGER IF NOT EXISTS trg_stats_{table}_delete AFTER DELETE ON {table}\n"
+        f"BEGIN\n  {body('OLD', -1)}\nEND",
+    ]
+    if columns:
+        moves = "\n  ".join(
+            [_bump(f"{table}.{col}", f"COALESCE(OLD.{col}, '')", -1) for col in columns] +
+            [_bump(f"{table}.{col}", f"COALESCE(NEW.{col}, '')", 1) for col in columns]
+        )
+        stmts.append(
+            f"CREATE TRIGGER IF NOT EXISTS trg_stats_{table}_update AFTER UPDATE OF {', '.join(columns)} ON {table}\n"
+            f"BEGIN\n  {moves}\nEND"
+        )
+    return stmts
+
+
+def install_stats_triggers(conn):
+    """Create the counter triggers (SQLite only) and seed counters from COUNT(*)"""
+    if conn.dialect.name == "sqlite":
+        for table, columns in STAT_TABLES.items():
+            for stmt in _trigger_statements(table, columns):
+                conn.execute(text(stmt))
+    rebuild_stats(conn)
+
+
+def drop_stats_triggers(conn):
+    if conn.dialect.name != "sqlite":
+        return
+    for table in STAT_TABLES:
+        for op in ("insert", "delete", "update"):
+            conn.execute(text(f"DROP TRIGGER IF EXISTS trg_stats_{table}_{op}"))
+
+
+def rebuild_stats(conn):
+    """Recompute every counter from COUNT(*) aggregates"""
+    conn.execute(delete(stats_counters))
+    for table, columns in STAT_TABLES.items():
+        conn.execute(text(
+            f"INSERT INTO stats_counters (scope, key, count) SELECT '{table}', '*', COUNT(*) FROM {table}"
+        ))
+        for col in columns:
+            conn.execute(text(
+                f"INSERT INTO stats_counters (scope, key, count) "
+                f"SELECT '{table}.{col}', COALESCE({col}, ''), COUNT(*) FROM {table} GROUP BY COALESCE({col}, '')"
+            ))
+    _last_rebuild[str(conn.engine.url)] = time.time()
+
+
+def refresh_stats(db_engine, wait: bool = False):
+    """
+    Start a background rebuild on db_engine (a primary) if its counters are
+    older than QFF_STATS_REFRESH_SECONDS. No-op on SQLite, where triggers keep
+    them current; wait=True blocks until the rebuild is done.
+    """
+    if db_engine.dialect.name == "sqlite":
+        return
+    url = str(db_engine.url)
+
+    def rebuild():
+        try:
+            with db_engine.begin() as conn:
+                rebuild_stats(conn)
+        except Exception as e:
+            print(f"Stats rebuild failed on {db_engine.url!r}: {e}")
+
+    with _rebuild_lock:
+        thread = _rebuilding.get(url)
+        if (thread is None or not thread.is_alive()) and \
+                time.time() - _last_rebuild.get(url, 0) > STATS_REFRESH_SECONDS:
+            # claim the interval up front so concurrent readers start one rebuild, not many
+            _last_rebuild[url] = time.time()
+            thread = _rebuilding[url] = threading.Thread(target=rebuild, name="qff-stats-rebuild", daemon=True)
+            thread.start()
+    if wait and thread is not None:
+        thread.join()
+
+
+def read_stats(conn) -> Dict:
+    """
+    Read all counters: {"users": n, "ledger": n, ..., "ledger.status": {"COMPLETED": n, ...}}
+    Read-only; cost is proportional to the number of distinct values, not table size.
+    """
+    stats: Dict = {table: 0 for table in STAT_TABLES}
+    for table, columns in STAT_TABLES.items():
+        for col in columns:
+            stats[f"{table}.{col}"] = {}
+    for r in conn.execute(select(stats_counters)):
+        if r.key == "*":
+            stats[r.scope] = r.count
+        elif r.count:
+            stats.setdefault(r.scope, {})[r.key] = r.count
+    return stats
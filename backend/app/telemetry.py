@@ -1,9 +1,58 @@
 # backend/app/telemetry.py
-from prometheus_client import Counter, generate_latest, CONTENT_TYPE_LATEST
+from prometheus_client import Counter, Gauge, Histogram, generate_latest, CONTENT_TYPE_LATEST
 from fastapi import Response
 
 ANALYZE_COUNT = Counter("qff_analyze_total", "Analyze calls")
 QKD_ATTEMPT = Counter("qff_qkd_attempt_total", "QKD attempts")
 
+DB_POOL_CHECKOUT_SECONDS = Histogram("qff_db_pool_checkout_seconds", "Time to check a connection out of the pool", ["pool"],
+                                     buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5))
+DB_POOL_IN_USE = Gauge("qff_db_pool_connections_in_use", "Connections currently checked out", ["pool"])
+DB_POOL_SATURATION = Gauge("qff_db_pool_saturation_ratio", "Checked-out connections / pool capacity", ["pool"])
+
+GROUP_COMMIT_BATCH_SIZE = Histogram("qff_group_commit_batch_size", "Units of work committed per transaction",
+                                    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512))
+GROUP_COMMIT_WAIT_SECONDS = Histogram("qff_group_commit_wait_seconds", "Submit-to-durable-commit latency",
+                                      buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1))
+
+BALANCE_OCC_CONFLICTS = Counter("qff_balance_occ_conflicts_total", "Debits retried after a version conflict")
+BALANCE_OCC_RETRIES_EXHAUSTED = Counter("qff_balance_occ_retries_exhausted_total", "Debits that gave up after max retries")
+
+DB_REPLICA_LAG_SECONDS = Gauge("qff_db_replica_lag_seconds", "Age of the newest primary heartbeat visible on the replica")
+DB_READS_ROUTED = Counter("qff_db_reads_routed_total", "Read-only requests by target database", ["target", "reason"])
+
+AUTH_TOKEN_CACHE = Counter("qff_auth_token_cache_total", "Token verifications by cache result", ["result"])
+AUTH_TOKEN_CACHE_SIZE = Gauge("qff_auth_token_cache_entries", "Verified tokens held in the claims cache")
+TOKEN_REVOCATION_CHECKS = Counter("qff_token_revocation_checks_total",
+                                  "Revocation checks by outcome (clear = Bloom miss, no DB lookup)", ["result"])
+
+PASSWORD_HASH_SECONDS = Histogram("qff_password_hash_seconds", "Queue + compute time of password hash operations", ["op"],
+                                  buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10))
+PASSWORD_HASH_REJECTED = Counter("qff_password_hash_rejected_total", "Hash requests refused with 503 because the pool was full")
+
+RATE_LIMITED = Counter("qff_rate_limited_total", "Requests refused with 429 by the rate limiter", ["route"])
+
+CONCURRENCY_LIMIT = Gauge("qff_concurrency_limit", "Current adaptive concurrency limit", ["route"])
+CONCURRENCY_IN_FLIGHT = Gauge("qff_concurrency_in_flight", "Requests admitted and running", ["route"])
+CONCURRENCY_QUEUE_DEPTH = Gauge("qff_concurrency_queue_depth", "Requests waiting for admission", ["route"])
+CONCURRENCY_SHED = Counter("qff_concurrency_shed_total", "Requests refused with 503 by the concurrency limiter",
+                           ["route", "reason"])
+
+STARTUP_PHASE_SECONDS = Gauge("qff_startup_phase_seconds", "Duration of each startup phase and lazy subsystem build",
+                              ["phase"])
+
+LEDGER_IMPORT_ROWS = Counter("qff_ledger_import_rows_total", "Bulk-imported ledger records by outcome", ["outcome"])
+
+ALERTS_DISPATCHED = Counter("qff_alerts_dispatched_total",
+                            "Alerts by channel and outcome (delivered, retried, spooled, replayed)", ["channel", "outcome"])
+ALERT_QUEUE_DEPTH = Gauge("qff_alert_queue_depth", "Alerts waiting for the dispatcher")
+
+HSM_CALLS = Counter("qff_hsm_calls_total", "Operations sent to the HSM", ["op"])
+HSM_REQUEST_SECONDS = Histogram("qff_hsm_request_seconds", "Async HSM request latency, batching wait included", ["op"],
+                                buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1))
+HSM_BATCH_SIZE = Histogram("qff_hsm_batch_size", "Operations coalesced into one HSM request",
+                           buckets=(1, 2, 4, 8, 16, 32, 64, 128))
+DATA_KEY_CACHE = Counter("qff_data_key_cache_total", "Envelope data key lookups by cache result", ["use", "result"])
+
 def metrics_endpoint():
     return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,86 @@
+"""
+Alert Dispatch Benchmark
+A burst of alerts against a local webhook that takes --webhook-ms to answer:
+the caller-side cost of posting each alert inline (what notify() used to do)
+against notify() handing alerts to the background dispatcher, and how many
+webhook posts each approach makes.
+
+    python benchmarks/bench_alert_dispatch.py [--alerts 500] [--webhook-ms 50]
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import threading
+import contextlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+class Webhook(BaseHTTPRequestHandler):
+    delay_s = 0.05
+    posts = 0
+    lock = threading.Lock()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        time.sleep(self.delay_s)
+        with Webhook.lock:
+            Webhook.posts += 1
+        self.send_response(200)
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"ok")
+
+    def log_message(self, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--alerts", type=int, default=500)
+    parser.add_argument("--webhook-ms", type=float, default=50)
+    args = parser.parse_args()
+
+    Webhook.delay_s = args.webhook_ms / 1000
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Webhook)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_address[1]}/hook"
+
+    os.environ["QFF_ALERT_WEBHOOK"] = url
+    os.environ["QFF_ALERT_SPOOL_DIR"] = tempfile.mkdtemp()
+    from app.alerter import notify, alert_dispatcher, webhook_payload
+
+    def alert(i):
+        return {"time": "2024-01-01T00:00:00Z", "level": "SECURITY", "title": f"Blocked login {i}",
+                "message": "Too many failed attempts", "metadata": {"ip": "203.0.113.7"}}
+
+    Webhook.posts = 0
+    start = time.perf_counter()
+    for i in range(args.alerts):
+        requests.post(url, json=webhook_payload([alert(i)]), timeout=5)
+    inline = time.perf_counter() - start
+    print(f"inline post       caller {inline / args.alerts * 1000:8.3f} ms/alert   "
+          f"{Webhook.posts} posts   all delivered after {inline:6.2f} s")
+
+    Webhook.posts = 0
+    alert_dispatcher.start()
+    start = time.perf_counter()
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for i in range(args.alerts):
+            notify("SECURITY", f"Blocked login {i}", "Too many failed attempts", {"ip": "203.0.113.7"})
+    queued = time.perf_counter() - start
+    alert_dispatcher.flush(timeout=60)
+    drained = time.perf_counter() - start
+    print(f"dispatcher        caller {queued / args.alerts * 1000:8.3f} ms/alert   "
+          f"{Webhook.posts} posts   all delivered after {drained:6.2f} s")
+    alert_dispatcher.close()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
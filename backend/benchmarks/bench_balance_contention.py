@@ -0,0 +1,116 @@
+"""
+Balance Contention Benchmark
+Throughput of balance transfers when N concurrent writers hit the same hot
+account, through the group-commit writer (the /execute path) and directly on
+pooled connections, where optimistic-concurrency retries do the arbitration.
+
+    python benchmarks/bench_balance_contention.py [--ops 2000] [--writers 1 10 1000]
+
+Scenarios:
+    debit   every writer debits one hot account (OCC conflicts possible)
+    credit  every writer has its own payer and credits one hot merchant
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from sqlalchemy import create_engine, insert, select  # noqa: E402
+
+from app.database import apply_sqlite_profile  # noqa: E402
+from app.models import init_db, accounts  # noqa: E402
+from app.balance_engine import transfer, BalanceConflict  # noqa: E402
+from app.group_commit import GroupCommitWriter  # noqa: E402
+from app.telemetry import BALANCE_OCC_CONFLICTS  # noqa: E402
+
+START_BALANCE = 10 ** 12
+
+
+def setup(path: str, writers: int):
+    url = f"sqlite:///{path}"
+    eng = create_engine(url, connect_args={"check_same_thread": False},
+                        pool_size=min(writers, 32), max_overflow=0, pool_timeout=120)
+    apply_sqlite_profile(eng)
+    init_db(eng)
+    with eng.begin() as conn:
+        rows = [dict(id="hot", user_id="u", account_type="BANK", currency="USD", balance="0.00")]
+        rows += [dict(id=f"payer-{i:04d}", user_id="u", account_type="BANK", currency="USD",
+                      balance=f"{START_BALANCE}.00") for i in range(writers)]
+        conn.execute(insert(accounts), rows)
+    return url, eng
+
+
+def run(mode: str, scenario: str, writers: int, ops: int) -> dict:
+    tmp = tempfile.mkdtemp()
+    url, eng = setup(os.path.join(tmp, "bench.db"), writers)
+    writer = GroupCommitWriter(enabled=True) if mode == "group-commit" else None
+    if writer:
+        from app.database import make_writer_engine
+        writer._engine = make_writer_engine(url)
+
+    per_writer = max(1, ops // writers)
+    gave_up = []
+    conflicts_before = BALANCE_OCC_CONFLICTS._value.get()
+    barrier = threading.Barrier(writers)
+
+    def worker(i: int):
+        source, dest = ("hot", f"payer-{i:04d}") if scenario == "debit" else (f"payer-{i:04d}", "hot")
+        barrier.wait()
+        for _ in range(per_writer):
+            try:
+                if writer:
+                    writer.execute(lambda conn: transfer(conn, source, dest, 1), timeout=300)
+                else:
+                    with eng.begin() as conn:
+                        transfer(conn, source, dest, 1)
+            except BalanceConflict:
+                gave_up.append(1)
+
+    if scenario == "debit":
+        with eng.begin() as conn:
+            conn.execute(accounts.update().where(accounts.c.id == "hot")
+                         .values(balance_minor=START_BALANCE * 100, balance=f"{START_BALANCE}.00"))
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(writers)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    if writer:
+        writer.stop()
+
+    done = per_writer * writers - len(gave_up)
+    with eng.connect() as conn:
+        hot = conn.execute(select(accounts.c.balance_minor, accounts.c.version).where(accounts.c.id == "hot")).one()
+    expected = START_BALANCE * 100 - done if scenario == "debit" else done
+    assert hot.balance_minor == expected, (hot.balance_minor, expected)
+    return {"mode": mode, "scenario": scenario, "writers": writers, "ops": done,
+            "ops_per_s": done / elapsed, "conflicts": int(BALANCE_OCC_CONFLICTS._value.get() - conflicts_before),
+            "gave_up": len(gave_up), "batches": writer.batches if writer else None}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--ops", type=int, default=2000, help="total transfers per run")
+    parser.add_argument("--writers", type=int, nargs="+", default=[1, 10, 1000])
+    parser.add_argument("--modes", nargs="+", default=["group-commit", "direct"])
+    parser.add_argument("--scenarios", nargs="+", default=["debit", "credit"])
+    args = parser.parse_args()
+
+    print(f"{'mode':<13} {'scenario':<8} {'writers':>7} {'ops':>6} {'ops/s':>9} {'conflicts':>9} {'gave up':>7} {'batches':>7}")
+    for mode in args.modes:
+        for scenario in args.scenarios:
+            for writers in args.writers:
+                r = run(mode, scenario, writers, args.ops)
+                print(f"{r['mode']:<13} {r['scenario']:<8} {r['writers']:>7} {r['ops']:>6} {r['ops_per_s']:>9.0f} "
+                      f"{r['conflicts']:>9} {r['gave_up']:>7} {r['batches'] if r['batches'] is not None else '-':>7}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""
+Envelope Encryption Benchmark
+Field encryption + decryption through the HSM stub server, one HSM
+encrypt/decrypt per field versus envelope encryption under cached data keys:
+fields per second and HSM calls per second.
+
+    python benchmarks/bench_envelope.py [--records 2000] [--latency-ms 1]
+"""
+import os
+import sys
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from app.hsm_client import HSMClient  # noqa: E402
+from app.hsm_stub import HSMStubServer  # noqa: E402
+from app.envelope import EnvelopeEncryptor  # noqa: E402
+
+FIELDS = ["amount", "receiver", "memo"]
+
+
+def per_field_hsm(hsm, records):
+    sealed = [{f: hsm.encrypt("qff_master_key", r[f].encode()) for f in FIELDS} for r in records]
+    return [{f: hsm.decrypt("qff_master_key", *s[f]).decode() for f in FIELDS} for s in sealed]
+
+
+def envelope_fields(envelope, records):
+    return envelope.decrypt_many(envelope.encrypt_many(records, FIELDS), FIELDS)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--records", type=int, default=2000)
+    parser.add_argument("--latency-ms", type=float, default=1.0, help="Simulated HSM time per request")
+    args = parser.parse_args()
+
+    records = [{"amount": f"{i}.25", "receiver": f"acct-{i:08d}", "memo": f"invoice {i}"} for i in range(args.records)]
+    server = HSMStubServer(("127.0.0.1", 0), latency_ms=args.latency_ms)
+    server.start()
+    fields = 2 * len(records) * len(FIELDS)  # encrypted and decrypted
+    try:
+        for label, run in (("per-field HSM", per_field_hsm), ("envelope", None)):
+            hsm = HSMClient(mode="stub", address=server.address)
+            start = time.perf_counter()
+            out = run(hsm, records) if run else envelope_fields(EnvelopeEncryptor(hsm), records)
+            elapsed = time.perf_counter() - start
+            assert out == records
+            calls = sum(hsm.calls.values())
+            print(f"{label:<14} {fields / elapsed:10.0f} fields/s   {calls:6d} HSM calls "
+                  f"({calls / elapsed:8.1f}/s)   {elapsed:.2f} s")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Async HSM Client Benchmark
+Throughput and latency of concurrent sign requests against the HSM stub
+server with simulated round-trip and device latency: the blocking client
+one request at a time, the async client over a connection pool, and the
+async client with request batching.
+
+    python benchmarks/bench_hsm_async.py [--requests 2000] [--concurrency 200] [--latency-ms 2] [--op-ms 0.05]
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import numpy as np  # noqa: E402
+from app.hsm_client import HSMClient  # noqa: E402
+from app.hsm_stub import HSMStubServer  # noqa: E402
+from app.hsm_async import AsyncHSMClient, SocketTransport  # noqa: E402
+
+KEY = "qff_tx_signing_key"
+
+
+def report(label, latencies, elapsed):
+    ms = np.array(latencies) * 1000
+    print(f"{label:<26} {len(ms) / elapsed:9.0f} ops/s   p50 {np.percentile(ms, 50):7.2f} ms   "
+          f"p99 {np.percentile(ms, 99):7.2f} ms")
+
+
+def blocking(address, n):
+    hsm = HSMClient(mode="stub", address=address)
+    latencies = []
+    start = time.perf_counter()
+    for i in range(n):
+        t = time.perf_counter()
+        hsm.sign(KEY, f"tx-{i}".encode())
+        latencies.append(time.perf_counter() - t)
+    return latencies, time.perf_counter() - start
+
+
+async def concurrent(address, n, concurrency, pool_size, window_ms):
+    hsm = AsyncHSMClient(SocketTransport(address, pool_size=pool_size), batch_window_ms=window_ms)
+    latencies = []
+    gate = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with gate:
+            t = time.perf_counter()
+            await hsm.sign(KEY, f"tx-{i}".encode())
+            latencies.append(time.perf_counter() - t)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(n)))
+    elapsed = time.perf_counter() - start
+    await hsm.close()
+    return latencies, elapsed, hsm.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--pool-size", type=int, default=8)
+    parser.add_argument("--latency-ms", type=float, default=2.0, help="Simulated round trip per request")
+    parser.add_argument("--op-ms", type=float, default=0.05, help="Simulated device time per operation")
+    args = parser.parse_args()
+
+    server = HSMStubServer(("127.0.0.1", 0), latency_ms=args.latency_ms, op_ms=args.op_ms)
+    server.start()
+    try:
+        report("blocking, 1 connection", *blocking(server.address, max(1, args.requests // 10)))
+        for label, window_ms in ((f"async pool={args.pool_size}", 0), (f"async pool={args.pool_size} + batch", 2)):
+            before = server.requests
+            latencies, elapsed, stats = asyncio.run(
+                concurrent(server.address, args.requests, args.concurrency, args.pool_size, window_ms))
+            report(label, latencies, elapsed)
+            print(f"{'':<26} {server.requests - before} HSM round trips, mean batch {stats['mean_batch_size']}")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+HSM Audit Log Benchmark
+Simulated HSM sign throughput and audit memory with the old unbounded list,
+the bounded ring alone, and the ring with the hash-chained file writer.
+
+    python benchmarks/bench_hsm_audit.py [--ops 200000] [--buffer 10000]
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+from collections import deque
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from app.hsm_audit import AuditLog  # noqa: E402
+from app.hsm_client import HSMClient  # noqa: E402
+
+
+class ListLog(AuditLog):
+    """The previous behaviour: every record kept in a list forever"""
+
+    def __init__(self):
+        super().__init__()
+        self.ring = deque()
+
+
+def retained_bytes(audit) -> int:
+    records = list(audit.ring) + list(audit._pending)
+    return sum(sys.getsizeof(r) + sum(sys.getsizeof(v) for v in r.values()) for r in records)
+
+
+def run(label, audit, ops):
+    hsm = HSMClient(mode="simulation", audit=audit)
+    hsm.generate_key("k", "AES256")
+    start = time.perf_counter()
+    for i in range(ops):
+        hsm.sign("k", i.to_bytes(8, "little"))
+    elapsed = time.perf_counter() - start
+    current = retained_bytes(audit)
+    flush_start = time.perf_counter()
+    audit.close()
+    flushed = time.perf_counter() - flush_start
+    print(f"{label:<16} {ops / elapsed:9.0f} signs/s   audit memory {current / 2**20:7.1f} MiB   "
+          f"final flush {flushed * 1000:6.0f} ms   {audit.stats()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--ops", type=int, default=200000)
+    parser.add_argument("--buffer", type=int, default=10000)
+    args = parser.parse_args()
+
+    run("unbounded list", ListLog(), args.ops)
+    run("ring", AuditLog(capacity=args.buffer), args.ops)
+    with tempfile.TemporaryDirectory() as directory:
+        run("ring + files", AuditLog(directory, capacity=args.buffer), args.ops)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+HSM Keystore Benchmark
+A million per-user keys in the tiered keystore: bulk load and single-key
+generation rate, hot and cold lookups (with unsealing), rotate/delete
+metadata updates, and the memory held compared with a plain dict.
+
+    python benchmarks/bench_hsm_keystore.py [--keys 1000000] [--hot 10000] [--lookups 100000]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from app.hsm_keystore import KeyStore  # noqa: E402
+from app.hsm_client import HSMClient  # noqa: E402
+from app.hsm_audit import AuditLog  # noqa: E402
+
+
+def key(i: int) -> dict:
+    return {"key_id": f"user-{i}", "key_type": "AES256", "created_at": "2024-01-01T00:00:00",
+            "exportable": False, "algorithm": "AES256", "length_bits": 256,
+            "usage": ["ENCRYPT", "DECRYPT", "SIGN", "VERIFY"], "material": os.urandom(32).hex()}
+
+
+def timed_us(fn, n) -> float:
+    start = time.perf_counter()
+    for i in range(n):
+        fn(i)
+    return (time.perf_counter() - start) / n * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--keys", type=int, default=1_000_000)
+    parser.add_argument("--hot", type=int, default=10_000)
+    parser.add_argument("--lookups", type=int, default=100_000)
+    args = parser.parse_args()
+    rng = random.Random(7)
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "keys.db")
+        store = KeyStore(path, hot_keys=args.hot)
+        start = time.perf_counter()
+        for chunk in range(0, args.keys, 10_000):
+            store.put_many((f"user-{i}", key(i)) for i in range(chunk, min(args.keys, chunk + 10_000)))
+        elapsed = time.perf_counter() - start
+        print(f"bulk load        {args.keys / elapsed:10.0f} keys/s   "
+              f"{os.path.getsize(path) / 2**20:.0f} MiB on disk")
+
+        hsm = HSMClient(mode="simulation", audit=AuditLog(), key_store=store)
+        per_key = timed_us(lambda i: hsm.generate_key(f"session-{i}", "AES256"), 10_000)
+        print(f"generate_key     {per_key:10.1f} us/key")
+
+        # 90% of lookups go to 1% of users, the rest anywhere
+        busy = [rng.randrange(args.keys) for _ in range(args.keys // 100)]
+        ids = [f"user-{rng.choice(busy) if rng.random() < 0.9 else rng.randrange(args.keys)}"
+               for _ in range(args.lookups)]
+        store.hits = store.misses = 0
+        mixed = timed_us(lambda i: store[ids[i]]["material"], args.lookups)
+        hit_rate = store.hits / (store.hits + store.misses)
+        cold = timed_us(lambda i: store[f"user-{rng.randrange(args.keys)}"]["material"], 10_000)
+        print(f"lookup, skewed   {mixed:10.1f} us   ({hit_rate:.0%} hot)")
+        print(f"lookup, cold     {cold:10.1f} us")
+        hot_id = ids[0]
+        print(f"lookup, hot      {timed_us(lambda i: store[hot_id]['material'], args.lookups):10.2f} us")
+        print(f"rotate_key       {timed_us(lambda i: hsm.rotate_key(f'user-{i}', f'user-{i}-v2'), 5_000):10.1f} us")
+        print(f"delete_key       {timed_us(lambda i: hsm.delete_key(f'user-{i + 5_000}'), 5_000):10.1f} us")
+        store.close()
+
+    sample = min(args.keys, 100_000)
+    tracemalloc.start()
+    plain = {f"user-{i}": key(i) for i in range(sample)}
+    per_dict_key = tracemalloc.get_traced_memory()[0] / sample
+    tracemalloc.stop()
+    del plain
+    print(f"memory           dict of {args.keys} keys ~{per_dict_key * args.keys / 2**20:.0f} MiB, "
+          f"hot set of {args.hot} ~{per_dict_key * args.hot / 2**20:.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
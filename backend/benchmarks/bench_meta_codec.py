@@ -0,0 +1,53 @@
+"""
+Ledger Meta Codec Benchmark
+Row size and CPU of the ledger.meta encoding versus the old str(dict) repr,
+using the payload /execute actually writes, and what is left for the
+group-commit writer thread when /execute hands it pre-encoded bytes.
+
+    python benchmarks/bench_meta_codec.py [--rows 100000]
+"""
+import os
+import sys
+import ast
+import time
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from app.gateway import exec_on_rail  # noqa: E402
+from app.pqc_sim import encapsulate_payload  # noqa: E402
+from app.meta_codec import encode_meta, decode_meta, LazyMeta, MetaType, HAS_ORJSON  # noqa: E402
+
+
+def timed(fn, items) -> float:
+    start = time.perf_counter()
+    for item in items:
+        fn(item)
+    return (time.perf_counter() - start) / len(items) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=100000)
+    args = parser.parse_args()
+
+    tx = {"amount": 125.5, "currency": "USD", "type": "CARD_PAYMENT", "receiver": "merchant-42"}
+    metas = [{"enc": encapsulate_payload(tx, "nokey"), "exec": exec_on_rail(tx)} for _ in range(min(args.rows, 1000))]
+    metas = (metas * (args.rows // len(metas) + 1))[:args.rows]
+
+    legacy = [str(m) for m in metas]
+    encoded = [encode_meta(m) for m in metas]
+    print(f"orjson: {HAS_ORJSON}, rows: {args.rows}")
+    print(f"{'':<22}{'bytes/row':>10}{'us/row':>10}")
+    print(f"{'write str(dict)':<22}{sum(map(len, legacy)) / len(legacy):>10.1f}{timed(str, metas):>10.2f}")
+    print(f"{'write encode_meta':<22}{sum(map(len, encoded)) / len(encoded):>10.1f}{timed(encode_meta, metas):>10.2f}")
+    bind = MetaType().process_bind_param
+    print(f"{'writer bind dict':<22}{'':>10}{timed(lambda m: bind(m, None), metas):>10.2f}")
+    print(f"{'writer bind encoded':<22}{'':>10}{timed(lambda b: bind(b, None), encoded):>10.2f}")
+    print(f"{'read literal_eval':<22}{'':>10}{timed(ast.literal_eval, legacy):>10.2f}")
+    print(f"{'read decode_meta':<22}{'':>10}{timed(decode_meta, encoded):>10.2f}")
+    print(f"{'read LazyMeta (unused)':<22}{'':>10}{timed(LazyMeta, encoded):>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Password Hashing Pool Benchmark
+Throughput and latency of a burst of concurrent bcrypt hashes through the
+hashing pool, with process workers versus a single hashing thread, plus how
+many requests the admission limit turns away with 503.
+
+    python benchmarks/bench_password_hashing.py [--burst 64] [--rounds 10]
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from fastapi import HTTPException  # noqa: E402
+from app.passwords import PasswordHasher, HASH_WORKERS, HASH_QUEUE_LIMIT  # noqa: E402
+
+
+async def burst(hasher: PasswordHasher, n: int):
+    latencies, rejected = [], 0
+
+    async def one(i):
+        nonlocal rejected
+        start = time.perf_counter()
+        try:
+            await hasher.hash_async(f"password-{i}")
+            latencies.append(time.perf_counter() - start)
+        except HTTPException:
+            rejected += 1
+
+    await hasher.hash_async("warm-up")
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(n)))
+    return time.perf_counter() - start, sorted(latencies), rejected
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--burst", type=int, default=64)
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--workers", type=int, default=HASH_WORKERS)
+    parser.add_argument("--queue-limit", type=int, default=HASH_QUEUE_LIMIT)
+    args = parser.parse_args()
+
+    for label, workers in (("1 thread", 0), (f"{args.workers} processes", args.workers)):
+        hasher = PasswordHasher(workers=workers, queue_limit=args.queue_limit, rounds=args.rounds)
+        try:
+            seconds, latencies, rejected = asyncio.run(burst(hasher, args.burst))
+        finally:
+            hasher.shutdown()
+        done = len(latencies)
+        p50 = latencies[done // 2] * 1000 if done else 0
+        p99 = latencies[min(done - 1, int(done * 0.99))] * 1000 if done else 0
+        print(f"{label:<14}{done / seconds:8.1f} hashes/s   p50 {p50:7.1f} ms   p99 {p99:7.1f} ms   503s {rejected}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,38 @@
-# backend/metrics_eval.py
 from app.ai_engine import AgenticAI
 from app.database import SessionLocal
 from app.models import ledger
+from app.money import from_minor_array
 from sqlalchemy import select
+from types import SimpleNamespace
 import numpy as np
+import sys
 
 def load_ledger(n=200):
     db = SessionLocal()
     rows = db.execute(select(ledger).order_by(ledger.c.timestamp.desc()).limit(n)).fetchall()
     db.close()
-    return rows
+    amounts = from_minor_array([r.amount_minor or 0 for r in rows], [r.currency for r in rows])
+    return [SimpleNamespace(tx_type=r.tx_type, amount=float(a) if r.amount_minor is not None else r.amount,
+                            currency=r.currency, receiver=r.receiver, status=r.status)
+            for r, a in zip(rows, amounts)]
 
-def evaluate():
+def load_ledger_snapshot(root, n=200):
+    """Read the newest n rows from a columnar snapshot instead of the database"""
+    from app.snapshots import load_snapshot, snapshot_dictionary
+    cols = load_snapshot(root, ["timestamp","tx_type","amount","currency","receiver","status"])
+    if len(cols["timestamp"]) == 0:
+        return []
+    idx = np.argsort(cols["timestamp"])[::-1][:n]
+    types = snapshot_dictionary(root, "tx_type")
+    currencies = snapshot_dictionary(root, "currency")
+    statuses = snapshot_dictionary(root, "status")
+    return [SimpleNamespace(tx_type=types[cols["tx_type"][i]], amount=float(cols["amount"][i]),
+                            currency=currencies[cols["currency"][i]], receiver=cols["receiver"][i].decode(),
+                            status=statuses[cols["status"][i]]) for i in idx]
+
+def evaluate(snapshot_dir=None):
     ai = AgenticAI()
-    rows = load_ledger(200)
+    rows = load_ledger_snapshot(snapshot_dir, 200) if snapshot_dir else load_ledger(200)
     y_true=[]
     y_pred=[]
     for r in rows:
@@ -34,4 +53,5 @@ def evaluate():
     print("Precision",prec,"Recall",rec,"F1",f1)
 
 if __name__=="__main__":
-    evaluate()
+    # usage: python metrics_eval.py [snapshot_dir]
+    evaluate(sys.argv[1] if len(sys.argv) > 1 else None)
@@ -0,0 +1,105 @@
+import os
+import time
+from app.alert_dispatch import AlertChannel, AlertDispatcher
+from app.alerter import webhook_payload
+
+def _alert(i, level="SECURITY"):
+    return {"time": f"2024-01-01T00:00:{i:02d}Z", "level": level, "title": f"alert {i}", "message": "m", "metadata": {}}
+
+class Recorder:
+    def __init__(self, fail_times=0, delay=0.0):
+        self.batches = []
+        self.fail_times = fail_times
+        self.delay = delay
+        self.calls = 0
+    def __call__(self, alerts):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.calls <= self.fail_times:
+            raise RuntimeError("webhook down")
+        self.batches.append([a["title"] for a in alerts])
+
+def test_enqueue_returns_immediately_and_alerts_go_out_in_batches(tmp_path):
+    webhook, email = Recorder(delay=0.3), Recorder()
+    dispatcher = AlertDispatcher([AlertChannel("webhook", webhook),
+                                  AlertChannel("email", email, lambda a: a["level"] == "CRITICAL")],
+                                 spool_dir=str(tmp_path), batch_window_ms=100)
+    start = time.perf_counter()
+    for i in range(20):
+        dispatcher.enqueue(_alert(i, "CRITICAL" if i % 5 == 0 else "SECURITY"))
+    assert time.perf_counter() - start < 0.1  # a slow webhook no longer sits in the caller's path
+    assert dispatcher.flush()
+    assert webhook.batches == [[f"alert {i}" for i in range(20)]]
+    assert email.batches == [["alert 0", "alert 5", "alert 10", "alert 15"]]
+    dispatcher.close()
+
+def test_failures_are_retried_with_backoff(tmp_path):
+    webhook = Recorder(fail_times=2)
+    dispatcher = AlertDispatcher([AlertChannel("webhook", webhook)], spool_dir=str(tmp_path),
+                                 batch_window_ms=10, backoff_base_s=0.05, max_attempts=5)
+    delays = [dispatcher.backoff(n) for n in (1, 2, 3)]
+    assert 0.025 <= delays[0] <= 0.05 and 0.05 <= delays[1] <= 0.1 and 0.1 <= delays[2] <= 0.2
+    dispatcher.enqueue(_alert(1))
+    assert dispatcher.flush(include_retries=True)
+    deadline = time.time() + 2
+    while not webhook.batches and time.time() < deadline:
+        time.sleep(0.01)
+    assert webhook.calls == 3 and webhook.batches == [["alert 1"]]
+    assert dispatcher.stats()["retried"] == 2 and dispatcher.spooled() == []
+    dispatcher.close()
+
+def test_undelivered_alerts_are_spooled_and_replayed_after_a_restart(tmp_path):
+    down = Recorder(fail_times=100)
+    dispatcher = AlertDispatcher([AlertChannel("webhook", down)], spool_dir=str(tmp_path),
+                                 batch_window_ms=10, backoff_base_s=0.01, max_attempts=2)
+    dispatcher.enqueue(_alert(1))
+    deadline = time.time() + 2
+    while not dispatcher.spooled() and time.time() < deadline:
+        time.sleep(0.01)
+    assert down.calls == 2 and len(dispatcher.spooled()) == 1
+    # whatever is still queued or waiting for a retry at shutdown is spooled too
+    dispatcher.enqueue(_alert(2))
+    dispatcher.close()
+    assert len(dispatcher.spooled()) == 2
+
+    up = Recorder()
+    restarted = AlertDispatcher([AlertChannel("webhook", up)], spool_dir=str(tmp_path))
+    restarted.start()
+    deadline = time.time() + 2
+    while not up.batches and time.time() < deadline:
+        time.sleep(0.01)
+    assert up.batches == [["alert 1", "alert 2"]]  # spool files are merged into one batch
+    assert restarted.spooled() == [] and restarted.stats()["replayed"] == 2
+    restarted.close()
+
+def test_webhook_payload_carries_one_attachment_per_alert():
+    single = webhook_payload([_alert(1, "CRITICAL")])
+    assert single["text"] == "🚨 *[CRITICAL]* alert 1" and len(single["attachments"]) == 1
+    batch = webhook_payload([_alert(i) for i in range(3)])
+    assert batch["text"].startswith("🚨 *3 alerts* (SECURITY)") and len(batch["attachments"]) == 3
+
+def test_replay_stops_at_the_first_failure_and_merges_files(tmp_path):
+    down = Recorder(fail_times=100)
+    dispatcher = AlertDispatcher([AlertChannel("webhook", down)], spool_dir=str(tmp_path), max_batch=4)
+    for i in range(10):
+        dispatcher._spool_batch([_alert(i)], attempts=0)  # as from a full queue: one file per alert
+    assert dispatcher.replay_spool() == 0
+    assert down.calls == 1  # one failed send, not one per file
+    assert len(dispatcher.spooled()) == 7  # the failed batch of 4 rewritten as one file, 6 untouched
+
+    up = Recorder()
+    dispatcher.channels["webhook"] = AlertChannel("webhook", up)
+    assert dispatcher.replay_spool() == 10
+    assert [len(b) for b in up.batches] == [4, 4, 2] and dispatcher.spooled() == []
+    assert sorted(a for b in up.batches for a in b) == sorted(f"alert {i}" for i in range(10))
+
+def test_files_claimed_by_a_dead_process_are_replayed(tmp_path):
+    import subprocess
+    dead = subprocess.Popen(["true"])
+    dead.wait()
+    dispatcher = AlertDispatcher([AlertChannel("webhook", Recorder())], spool_dir=str(tmp_path))
+    dispatcher._spool_batch([_alert(1)], attempts=0)
+    name = dispatcher.spooled()[0]
+    os.rename(tmp_path / name, tmp_path / f".{name}.{dead.pid}.claimed")  # it crashed mid-send
+    assert dispatcher.spooled() == []
+    assert dispatcher.replay_spool() == 1 and os.listdir(tmp_path) == []
@@ -0,0 +1,78 @@
+import threading
+import pytest
+from sqlalchemy import create_engine, insert, select
+from app.models import init_db, accounts
+from app.balance_engine import debit, transfer, InsufficientFunds, AccountNotFound, BalanceConflict
+
+def _engine(tmp_path):
+    eng = create_engine(f"sqlite:///{tmp_path}/qff.db", connect_args={"check_same_thread": False})
+    init_db(eng)
+    with eng.begin() as conn:
+        conn.execute(insert(accounts), [
+            dict(id="payer", user_id="u1", account_type="BANK", currency="USD", balance="100.00"),
+            dict(id="merchant", user_id="u2", account_type="BANK", currency="USD", balance="0.00"),
+        ])
+    return eng
+
+def _account(eng, account_id):
+    with eng.connect() as conn:
+        return conn.execute(select(accounts).where(accounts.c.id == account_id)).one()
+
+def test_transfer_moves_both_balances_atomically(tmp_path):
+    eng = _engine(tmp_path)
+    with eng.begin() as conn:
+        moved = transfer(conn, "payer", "merchant", 2550)
+    assert moved == {"source_balance_minor": 7450, "dest_balance_minor": 2550}
+    payer, merchant = _account(eng, "payer"), _account(eng, "merchant")
+    assert (payer.balance_minor, payer.balance, payer.version) == (7450, "74.50", 1)
+    assert (merchant.balance_minor, merchant.balance, merchant.version) == (2550, "25.50", 1)
+
+    # an overdraft rolls back the whole transaction, credit included
+    with pytest.raises(InsufficientFunds):
+        with eng.begin() as conn:
+            transfer(conn, "payer", "merchant", 10 ** 6)
+    assert _account(eng, "merchant").balance_minor == 2550
+    with pytest.raises(AccountNotFound):
+        with eng.begin() as conn:
+            transfer(conn, "nobody", None, 1)
+
+def test_concurrent_debits_never_lose_updates(tmp_path):
+    eng = _engine(tmp_path)
+    errors = []
+
+    def worker():
+        for _ in range(20):
+            try:
+                with eng.begin() as conn:
+                    transfer(conn, "payer", "merchant", 1)
+            except BalanceConflict:
+                errors.append(1)
+
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    done = 160 - len(errors)
+    payer, merchant = _account(eng, "payer"), _account(eng, "merchant")
+    assert payer.balance_minor == 10000 - done
+    assert merchant.balance_minor == done
+    assert payer.version == done
+
+def test_debit_gives_up_after_bounded_retries(tmp_path, monkeypatch):
+    eng = _engine(tmp_path)
+    import app.balance_engine as be
+    monkeypatch.setattr(be, "_backoff", lambda attempt: None)
+    with eng.begin() as conn:
+        # every compare-and-swap misses: simulate a version that always moved
+        real_execute = conn.execute
+        def racing_execute(stmt, *a, **k):
+            result = real_execute(stmt, *a, **k)
+            if getattr(stmt, "is_select", False):
+                real_execute(accounts.update().where(accounts.c.id == "payer")
+                             .values(version=accounts.c.version + 1))
+            return result
+        conn.execute = racing_execute
+        with pytest.raises(BalanceConflict):
+            debit(conn, "payer", 1, max_retries=3)
@@ -0,0 +1,61 @@
+import asyncio
+import pytest
+import httpx
+from fastapi import FastAPI
+from app.concurrency import GradientLimit, AdaptiveLimiter, ConcurrencyLimitMiddleware, Overloaded
+
+def test_gradient_limit_follows_latency():
+    limit = GradientLimit(initial=10, min_limit=2, max_limit=100)
+    for _ in range(50):
+        limit.update(0.010, in_flight=int(limit.limit))
+    grown = limit.limit
+    assert grown > 20
+    # latency triples under contention: the limit comes back down
+    for _ in range(30):
+        limit.update(0.030, in_flight=int(limit.limit))
+    assert limit.limit < grown * 0.6
+    # requests far below the limit carry no signal
+    before = limit.limit
+    limit.update(0.001, in_flight=0)
+    assert limit.limit == before
+    limit.update(0.010, in_flight=5, dropped=True)
+    assert limit.limit == pytest.approx(before * 0.9)
+
+def test_limiter_queues_then_sheds():
+    async def scenario():
+        limiter = AdaptiveLimiter("t", GradientLimit(initial=1, min_limit=1, max_limit=1),
+                                  queue_size=1, queue_timeout_s=0.2)
+        await limiter.acquire()
+        queued = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        with pytest.raises(Overloaded) as exc:
+            await limiter.acquire()
+        assert exc.value.reason == "queue_full"
+        limiter.release(0.01)
+        await queued
+        assert limiter.stats() == {"limit": 1, "in_flight": 1, "queued": 0, "shed": 1}
+        with pytest.raises(Overloaded) as exc:
+            await limiter.acquire()
+        assert exc.value.reason == "queue_timeout" and limiter.stats()["queued"] == 0
+    asyncio.run(scenario())
+
+def test_middleware_returns_503_beyond_the_queue():
+    app = FastAPI()
+    limiter = AdaptiveLimiter("/slow", GradientLimit(initial=1, min_limit=1, max_limit=1),
+                              queue_size=1, queue_timeout_s=5)
+    app.add_middleware(ConcurrencyLimitMiddleware, limiters={"/slow": limiter})
+
+    @app.get("/slow")
+    async def slow():
+        await asyncio.sleep(0.1)
+        return {"ok": True}
+
+    async def burst():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://t") as client:
+            return await asyncio.gather(*(client.get("/slow") for _ in range(4)))
+
+    responses = asyncio.run(burst())
+    assert sorted(r.status_code for r in responses) == [200, 200, 503, 503]
+    shed = next(r for r in responses if r.status_code == 503)
+    assert shed.headers["Retry-After"] == "1" and shed.json()["errorCode"] == "OVERLOADED"
+    assert limiter.in_flight == 0
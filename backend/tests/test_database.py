@@ -0,0 +1,20 @@
+import pytest
+from unittest.mock import MagicMock, patch
+from app.database import async_url, get_db
+
+def test_async_url_maps_drivers():
+    assert async_url("sqlite:///./qff.db") == "sqlite+aiosqlite:///./qff.db"
+    assert async_url("postgresql://u:p@h/db") == "postgresql+asyncpg://u:p@h/db"
+
+@patch("app.database.SessionLocal")
+def test_get_db_rolls_back_and_closes_on_error(mock_session_cls):
+    mock_db = MagicMock()
+    mock_session_cls.return_value = mock_db
+
+    gen = get_db()
+    assert next(gen) is mock_db
+    with pytest.raises(RuntimeError):
+        gen.throw(RuntimeError("handler failed"))
+
+    mock_db.rollback.assert_called_once()
+    mock_db.close.assert_called_once()
@@ -0,0 +1,80 @@
+import pytest
+from cryptography.exceptions import InvalidTag
+from app.hsm_client import HSMClient
+from app.hsm_stub import HSMStubServer
+from app.envelope import DataKeyCache, EnvelopeEncryptor
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+    def __call__(self):
+        return self.now
+
+def _hsm():
+    hsm = HSMClient(mode="simulation")
+    hsm.generate_key("qff_master_key", "AES256", exportable=False)
+    hsm.calls.clear()
+    return hsm
+
+def test_one_data_key_serves_many_fields():
+    hsm = _hsm()
+    envelope = EnvelopeEncryptor(hsm)
+    records = [{"id": i, "amount": f"{i}.50", "receiver": f"acct-{i}"} for i in range(200)]
+    sealed = envelope.encrypt_many(records, ["amount", "receiver"])
+    assert sealed[0]["amount"] != "0.50" and sealed[0]["id"] == 0
+    assert envelope.decrypt_many(sealed, ["amount", "receiver"]) == records
+    # 400 field encryptions and decryptions, one HSM call
+    assert dict(hsm.calls) == {"generate_data_key": 1}
+
+    # a fresh reader unwraps the data key once for the whole batch
+    reader = EnvelopeEncryptor(hsm)
+    assert reader.decrypt_many(sealed, ["amount", "receiver"]) == records
+    assert hsm.calls["unwrap_data_key"] == 1
+
+def test_data_key_rotates_at_each_limit():
+    clock = Clock()
+    hsm = _hsm()
+    envelope = EnvelopeEncryptor(hsm, cache=DataKeyCache(max_age_s=60, max_messages=3, max_bytes=100, clock=clock))
+    for _ in range(3):
+        envelope.encrypt(b"x")
+    assert hsm.calls["generate_data_key"] == 1
+    envelope.encrypt(b"x")                      # 4th message
+    assert hsm.calls["generate_data_key"] == 2
+    envelope.encrypt(b"y" * 100)                # would pass 100 bytes under the current key
+    assert hsm.calls["generate_data_key"] == 3
+    clock.now = 61                              # too old
+    blob = envelope.encrypt(b"z")
+    assert hsm.calls["generate_data_key"] == 4
+    assert envelope.cache.stats()["rotations"] == 3
+    assert envelope.decrypt(blob) == b"z"
+
+def test_field_name_is_bound_and_tampering_fails():
+    envelope = EnvelopeEncryptor(_hsm())
+    token = envelope.encrypt_field("amount", "10.00")
+    assert envelope.decrypt_field("amount", token) == "10.00"
+    with pytest.raises(InvalidTag):
+        envelope.decrypt_field("receiver", token)
+    blob = bytearray(envelope.encrypt(b"payload"))
+    blob[-1] ^= 1
+    with pytest.raises(InvalidTag):
+        envelope.decrypt(bytes(blob))
+
+def test_envelope_against_the_stub_server():
+    server = HSMStubServer(("127.0.0.1", 0))
+    server.start()
+    try:
+        hsm = HSMClient(mode="stub", address=server.address)
+        ciphertext, iv = hsm.encrypt("qff_master_key", b"direct")
+        assert hsm.decrypt("qff_master_key", ciphertext, iv) == b"direct"
+        assert hsm.verify("qff_tx_signing_key", b"data", hsm.sign("qff_tx_signing_key", b"data"))
+        with pytest.raises(ValueError):
+            hsm.encrypt("no_such_key", b"x")
+
+        envelope = EnvelopeEncryptor(hsm)
+        tokens = [envelope.encrypt_field("amount", str(i)) for i in range(50)]
+        assert [envelope.decrypt_field("amount", t) for t in tokens] == [str(i) for i in range(50)]
+        assert hsm.calls["generate_data_key"] == 1
+        assert server.hsm.calls["generate_data_key"] == 1
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,73 @@
+import time
+import threading
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import create_engine, insert, select, func
+from sqlalchemy.exc import IntegrityError
+from app.database import make_writer_engine
+from app.models import metadata, ledger
+from app.group_commit import GroupCommitWriter
+
+def _row(tx_id):
+    return dict(id=tx_id, tx_type="BANK_TRANSFER", amount="1", currency="USD", receiver="r")
+
+def _count(url):
+    with create_engine(url).connect() as conn:
+        return conn.execute(select(func.count()).select_from(ledger)).scalar()
+
+def test_concurrent_submits_share_transactions(tmp_path):
+    url = f"sqlite:///{tmp_path}/qff.db"
+    metadata.create_all(create_engine(url))
+    writer = GroupCommitWriter(make_writer_engine(url), window_ms=20)
+
+    def write(i):
+        return writer.execute(lambda conn: conn.execute(insert(ledger).values(**_row(f"TX-{i}"))).rowcount)
+
+    with ThreadPoolExecutor(32) as pool:
+        assert list(pool.map(write, range(200))) == [1] * 200
+    writer.stop()
+
+    assert _count(url) == 200
+    assert writer.units == 200
+    assert writer.batches < 200
+
+def test_failed_unit_does_not_abort_batch(tmp_path):
+    url = f"sqlite:///{tmp_path}/qff.db"
+    metadata.create_all(create_engine(url))
+    writer = GroupCommitWriter(make_writer_engine(url), window_ms=50)
+
+    ok = writer.submit(lambda conn: conn.execute(insert(ledger).values(**_row("TX-1"))))
+    dup = writer.submit(lambda conn: conn.execute(insert(ledger).values(**_row("TX-1"))))
+    ok2 = writer.submit(lambda conn: conn.execute(insert(ledger).values(**_row("TX-2"))))
+
+    ok.result(5); ok2.result(5)
+    with pytest.raises(IntegrityError):
+        dup.result(5)
+    writer.stop()
+    assert _count(url) == 2
+
+def test_timeout_withdraws_only_units_the_writer_has_not_reached(tmp_path):
+    url = f"sqlite:///{tmp_path}/qff.db"
+    metadata.create_all(create_engine(url))
+    writer = GroupCommitWriter(make_writer_engine(url), window_ms=1)
+    started, release = threading.Event(), threading.Event()
+
+    def slow(conn):
+        started.set()
+        release.wait(5)
+        conn.execute(insert(ledger).values(**_row("TX-slow")))
+        return "committed"
+
+    with ThreadPoolExecutor(1) as pool:
+        running = pool.submit(writer.execute, slow, 0.05)
+        started.wait(5)
+        # queued behind the stuck batch: withdrawn on timeout and never run
+        with pytest.raises(TimeoutError):
+            writer.execute(lambda conn: conn.execute(insert(ledger).values(**_row("TX-queued"))), 0.05)
+        time.sleep(0.1)
+        release.set()
+        # in a batch when its caller's timeout passed: the caller still gets the commit
+        assert running.result(5) == "committed"
+    writer.stop()
+    with create_engine(url).connect() as conn:
+        assert [r.id for r in conn.execute(select(ledger.c.id))] == ["TX-slow"]
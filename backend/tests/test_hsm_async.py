@@ -0,0 +1,67 @@
+import asyncio
+import pytest
+from app.hsm_stub import HSMStubServer
+from app.hsm_async import AsyncHSMClient, HSMTransport, LocalTransport, SocketTransport
+
+class CountingTransport(HSMTransport):
+    def __init__(self, inner):
+        self.inner = inner
+        self.sent = []
+    async def send(self, request):
+        self.sent.append(request["op"])
+        return await self.inner.send(request)
+
+def test_every_operation_over_the_local_transport():
+    async def run():
+        hsm = AsyncHSMClient(LocalTransport(), batch_window_ms=0)
+        ciphertext, iv = await hsm.encrypt("qff_master_key", b"secret")
+        assert await hsm.decrypt("qff_master_key", ciphertext, iv) == b"secret"
+        signature = await hsm.sign("qff_tx_signing_key", b"tx")
+        assert await hsm.verify("qff_tx_signing_key", b"tx", signature)
+        assert not await hsm.verify("qff_tx_signing_key", b"other", signature)
+        plaintext, wrapped = await hsm.generate_data_key("qff_master_key")
+        assert await hsm.unwrap_data_key("qff_master_key", wrapped) == plaintext
+        assert (await hsm.generate_key("user_key"))["key_id"] == "user_key"
+        with pytest.raises(ValueError):
+            await hsm.encrypt("no_such_key", b"x")
+    asyncio.run(run())
+
+def test_concurrent_signs_are_coalesced_into_batches():
+    async def run():
+        transport = CountingTransport(LocalTransport())
+        hsm = AsyncHSMClient(transport, batch_window_ms=20, max_batch=32)
+        payloads = [f"tx-{i}".encode() for i in range(50)]
+        signatures = await asyncio.gather(*(hsm.sign("qff_tx_signing_key", p) for p in payloads))
+        # 32 fill a batch at once, the other 18 go when the window closes
+        assert transport.sent == ["batch", "batch"]
+        assert hsm.stats()["mean_batch_size"] == 25
+        # each caller got its own result, and errors stay with their caller
+        results = await asyncio.gather(*(hsm.verify("qff_tx_signing_key", p, s) for p, s in zip(payloads, signatures)),
+                                       hsm.sign("no_such_key", b"x"), return_exceptions=True)
+        assert results[:-1] == [True] * 50
+        assert isinstance(results[-1], ValueError)
+    asyncio.run(run())
+
+def test_socket_pool_limits_sessions_against_the_stub():
+    server = HSMStubServer(("127.0.0.1", 0), latency_ms=5)
+    server.start()
+
+    async def run():
+        transport = SocketTransport(server.address, pool_size=2)
+        hsm = AsyncHSMClient(transport, batch_window_ms=0)
+        sealed = await asyncio.gather(*(hsm.encrypt("qff_master_key", bytes([i])) for i in range(10)))
+        assert transport.opened == 2
+        opened = await asyncio.gather(*(hsm.decrypt("qff_master_key", c, iv) for c, iv in sealed))
+        assert opened == [bytes([i]) for i in range(10)]
+        assert transport.opened == 2 and server.requests == 20
+
+        batched = AsyncHSMClient(transport, batch_window_ms=5)
+        await asyncio.gather(*(batched.sign("qff_tx_signing_key", bytes([i])) for i in range(10)))
+        assert server.requests == 21
+        await hsm.close()
+
+    try:
+        asyncio.run(run())
+    finally:
+        server.shutdown()
+        server.server_close()
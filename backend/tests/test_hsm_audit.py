@@ -0,0 +1,74 @@
+import os
+import json
+from app.hsm_audit import AuditLog
+from app.hsm_client import HSMClient
+
+def _record(i):
+    return {"timestamp": f"t{i}", "action": "SIGN", "details": f"op {i}", "mode": "simulation"}
+
+def test_ring_is_bounded_and_tail_reads_through_to_segments(tmp_path):
+    audit = AuditLog(str(tmp_path), capacity=5, flush_ms=10, segment_bytes=1024)
+    for i in range(40):
+        audit.append(_record(i))
+        if i % 10 == 9:
+            assert audit.flush()  # segments rotate between batches
+    assert len(audit.ring) == 5
+    assert audit.stats()["persisted"] == 40
+    assert len(audit.segments()) > 1  # rotated
+
+    assert [r["details"] for r in audit.tail(3)] == ["op 37", "op 38", "op 39"]
+    tail = audit.tail(25)
+    assert [r["details"] for r in tail] == [f"op {i}" for i in range(15, 40)]
+    assert [r["seq"] for r in tail] == list(range(16, 41))
+    assert len(audit.tail(100)) == 40
+    audit.close()
+
+def test_chain_continues_across_restarts_and_detects_tampering(tmp_path):
+    first = AuditLog(str(tmp_path), flush_ms=10, segment_bytes=512)
+    for i in range(10):
+        first.append(_record(i))
+    first.close()
+    second = AuditLog(str(tmp_path), flush_ms=10, segment_bytes=512)
+    for i in range(10, 20):
+        second.append(_record(i))
+    second.flush()
+    assert second.verify_chain() == (True, 20, None)
+    assert second.tail(1)[0]["seq"] == 20
+
+    # rewrite one persisted record: the chain breaks there
+    path = second.segments()[0]
+    lines = open(path).read().splitlines()
+    record = json.loads(lines[1])
+    record["details"] = "nothing to see"
+    lines[1] = json.dumps(record, sort_keys=True, separators=(",", ":"))
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    assert second.verify_chain() == (False, 1, 2)
+    second.close()
+
+def test_memory_only_log_and_verify_logs_once():
+    hsm = HSMClient(mode="simulation", audit=AuditLog(capacity=3))
+    hsm.generate_key("k", "AES256")
+    signature = hsm.sign("k", b"data")
+    assert hsm.verify("k", b"data", signature)
+    actions = [r["action"] for r in hsm.get_audit_log(10)]
+    assert actions == ["KEY_GENERATE", "SIGN", "VERIFY"]  # HSM_INIT pushed out of the ring
+    assert hsm.calls["sign"] == 1 and hsm.calls["verify"] == 1
+    assert hsm.audit.segments() == [] and not os.path.exists("hsm_audit")
+
+def test_dropped_records_leave_a_chained_marker(tmp_path, monkeypatch):
+    audit = AuditLog(str(tmp_path), max_pending=2, flush_ms=10)
+    # a writer that never catches up: nothing drains, and the caller's wait times out at once
+    audit._writer = object()
+    monkeypatch.setattr(audit._cond, "wait_for", lambda predicate, timeout=None: predicate())
+    for i in range(5):
+        audit.append(_record(i))
+    assert audit.dropped == 3
+    monkeypatch.undo()
+    audit._start()
+    assert audit.flush()
+    records = [json.loads(line) for path in audit.segments() for line in open(path)]
+    assert [r["action"] for r in records] == ["AUDIT_DROPPED", "SIGN", "SIGN"]
+    assert records[0]["dropped"] == 3 and [r["details"] for r in records[1:]] == ["op 3", "op 4"]
+    assert audit.verify_chain() == (True, 3, None)
+    audit.close()
@@ -0,0 +1,106 @@
+import os
+import sqlite3
+import pytest
+from cryptography.exceptions import InvalidTag
+from app.hsm_keystore import KeyStore, load_kek
+from app.hsm_client import HSMClient
+
+def _key(i):
+    return {"key_id": f"user-{i}", "key_type": "AES256", "material": os.urandom(32).hex()}
+
+def test_hot_set_is_bounded_and_keys_survive_reopening(tmp_path):
+    path = str(tmp_path / "keys.db")
+    kek = os.urandom(32)
+    store = KeyStore(path, hot_keys=2, kek=kek)
+    keys = [_key(i) for i in range(5)]
+    store.put_many((k["key_id"], k) for k in keys)
+    assert len(store) == 5 and store.stats()["hot"] == 2
+    assert store["user-0"]["material"] == keys[0]["material"]  # cold: read and unsealed
+    assert store["user-0"]["material"] == keys[0]["material"]  # now hot
+    assert (store.hits, store.misses) == (1, 1)
+    assert "user-4" in store and "user-9" not in store
+    with pytest.raises(KeyError):
+        store["user-9"]
+    store.close()
+
+    reopened = KeyStore(path, kek=kek)
+    assert [reopened[f"user-{i}"]["material"] for i in range(5)] == [k["material"] for k in keys]
+    assert [k["key_id"] for k in reopened.values()] == [f"user-{i}" for i in range(5)]
+
+def test_material_is_sealed_on_disk_and_bound_to_its_key_id(tmp_path):
+    path = str(tmp_path / "keys.db")
+    store = KeyStore(path, hot_keys=0)
+    first, second = _key(1), _key(2)
+    store["user-1"], store["user-2"] = first, second
+    store.close()
+    with open(path, "rb") as f:
+        raw = f.read()
+    for name in os.listdir(tmp_path):
+        if name.endswith("-wal"):
+            raw += open(tmp_path / name, "rb").read()
+    assert bytes.fromhex(first["material"]) not in raw and first["material"].encode() not in raw
+
+    # moving one key's sealed material onto another row does not unseal
+    db = sqlite3.connect(path)
+    db.execute("UPDATE hsm_keys SET material = (SELECT material FROM hsm_keys WHERE key_id = 'user-1') "
+               "WHERE key_id = 'user-2'")
+    db.commit()
+    db.close()
+    with pytest.raises(InvalidTag):
+        KeyStore(path, hot_keys=0)["user-2"]
+    # the key file was created once and is reused
+    assert load_kek(path) == load_kek(path)
+    assert oct(os.stat(path + ".kek").st_mode & 0o777) == "0o600"
+
+def test_hsm_keys_persist_and_rotate_and_delete_in_place(tmp_path):
+    path = str(tmp_path / "keys.db")
+    hsm = HSMClient(mode="simulation", key_store=KeyStore(path, hot_keys=10))
+    hsm.generate_key("user-1", "AES256")
+    ciphertext, iv = hsm.encrypt("user-1", b"balance")
+
+    restarted = HSMClient(mode="simulation", key_store=KeyStore(path, hot_keys=10))
+    assert restarted.decrypt("user-1", ciphertext, iv) == b"balance"
+    restarted.rotate_key("user-1", "user-1-v2")
+    assert restarted.get_key_metadata("user-1")["successor"] == "user-1-v2"
+    assert restarted.decrypt("user-1", ciphertext, iv) == b"balance"  # deprecated keys still decrypt
+
+    assert restarted.delete_key("user-1") and not restarted.delete_key("nope")
+    with pytest.raises(ValueError):
+        restarted.decrypt("user-1", ciphertext, iv)
+    assert [k["key_id"] for k in restarted.list_keys()] == ["user-1-v2"]
+    db = sqlite3.connect(path)
+    assert db.execute("SELECT material FROM hsm_keys WHERE key_id = 'user-1'").fetchone() == (None,)
+
+def test_workers_sharing_a_keystore_agree_on_keys_and_see_each_others_deletes(tmp_path):
+    path = str(tmp_path / "keys.db")
+    kek = os.urandom(32)
+    worker_a = HSMClient(mode="simulation", key_store=KeyStore(path, kek=kek))
+    worker_b = HSMClient(mode="simulation", key_store=KeyStore(path, kek=kek))
+    # both start up and create the default key: one material wins, and both use it
+    worker_a.ensure_key("qff_master_key")
+    worker_b.ensure_key("qff_master_key")
+    ciphertext, iv = worker_a.encrypt("qff_master_key", b"balance")
+    assert worker_b.decrypt("qff_master_key", ciphertext, iv) == b"balance"
+    # the race itself: both saw no key and both add one
+    first, second = _key(7), _key(7)
+    assert worker_a.key_store.add("user-7", first)["material"] == first["material"]
+    assert worker_b.key_store.add("user-7", second)["material"] == first["material"]
+
+    worker_b.rotate_key("qff_master_key", "qff_master_key-v2")
+    assert worker_a.get_key_metadata("qff_master_key")["status"] == "DEPRECATED"
+    worker_b.delete_key("qff_master_key")
+    with pytest.raises(ValueError):
+        worker_a.decrypt("qff_master_key", ciphertext, iv)  # was hot in worker A
+    assert worker_a.key_store.invalidations >= 1
+
+def test_kek_file_is_created_once_under_concurrent_first_use(tmp_path):
+    import threading
+    path = str(tmp_path / "keys.db")
+    keks = []
+    threads = [threading.Thread(target=lambda: keks.append(load_kek(path))) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(set(keks)) == 1 and len(keks[0]) == 32
+    assert os.listdir(tmp_path) == ["keys.db.kek"]
@@ -0,0 +1,119 @@
+import os
+import shutil
+from datetime import datetime
+from sqlalchemy import create_engine, insert, select, func
+from app.models import init_db, ledger, ledger_archive_index
+from app.ledger_archive import LedgerArchive
+from app.ledger_export import export_stream
+
+NOW = datetime(2026, 10, 19)
+
+def _setup(tmp_path):
+    eng = create_engine(f"sqlite:///{tmp_path}/qff.db")
+    init_db(eng)
+    with eng.begin() as conn:
+        for i, (y, m) in enumerate([(2024, 1), (2024, 1), (2024, 2), (2025, 6), (2026, 10)]):
+            conn.execute(insert(ledger).values(id=f"TX-{i}", user_id="u", tx_type="BANK_TRANSFER", amount="1.5",
+                                               currency="USD", receiver="r", status="COMPLETED", meta={"n": i},
+                                               timestamp=datetime(y, m, 3, 12, 0, 0)))
+    return eng, LedgerArchive(f"{tmp_path}/archive", eng, retention_months=12)
+
+def test_archive_moves_cold_months_and_keeps_them_queryable(tmp_path):
+    eng, archive = _setup(tmp_path)
+    assert archive.cutoff(NOW) == datetime(2025, 10, 1)
+    moved = archive.run(NOW)
+    assert [(m["partition"], m["moved"]) for m in moved] == [("2024-01", 2), ("2024-02", 1), ("2025-06", 1)]
+
+    with eng.connect() as conn:
+        assert conn.execute(select(ledger.c.id)).scalars().all() == ["TX-4"]
+        assert conn.execute(select(func.count()).select_from(ledger_archive_index)).scalar() == 4
+
+    row = archive.find("TX-1")
+    assert row.timestamp == datetime(2024, 1, 3, 12, 0, 0)
+    assert row.amount_minor == 150 and dict(row.meta) == {"n": 1}
+    assert archive.find("TX-4") is None
+
+    # a second pass is a no-op; the export prunes partitions by timestamp
+    assert archive.run(NOW) == []
+    lines = b"".join(export_stream("ndjson", db_engine=eng, archive=archive, start=datetime(2024, 2, 1))).splitlines()
+    assert [l.split(b'"')[3] for l in lines] == [b"TX-2", b"TX-3", b"TX-4"]
+
+def test_late_rows_merge_into_existing_partition(tmp_path):
+    eng, archive = _setup(tmp_path)
+    archive.run(NOW)
+    with eng.begin() as conn:
+        conn.execute(insert(ledger).values(id="TX-9", tx_type="BANK_TRANSFER", amount="2", currency="USD",
+                                           receiver="r", status="COMPLETED", timestamp=datetime(2024, 1, 20)))
+    archive.run(NOW)
+    assert archive.manifest["partitions"]["2024-01"]["rows"] == 3
+    assert archive.find("TX-0") is not None and archive.find("TX-9") is not None
+
+    # a lost manifest is rebuilt from the partition files
+    shutil.copytree(f"{tmp_path}/archive", f"{tmp_path}/archive-copy")
+    os.remove(f"{tmp_path}/archive-copy/manifest.json")
+    reopened = LedgerArchive(f"{tmp_path}/archive-copy", eng)
+    reopened.run(NOW)
+    assert reopened.archived_rows() == 5
+
+def test_rows_stream_in_batches_and_a_row_landing_mid_pass_stays_hot(tmp_path):
+    eng, archive = _setup(tmp_path)
+    archive.batch_rows = 1
+    publish = archive._publish_partition
+
+    def publish_then_insert(key, work):
+        entry = publish(key, work)
+        if key == "2024-01":
+            # lands inside the first batch's key range after the partition was written
+            with eng.begin() as conn:
+                conn.execute(insert(ledger).values(id="TX-00", tx_type="BANK_TRANSFER", amount="3", currency="USD",
+                                                   receiver="r", status="COMPLETED",
+                                                   timestamp=datetime(2024, 1, 3, 12, 0, 0)))
+        return entry
+
+    archive._publish_partition = publish_then_insert
+    moved = archive.run(NOW)
+    assert [(m["partition"], m["moved"]) for m in moved] == [("2024-01", 2), ("2024-02", 1), ("2025-06", 1)]
+    with eng.connect() as conn:
+        assert sorted(conn.execute(select(ledger.c.id)).scalars()) == ["TX-00", "TX-4"]
+        assert conn.execute(select(func.count()).select_from(ledger_archive_index)).scalar() == 4
+
+    archive._publish_partition = publish
+    assert [m["moved"] for m in archive.run(NOW)] == [1]
+    assert archive.find("TX-00") is not None and archive.manifest["partitions"]["2024-01"]["rows"] == 3
+    assert not [n for n in os.listdir(f"{tmp_path}/archive") if n.endswith(".tmp")]
+
+def test_workers_sharing_a_root_archive_each_month_once(tmp_path):
+    import threading
+    eng, _ = _setup(tmp_path)
+    workers = [LedgerArchive(f"{tmp_path}/archive", eng, retention_months=12) for _ in range(3)]
+    results = []
+    threads = [threading.Thread(target=lambda w=w: results.append(w.run(NOW))) for w in workers]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sum(m["moved"] for r in results for m in r) == 4
+    # a worker that did not archive sees the others' partitions
+    assert all(w.archived_rows() == 4 for w in workers)
+    assert all(w.find("TX-0") is not None for w in workers)
+
+def test_every_shard_is_archived_and_read_back_in_order(tmp_path, monkeypatch):
+    import app.sharding
+    from app.ledger_archive import ShardedLedgerArchive
+    from app.sharding import ShardSet
+    engines = [create_engine(f"sqlite:///{tmp_path}/shard{i}.db") for i in range(2)]
+    for i, eng in enumerate(engines):
+        init_db(eng)
+        with eng.begin() as conn:
+            for d in (1, 2):
+                conn.execute(insert(ledger).values(id=f"TX-{i}-{d}", user_id="u", tx_type="BANK_TRANSFER", amount="1",
+                                                   currency="USD", receiver="r", status="COMPLETED",
+                                                   timestamp=datetime(2024, 1, 2 * d + i, 12)))
+    monkeypatch.setattr(app.sharding, "shards", ShardSet(engines))
+    archive = ShardedLedgerArchive(f"{tmp_path}/archive")
+
+    assert [(m["shard"], m["partition"], m["moved"]) for m in archive.run(NOW)] == [(0, "2024-01", 2), (1, "2024-01", 2)]
+    assert archive.archived_rows() == 4 and os.path.isdir(f"{tmp_path}/archive/shard1")
+    assert archive.find("TX-1-2").timestamp == datetime(2024, 1, 5, 12)
+    lines = b"".join(export_stream("ndjson", db_engine=engines[0], archive=archive)).splitlines()
+    assert [l.split(b'"')[3] for l in lines] == [b"TX-0-1", b"TX-1-1", b"TX-0-2", b"TX-1-2"]
@@ -0,0 +1,35 @@
+import csv
+import gzip
+import io
+import json
+from datetime import datetime
+from sqlalchemy import create_engine, insert
+from app.models import metadata, ledger
+from app.ledger_export import export_stream
+
+def _engine(tmp_path, n=25):
+    eng = create_engine(f"sqlite:///{tmp_path}/ledger.db")
+    metadata.create_all(eng)
+    with eng.begin() as conn:
+        for i in range(n):
+            conn.execute(insert(ledger).values(
+                id=f"TX-{i:03d}", user_id=f"user-{i % 2}", tx_type="BANK_TRANSFER", amount=str(i),
+                currency="USD", receiver="r", status="COMPLETED" if i % 5 else "FAILED",
+                timestamp=datetime(2026, 1, 1 + i // 10)
+            ))
+    return eng
+
+def test_ndjson_export_filters(tmp_path):
+    eng = _engine(tmp_path)
+    body = b"".join(export_stream("ndjson", db_engine=eng, user_id="user-0", status="COMPLETED",
+                                  start=datetime(2026, 1, 1), end=datetime(2026, 1, 2)))
+    rows = [json.loads(line) for line in body.decode().splitlines()]
+    assert [r["id"] for r in rows] == ["TX-002", "TX-004", "TX-006", "TX-008"]
+
+def test_gzip_csv_export_round_trips(tmp_path):
+    eng = _engine(tmp_path)
+    chunks = list(export_stream("csv", compress=True, db_engine=eng))
+    reader = csv.DictReader(io.StringIO(gzip.decompress(b"".join(chunks)).decode()))
+    rows = list(reader)
+    assert len(rows) == 25
+    assert rows[0]["id"] == "TX-000" and rows[-1]["id"] == "TX-024"
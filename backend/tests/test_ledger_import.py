@@ -0,0 +1,49 @@
+import io
+import gzip
+import json
+from sqlalchemy import create_engine, select
+from app.models import init_db, ledger
+from app.sharding import ShardSet
+from app.pagination import timestamp_key
+from app.immutable_ledger import immutable_ledger
+from app.ledger_import import import_stream, validate_chunk
+
+def _record(i, **overrides):
+    record = {"id": f"H-{i}", "user_id": "user-1", "tx_type": "BANK_TRANSFER", "amount": "10.05",
+              "currency": "USD", "receiver": f"r{i}", "timestamp": f"2023-01-01T00:00:{i:02d}Z"}
+    record.update(overrides)
+    return record
+
+def test_validate_chunk_rejects_with_first_failed_check():
+    records = [_record(0), _record(1, amount="-5"), _record(2, currency="XYZ"), _record(3, timestamp="yesterday"),
+               _record(0), _record(5, receiver=""), _record(6, risk_score="101"), _record(7, amount="0.1", currency="BTC")]
+    rows, rejects = validate_chunk(records, existing_ids={"H-7"})
+    assert [r["id"] for r in rows] == ["H-0"]
+    assert rows[0]["amount_minor"] == 1005 and rows[0]["status"] == "COMPLETED"
+    assert dict(rejects) == {1: "invalid amount", 2: "unknown currency", 3: "invalid timestamp",
+                             4: "duplicate id in file", 5: "missing receiver", 6: "invalid risk_score",
+                             7: "id already in ledger"}
+
+def test_import_ndjson_and_gzipped_csv_then_link_chain(tmp_path):
+    eng = create_engine(f"sqlite:///{tmp_path}/qff.db", connect_args={"check_same_thread": False})
+    init_db(eng)
+    shards = ShardSet([eng])
+
+    body = "\n".join(json.dumps(_record(i)) for i in range(25)) + "\nnot json\n" + json.dumps(_record(3)) + "\n"
+    report = import_stream(io.BytesIO(body.encode()), "ndjson", chunk_rows=10, shard_set=shards)
+    assert (report["imported"], report["rejected"], report["chain_linked"]) == (25, 2, 25)
+    assert report["rejections"] == [{"line": 26, "reason": "invalid JSON"}, {"line": 27, "reason": "id already in ledger"}]
+
+    csv_body = 'id,tx_type,amount,currency,receiver,timestamp,meta\nC-1,CARD_PAYMENT,12.5,EUR,r,2023-02-01 10:00:00,"{""k"": 1}"\n'
+    report = import_stream(io.BytesIO(gzip.compress(csv_body.encode())), "csv", shard_set=shards)
+    assert report["imported"] == 1
+
+    # every imported row is linked to its predecessor in (timestamp, id) order
+    ts_key = timestamp_key(ledger.c.timestamp, "sqlite")
+    with eng.connect() as conn:
+        rows = conn.execute(select(ledger).order_by(ts_key, ledger.c.id)).fetchall()
+    previous = immutable_ledger.GENESIS_HASH
+    for r in rows:
+        previous = immutable_ledger.link_hash(r, previous)
+        assert r.fingerprint == previous
+    assert rows[-1].meta.to_dict() == {"k": 1}
@@ -0,0 +1,51 @@
+import zlib
+from sqlalchemy import create_engine, insert, select, text
+from app.models import init_db, ledger
+from app.meta_codec import encode_meta, decode_meta, LazyMeta, META_DICTIONARY, FLAG_ZLIB
+
+def _meta():
+    return {"enc": "PQC::REDACTED::eyJhbW91bnQiOiAxMjUuNSwgImN1cnJlbmN5IjogIlVTRCIsICJ0eXBlIjogIkNBUkRfUEFZTUVO",
+            "exec": {"success": True, "backend_ref": "CARD-1a2b3c4d5e", "fees": {"flat": "0.00"}, "rail": "CARD"}}
+
+def test_round_trip_and_compression():
+    small = encode_meta({"note": "Coffee payment"})
+    assert small[:3] == b"QM\x01" and not small[3] & FLAG_ZLIB
+    assert decode_meta(small) == {"note": "Coffee payment"}
+
+    big = encode_meta(_meta())
+    assert big[3] & FLAG_ZLIB
+    assert len(big) < len(str(_meta())) / 3
+    assert decode_meta(big) == _meta()
+
+def test_dictionary_is_frozen():
+    # existing rows depend on these exact bytes; bump META_VERSION instead of editing
+    assert zlib.crc32(META_DICTIONARY) == 0x8d57b0a5
+
+def test_legacy_text_rows_decode_and_migrate(tmp_path):
+    assert decode_meta(str(_meta())) == _meta()
+    assert decode_meta('{"note": "x"}') == {"note": "x"}
+    assert decode_meta("not structured") == {"raw": "not structured"}
+
+    eng = create_engine(f"sqlite:///{tmp_path}/qff.db")
+    init_db(eng)
+    with eng.begin() as conn:
+        conn.execute(insert(ledger).values(id="TX-1", tx_type="CARD_PAYMENT", amount="1", currency="USD",
+                                           receiver="r", status="COMPLETED", meta=_meta()))
+        conn.execute(text("INSERT INTO ledger (id, tx_type, amount, currency, receiver, status, meta) "
+                          "VALUES ('TX-0', 'CARD_PAYMENT', '1', 'USD', 'r', 'COMPLETED', :m)"), {"m": str(_meta())})
+        from app.migrations import _m005_binary_meta
+        _m005_binary_meta(conn, batch_rows=1)
+
+    with eng.connect() as conn:
+        rows = conn.execute(select(ledger.c.id, ledger.c.meta).order_by(ledger.c.id)).fetchall()
+        raw = conn.execute(text("SELECT typeof(meta) FROM ledger")).scalars().all()
+    assert raw == ["blob", "blob"]
+    assert all(isinstance(r.meta, LazyMeta) and not r.meta._decoded for r in rows)
+    assert rows[0].meta["exec"]["rail"] == "CARD"
+    assert dict(rows[1].meta) == _meta()
+
+def test_pre_encoded_meta_is_bound_unchanged():
+    from app.meta_codec import MetaType
+    encoded = encode_meta(_meta())
+    assert MetaType().process_bind_param(encoded, None) is encoded
+    assert MetaType().process_bind_param(_meta(), None) == encoded
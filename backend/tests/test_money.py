@@ -0,0 +1,65 @@
+from decimal import Decimal
+import numpy as np
+import pytest
+from sqlalchemy import create_engine, insert, select, text
+from app.models import init_db, ledger, accounts
+from app.money import (to_minor, from_minor, format_minor, to_minor_array, from_minor_array,
+                       parse_amount_array, ledger_totals_stmt)
+
+def test_conversions_are_exact():
+    assert to_minor("1234.56", "USD") == 123456
+    assert to_minor("0.015", "USD") == 2          # banker's rounding
+    assert to_minor("0.025", "USD") == 2
+    assert to_minor("1500", "JPY") == 1500
+    assert to_minor("0.00000001", "BTC") == 1
+    assert from_minor(123456, "USD") == Decimal("1234.56")
+    assert format_minor(5, "USD") == "0.05"
+    assert format_minor(150000000, "BTC") == "1.50000000"
+    with pytest.raises(ValueError):
+        to_minor("abc", "USD")
+
+def test_vectorized_conversions_match_exact():
+    amounts = ["1234.56", "0.015", "0.025", "1500", "0.1", "999999999999999.99", "2.675"]
+    currencies = ["USD", "USD", "USD", "JPY", "BTC", "USD", "USD"]
+    minor = to_minor_array(amounts, currencies)
+    assert minor.tolist() == [to_minor(a, c) for a, c in zip(amounts, currencies)]
+    assert np.allclose(from_minor_array(minor[:1], ["USD"]), [1234.56])
+
+    values, valid = parse_amount_array(["1", "x", None, "2.5"])
+    assert valid.tolist() == [True, False, False, True]
+    assert values[3] == 2.5
+
+def test_minor_units_default_and_sql_totals(tmp_path):
+    eng = create_engine(f"sqlite:///{tmp_path}/qff.db")
+    init_db(eng)
+    with eng.begin() as conn:
+        conn.execute(insert(accounts).values(id="a1", user_id="u1", account_type="CHECKING",
+                                             currency="USD", balance="10.50"))
+        for i, (amount, currency) in enumerate([("0.10", "USD"), ("0.20", "USD"), ("100", "USD"), ("0.5", "BTC")]):
+            conn.execute(insert(ledger).values(id=f"TX-{i}", user_id="u1", tx_type="BANK_TRANSFER",
+                                               amount=amount, currency=currency, receiver="r", status="COMPLETED"))
+
+    with eng.connect() as conn:
+        assert conn.execute(select(accounts.c.balance_minor)).scalar() == 1050
+        totals = {r.currency: (r.count, r.total_minor) for r in conn.execute(ledger_totals_stmt(ledger))}
+        assert totals == {"USD": (3, 10030), "BTC": (1, 50000000)}
+        # float summation would give 0.30000000000000004 here
+        small = conn.execute(ledger_totals_stmt(ledger, currency="USD", status="COMPLETED")
+                             .where(ledger.c.amount_minor < 100)).one()
+        assert format_minor(small.total_minor, "USD") == "0.30"
+        big = conn.execute(ledger_totals_stmt(ledger, currency="USD", min_amount="1")).one()
+        assert big.count == 1
+        assert conn.execute(text("SELECT scale FROM currency_scales WHERE code = 'BTC'")).scalar() == 8
+
+def test_minor_unit_backfill_pages_past_unparseable_amounts(tmp_path):
+    from app.migrations import _backfill_minor_units
+    eng = create_engine(f"sqlite:///{tmp_path}/qff.db")
+    init_db(eng)
+    amounts = ["1.00", "oops", "2.50", "", "3", "abc", "0.01"]
+    with eng.begin() as conn:
+        for i, amount in enumerate(amounts):
+            conn.execute(insert(ledger).values(id=f"TX-{i}", tx_type="BANK_TRANSFER", amount=amount,
+                                               currency="USD", receiver="r", amount_minor=None))
+        _backfill_minor_units(conn, ledger, "id", "amount", "amount_minor", batch_rows=2)
+        minor = dict(conn.execute(select(ledger.c.id, ledger.c.amount_minor)).fetchall())
+    assert [minor[f"TX-{i}"] for i in range(len(amounts))] == [100, None, 250, None, 300, None, 1]
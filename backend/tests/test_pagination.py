@@ -0,0 +1,45 @@
+import pytest
+from datetime import datetime
+from fastapi import HTTPException
+from sqlalchemy import create_engine, insert, select, text
+from app.models import metadata, ledger, init_db
+from app.pagination import keyset_page, page_rows, decode_cursor
+
+def test_keyset_pages_cover_ledger_once(tmp_path):
+    eng = create_engine(f"sqlite:///{tmp_path}/ledger.db")
+    metadata.create_all(eng)
+    with eng.begin() as conn:
+        # ties on timestamp exercise the id tie-breaker
+        for i in range(25):
+            conn.execute(insert(ledger).values(
+                id=f"TX-{i:03d}", user_id="user-1", tx_type="BANK_TRANSFER", amount="1",
+                currency="USD", receiver="r", timestamp=datetime(2026, 1, 1, 10, i // 3)
+            ))
+
+    seen, cursor = [], None
+    with eng.connect() as conn:
+        while True:
+            stmt = keyset_page(select(ledger).where(ledger.c.user_id == "user-1"),
+                               ledger.c.timestamp, ledger.c.id, cursor, 10, "sqlite")
+            rows, cursor = page_rows(conn.execute(stmt).fetchall(), 10)
+            seen.extend(r.id for r in rows)
+            if not cursor:
+                break
+
+    assert seen == [f"TX-{i:03d}" for i in reversed(range(25))]
+
+def test_keyset_query_uses_index(tmp_path):
+    eng = create_engine(f"sqlite:///{tmp_path}/ledger.db")
+    init_db(eng)
+    stmt = keyset_page(select(ledger).where(ledger.c.user_id == "u"), ledger.c.timestamp, ledger.c.id,
+                       None, 10, "sqlite")
+    sql = str(stmt.compile(eng, compile_kwargs={"literal_binds": True}))
+    with eng.connect() as conn:
+        plan = " ".join(r[-1] for r in conn.execute(text("EXPLAIN QUERY PLAN " + sql)))
+    assert "ix_ledger_user_ts" in plan
+    assert "TEMP B-TREE" not in plan
+
+def test_invalid_cursor_rejected():
+    with pytest.raises(HTTPException) as exc:
+        decode_cursor("not-a-cursor")
+    assert exc.value.status_code == 400
@@ -0,0 +1,62 @@
+import time
+import pytest
+from fastapi import HTTPException
+from app.passwords import PasswordHasher, legacy_hash, cost_of, tune_rounds
+
+def test_hash_verify_and_long_passwords():
+    hasher = PasswordHasher(workers=0, rounds=4)
+    stored = hasher.hash("s3cret")
+    assert stored.startswith("$2b$04$") and hasher.verify("s3cret", stored) == (True, None)
+    assert hasher.verify("wrong", stored) == (False, None)
+    # past bcrypt's 72-byte limit the whole password still counts
+    long_stored = hasher.hash("x" * 100)
+    assert hasher.verify("x" * 100, long_stored)[0] and not hasher.verify("x" * 72, long_stored)[0]
+
+def test_legacy_and_weaker_hashes_are_upgraded_on_success():
+    hasher = PasswordHasher(workers=0, rounds=5)
+    ok, upgraded = hasher.verify("demo123", legacy_hash("demo123"))
+    assert ok and cost_of(upgraded) == 5 and hasher.verify("demo123", upgraded) == (True, None)
+    assert hasher.verify("nope", legacy_hash("demo123")) == (False, None)
+
+    weak = PasswordHasher(workers=0, rounds=4).hash("demo123")
+    ok, upgraded = hasher.verify("demo123", weak)
+    assert ok and cost_of(upgraded) == 5
+    assert hasher.rehashed == 2
+
+def test_pool_rejects_with_503_when_full():
+    hasher = PasswordHasher(workers=0, queue_limit=1, rounds=4)
+    running = [hasher._submit("verify", time.sleep, 0.3), hasher._submit("verify", time.sleep, 0.3)]
+    with pytest.raises(HTTPException) as exc:
+        hasher.hash("pw")
+    assert exc.value.status_code == 503 and exc.value.headers["Retry-After"] == "1"
+    for f in running:
+        f.result()
+    assert hasher.hash("pw").startswith("$2b$") and hasher.rejected == 1
+
+def test_process_pool_and_autotune():
+    hasher = PasswordHasher(workers=1, rounds=4)
+    try:
+        assert hasher.verify("pw", hasher.hash("pw")) == (True, None)
+    finally:
+        hasher.shutdown()
+    assert 10 <= tune_rounds(target_ms=1) <= tune_rounds(target_ms=10000) <= 16
+
+def test_first_async_hash_tunes_the_cost_off_the_event_loop(monkeypatch):
+    import asyncio
+    import app.passwords
+    monkeypatch.setattr(app.passwords, "tune_rounds", lambda target_ms: time.sleep(0.3) or 4)
+    hasher = PasswordHasher(workers=0, rounds="auto")
+
+    async def main():
+        ticks = []
+        async def ticker():
+            while len(ticks) < 20:
+                ticks.append(time.perf_counter())
+                await asyncio.sleep(0.01)
+        tick = asyncio.create_task(ticker())
+        stored = await hasher.hash_async("pw")
+        await tick
+        return stored, max(b - a for a, b in zip(ticks, ticks[1:]))
+
+    stored, longest_gap = asyncio.run(main())
+    assert cost_of(stored) == 4 and longest_gap < 0.2  # the loop kept running while the cost was measured
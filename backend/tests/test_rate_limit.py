@@ -0,0 +1,55 @@
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from app.rate_limit import SharedBuckets, RateLimiter, RateLimitMiddleware, parse_costs
+from app.security import create_access_token
+
+def test_gcra_burst_refill_and_all_or_nothing(tmp_path):
+    buckets = SharedBuckets(f"{tmp_path}/b.bin", slots=64)
+    # 2 tokens/s, burst 4: four unit requests pass at once, the fifth waits half a second
+    assert all(buckets.check([("k", 2, 4, 1)], now=100.0) is None for _ in range(4))
+    assert abs(buckets.check([("k", 2, 4, 1)], now=100.0) - 0.5) < 1e-9
+    assert buckets.check([("k", 2, 4, 1)], now=100.5) is None
+    # a cost-3 request needs 1.5 s of refill
+    assert abs(buckets.check([("k", 2, 4, 3)], now=100.5) - 1.5) < 1e-9
+
+    # a denial by one bucket charges none of them
+    assert buckets.check([("fresh", 2, 4, 1), ("k", 2, 4, 1)], now=100.5) is not None
+    assert all(buckets.check([("fresh", 2, 4, 1)], now=100.5) is None for _ in range(4))
+
+def test_buckets_are_shared_through_the_mapped_file(tmp_path):
+    worker_a = SharedBuckets(f"{tmp_path}/b.bin", slots=64)
+    worker_b = SharedBuckets(f"{tmp_path}/b.bin", slots=64)
+    assert worker_a.check([("ip:1.2.3.4", 1, 2, 2)], now=50.0) is None
+    assert worker_b.check([("ip:1.2.3.4", 1, 2, 1)], now=50.0) == 1.0
+
+def test_middleware_limits_listed_routes_per_user_and_ip(tmp_path):
+    limiter = RateLimiter(SharedBuckets(f"{tmp_path}/b.bin", slots=1024), costs=parse_costs("/pqc=5,/cheap=1"),
+                          user_limit=(1, 5), ip_limit=(100, 100), route_limit=(100, 100))
+    app = FastAPI()
+    app.add_middleware(RateLimitMiddleware, limiter=limiter)
+    for path in ("/pqc", "/cheap", "/free"):
+        app.add_api_route(path, lambda: {"ok": True})
+    client = TestClient(app)
+    alice = {"Authorization": f"Bearer {create_access_token({'sub': 'alice'})}"}
+    bob = {"Authorization": f"Bearer {create_access_token({'sub': 'bob'})}"}
+
+    assert client.get("/pqc", headers=alice).status_code == 200
+    limited = client.get("/cheap", headers=alice)
+    assert limited.status_code == 429 and limited.headers["Retry-After"] == "1"
+    assert limited.json()["errorCode"] == "RATE_LIMITED"
+    # other users are unaffected, and unlisted routes are never limited
+    assert client.get("/pqc", headers=bob).status_code == 200
+    assert all(client.get("/free", headers=alice).status_code == 200 for _ in range(20))
+
+def test_user_key_never_consults_the_revocation_list(monkeypatch):
+    from app.security import token_cache
+
+    class Unreachable:
+        def is_revoked(self, payload):
+            raise AssertionError("revocation lookup on the event loop")
+
+    monkeypatch.setattr(token_cache, "revocations", Unreachable())
+    token = create_access_token({"sub": "carol"})
+    scope = {"headers": [(b"authorization", f"Bearer {token}".encode())]}
+    assert RateLimiter.user_of(scope) == "carol"
+    assert RateLimiter.user_of({"headers": [(b"authorization", b"Bearer forged.token.value")]}) is None
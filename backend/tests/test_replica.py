@@ -0,0 +1,51 @@
+import sqlite3
+from sqlalchemy import create_engine
+from app.models import init_db
+from app.replica import ReplicaRouter
+
+def _refresh(primary_path, replica_path):
+    # a replica that is a periodically copied SQLite file
+    src, dst = sqlite3.connect(primary_path), sqlite3.connect(replica_path)
+    src.backup(dst)
+    src.close(); dst.close()
+
+def test_lag_and_read_your_writes_routing(tmp_path):
+    primary_path, replica_path = f"{tmp_path}/primary.db", f"{tmp_path}/replica.db"
+    primary, replica = create_engine(f"sqlite:///{primary_path}"), create_engine(f"sqlite:///{replica_path}")
+    init_db(primary)
+    router = ReplicaRouter(primary, replica, max_lag_s=60)
+    router.start = lambda: None  # drive the heartbeat by hand
+
+    # replica never refreshed: lag unknown, everything reads the primary
+    router.beat()
+    assert router.lag == float("inf")
+    assert not router.use_replica("u1")
+
+    _refresh(primary_path, replica_path)
+    router.beat()
+    assert router.lag < 60
+    assert router.use_replica("u1")
+
+    # u1 writes: pinned to the primary until the replica has a newer heartbeat
+    router.record_write("u1")
+    assert not router.use_replica("u1")
+    assert router.use_replica("u2")
+    _refresh(primary_path, replica_path)   # copies a heartbeat from before the write
+    router.beat()
+    assert not router.use_replica("u1")
+    _refresh(primary_path, replica_path)   # now includes a heartbeat stamped after it
+    router.beat()
+    assert router.use_replica("u1")
+
+    # a stale replica sends every read back to the primary
+    router.max_lag_s = 0
+    router.beat()
+    assert not router.use_replica("u2")
+
+def test_without_replica_reads_use_primary(tmp_path):
+    primary = create_engine(f"sqlite:///{tmp_path}/qff.db")
+    router = ReplicaRouter(primary, primary)
+    assert not router.enabled
+    router.record_write("u1")
+    assert not router.use_replica("u1")
+    assert router.status()["pinned_users"] == 0
@@ -0,0 +1,59 @@
+import time
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import create_engine, select
+from app.models import init_db, revoked_tokens
+from app.revocation import BloomFilter, RevocationList
+from app.security import TokenCache, create_access_token, decode_token
+
+def _lists(tmp_path, n=2):
+    eng = create_engine(f"sqlite:///{tmp_path}/qff.db", connect_args={"check_same_thread": False})
+    init_db(eng)
+    # one list per "worker", sharing the database and the snapshot file
+    return eng, [RevocationList(eng, snapshot_path=f"{tmp_path}/rev/filters.bloom", bits=1 << 16, refresh_s=0)
+                 for _ in range(n)]
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = BloomFilter(bits=1 << 16, hashes=7)
+    keys = [f"jti-{i}" for i in range(2000)]
+    for k in keys:
+        bloom.add(k)
+    assert all(k in bloom for k in keys)
+    assert sum(f"other-{i}" in bloom for i in range(10000)) < 200
+
+def test_revoked_token_is_seen_by_other_workers(tmp_path):
+    eng, (a, b) = _lists(tmp_path)
+    token = decode_token(create_access_token({"sub": "u1"}))
+    other = decode_token(create_access_token({"sub": "u1"}))
+    assert not a.is_revoked(token) and a.lookups == 0
+
+    a.revoke_token(token["jti"], "u1", token["exp"])
+    assert a.is_revoked(token) and b.is_revoked(token)
+    assert not b.is_revoked(other)
+    assert b.lookups == 1  # only the bloom hit went to the table
+
+    # a restarted worker rebuilds nothing: it loads the snapshot
+    (c,) = _lists(tmp_path, n=1)[1]
+    assert c.is_revoked(token)
+
+def test_revoke_user_rejects_earlier_tokens_through_the_cache(tmp_path):
+    _, (a, b) = _lists(tmp_path)
+    old = create_access_token({"sub": "u1", "role": "admin"})
+    cache = TokenCache(revocations=b)
+    assert cache.claims(old)["role"] == "admin"
+
+    a.revoke_user("u1", token_lifetime_s=3600)
+    fresh = create_access_token({"sub": "u1", "role": "user"})
+    # b's cached entry for the old token is still checked against the shared filters
+    with pytest.raises(HTTPException) as exc:
+        cache.claims(old)
+    assert exc.value.status_code == 401
+    assert cache.claims(fresh)["role"] == "user" and cache.claims(fresh)["role"] == "user"
+    assert b.false_positives == 1  # the new token's bloom hit is confirmed once, then memoised
+
+def test_expired_revocations_rotate_out(tmp_path):
+    eng, (a, _) = _lists(tmp_path)
+    a.revoke_token("gone", "u1", time.time() - 1)
+    with eng.connect() as conn:
+        assert conn.execute(select(revoked_tokens)).fetchall() == []
+    assert a.stats()["windows"] == 0
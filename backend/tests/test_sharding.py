@@ -0,0 +1,134 @@
+import time
+from datetime import datetime
+from sqlalchemy import create_engine, insert, select
+from app.models import init_db, accounts, ledger, shard_outbox, shard_inbox
+from app.sharding import ShardSet, shard_hash
+from app.pagination import keyset_page
+
+def _shards(tmp_path, n=3):
+    engines = [create_engine(f"sqlite:///{tmp_path}/shard{i}.db", connect_args={"check_same_thread": False})
+               for i in range(n)]
+    for eng in engines:
+        init_db(eng)
+    return ShardSet(engines, directory_ttl=0)
+
+def _users_on_distinct_shards(n):
+    found = {}
+    i = 0
+    while len(found) < n:
+        found.setdefault(shard_hash(f"u{i}", n), f"u{i}")
+        i += 1
+    return [found[s] for s in range(n)]
+
+def _add_user(shards, user_id, balance="100.00", txs=0):
+    with shards.engine_for(user_id).begin() as conn:
+        conn.execute(insert(accounts).values(id=f"acc-{user_id}", user_id=user_id, account_type="BANK",
+                                             currency="USD", balance=balance))
+        for t in range(txs):
+            conn.execute(insert(ledger).values(id=f"TX-{user_id}-{t}", user_id=user_id, tx_type="BANK_TRANSFER",
+                                               amount="1.00", currency="USD", receiver="r", status="COMPLETED",
+                                               timestamp=datetime(2024, 1, 1, 0, 0, t)))
+
+def _balance(shards, user_id):
+    with shards.engine_for(user_id).connect() as conn:
+        return conn.execute(select(accounts.c.balance_minor).where(accounts.c.user_id == user_id)).scalar()
+
+def test_routing_fan_out_and_merged_pages(tmp_path):
+    shards = _shards(tmp_path)
+    users = _users_on_distinct_shards(3)
+    for u in users:
+        _add_user(shards, u, txs=4)
+    assert [shards.shard_of(u) for u in users] == [0, 1, 2]
+    assert [len(rows) for rows in shards.fetch_all(select(ledger))] == [4, 4, 4]
+
+    stats = shards.sum_stats()
+    assert stats["ledger"] == 12 and stats["accounts"] == 3
+    assert stats["ledger.status"] == {"COMPLETED": 12}
+
+    # walking merged keyset pages yields every row once, newest first
+    seen, cursor = [], None
+    while True:
+        rows, cursor = shards.merged_page(keyset_page(select(ledger), ledger.c.timestamp, ledger.c.id, cursor, 5), 5)
+        seen += [(r.cursor_ts, r.id) for r in rows]
+        if cursor is None:
+            break
+    assert len(seen) == 12 and seen == sorted(seen, reverse=True)
+
+    batches = list(shards.iter_merged_batches(select(ledger).order_by(ledger.c.timestamp, ledger.c.id),
+                                              key=lambda r: (r.timestamp, r.id), batch_rows=5))
+    assert [len(b) for b in batches] == [5, 5, 2]
+
+def test_move_user_and_rebalance(tmp_path):
+    shards = _shards(tmp_path)
+    user = _users_on_distinct_shards(3)[1]
+    _add_user(shards, user, txs=3)
+
+    moved = shards.relocate(user, 2)
+    assert moved["rows"] == {"accounts": 1, "ledger": 3, "shard_inbox": 0}
+    assert shards.shard_of(user) == 2
+    assert [len(rows) for rows in shards.fetch_all(select(ledger))] == [0, 0, 3]
+
+    # rows left on the wrong shard (e.g. seeded on the primary) are found and moved home
+    with shards.primary.begin() as conn:
+        conn.execute(insert(accounts).values(id="acc-stray", user_id=user, account_type="BANK",
+                                             currency="USD", balance="1.00"))
+    assert shards.rebalance(dry_run=True) == [{"user_id": user, "from": 0, "to": 2}]
+    shards.rebalance()
+    assert shards.misplaced_users() == []
+    assert [len(rows) for rows in shards.fetch_all(select(accounts))] == [0, 0, 2]
+
+def test_cross_shard_credit_is_applied_once(tmp_path):
+    shards = _shards(tmp_path, n=2)
+    payer, payee = _users_on_distinct_shards(2)
+    _add_user(shards, payer)
+    _add_user(shards, payee, balance="0.00")
+
+    # the payer's unit queues the credit; delivery applies it on the payee's shard
+    with shards.engine_for(payer).begin() as conn:
+        shards.queue_credit(conn, "TX-1", payee, f"acc-{payee}", 2500)
+    shards.deliver_credit(0, "TX-1", payee, f"acc-{payee}", 2500)
+    assert _balance(shards, payee) == 2500
+
+    # a replay (e.g. a crash before the outbox row was cleared) is deduped by the inbox
+    with shards.engine_for(payer).begin() as conn:
+        shards.queue_credit(conn, "TX-1", payee, f"acc-{payee}", 2500)
+    assert shards.drain_outbox() == 1
+    assert _balance(shards, payee) == 2500
+    assert [len(rows) for rows in shards.fetch_all(select(shard_outbox))] == [0, 0]
+    assert [len(rows) for rows in shards.fetch_all(select(shard_inbox))] == [0, 1]
+
+def test_rows_written_to_the_primary_are_pinned_there(tmp_path):
+    shards = _shards(tmp_path)
+    elsewhere = _users_on_distinct_shards(3)[1:]
+    for u in elsewhere:
+        with shards.primary.begin() as conn:  # like the demo seed
+            conn.execute(insert(accounts).values(id=f"acc-{u}", user_id=u, account_type="BANK",
+                                                 currency="USD", balance="5.00"))
+    assert shards.pin_in_place(0) == 2
+    assert [shards.shard_of(u) for u in elsewhere] == [0, 0]
+    assert [_balance(shards, u) for u in elsewhere] == [500, 500] and shards.misplaced_users() == []
+
+def test_moves_by_another_process_reach_the_cached_directory(tmp_path):
+    shards = _shards(tmp_path)
+    worker = ShardSet(shards.engines, directory_ttl=0.05)  # a running worker's own directory cache
+    u = _users_on_distinct_shards(3)[1]
+    _add_user(shards, u)
+    assert worker.shard_of(u) == 1 and _balance(worker, u) == 10000
+
+    shards.relocate(u, 2)  # the CLI, in another process
+    time.sleep(0.06)
+    assert worker.shard_of(u) == 2 and _balance(worker, u) == 10000
+
+def test_payee_lookups_fan_out_once_per_receiver(tmp_path):
+    shards = _shards(tmp_path)
+    payee = _users_on_distinct_shards(3)[2]
+    _add_user(shards, payee)
+    fan_outs = []
+    real_find_first = shards.find_first
+    shards.find_first = lambda lookup: fan_outs.append(1) or real_find_first(lookup)
+
+    for _ in range(3):
+        assert shards.find_credit_account(f"acc-{payee}", "USD").user_id == payee
+        assert shards.find_credit_account("external-merchant", "USD") is None
+    assert shards.find_credit_account(f"acc-{payee}", "EUR") is None
+    assert len(fan_outs) == 2  # once for the account's owner, once to learn the merchant is external
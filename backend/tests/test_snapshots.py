@@ -0,0 +1,109 @@
+import numpy as np
+from datetime import datetime
+from sqlalchemy import create_engine, insert, text
+from app.models import init_db, ledger
+from app.snapshots import LedgerSnapshotExporter, load_snapshot, decode_column
+
+def _engine(tmp_path):
+    eng = create_engine(f"sqlite:///{tmp_path}/ledger.db")
+    init_db(eng)
+    return eng
+
+def _insert(eng, tx_id, ts, amount, tx_type="BANK_TRANSFER", currency="USD"):
+    with eng.begin() as conn:
+        conn.execute(insert(ledger).values(
+            id=tx_id, user_id="user-1", tx_type=tx_type, amount=amount, currency=currency,
+            receiver="r", risk_score=90, status="COMPLETED", timestamp=ts
+        ))
+
+def test_snapshot_partitions_and_dictionaries(tmp_path):
+    eng = _engine(tmp_path)
+    _insert(eng, "TX-1", datetime(2026, 1, 1, 10), "10.50")
+    _insert(eng, "TX-2", datetime(2026, 1, 2, 11), "0.01", "CRYPTO_TRANSFER", "BTC")
+
+    summary = LedgerSnapshotExporter(str(tmp_path / "snap"), db_engine=eng).export()
+    assert summary["rows_written"] == 2
+    assert {p["day"] for p in summary["parts"]} == {"2026-01-01", "2026-01-02"}
+
+    cols = load_snapshot(str(tmp_path / "snap"))
+    assert cols["amount"].dtype == np.float64
+    assert list(cols["amount"]) == [10.5, 0.01]
+    assert list(decode_column(str(tmp_path / "snap"), "currency", cols["currency"])) == ["USD", "BTC"]
+
+def test_snapshot_appends_incrementally(tmp_path):
+    eng = _engine(tmp_path)
+    _insert(eng, "TX-1", datetime(2026, 1, 1, 10), "1")
+    root = str(tmp_path / "snap")
+    LedgerSnapshotExporter(root, db_engine=eng).export()
+
+    # same timestamp as the watermark but a later id, plus a newer row
+    _insert(eng, "TX-2", datetime(2026, 1, 1, 10), "2")
+    _insert(eng, "TX-3", datetime(2026, 1, 1, 12), "3")
+    summary = LedgerSnapshotExporter(root, db_engine=eng, compress=True).export()
+    assert summary["rows_written"] == 2
+    assert summary["total_rows"] == 3
+
+    cols = load_snapshot(root, ["id", "amount"], start="2026-01-01", end="2026-01-01")
+    assert list(cols["id"]) == [b"TX-1", b"TX-2", b"TX-3"]
+
+def test_rows_committed_late_with_older_keys_are_not_skipped(tmp_path):
+    eng = _engine(tmp_path)
+    _insert(eng, "TX-5", datetime(2026, 1, 5, 10), "5")
+    root = str(tmp_path / "snap")
+    LedgerSnapshotExporter(root, db_engine=eng).export()
+
+    # a backfilled row from an earlier day and one in the same second with a smaller id
+    _insert(eng, "TX-1", datetime(2026, 1, 1, 10), "1")
+    _insert(eng, "TX-4", datetime(2026, 1, 5, 10), "4")
+    summary = LedgerSnapshotExporter(root, db_engine=eng).export()
+    assert summary["rows_written"] == 2 and summary["total_rows"] == 3
+    assert LedgerSnapshotExporter(root, db_engine=eng).export()["rows_written"] == 0
+    assert sorted(load_snapshot(root, ["id"])["id"]) == [b"TX-1", b"TX-4", b"TX-5"]
+
+def test_version_1_manifest_is_rebuilt(tmp_path):
+    eng = _engine(tmp_path)
+    _insert(eng, "TX-1", datetime(2026, 1, 1, 10), "1")
+    root = str(tmp_path / "snap")
+    exporter = LedgerSnapshotExporter(root, db_engine=eng)
+    exporter.export()
+    exporter.manifest.update(version=1, watermark={"timestamp": "2026-01-01T10:00:00+00:00", "id": "TX-1"})
+    exporter._save_manifest()
+    summary = LedgerSnapshotExporter(root, db_engine=eng).export()
+    assert summary["total_rows"] == 1 and summary["watermark"]["seq"] == 1
+
+def test_sequence_is_not_reused_after_vacuum_or_deleting_the_newest_row(tmp_path):
+    eng = _engine(tmp_path)
+    for i in range(1, 4):
+        _insert(eng, f"TX-{i}", datetime(2026, 1, 1, 10), str(i))
+    root = str(tmp_path / "snap")
+    LedgerSnapshotExporter(root, db_engine=eng, seq_lookback=0).export()
+
+    # archiving the newest row frees its rowid, and VACUUM renumbers the rest
+    with eng.begin() as conn:
+        conn.execute(text("DELETE FROM ledger WHERE id = 'TX-3'"))
+    with eng.connect() as conn:
+        conn.execution_options(isolation_level="AUTOCOMMIT").execute(text("VACUUM"))
+    _insert(eng, "TX-4", datetime(2026, 1, 1, 11), "4")
+    summary = LedgerSnapshotExporter(root, db_engine=eng, seq_lookback=0).export()
+    assert summary["rows_written"] == 1 and summary["watermark"]["seq"] == 4
+    assert sorted(load_snapshot(root, ["id"])["id"]) == [b"TX-1", b"TX-2", b"TX-3", b"TX-4"]
+
+def test_every_shard_is_exported_with_its_own_watermark(tmp_path, monkeypatch):
+    import app.sharding
+    from app.sharding import ShardSet
+    engines = []
+    for i in range(2):
+        (tmp_path / f"s{i}").mkdir()
+        engines.append(_engine(tmp_path / f"s{i}"))
+    monkeypatch.setattr(app.sharding, "shards", ShardSet(engines))
+    for i in range(3):
+        _insert(engines[0], f"TX-0{i}", datetime(2026, 1, 1, 10), "1")
+    _insert(engines[1], "TX-10", datetime(2026, 1, 1, 11), "2")
+    root = str(tmp_path / "snap")
+    assert LedgerSnapshotExporter(root, seq_lookback=0).export()["rows_written"] == 4
+
+    # seq 2 on shard 1 is behind the primary's watermark (3), but not behind shard 1's own
+    _insert(engines[1], "TX-11", datetime(2026, 1, 2, 10), "3")
+    summary = LedgerSnapshotExporter(root, seq_lookback=0).export()
+    assert summary["rows_written"] == 1 and summary["watermark"]["seq"] == 3
+    assert sorted(load_snapshot(root, ["id"])["id"]) == [b"TX-00", b"TX-01", b"TX-02", b"TX-10", b"TX-11"]
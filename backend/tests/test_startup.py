@@ -0,0 +1,48 @@
+import threading
+from app.startup import StartupReport, LazySubsystem, warm_in_background
+
+def test_lazy_subsystem_builds_once_under_concurrent_first_use():
+    report = StartupReport()
+    builds = []
+    subsystem = LazySubsystem("model", lambda: builds.append(1) or object(), report=report)
+    assert not subsystem.loaded
+    seen = []
+    threads = [threading.Thread(target=lambda: seen.append(subsystem.get())) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(builds) == 1 and len({id(v) for v in seen}) == 1
+    assert subsystem.loaded and "model" in report.subsystems
+
+def test_phases_and_background_warming():
+    report = StartupReport()
+    with report.phase("init_db"):
+        pass
+    attempts = []
+
+    def flaky():
+        attempts.append(1)
+        if len(attempts) == 1:
+            raise RuntimeError("backend down")
+        return "ok"
+
+    subsystem = LazySubsystem("pqc", flaky, report=report)
+    warm_in_background([subsystem]).join()
+    assert report.failed == {"pqc": "backend down"} and not subsystem.loaded
+    # a failed warm-up is retried on first use
+    assert subsystem.get() == "ok"
+    report.ready()
+    summary = report.as_dict()
+    assert set(summary["phases_ms"]) == {"init_db"} and summary["ready_ms"] >= 0
+
+def test_only_registered_subsystems_are_warmed_by_default():
+    import app.startup as startup_module
+    report = StartupReport()
+    built = []
+    registered = report.register(LazySubsystem("kept", lambda: built.append("kept"), report=report))
+    LazySubsystem("test-only", lambda: built.append("test-only"), report=report)
+    assert report.registered == [registered]
+    assert all(s.name != "test-only" for s in startup_module.startup.registered)
+    warm_in_background(report.registered).join()
+    assert built == ["kept"]
@@ -0,0 +1,53 @@
+from sqlalchemy import create_engine, insert, update, delete
+from app.models import init_db, ledger, users
+from app.stats import read_stats, rebuild_stats, refresh_stats, drop_stats_triggers
+
+def _tx(i, status="COMPLETED", currency="USD"):
+    return dict(id=f"TX-{i}", user_id="user-1", tx_type="BANK_TRANSFER", amount="1",
+                currency=currency, receiver="r", status=status)
+
+def test_triggers_track_inserts_updates_and_deletes(tmp_path):
+    eng = create_engine(f"sqlite:///{tmp_path}/qff.db")
+    init_db(eng)
+    with eng.begin() as conn:
+        conn.execute(insert(users).values(id="u1", username="a", email="a@x", password_hash="h"))
+        for i in range(5):
+            conn.execute(insert(ledger).values(**_tx(i, currency="BTC" if i == 0 else "USD")))
+        conn.execute(update(ledger).where(ledger.c.id == "TX-1").values(status="FAILED"))
+        conn.execute(delete(ledger).where(ledger.c.id == "TX-2"))
+
+    with eng.connect() as conn:
+        stats = read_stats(conn)
+    assert stats["users"] == 1
+    assert stats["ledger"] == 4
+    assert stats["accounts"] == 0
+    assert stats["ledger.status"] == {"COMPLETED": 3, "FAILED": 1}
+    assert stats["ledger.currency"] == {"BTC": 1, "USD": 3}
+
+    # a rolled-back insert leaves the counters untouched
+    try:
+        with eng.begin() as conn:
+            conn.execute(insert(ledger).values(**_tx(99)))
+            raise RuntimeError("abort")
+    except RuntimeError:
+        pass
+
+    with eng.begin() as conn:
+        before = read_stats(conn)
+        rebuild_stats(conn)
+        assert read_stats(conn) == before
+
+def test_without_triggers_reads_never_write_and_refresh_rebuilds_in_the_background(tmp_path, monkeypatch):
+    monkeypatch.setattr("app.stats.STATS_REFRESH_SECONDS", 0)
+    eng = create_engine(f"sqlite:///{tmp_path}/qff.db")
+    init_db(eng)
+    with eng.begin() as conn:
+        drop_stats_triggers(conn)
+        conn.execute(insert(ledger).values(**_tx(1)))
+    monkeypatch.setattr(eng.dialect, "name", "postgresql")  # the trigger-less path other dialects take
+
+    with eng.connect() as conn:
+        assert read_stats(conn)["ledger"] == 0  # stale, but nothing was written by reading
+    refresh_stats(eng, wait=True)
+    with eng.connect() as conn:
+        assert read_stats(conn)["ledger"] == 1
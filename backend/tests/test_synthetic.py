@@ -0,0 +1,43 @@
+import numpy as np
+from sqlalchemy import create_engine, select, func
+from app.models import init_db, ledger
+from app.money import to_minor
+from app.sharding import ShardSet
+from app.seed.synthetic import SyntheticLedger, populate
+
+def test_batches_are_reproducible_and_time_ordered():
+    a, b = SyntheticLedger(5000, seed=3, batch_rows=2000), SyntheticLedger(5000, seed=3, batch_rows=2000)
+    batches = list(a.batches())
+    assert [len(x["id"]) for x in batches] == [2000, 2000, 1000]
+    for x, y in zip(batches, b.batches()):
+        assert all((x[k] == y[k]).all() for k in x)
+    assert not (SyntheticLedger(5000, seed=4, batch_rows=2000).batch(0)["amount_minor"] == batches[0]["amount_minor"]).all()
+
+    ts = np.concatenate([x["timestamp"] for x in batches])
+    assert (np.diff(ts.astype("int64")) >= 0).all()
+    first = batches[0]
+    for i in range(0, 2000, 97):
+        assert to_minor(first["amount"][i], first["currency"][i]) == first["amount_minor"][i]
+
+def test_profile_shapes_mix_and_fraud():
+    profile = {"tx_types": {"UPI_PAYMENT": {"weight": 0}}, "fraud": {"rate": 0.05, "patterns": {"structuring": 1}}}
+    batch = SyntheticLedger(20000, seed=1, profile=profile, batch_rows=20000).batch(0)
+    assert "UPI_PAYMENT" not in set(batch["tx_type"])
+    structuring = batch["fraud"] == "structuring"
+    assert 0.04 < structuring.mean() < 0.06
+    usd = batch["amount_minor"][structuring & (batch["currency"] == "USD")] / 100
+    assert ((usd >= 9000) & (usd < 10000)).all()
+    # receiver popularity is heavy-tailed: the top receiver takes far more than an even share
+    _, counts = np.unique(batch["receiver"].astype(str), return_counts=True)
+    assert counts.max() > 100 * counts.mean()
+
+def test_populate_bulk_inserts_labelled_rows(tmp_path):
+    eng = create_engine(f"sqlite:///{tmp_path}/qff.db", connect_args={"check_same_thread": False})
+    init_db(eng)
+    report = populate(3000, seed=2, batch_rows=1000, shard_set=ShardSet([eng]), profile={"fraud": {"rate": 0.01}})
+    assert report["rows"] == 3000 and sum(report["fraud"].values()) > 0
+    with eng.connect() as conn:
+        assert conn.execute(select(func.count()).select_from(ledger)).scalar() == 3000
+        labelled = conn.execute(select(ledger.c.meta).where(ledger.c.meta.is_not(None))).fetchall()
+    assert len(labelled) == sum(report["fraud"].values())
+    assert {r.meta["synthetic"] for r in labelled} <= set(report["fraud"])
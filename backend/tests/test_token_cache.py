@@ -0,0 +1,52 @@
+import time
+import pytest
+from datetime import timedelta
+from fastapi import HTTPException
+from app.security import TokenCache, create_access_token
+
+def _token(user_id="u1", role="user", **kwargs):
+    return create_access_token({"sub": user_id, "username": user_id, "role": role}, **kwargs)
+
+def test_hits_after_first_verification_and_respects_exp():
+    cache = TokenCache(max_entries=2)
+    token = _token()
+    assert cache.claims(token) == {"user_id": "u1", "username": "u1", "role": "user"}
+    assert cache.claims(token)["role"] == "user"
+    assert (cache.hits, cache.misses) == (1, 1)
+
+    # LRU bound: the least recently used token is evicted
+    cache.claims(_token("u2"))
+    cache.claims(_token("u3"))
+    assert cache.stats()["entries"] == 2
+    cache.claims(token)
+    assert cache.misses == 4
+
+    # an entry past the token's exp is never served; the re-decode rejects it
+    expired = _token("u4", expires_delta=timedelta(seconds=1))
+    cache.claims(expired)
+    time.sleep(2.1)
+    with pytest.raises(HTTPException) as e:
+        cache.claims(expired)
+    assert e.value.status_code == 401
+
+def test_revoke_user_rejects_tokens_issued_before_the_change():
+    cache = TokenCache()
+    old = _token("u1", role="admin")
+    other = _token("u2")
+    cache.claims(old)
+    cache.claims(other)
+    cache.revoke_user("u1")
+    with pytest.raises(HTTPException) as e:
+        cache.claims(old)
+    assert e.value.status_code == 401
+    assert cache.claims(other)["user_id"] == "u2"
+
+    # a token issued after the change (e.g. re-login with the new role) is accepted
+    assert cache.claims(_token("u1", role="user"))["role"] == "user"
+
+def test_disabled_cache_always_verifies():
+    cache = TokenCache(max_entries=0)
+    token = _token()
+    cache.claims(token)
+    cache.claims(token)
+    assert (cache.hits, cache.misses, cache.stats()["entries"]) == (0, 2, 0)
@@ -24,5 +24,6 @@ echo.
 echo Press Ctrl+C to stop the server
 echo.
 
+set QFF_SEED_DEMO=true
 python -m uvicorn app.main:app --reload --port 8000
 pause
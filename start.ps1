@@ -34,6 +34,7 @@ if (!(Test-Path .venv)) {
 & .\.venv\Scripts\Activate.ps1
 Write-Host 'Installing backend dependencies...' -ForegroundColor Cyan
 pip install -q -r requirements.txt
+$env:QFF_SEED_DEMO = 'true'
 Write-Host 'Backend running on http://localhost:8000' -ForegroundColor Green
 uvicorn app.main:app --reload --port 8000
 "@